@@ -0,0 +1,76 @@
+# Written by Dr Daniel Buscombe, Marda Science LLC
+# for "ML Mondays", a course supported by the USGS Community for Data Integration
+# and the USGS Coastal Change Hazards Program
+#
+# MIT License
+#
+# Copyright (c) 2020, Marda Science LLC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Times the input pipelines with no model attached, over a sweep of pipeline settings,
+# and writes the results as json. If model.fit trains at about the images/sec of
+# get_batched_dataset here, training is input-bound
+
+###############################################################
+## IMPORTS
+###############################################################
+from imports import *
+
+###############################################################
+## VARIABLES
+###############################################################
+
+data_path = os.getcwd()+os.sep+"data/synthetic/"+str(TARGET_SIZE) # (see synthetic_make_tfrecords.py) or e.g. "data/tamucc/full/"+str(TARGET_SIZE)
+recoded_dir = None # folder of jpegs, to also time get_dataset_for_tfrecords (tfrecord creation)
+
+json_file = os.getcwd()+os.sep+'results/benchmark_pipelines_'+time.strftime("%Y%m%d-%H%M%S")+'.json'
+baseline_json = None # earlier results file, to report throughput regressions against
+
+num_elements = 50 # batches timed in each run
+
+# every combination of these settings is timed (see the top of tfrecords_funcs.py)
+grid = {"CYCLE_LENGTH": [4, 16],
+        "MAP_PARALLELISM": [AUTO, 4],
+        "CACHE": [True, False],
+        "SHUFFLE_BUFFER": [2048],
+        "BATCH_SIZE": [BATCH_SIZE, 2*BATCH_SIZE]}
+
+###############################################################
+## EXECUTION
+###############################################################
+
+filenames = sorted(tf.io.gfile.glob(data_path+os.sep+'*.tfrec'))
+print("{} tfrecord files".format(len(filenames)))
+
+pipelines = [
+    # the stages of get_batched_dataset: reading the records, then decoding them
+    ("read", lambda: get_stage_dataset(filenames, 'read'), True),
+    ("read+parse", lambda: get_stage_dataset(filenames, 'parse'), True),
+    ("get_batched_dataset", lambda: get_batched_dataset(filenames), True),
+    ("get_eval_dataset", lambda: get_eval_dataset(filenames), True),
+]
+if recoded_dir is not None:
+    pipelines.append(("get_dataset_for_tfrecords", lambda: get_dataset_for_tfrecords(recoded_dir, ims_per_shard, fast_decode=True), True))
+
+results = benchmark_pipelines(pipelines, grid, json_file, num_elements)
+
+if baseline_json is not None:
+    compare_benchmarks(baseline_json, json_file)
@@ -0,0 +1,162 @@
+# Written by Dr Daniel Buscombe, Marda Science LLC
+# for "ML Mondays", a course supported by the USGS Community for Data Integration
+# and the USGS Coastal Change Hazards Program
+#
+# MIT License
+#
+# Copyright (c) 2020, Marda Science LLC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Checks the download functions (download_funcs.py) against a local web server, with no network access:
+#   python check_downloads.py
+# The server answers range requests and drops the first connection for each file half way,
+# so the checks cover resuming a dropped download, rejecting a file with the wrong checksum,
+# and skipping a zip file that has already been extracted
+
+###############################################################
+## IMPORTS
+###############################################################
+import http.server, threading, tempfile, io, shutil
+from download_funcs import *
+
+###############################################################
+## VARIABLES
+###############################################################
+
+file_size = 3<<20 # bytes in the test zip file
+
+###############################################################
+## FUNCTIONS
+###############################################################
+
+#-----------------------------------
+class RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    RangeRequestHandler
+    Serves the bytes in the class attribute files (name to bytes), answering 'Range: bytes=start-'
+    requests with 206, and sends only half of the first response for each file before closing the
+    connection (a dropped download). Every request is logged in the class attribute requests
+    """
+    files = {}
+    requests = []
+    dropped = set()
+
+    def do_GET(self):
+        name = self.path.lstrip('/')
+        self.requests.append((name, self.headers.get('Range')))
+        if name not in self.files:
+            self.send_error(404)
+            return
+        data = self.files[name]
+        start = int(self.headers['Range'].split('=')[1].split('-')[0]) if self.headers.get('Range') else 0
+        if start >= len(data):
+            self.send_error(416)
+            return
+        self.send_response(206 if start > 0 else 200)
+        self.send_header('Content-Length', str(len(data)-start))
+        self.end_headers()
+        if name not in self.dropped:
+            self.dropped.add(name)
+            self.wfile.write(data[start:start+(len(data)-start)//2])
+            self.close_connection = True
+            return
+        self.wfile.write(data[start:])
+
+    def log_message(self, *args):
+        pass
+
+#-----------------------------------
+def make_test_zip(size):
+    """
+    make_test_zip(size)
+    This function makes an (uncompressed) zip file of about size bytes, holding one file test.bin
+    INPUTS:
+        * size [int]
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * zip file [bytes]
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as z:
+        z.writestr('test.bin', os.urandom(size))
+    return buffer.getvalue()
+
+#-----------------------------------
+def check(name, ok):
+    """
+    check(name, ok)
+    This function prints the result of one check
+    INPUTS:
+        * name [string]
+        * ok [bool]
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * ok [bool]
+    """
+    print("{}: {}".format(name, "passed" if ok else "FAILED"))
+    return ok
+
+###############################################################
+## EXECUTION
+###############################################################
+
+data = make_test_zip(file_size)
+RangeRequestHandler.files = {'test.zip': data, 'corrupt.zip': data}
+server = http.server.ThreadingHTTPServer(('localhost', 0), RangeRequestHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+url = 'http://localhost:{}/'.format(server.server_address[1])
+
+folder = tempfile.mkdtemp()
+results = []
+try:
+    # a dropped connection is resumed from the end of the .part file with a range request
+    filename = os.path.join(folder, 'test.zip')
+    fetch_file(url+'test.zip', filename, hashlib.sha256(data).hexdigest(), retries=3)
+    ranges = [r for n, r in RangeRequestHandler.requests if n == 'test.zip']
+    results.append(check("resume after a dropped connection", file_sha256(filename) == hashlib.sha256(data).hexdigest()
+                         and len(ranges) == 2 and ranges[0] is None and ranges[1] == 'bytes={}-'.format(len(data)//2)))
+
+    # a file that does not match its checksum is discarded, retried, and finally reported
+    filename = os.path.join(folder, 'corrupt.zip')
+    try:
+        fetch_file(url+'corrupt.zip', filename, '0'*64, retries=2)
+        failed = False
+    except IOError:
+        failed = True
+    results.append(check("checksum mismatch raises an error", failed and not os.path.exists(filename)
+                         and not os.path.exists(filename+'.part')))
+
+    # a zip file is extracted once, then skipped (no request) while its marker exists
+    extract_to = os.path.join(folder, 'extracted')
+    filename = os.path.join(folder, 'test.zip')
+    download_files([(url+'test.zip', filename, extract_to)], {'test.zip': hashlib.sha256(data).hexdigest()})
+    extracted = os.path.isfile(os.path.join(extract_to, 'test.bin')) and not os.path.exists(filename)
+    num_requests = len(RangeRequestHandler.requests)
+    download_files([(url+'test.zip', filename, extract_to)], {'test.zip': hashlib.sha256(data).hexdigest()})
+    results.append(check("extracted zip files are not downloaded again", extracted
+                         and len(RangeRequestHandler.requests) == num_requests and not os.path.exists(filename)))
+finally:
+    server.shutdown()
+    shutil.rmtree(folder)
+
+print("{} of {} download checks passed".format(sum(results), len(results)))
@@ -1,6 +1,5 @@
-
-import os, zipfile
-import tensorflow as tf
+import os
+from download_funcs import *
 
 try:
     os.mkdir('data')
@@ -12,6 +11,13 @@ try:
 except:
     pass
 
+# set extract = False to keep the zip files instead of extracting them; the tfrecords can then be read
+# in place with list_zip_members and the zip_path argument of the dataset functions (see tfrecords_funcs.py)
+extract = True
+
+# number of files downloaded at once
+num_workers = 4
+
 folders_to_extract_to = [
 './data',
 './data/tamucc',
@@ -30,21 +36,14 @@ files_to_download = [
 'tamucc_subset_4class.zip',
 ]
 
-for k in range(len(files_to_download)):
-    file = files_to_download[k]
-    folder = folders_to_extract_to[k]
-    #url = "https://github.com/dbuscombe-usgs/mlmondays_data_imrecog/releases/download/0.1.0/"+file
-    url = "https://ml-mondays-data.s3-us-west-2.amazonaws.com/mlmondays_data_imrecog/releases/download/0.1.0/"+file
-    filename = os.path.join(os.getcwd(), file)
-    print("Downloading %s ... " % (filename))
-    tf.keras.utils.get_file(filename, url)
-    print("Unzipping to %s ... " % (folder))
-    with zipfile.ZipFile(file, "r") as z_fp:
-        z_fp.extractall("./"+folder)
-
-
-for f in files_to_download:
-    try:
-        os.remove(f)
-    except:
-        pass
+#url = "https://github.com/dbuscombe-usgs/mlmondays_data_imrecog/releases/download/0.1.0/"
+url = "https://ml-mondays-data.s3-us-west-2.amazonaws.com/mlmondays_data_imrecog/releases/download/0.1.0/"
+
+# sha256 of each release file, checked after download (recorded in checksums.json with
+# write_checksums(<release files>, 'checksums.json'); files with a null hash are not verified)
+checksums = read_checksums(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checksums.json'))
+
+downloads = [(url+file, os.path.join(os.getcwd(), file), folder if extract else None)
+             for file, folder in zip(files_to_download, folders_to_extract_to)]
+
+download_files(downloads, checksums, num_workers)
@@ -0,0 +1,86 @@
+# Written by Dr Daniel Buscombe, Marda Science LLC
+# for "ML Mondays", a course supported by the USGS Community for Data Integration
+# and the USGS Coastal Change Hazards Program
+#
+# MIT License
+#
+# Copyright (c) 2020, Marda Science LLC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Exports a trained classifier to tflite for cpu-only inference hosts (float32, dynamic-range, float16
+# and full-integer int8, calibrated on images from the tfrecords), then benchmarks each file against the
+# keras model: single-image latency, throughput, model size and validation accuracy difference
+
+###############################################################
+## IMPORTS
+###############################################################
+
+from imports import *
+
+###############################################################
+## VARIABLES
+###############################################################
+
+data_path= os.getcwd()+os.sep+"data/tamucc/subset_3class/400"
+
+CLASSES = [b'marsh', b'dev', b'other']
+
+weights_file = os.getcwd()+os.sep+'results/tamucc_subset_3class_mv2_best_weights_model2.h5'
+standardize = 'mobilenet' # 'vgg' for transfer_learning_model_vgg
+
+tflite_prefix = weights_file.replace('.h5', '') # files are tflite_prefix+'_'+mode+'.tflite'
+modes = ('float32', 'dynamic', 'float16', 'int8')
+num_representative = 200 # calibration images for int8
+
+num_threads = None # tflite interpreter threads (None = tflite default)
+benchmark_json = tflite_prefix+'_tflite_benchmark.json'
+
+###############################################################
+## EXECUTION
+###############################################################
+
+#images already shuffled
+filenames = sorted(tf.io.gfile.glob(data_path+os.sep+'*.tfrec'))
+
+split = int(len(filenames) * VALIDATION_SPLIT)
+
+training_filenames = filenames[split:]
+validation_filenames = filenames[:split]
+
+# the model function the weights were trained with
+model = transfer_learning_mobilenet_model(len(CLASSES), (TARGET_SIZE, TARGET_SIZE, 3), dropout_rate=0.5)
+# model = mobilenet_model(len(CLASSES), (TARGET_SIZE, TARGET_SIZE, 3), dropout_rate=0.5)
+# model = transfer_learning_model_vgg(len(CLASSES), (TARGET_SIZE, TARGET_SIZE, 3), dropout_rate=0.5)
+# model = xception_model(len(CLASSES), (TARGET_SIZE, TARGET_SIZE, 3), dropout_rate=0.25)
+# model = make_cat_model(len(CLASSES), denseunits=256, base_filters = 30, dropout=0.5)
+model.load_weights(weights_file)
+
+print('.....................................')
+print('Exporting tflite models ...')
+
+# calibration images come from the training files, so the validation accuracy is measured on unseen images
+representative_dataset = get_representative_dataset(training_filenames, standardize, num_representative)
+tflite_files = export_tflite(model, tflite_prefix, representative_dataset, modes)
+
+print('.....................................')
+print('Benchmarking on the validation files ...')
+
+results = benchmark_tflite(model, tflite_files, validation_filenames, standardize, num_threads=num_threads, json_file=benchmark_json)
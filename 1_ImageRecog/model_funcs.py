@@ -32,10 +32,11 @@ from tamucc_imports import *
 
 #see mlmondays blog post:
 import os
-os.environ["TF_DETERMINISTIC_OPS"] = "1"
+# kernel determinism is set by the execution profile (see set_execution_profile in tfrecords_funcs.py)
 
 import tensorflow as tf #numerical operations on gpu
 import numpy as np #numerical operations on cpu
+import csv, json, time
 
 # set a seed for reproducibility
 SEED=42
@@ -50,6 +51,8 @@ from tensorflow.keras.applications import MobileNetV2 #mobilenet v2 model, used
 from tensorflow.keras.applications import VGG16 #vgg model, used for feature extraction
 from tensorflow.keras.applications import Xception #xception model, used for feature extraction
 
+from tfrecords_funcs import get_file_dataset, get_record_dataset, read_tfrecord_uint8, standardize_image
+
 
 ###############################################
 ##### MODEL FUNCTIONS
@@ -304,3 +307,462 @@ def make_cat_model(num_classes, dropout, denseunits, base_filters, bn=False, poo
               metrics={'output': 'accuracy'})
 
     return model
+
+#-----------------------------------
+def multihead_mobilenet_model(head_sizes, input_shape, dropout_rate=0.5, trainable=False):
+    """
+    multihead_mobilenet_model(head_sizes, input_shape, dropout_rate=0.5, trainable=False)
+    This function creates a model with one mobilenet v2 extractor (initialized using pretrained
+    imagenet weights) shared by several classification heads, one per label set, so one forward pass
+    of the extractor per image serves every head. Each head is the head of transfer_learning_mobilenet_model,
+    and its output is named after it
+    INPUTS:
+        * head_sizes [dict]: number of classes of each head, by head name
+        * input_shape = size of input layer (i.e. image tensor)
+    OPTIONAL INPUTS:
+        * dropout_rate = proportion of neurons to randomly set to zero, after the pooling layer
+        * trainable [bool]: train the extractor as well as the heads
+    GLOBAL INPUTS: None
+    OUTPUTS: keras model instance (with a dict of outputs)
+    """
+    EXTRACTOR = MobileNetV2(weights="imagenet", include_top=False,
+                        input_shape=input_shape)
+
+    EXTRACTOR.trainable = trainable
+    features = tf.keras.layers.GlobalAveragePooling2D()(EXTRACTOR.output)
+
+    outputs = {}
+    for name, num_classes in head_sizes.items():
+        class_head = tf.keras.layers.Dense(256, activation="relu", name=name+"_dense")(features)
+        class_head = tf.keras.layers.Dropout(dropout_rate, name=name+"_dropout")(class_head)
+        outputs[name] = tf.keras.layers.Dense(num_classes, activation="softmax", name=name)(class_head)
+
+    model = tf.keras.Model(inputs=EXTRACTOR.input, outputs=outputs)
+
+    return model
+
+#-----------------------------------
+def get_feature_model(model=None, layer_name=None):
+    """
+    get_feature_model(model=None, layer_name=None)
+    This function returns a model that maps an image to a feature vector: the pooled features
+    of a trained classifier (e.g. from transfer_learning_mobilenet_model or make_cat_model),
+    or of mobilenet v2 with imagenet weights if no model is given
+    INPUTS: None
+    OPTIONAL INPUTS:
+        * model [keras model]: trained classifier (None = imagenet mobilenet v2)
+        * layer_name [string]: layer whose output is the feature vector
+          (None = the last global pooling layer)
+    GLOBAL INPUTS: TARGET_SIZE
+    OUTPUTS: keras model instance
+    """
+    if model is None:
+        return MobileNetV2(weights="imagenet", include_top=False, pooling='avg',
+                           input_shape=(TARGET_SIZE, TARGET_SIZE, 3))
+    if layer_name is None:
+        pooling = [layer for layer in model.layers if isinstance(layer, (tf.keras.layers.GlobalAveragePooling2D, tf.keras.layers.GlobalMaxPool2D))]
+        if len(pooling)==0:
+            raise ValueError("model has no global pooling layer; give the feature layer_name")
+        layer_name = pooling[-1].name
+    return tf.keras.Model(inputs=model.input, outputs=model.get_layer(layer_name).output)
+
+###############################################
+##### BOTTLENECK FEATURE FUNCTIONS
+###############################################
+
+# frozen extractor (imagenet weights), transfer learning model builder and image standardization of each base
+BOTTLENECK_BASES = {'vgg': (VGG16, transfer_learning_model_vgg, 'vgg'),
+                    'mobilenet': (MobileNetV2, transfer_learning_mobilenet_model, 'mobilenet'),
+                    'xception': (Xception, transfer_learning_xception_model, 'mobilenet')}
+
+#-----------------------------------
+def get_frozen_extractor(base='mobilenet', input_shape=None):
+    """
+    get_frozen_extractor(base='mobilenet', input_shape=None)
+    This function returns the frozen imagenet extractor of a transfer learning model, with global
+    average pooling, so its output is the input of the head of that model
+    INPUTS: None
+    OPTIONAL INPUTS:
+        * base = {'vgg' | 'mobilenet' | 'xception'}
+        * input_shape [tuple]: size of input layer (None = TARGET_SIZE x TARGET_SIZE x 3)
+    GLOBAL INPUTS: TARGET_SIZE, BOTTLENECK_BASES
+    OUTPUTS: keras model instance
+    """
+    if input_shape is None:
+        input_shape = (TARGET_SIZE, TARGET_SIZE, 3)
+    EXTRACTOR = BOTTLENECK_BASES[base][0](weights="imagenet", include_top=False,
+                        input_shape=input_shape, pooling='avg')
+    EXTRACTOR.trainable = False
+    return EXTRACTOR
+
+#-----------------------------------
+def cache_bottleneck_features(filenames, cache_dir, base='mobilenet', data_augmentation=None, num_passes=1):
+    """
+    cache_bottleneck_features(filenames, cache_dir, base='mobilenet', data_augmentation=None, num_passes=1)
+    This function runs the frozen extractor once over every image in a list of tfrecord files
+    and stores the pooled features as a float16 memory-mapped array (features.dat) with the labels
+    (labels.npy) in cache_dir. If cache_dir already holds the features of the same files and
+    settings (bottleneck.json), they are reused without running the extractor
+    INPUTS:
+        * filenames [list]: tfrecord files of ("image", "class") examples
+        * cache_dir [string]: directory for the cached features
+    OPTIONAL INPUTS:
+        * base = {'vgg' | 'mobilenet' | 'xception'}: frozen extractor (see get_frozen_extractor)
+        * data_augmentation [keras model]: applied to the images of each pass (None = no augmentation)
+        * num_passes [int]: number of passes over the images (more than one only makes sense with data_augmentation)
+    GLOBAL INPUTS: BATCH_SIZE, TARGET_SIZE
+    OUTPUTS:
+        * features [ndarray]: memory-mapped, float16, number of images x feature length
+        * labels [ndarray]: class of each image
+    """
+    settings = {"filenames": [f.split(os.sep)[-1] for f in filenames], "base": base, "target_size": TARGET_SIZE,
+                "augmented": data_augmentation is not None, "num_passes": num_passes}
+    info_file = cache_dir+os.sep+'bottleneck.json'
+    if os.path.isfile(info_file):
+        with open(info_file) as f:
+            info = json.load(f)
+        if info["settings"] == settings:
+            print("Using cached features in {}".format(cache_dir))
+            features = np.memmap(cache_dir+os.sep+'features.dat', dtype=np.float16, mode='r', shape=tuple(info["shape"]))
+            return features, np.load(cache_dir+os.sep+'labels.npy')
+
+    os.makedirs(cache_dir, exist_ok=True)
+    EXTRACTOR = get_frozen_extractor(base)
+    model = BOTTLENECK_BASES[base][2]
+    dataset = get_record_dataset(filenames, shuffle=False).map(read_tfrecord_uint8, num_parallel_calls=AUTO)
+    dataset = dataset.batch(BATCH_SIZE).prefetch(AUTO)
+
+    labels = []
+    start = time.time()
+    with open(cache_dir+os.sep+'features.dat', 'wb') as f:
+        for _ in range(num_passes):
+            for images, lbls in dataset:
+                images = standardize_image(images, lbls, model)[0]
+                if data_augmentation is not None:
+                    images = data_augmentation(images, training=True)
+                f.write(EXTRACTOR.predict_on_batch(images).astype(np.float16).tobytes())
+                labels.append(lbls.numpy())
+    labels = np.hstack(labels) if len(labels)>0 else np.array([], dtype=np.int32)
+    np.save(cache_dir+os.sep+'labels.npy', labels)
+    shape = (len(labels), EXTRACTOR.output_shape[-1])
+    with open(info_file, 'w') as f:
+        json.dump({"settings": settings, "shape": shape}, f)
+    print("Cached {} features of {} images in {:.1f} s".format(shape[1], shape[0], time.time()-start))
+
+    features = np.memmap(cache_dir+os.sep+'features.dat', dtype=np.float16, mode='r', shape=shape)
+    return features, labels
+
+#-----------------------------------
+def get_bottleneck_dataset(features, labels, shuffle=True, batch_size=None):
+    """
+    get_bottleneck_dataset(features, labels, shuffle=True, batch_size=None)
+    This function returns batches of cached features (cast to float32) and labels.
+    Batches are read from the memory-mapped array in index order, so only one batch is in memory
+    INPUTS:
+        * features [ndarray]: from cache_bottleneck_features
+        * labels [ndarray]: from cache_bottleneck_features
+    OPTIONAL INPUTS:
+        * shuffle [bool]: shuffle the images at every pass over the dataset
+        * batch_size [int]: (None = BATCH_SIZE)
+    GLOBAL INPUTS: BATCH_SIZE, SEED
+    OUTPUTS: tf.data.Dataset object (repeats if shuffle is True)
+    """
+    if batch_size is None:
+        batch_size = BATCH_SIZE
+    rng = np.random.RandomState(SEED)
+    def batches():
+        while True:
+            order = rng.permutation(len(labels)) if shuffle else np.arange(len(labels))
+            for start in range(0, len(order), batch_size):
+                index = np.sort(order[start:start+batch_size])
+                yield np.asarray(features[index], dtype=np.float32), labels[index]
+            if not shuffle:
+                return
+    dataset = tf.data.Dataset.from_generator(batches, output_signature=(
+              tf.TensorSpec(shape=(None, features.shape[1]), dtype=tf.float32),
+              tf.TensorSpec(shape=(None,), dtype=tf.as_dtype(labels.dtype))))
+    return dataset.prefetch(AUTO)
+
+#-----------------------------------
+def transfer_learning_head(num_features, num_classes, dropout_rate=0.5):
+    """
+    transfer_learning_head(num_features, num_classes, dropout_rate=0.5)
+    This function creates the head of the transfer learning models (the layers after the pooling
+    layer) on its own, to be trained on cached bottleneck features
+    INPUTS:
+        * num_features = length of the pooled feature vectors
+        * num_classes = number of classes (output nodes on classification layer)
+    OPTIONAL INPUTS:
+        * dropout_rate = proportion of neurons to randomly set to zero, after the pooling layer
+    GLOBAL INPUTS: None
+    OUTPUTS: keras model instance
+    """
+    features = tf.keras.layers.Input(shape=(num_features,))
+    class_head = tf.keras.layers.Dense(256, activation="relu")(features)
+    class_head = tf.keras.layers.Dropout(dropout_rate)(class_head)
+    class_head = tf.keras.layers.Dense(num_classes, activation="softmax")(class_head)
+
+    return tf.keras.Model(inputs=features, outputs=class_head)
+
+#-----------------------------------
+def assemble_transfer_model(head, base='mobilenet', input_shape=None):
+    """
+    assemble_transfer_model(head, base='mobilenet', input_shape=None)
+    This function builds the full transfer learning model of a base (e.g. transfer_learning_mobilenet_model)
+    and copies the weights of a head trained on bottleneck features into it, so the model takes images
+    and its weights files can be used interchangeably with those of models trained end to end
+    INPUTS:
+        * head [keras model]: from transfer_learning_head, trained
+    OPTIONAL INPUTS:
+        * base = {'vgg' | 'mobilenet' | 'xception'}: the base the features were extracted with
+        * input_shape [tuple]: size of input layer (None = TARGET_SIZE x TARGET_SIZE x 3)
+    GLOBAL INPUTS: TARGET_SIZE, BOTTLENECK_BASES
+    OUTPUTS: keras model instance
+    """
+    if input_shape is None:
+        input_shape = (TARGET_SIZE, TARGET_SIZE, 3)
+    head_dense = [layer for layer in head.layers if isinstance(layer, tf.keras.layers.Dense)]
+    dropout_rate = [layer for layer in head.layers if isinstance(layer, tf.keras.layers.Dropout)][0].rate
+    model = BOTTLENECK_BASES[base][1](head_dense[-1].units, input_shape, dropout_rate=dropout_rate)
+    model_dense = [layer for layer in model.layers if isinstance(layer, tf.keras.layers.Dense)]
+    for layer, trained in zip(model_dense, head_dense):
+        layer.set_weights(trained.get_weights())
+    return model
+
+###############################################
+##### PREDICTION FUNCTIONS
+###############################################
+
+#-----------------------------------
+def _open_prediction_writer(output_file, columns):
+    """
+    "_open_prediction_writer(output_file, columns)"
+    open a csv or parquet (if output_file ends in .parquet) file for writing rows of predictions
+    INPUTS:
+        * output_file [string]
+        * columns [list]: column names
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * write [function]: writes a list of rows (one list of values per image)
+        * close [function]: closes the file
+    """
+    if output_file.endswith('.parquet'):
+        import pyarrow, pyarrow.parquet # only needed for parquet output
+        schema = pyarrow.schema([(c, pyarrow.string() if c=='file' or c.startswith('class') else pyarrow.float32()) for c in columns])
+        writer = pyarrow.parquet.ParquetWriter(output_file, schema)
+        def write(rows):
+            writer.write_table(pyarrow.Table.from_pylist([dict(zip(columns, row)) for row in rows], schema=schema))
+        return write, writer.close
+
+    f = open(output_file, 'w', newline='')
+    writer = csv.writer(f)
+    writer.writerow(columns)
+    return writer.writerows, f.close
+
+#-----------------------------------
+def predict_files(model, filenames, CLASSES, output_file, top_k=3, standardize='mobilenet', batch_size=None, rows_per_write=4096):
+    """
+    predict_files(model, filenames, CLASSES, output_file, top_k=3, standardize='mobilenet', batch_size=None, rows_per_write=4096)
+    This function classifies a list of image files in batches (read with get_file_dataset, so the next batch
+    is decoded while the model runs) and streams the top_k classes and probabilities of each image to a
+    csv file, or a parquet file if output_file ends in .parquet, so any number of images can be classified
+    with one batch in memory. Files that cannot be read or decoded are skipped and listed in the outputs,
+    and the rows already predicted are written even if the run stops with an error
+    INPUTS:
+        * model: trained keras classifier
+        * filenames [list]: image files
+        * CLASSES [list]: class names, in class id order
+        * output_file [string]: .csv or .parquet file, with columns file, class_1, prob_1, ..., class_k, prob_k
+    OPTIONAL INPUTS:
+        * top_k [int]: number of classes written per image
+        * standardize = {'mobilenet' | 'vgg'}: image standardization of the model
+        * batch_size [int]: images per batch (None = BATCH_SIZE)
+        * rows_per_write [int]: rows buffered before each write (a parquet row group)
+    GLOBAL INPUTS: BATCH_SIZE
+    OUTPUTS:
+        * stats [dict]: number of images, seconds, images per second and failed (files that were skipped)
+    """
+    top_k = min(top_k, len(CLASSES))
+    names = [c.decode() if isinstance(c, bytes) else str(c) for c in CLASSES]
+    columns = ['file'] + [c for k in range(1, top_k+1) for c in ('class_'+str(k), 'prob_'+str(k))]
+    write, close = _open_prediction_writer(output_file, columns)
+
+    rows = []
+    done = set()
+    num_images = 0
+    start = time.time()
+    try:
+        for _, im, files in get_file_dataset(filenames, standardize, batch_size, ignore_errors=True):
+            scores = model.predict_on_batch(im)
+            scores = np.asarray(scores)
+            best = np.argsort(-scores, axis=1)[:, :top_k]
+            for f, k, p in zip(files.numpy(), best, np.take_along_axis(scores, best, axis=1)):
+                rows.append([f.decode()] + [v for n, q in zip(k, p) for v in (names[n], float(q))])
+                done.add(rows[-1][0])
+            num_images += len(best)
+            if len(rows) >= rows_per_write:
+                batch_rows, rows = rows, []
+                write(batch_rows)
+    finally:
+        # also on an error, so the rows of the batches already predicted are not lost
+        if len(rows) > 0:
+            write(rows)
+        close()
+
+    failed = [f for f in filenames if f not in done]
+    elapsed = time.time()-start
+    stats = {"num_images": num_images, "seconds": elapsed, "images_per_second": num_images / max(elapsed, 1e-9), "failed": failed}
+    print("Classified {} images in {:.1f} s ({:.1f} images/s), written to {}".format(
+          num_images, elapsed, stats["images_per_second"], output_file))
+    if len(failed) > 0:
+        print("Skipped {} files that could not be read or decoded, e.g. {}".format(len(failed), failed[:5]))
+    return stats
+
+###############################################
+##### QUANTIZATION FUNCTIONS
+###############################################
+
+#-----------------------------------
+def get_representative_dataset(filenames, standardize='mobilenet', num_samples=200):
+    """
+    get_representative_dataset(filenames, standardize='mobilenet', num_samples=200)
+    This function returns a representative dataset for full-integer quantization: a generator of
+    num_samples standardized images, drawn from a shuffled list of tfrecord files, from which the
+    converter measures the range of every activation
+    INPUTS:
+        * filenames [list]: tfrecord files of ("image", "class") examples
+    OPTIONAL INPUTS:
+        * standardize = {'mobilenet' | 'vgg'}: image standardization of the model
+        * num_samples [int]: number of images
+    GLOBAL INPUTS: AUTO
+    OUTPUTS: function returning a generator of [image] (float32, 1 x height x width x 3)
+    """
+    dataset = get_record_dataset(filenames).map(read_tfrecord_uint8, num_parallel_calls=AUTO)
+    dataset = dataset.shuffle(num_samples).take(num_samples).batch(1)
+    def representative_dataset():
+        for image, label in dataset:
+            yield [standardize_image(image, label, standardize)[0]]
+    return representative_dataset
+
+#-----------------------------------
+def export_tflite(model, tflite_prefix, representative_dataset=None, modes=('dynamic', 'float16', 'int8')):
+    """
+    export_tflite(model, tflite_prefix, representative_dataset=None, modes=('dynamic', 'float16', 'int8'))
+    This function converts a keras model to tflite files, one per quantization mode:
+    'float32' (no quantization), 'dynamic' (int8 weights, float activations), 'float16' (float16 weights)
+    and 'int8' (int8 weights and activations, with integer-only kernels; input and output stay float32,
+    so the models take the same standardized images as the keras model)
+    INPUTS:
+        * model [keras model]
+        * tflite_prefix [string]: the files are tflite_prefix+'_'+mode+'.tflite'
+    OPTIONAL INPUTS:
+        * representative_dataset [function]: from get_representative_dataset (needed for 'int8')
+        * modes [tuple]: quantization modes
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * tflite_files [dict]: file name of each mode
+    """
+    tflite_files = {}
+    for mode in modes:
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        if mode != 'float32':
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if mode == 'float16':
+            converter.target_spec.supported_types = [tf.float16]
+        elif mode == 'int8':
+            if representative_dataset is None:
+                raise ValueError("int8 quantization needs a representative_dataset")
+            converter.representative_dataset = representative_dataset
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        elif mode not in ('float32', 'dynamic'):
+            raise ValueError("unknown quantization mode {}".format(mode))
+
+        tflite_files[mode] = tflite_prefix+'_'+mode+'.tflite'
+        with open(tflite_files[mode], 'wb') as f:
+            f.write(converter.convert())
+        print("Wrote {} ({:.1f} MB)".format(tflite_files[mode], os.path.getsize(tflite_files[mode])/1e6))
+    return tflite_files
+
+#-----------------------------------
+def _tflite_predict(interpreter, images):
+    """
+    "_tflite_predict(interpreter, images)"
+    run a tflite interpreter on a batch of images (resizing its input to the batch if needed)
+    INPUTS:
+        * interpreter [tf.lite.Interpreter]
+        * images [ndarray]: float32, batch x height x width x 3
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: scores [ndarray]
+    """
+    input_details = interpreter.get_input_details()[0]
+    if tuple(input_details['shape']) != images.shape:
+        interpreter.resize_tensor_input(input_details['index'], images.shape)
+        interpreter.allocate_tensors()
+    interpreter.set_tensor(input_details['index'], images)
+    interpreter.invoke()
+    return interpreter.get_tensor(interpreter.get_output_details()[0]['index'])
+
+#-----------------------------------
+def benchmark_tflite(model, tflite_files, filenames, standardize='mobilenet', num_latency=50, num_threads=None, json_file=None):
+    """
+    benchmark_tflite(model, tflite_files, filenames, standardize='mobilenet', num_latency=50, num_threads=None, json_file=None)
+    This function compares a keras model with its tflite exports on the images of a list of tfrecord
+    files: single-image latency (median and 90th percentile over num_latency images), batch throughput,
+    model size, and accuracy, with the accuracy difference of each tflite model to the keras model.
+    The batches are streamed from the files once per model (throughput counts the prediction time only),
+    so only the num_latency images of the latency runs are held in memory
+    INPUTS:
+        * model [keras model]: the float model the tflite files were made from
+        * tflite_files [dict]: from export_tflite
+        * filenames [list]: tfrecord files of ("image", "class") examples (e.g. the validation files)
+    OPTIONAL INPUTS:
+        * standardize = {'mobilenet' | 'vgg'}: image standardization of the model
+        * num_latency [int]: number of single-image runs for the latency
+        * num_threads [int]: tflite interpreter threads (None = tflite default)
+        * json_file [string]: file to write the results to (None = not written)
+    GLOBAL INPUTS: BATCH_SIZE, AUTO
+    OUTPUTS:
+        * results [list]: one dict per model
+    """
+    dataset = get_record_dataset(filenames, shuffle=False).map(read_tfrecord_uint8, num_parallel_calls=AUTO)
+    dataset = dataset.batch(BATCH_SIZE).map(lambda x, y: standardize_image(x, y, standardize), num_parallel_calls=AUTO)
+    dataset = dataset.prefetch(AUTO)
+    singles = np.concatenate([images.numpy() for images, _ in dataset.unbatch().batch(num_latency).take(1)])
+
+    def measure(name, predict, size):
+        predict(singles[:1]) # warm up
+        latency = []
+        for image in singles:
+            start = time.perf_counter()
+            predict(image[None])
+            latency.append(time.perf_counter()-start)
+        elapsed, correct, num_images = 0., 0, 0
+        for images, labels in dataset:
+            images, labels = images.numpy(), labels.numpy()
+            start = time.perf_counter()
+            scores = predict(images)
+            elapsed += time.perf_counter()-start
+            correct += int(np.sum(np.argmax(scores, axis=1) == labels))
+            num_images += len(labels)
+        return {"model": name, "size_mb": size/1e6,
+                "latency_ms": 1000*float(np.median(latency)), "latency_p90_ms": 1000*float(np.percentile(latency, 90)),
+                "num_images": num_images, "images_per_second": num_images/max(elapsed, 1e-9), "accuracy": correct/max(num_images, 1)}
+
+    results = [measure('keras', lambda x: np.asarray(model.predict_on_batch(x)), 4*model.count_params())]
+    for mode, tflite_file in tflite_files.items():
+        interpreter = tf.lite.Interpreter(model_path=tflite_file, num_threads=num_threads)
+        interpreter.allocate_tensors()
+        results.append(measure(mode, lambda x: _tflite_predict(interpreter, x), os.path.getsize(tflite_file)))
+    for r in results:
+        r["accuracy_delta"] = r["accuracy"] - results[0]["accuracy"]
+
+    print("{:<10} {:>9} {:>12} {:>12} {:>10} {:>9} {:>9}".format('model', 'size MB', 'latency ms', 'p90 ms', 'images/s', 'accuracy', 'delta'))
+    for r in results:
+        print("{:<10} {:>9.2f} {:>12.2f} {:>12.2f} {:>10.1f} {:>9.4f} {:>+9.4f}".format(
+              r["model"], r["size_mb"], r["latency_ms"], r["latency_p90_ms"], r["images_per_second"], r["accuracy"], r["accuracy_delta"]))
+    if json_file is not None:
+        with open(json_file, 'w') as f:
+            json.dump({"num_images": results[0]["num_images"], "num_threads": num_threads, "results": results}, f, indent=2)
+    return results
@@ -29,65 +29,6 @@
 ###############################################################
 from imports import *
 
-###############################################################
-### FUNCTIONS
-###############################################################
-
-#-----------------------------------
-def get_training_dataset():
-    """
-    This function will return a batched dataset for training
-    """
-    return get_batched_dataset_viz(training_filenames)
-
-def get_validation_dataset():
-    """
-    This function will return a batched dataset for validation
-    """
-    return get_batched_dataset_viz(validation_filenames)
-
-#-----------------------------------
-def get_batched_dataset_viz(filenames):
-    """
-    This function defines the flow of data from the tfrecord files,
-    for visuzliation purposes (no .repeat)
-    """
-    option_no_order = tf.data.Options()
-    option_no_order.experimental_deterministic = True
-
-    dataset = tf.data.Dataset.list_files(filenames)
-    dataset = dataset.with_options(option_no_order)
-    dataset = dataset.interleave(tf.data.TFRecordDataset, cycle_length=16, num_parallel_calls=AUTO)
-    dataset = dataset.map(read_tfrecord_viz, num_parallel_calls=AUTO)
-
-    dataset = dataset.cache() # This dataset fits in RAM
-    # dataset = dataset.repeat()
-    dataset = dataset.shuffle(2048)
-    dataset = dataset.batch(BATCH_SIZE, drop_remainder=True) # drop_remainder will be needed on TPU
-    dataset = dataset.prefetch(AUTO) #
-
-    return dataset
-
-#-----------------------------------
-def read_tfrecord_viz(example):
-    """
-    This function reads an example record from a tfrecord and decodes the image into a jpeg
-    """
-    features = {
-        "image": tf.io.FixedLenFeature([], tf.string),  # tf.string = bytestring (not text string)
-        "class": tf.io.FixedLenFeature([], tf.int64),   # shape [] means scalar
-    }
-    # decode the TFRecord
-    example = tf.io.parse_single_example(example, features)
-
-    image = tf.image.decode_jpeg(example['image'], channels=3)
-    image = tf.cast(image, tf.uint8)
-    image = tf.reshape(image, [TARGET_SIZE,TARGET_SIZE, 3])
-
-    class_label = tf.cast(example['class'], tf.int32)
-
-    return image, class_label
-
 ####================================================
 
 data_path= os.getcwd()+os.sep+"data/nwpu/full/224"
@@ -103,40 +44,34 @@ print(CLASSES)
 
 CLASSES = [c.decode() for c in CLASSES]
 
+bs = 6 # example images plotted per class
+num_samples = 500 # images plotted as thumbnails on the t-SNE plot
 
-nb_images = ims_per_shard * len(training_filenames)
-print(nb_images)
-
+# one pass over all the tfrecords, in parallel, without holding the dataset in memory:
+# counts, mean and median images and pixel histograms per class, and a few sample images
+stats = get_dataset_stats(training_filenames, num_samples=bs)
 
-num_batches = int(((1-VALIDATION_SPLIT) * nb_images) / BATCH_SIZE)
-print(num_batches)
-X_train = []
-ytrain = []
-train_ds = get_training_dataset()
-for imgs,lbls in train_ds.take(num_batches):
-  n = np.bincount(lbls, minlength=len(CLASSES))
-  ytrain.append(lbls.numpy())
-  for im in imgs:
-    X_train.append(im)
+# class balance
+class_counts = np.array([stats[k]["count"] if k in stats else 0 for k in range(len(CLASSES))])
 
+plt.figure(figsize=(12,4))
+plt.bar(CLASSES, class_counts)
+plt.xticks(rotation=90, fontsize=7)
+plt.ylabel('Number of images')
+plt.savefig( os.getcwd()+os.sep+'results/nwpu_sample_11class_counts.png', dpi=200, bbox_inches='tight')
+plt.close('all')
 
-X_train = np.array(X_train)
-
-ytrain = np.hstack(ytrain)
+print(np.sum(class_counts))
 
 
 # show examples per class
 
-bs = 6
 for class_idx in range(len(CLASSES)): # [0,1,2]:
-  #show_one_class(class_idx=class_idx, bs=64)
-  locs = np.where(ytrain == class_idx)
-  samples = locs[:][0]
-  #random.shuffle(samples)
-  samples = samples[:bs]
-  print("Total number of {} (s) in the dataset: {}".format(CLASSES[class_idx], len(locs[:][0])))
-  X_subset = X_train[samples]
-  plot_one_class(X_subset, samples, class_idx, bs, CLASSES, rows=3, cols=2)
+  if class_idx not in stats:
+    continue
+  print("Total number of {} (s) in the dataset: {}".format(CLASSES[class_idx], class_counts[class_idx]))
+  X_subset = stats[class_idx]["samples"][:bs]
+  plot_one_class(X_subset, np.arange(len(X_subset)), class_idx, len(X_subset), CLASSES, rows=3, cols=2)
   plt.savefig( os.getcwd()+os.sep+'results/nwpu_sample_11class_samples_'+CLASSES[class_idx]+'.png', dpi=200, bbox_inches='tight')
   plt.close('all')
 
@@ -144,60 +79,44 @@ for class_idx in range(len(CLASSES)): # [0,1,2]:
 
 # plot mean images per class
 
-plot_mean_images(X_train, ytrain, CLASSES, rows=4, cols=3)
+plot_mean_images(None, None, CLASSES, rows=4, cols=3, stats=stats)
 plt.savefig( os.getcwd()+os.sep+'results/nwpu_sample_11class_mean.png', dpi=200, bbox_inches='tight')
 plt.close('all')
 
 
 #### plot histograms
 
+for class_idx in sorted(stats.keys()):
+  plot_distribution(None, None, class_idx, CLASSES, stats=stats)
+  plt.savefig( os.getcwd()+os.sep+'results/nwpu_sample_11class_hist_'+CLASSES[class_idx]+'.png', dpi=200, bbox_inches='tight')
+  plt.close('all')
 
-plot_distribution(X_train, ytrain, 0, CLASSES)
-plt.savefig( os.getcwd()+os.sep+'results/nwpu_sample_11class_hist_'+CLASSES[0]+'.png', dpi=200, bbox_inches='tight')
-plt.close('all')
-
-plot_distribution(X_train, ytrain, 1, CLASSES)
-plt.savefig( os.getcwd()+os.sep+'results/nwpu_sample_11class_hist_'+CLASSES[1]+'.png', dpi=200, bbox_inches='tight')
-plt.close('all')
-
-plot_distribution(X_train, ytrain, 2, CLASSES)
-plt.savefig( os.getcwd()+os.sep+'results/nwpu_sample_11class_hist_'+CLASSES[2]+'.png', dpi=200, bbox_inches='tight')
-plt.close('all')
-
-
-
-num_samples = 500
-X_subset = X_train[:num_samples]
-X_subset = X_subset.reshape(num_samples,-1)
-y_subset = ytrain[:num_samples]
-
-
+  plot_channel_histograms(stats, class_idx, CLASSES)
+  plt.savefig( os.getcwd()+os.sep+'results/nwpu_sample_11class_pixelhist_'+CLASSES[class_idx]+'.png', dpi=200, bbox_inches='tight')
+  plt.close('all')
 
-num_components=100
-pca = PCA(n_components=num_components)
-reduced = pca.fit_transform(X_subset)
-print('Cumulative variance explained by {} principal components: {}'.format(num_components, np.sum(pca.explained_variance_ratio_)))
 
 
+# embedding of every image: mobilenet features (imagenet weights, or pass a trained model to
+# get_feature_model), incremental PCA, then Barnes-Hut t-SNE. The embedding, a sprite atlas of
+# thumbnails and tensorboard projector files are written to embedding_dir (tensorboard --logdir embedding_dir)
+embedding_dir = os.getcwd()+os.sep+'results/nwpu_sample_11class_embedding'
 
-# Create animation
-tsne = TSNE(n_components=3,n_jobs=-1)
-tsne_result = tsne.fit_transform(reduced)
-tsne_result_scaled = StandardScaler().fit_transform(tsne_result)
+feature_model = get_feature_model()
+tsne_result_scaled, y_all = write_embedding(training_filenames, feature_model, embedding_dir, CLASSES)
 
 
-fig, ax = plot_tsne(tsne_result_scaled,y_subset, CLASSES)
-plt.savefig( os.getcwd()+os.sep+'results/nwpu_sample_11class_tsne_sample.png', dpi=200, bbox_inches='tight')
+fig, ax = plot_tsne(tsne_result_scaled, y_all, CLASSES)
+plt.savefig( os.getcwd()+os.sep+'results/nwpu_sample_11class_tsne.png', dpi=200, bbox_inches='tight')
 plt.close('all')
 
 
-X_subset = X_train[:num_samples]
-y_subset = ytrain[:num_samples]
-
+# thumbnails of a random subset, read back from the sprite atlas
+subset = np.sort(np.random.choice(len(y_all), min(num_samples, len(y_all)), replace=False))
 
-f = visualize_scatter_with_images(tsne_result_scaled, y_subset,
-                                  images = [np.reshape(i, (TARGET_SIZE,TARGET_SIZE,3)) for i in X_subset],
-                                  image_zoom=0.5, xlim = (-2,2), ylim=(-2,2))
+f = visualize_scatter_with_images(tsne_result_scaled[subset], y_all[subset],
+                                  images = read_sprite_thumbnails(embedding_dir+os.sep+'sprite.png', subset),
+                                  image_zoom=1, xlim = (-2,2), ylim=(-2,2))
 
 plt.savefig( os.getcwd()+os.sep+'results/nwpu_sample_11class_tsne_vizimages_sample.png', dpi=200, bbox_inches='tight')
 plt.close('all')
@@ -36,9 +36,11 @@ def get_training_dataset():
     This function will return a batched dataset for model training
     INPUTS: None
     OPTIONAL INPUTS: None
-    GLOBAL INPUTS: training_filenames
+    GLOBAL INPUTS: training_filenames, balanced, manifest
     OUTPUTS: batched data set object
     """
+    if balanced:
+        return get_class_balanced_dataset(training_filenames, manifest)
     return get_batched_dataset(training_filenames)
 
 def get_validation_dataset():
@@ -128,12 +130,21 @@ sample_data_path=  os.getcwd()+os.sep+"data/nwpu/full/sample"
 
 filepath =  os.getcwd()+os.sep+'results/nwpu_full_11class_mv2_best_weights_model1.h5'
 
+# True = train only the head, on features computed once by the frozen extractor and cached in bottleneck_dir
+# (much faster, but without data augmentation); the full model is then reassembled and saved to filepath
+bottleneck = False
+bottleneck_dir = filepath.replace('.h5', '_bottleneck')
+
 hist_fig =  os.getcwd()+os.sep+'results/nwpu_sample_11class_mv2_model1.png'
 
 json_file =  os.getcwd()+os.sep+'data/nwpu/nwpu_11classes.json'
 
 patience = 10
 
+# True = class-balanced training batches, drawn from per-class shards
+# (made with write_records(..., by_class=True)), instead of class weights
+balanced = False
+
 ###############################################################
 ## EXECUTION
 ###############################################################
@@ -142,16 +153,22 @@ filenames = sorted(tf.io.gfile.glob(data_path+os.sep+'*.tfrec'))
 CLASSES = read_classes_from_json(json_file)
 print(CLASSES)
 
-nb_images = ims_per_shard * len(filenames)
+manifest = read_manifest(data_path)
+
+nb_images = get_num_records(filenames, manifest)
 print(nb_images)
 
-split = int(len(filenames) * VALIDATION_SPLIT)
+if balanced:
+    # the shards hold one class each, so each class is split separately
+    training_filenames, validation_filenames = split_filenames_by_class(filenames, manifest, VALIDATION_SPLIT)
+else:
+    split = int(len(filenames) * VALIDATION_SPLIT)
 
-training_filenames = filenames[split:]
-validation_filenames = filenames[:split]
+    training_filenames = filenames[split:]
+    validation_filenames = filenames[:split]
 
-validation_steps = int(nb_images // len(filenames) * len(validation_filenames)) // BATCH_SIZE
-steps_per_epoch = int(nb_images // len(filenames) * len(training_filenames)) // BATCH_SIZE
+validation_steps = get_num_records(validation_filenames, manifest) // BATCH_SIZE
+steps_per_epoch = get_num_records(training_filenames, manifest) // BATCH_SIZE
 
 print(steps_per_epoch)
 print(validation_steps)
@@ -225,9 +242,33 @@ do_train = False #True
 # model.summary()
 
 if do_train:
-    history = model.fit(augmented_train_ds, steps_per_epoch=steps_per_epoch, epochs=MAX_EPOCHS,
-                          validation_data=augmented_val_ds, validation_steps=validation_steps,
-                          callbacks=callbacks)
+    if bottleneck:
+        # the frozen extractor runs once per image; only the head is trained, on the cached features
+        train_features, train_labels = cache_bottleneck_features(training_filenames, bottleneck_dir+os.sep+'train', 'mobilenet')
+        val_features, val_labels = cache_bottleneck_features(validation_filenames, bottleneck_dir+os.sep+'val', 'mobilenet')
+
+        head = transfer_learning_head(train_features.shape[1], len(CLASSES), dropout_rate=0.5)
+        head.compile(optimizer=tf.keras.optimizers.Adam(),
+                  loss='sparse_categorical_crossentropy',
+                  metrics=['accuracy'])
+        head_checkpoint = ModelCheckpoint(bottleneck_dir+os.sep+'head_weights.h5', monitor='val_loss',
+                                        verbose=0, save_best_only=True, mode='min',
+                                        save_weights_only = True)
+
+        history = head.fit(get_bottleneck_dataset(train_features, train_labels), steps_per_epoch=len(train_labels) // BATCH_SIZE,
+                              epochs=MAX_EPOCHS, validation_data=get_bottleneck_dataset(val_features, val_labels, shuffle=False),
+                              callbacks=[head_checkpoint, earlystop, lr_callback])
+
+        head.load_weights(bottleneck_dir+os.sep+'head_weights.h5')
+        model = assemble_transfer_model(head, 'mobilenet')
+        model.compile(optimizer=tf.keras.optimizers.Adam(),
+                  loss='sparse_categorical_crossentropy',
+                  metrics=['accuracy'])
+        model.save_weights(filepath)
+    else:
+        history = model.fit(augmented_train_ds, steps_per_epoch=steps_per_epoch, epochs=MAX_EPOCHS,
+                              validation_data=augmented_val_ds, validation_steps=validation_steps,
+                              callbacks=callbacks)
 
     # Plot training history
     plot_history(history, hist_fig)
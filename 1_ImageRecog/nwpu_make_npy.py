@@ -0,0 +1,61 @@
+# Written by Dr Daniel Buscombe, Marda Science LLC
+# for "ML Mondays", a course supported by the USGS Community for Data Integration
+# and the USGS Coastal Change Hazards Program
+#
+# MIT License
+#
+# Copyright (c) 2020, Marda Science LLC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+###############################################################
+## IMPORTS
+###############################################################
+from imports import *
+
+##NOTE: set "from nwpu_imports import *" in imports.py and tfrecords_funcs.py to use NWPU data
+
+###############################################################
+## VARIABLES
+###############################################################
+
+data_path= os.getcwd()+os.sep+"data/nwpu/full/"+str(TARGET_SIZE)
+
+###############################################################
+## EXECUTION
+###############################################################
+
+# export the train and validation tfrecords (split as in the model training scripts)
+# to memory-mapped numpy arrays, for use with get_npy_dataset
+filenames = sorted(tf.io.gfile.glob(data_path+os.sep+'*.tfrec'))
+
+split = int(len(filenames) * VALIDATION_SPLIT)
+
+training_filenames = filenames[split:]
+validation_filenames = filenames[:split]
+
+export_npy(training_filenames, data_path+os.sep+'train')
+export_npy(validation_filenames, data_path+os.sep+'val')
+
+print('.....................................')
+print('Comparing input pipeline throughput ...')
+
+print("tfrecords: {:.1f} images/sec".format(measure_throughput(get_batched_dataset(training_filenames))))
+print("npy memmap: {:.1f} images/sec".format(measure_throughput(get_npy_dataset(data_path+os.sep+'train'))))
@@ -32,84 +32,102 @@
 #do twice for sea ice
 
 from imports import *
-print(TARGET_SIZE)
+# the worker processes are spawned and import this script again (see _spawn_pool in tfrecords_funcs.py),
+# so the work only runs in the main process
+if __name__ == '__main__':
+    print(TARGET_SIZE)
 
-imdir = '/media/marda/TWOTB/USGS/SOFTWARE/DL-CDI2020/1_ImageRecog/data/nwpu/images'
-tfrecord_dir = '/media/marda/TWOTB/USGS/SOFTWARE/DL-CDI2020/1_ImageRecog/data/nwpu/full/'+str(TARGET_SIZE)
+    imdir = '/media/marda/TWOTB/USGS/SOFTWARE/DL-CDI2020/1_ImageRecog/data/nwpu/images'
+    tfrecord_dir = '/media/marda/TWOTB/USGS/SOFTWARE/DL-CDI2020/1_ImageRecog/data/nwpu/full/'+str(TARGET_SIZE)
 
-images=tf.io.gfile.glob(imdir+os.sep+'*.jpg')
+    images=tf.io.gfile.glob(imdir+os.sep+'*.jpg')
 
-# get file names
-labels = [i.split('/')[-1] for i in images]
+    # get file names
+    labels = [i.split('/')[-1] for i in images]
 
-# remove numbers
-labels = [''.join([i for i in s if not i.isdigit()]) for s in labels]
+    # remove numbers
+    labels = [''.join([i for i in s if not i.isdigit()]) for s in labels]
 
-# remove file extension
-labels = [i.split('.jpg')[0] for i in labels]
+    # remove file extension
+    labels = [i.split('.jpg')[0] for i in labels]
 
 
-CLASSES = np.unique(np.array(labels))
-## 11 classes
+    CLASSES = np.unique(np.array(labels))
+    ## 11 classes
 
-print(CLASSES)
+    print(CLASSES)
 
-# need a different function because the file structure is different than that of the tamucc imagery
+    # need a different function because the file structure is different than that of the tamucc imagery
 
-def read_image_and_label(img_path):
+    def read_image_and_label(img_path):
 
-  bits = tf.io.read_file(img_path)
-  image = tf.image.decode_jpeg(bits)
+      bits = tf.io.read_file(img_path)
+      image = tf.image.decode_jpeg(bits)
 
-  label = tf.strings.split(img_path, sep='/')
+      label = tf.strings.split(img_path, sep='/')
 
-  # remove numbers
-  label = tf.strings.regex_replace(label[-1], "([0-9]+)", r"")
-  ##label = tf.strings.split(''.join([i for i in label[-1].numpy().decode() if not i.isdigit()]), sep='.jpg')
-  label = tf.strings.split(label, sep='.jpg')
+      # remove numbers
+      label = tf.strings.regex_replace(label[-1], "([0-9]+)", r"")
+      ##label = tf.strings.split(''.join([i for i in label[-1].numpy().decode() if not i.isdigit()]), sep='.jpg')
+      label = tf.strings.split(label, sep='.jpg')
 
-  return image,label[0]
+      return image,label[0]
 
 
-# overwrite get_dataset_for_tfrecords (from imports.py) to incorporate the redefined read_image_and_label
-def get_dataset_for_tfrecords(recoded_dir, shared_size):
-    tamucc_dataset = tf.data.Dataset.list_files(recoded_dir+os.sep+'*.jpg', seed=10000) # This also shuffles the images
-    tamucc_dataset = tamucc_dataset.map(read_image_and_label)
-    tamucc_dataset = tamucc_dataset.map(resize_and_crop_image, num_parallel_calls=AUTO)
+    def read_image_and_label_fast(img_path):
 
-    tamucc_dataset = tamucc_dataset.map(recompress_image, num_parallel_calls=AUTO)
-    tamucc_dataset = tamucc_dataset.batch(shared_size)
-    return tamucc_dataset
+      image = decode_resize_crop_jpeg(tf.io.read_file(img_path))
 
+      label = tf.strings.split(img_path, sep='/')
+      label = tf.strings.regex_replace(label[-1], "([0-9]+)", r"")
+      label = tf.strings.split(label, sep='.jpg')
 
-for c in CLASSES:
-    im, lab = read_image_and_label(imdir+os.sep+c+'100.jpg')
-    print(lab.numpy())
-    class_num = np.argmax(np.array(CLASSES)==lab)
-    print(class_num)
+      return image,label[0]
 
-CLASSES = [c.encode() for c in CLASSES]
 
-nb_images=len(tf.io.gfile.glob(imdir+os.sep+'*.jpg'))
+    # overwrite get_dataset_for_tfrecords (from imports.py) to incorporate the redefined read_image_and_label
+    def get_dataset_for_tfrecords(recoded_dir, shared_size, fast_decode=True):
+        tamucc_dataset = tf.data.Dataset.list_files(recoded_dir+os.sep+'*.jpg', seed=10000) # This also shuffles the images
+        if fast_decode:
+            tamucc_dataset = tamucc_dataset.map(read_image_and_label_fast, num_parallel_calls=AUTO)
+        else:
+            tamucc_dataset = tamucc_dataset.map(read_image_and_label)
+            tamucc_dataset = tamucc_dataset.map(resize_and_crop_image, num_parallel_calls=AUTO)
 
-SHARDS = int(nb_images / ims_per_shard) + (1 if nb_images % ims_per_shard != 0 else 0)
-print(SHARDS)
+        tamucc_dataset = tamucc_dataset.map(recompress_image, num_parallel_calls=AUTO)
+        tamucc_dataset = tamucc_dataset.batch(shared_size)
+        return tamucc_dataset
 
-shared_size = int(np.ceil(1.0 * nb_images / SHARDS))
-print(shared_size)
 
-# nwpu_dataset = get_dataset_for_tfrecords(imdir, BATCH_SIZE)
-#
-# for imgs,lbls in nwpu_dataset.take(1):
-#   #print(lbls)
-#   for count,im in enumerate(imgs):
-#      plt.subplot(int(BATCH_SIZE/2),int(BATCH_SIZE/2),count+1)
-#      plt.imshow(tf.image.decode_jpeg(im, channels=3))
-#      plt.title(lbls.numpy()[count].decode(), fontsize=8)
-#      #plt.axis('off')
-# plt.show()
+    for c in CLASSES:
+        im, lab = read_image_and_label(imdir+os.sep+c+'100.jpg')
+        print(lab.numpy())
+        class_num = np.argmax(np.array(CLASSES)==lab)
+        print(class_num)
+
+    CLASSES = [c.encode() for c in CLASSES]
+
+    nb_images=len(tf.io.gfile.glob(imdir+os.sep+'*.jpg'))
+
+    SHARDS = int(nb_images / ims_per_shard) + (1 if nb_images % ims_per_shard != 0 else 0)
+    print(SHARDS)
+
+    shared_size = int(np.ceil(1.0 * nb_images / SHARDS))
+    print(shared_size)
+
+    # nwpu_dataset = get_dataset_for_tfrecords(imdir, BATCH_SIZE)
+    #
+    # for imgs,lbls in nwpu_dataset.take(1):
+    #   #print(lbls)
+    #   for count,im in enumerate(imgs):
+    #      plt.subplot(int(BATCH_SIZE/2),int(BATCH_SIZE/2),count+1)
+    #      plt.imshow(tf.image.decode_jpeg(im, channels=3))
+    #      plt.title(lbls.numpy()[count].decode(), fontsize=8)
+    #      #plt.axis('off')
+    # plt.show()
 
-nwpu_dataset = get_dataset_for_tfrecords(imdir, shared_size)
+    nwpu_dataset = get_dataset_for_tfrecords(imdir, shared_size)
 
 
-write_records(nwpu_dataset, tfrecord_dir, CLASSES)
+    by_class = False # True = separate shards for each class, for get_class_balanced_dataset
+    write_records(nwpu_dataset, tfrecord_dir, CLASSES, by_class=by_class)
@@ -32,7 +32,7 @@ from tamucc_imports import *
 
 #see mlmondays blog post:
 import os
-os.environ["TF_DETERMINISTIC_OPS"] = "1"
+# kernel determinism is set by the execution profile (see set_execution_profile in tfrecords_funcs.py)
 
 import numpy as np #numerical operations on cpu
 
@@ -48,10 +48,12 @@ from matplotlib.offsetbox import OffsetImage, AnnotationBbox #for visualizing im
 
 #calcs
 from sklearn.decomposition import PCA  #for data dimensionality reduction / viz.
+from sklearn.decomposition import IncrementalPCA #for data dimensionality reduction of large datasets, in batches
 from sklearn.preprocessing import StandardScaler #data scaling data in PCA and TSNE algorithms
 from sklearn.manifold import TSNE #for data dimensionality reduction / viz.
 
-from tfrecords_funcs import file2tensor
+from tfrecords_funcs import get_file_dataset, get_record_dataset, read_tfrecord_uint8, standardize_image
+import json
 import tensorflow as tf #numerical operations on gpu
 
 
@@ -115,6 +117,65 @@ def get_label_pairs(val_ds, model):
     preds = np.hstack(preds)
     return labs, preds
 
+#-----------------------------------
+def get_multihead_label_pairs(val_ds, model):
+    """
+    get_multihead_label_pairs(val_ds, model)
+    This function gets label observations and model estimates of every head of a multi-head model,
+    with one prediction per batch for all heads
+    INPUTS:
+        * val_ds: a batched data set object of (image, labels, weights), from to_multihead
+        * model: trained and compiled multi-head keras model instance
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * label_pairs [dict]: for each head name, (labs, preds) as from get_label_pairs
+          (images whose class is not in a head are left out)
+    """
+    labs = {}
+    preds = {}
+    for img, lab, weight in val_ds.take(-1):
+        scores = model.predict_on_batch(img)
+        for name in scores:
+            keep = weight[name].numpy().flatten() > 0
+            labs.setdefault(name, []).append(lab[name].numpy().flatten()[keep])
+            preds.setdefault(name, []).append(np.argmax(scores[name], axis=1)[keep])
+
+    return {name: (np.hstack(labs[name]), np.hstack(preds[name])) for name in labs}
+
+#-----------------------------------
+def plot_multihead_history(history, heads, train_hist_fig):
+    """
+    plot_multihead_history(history, heads, train_hist_fig)
+    This function plots the training history of each head of a multi-head model
+    INPUTS:
+        * history [dict]: the output dictionary of the model.fit() process, i.e. history = model.fit(...)
+        * heads [list]: head names
+        * train_hist_fig [string]: the filename where the plot will be printed
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: None (figure printed to file)
+    """
+    n = len(history.history['loss'])
+
+    plt.figure(figsize=(20,10))
+    plt.subplot(121)
+    for name in heads:
+        plt.plot(np.arange(1,n+1), history.history[name+'_accuracy'], label=name+' train accuracy')
+        plt.plot(np.arange(1,n+1), history.history['val_'+name+'_accuracy'], '--', label=name+' validation accuracy')
+    plt.xlabel('Epoch number', fontsize=10); plt.ylabel('Accuracy', fontsize=10)
+    plt.legend(fontsize=10)
+
+    plt.subplot(122)
+    for name in heads:
+        plt.plot(np.arange(1,n+1), history.history[name+'_loss'], label=name+' train loss')
+        plt.plot(np.arange(1,n+1), history.history['val_'+name+'_loss'], '--', label=name+' validation loss')
+    plt.xlabel('Epoch number', fontsize=10); plt.ylabel('Loss', fontsize=10)
+    plt.legend(fontsize=10)
+
+    # plt.show()
+    plt.savefig(train_hist_fig, dpi=200, bbox_inches='tight')
+
 #-----------------------------------
 def p_confmat(labs, preds, cm_filename, CLASSES, thres = 0.1):
     """
@@ -160,9 +221,9 @@ def p_confmat(labs, preds, cm_filename, CLASSES, thres = 0.1):
 ### DATA VIZ FUNCTIONS
 ###############################################################
 
-def make_sample_plot(model, sample_filenames, test_samples_fig, CLASSES):
+def make_sample_plot(model, sample_filenames, test_samples_fig, CLASSES, standardize='mobilenet'):
     """
-    make_sample_plot(model, sample_filenames, test_samples_fig, CLASSES))
+    make_sample_plot(model, sample_filenames, test_samples_fig, CLASSES, standardize='mobilenet')
     This function computes a confusion matrix (matrix of correspondences between true and estimated classes)
     using the sklearn function of the same name. Then normalizes by column totals, and makes a heatmap plot of the matrix
     saving out to the provided filename, cm_filename
@@ -171,23 +232,29 @@ def make_sample_plot(model, sample_filenames, test_samples_fig, CLASSES):
         * sample_filenames: [list] of strings
         * test_samples_fig [string]: filename to print figure to
         * CLASSES [list] os trings: class names
-    OPTIONAL INPUTS: None
+    OPTIONAL INPUTS:
+        * standardize = {'mobilenet' | 'vgg'}: image standardization of the model
     GLOBAL INPUTS: None
     OUTPUTS: None (matplotlib figure, printed to file)
     """
 
     plt.figure(figsize=(16,16))
 
+    # the images are decoded once each, and the model predicts a batch at a time
+    images, scores = [], []
+    for image, im, _ in get_file_dataset(sample_filenames, standardize):
+        images.append(tf.cast(image, tf.uint8).numpy())
+        scores.append(model.predict_on_batch(im))
+    images, scores = np.concatenate(images), np.concatenate(scores)
+
     for counter,f in enumerate(sample_filenames):
-        image, im = file2tensor(f, 'mobilenet')
         plt.subplot(6,4,counter+1)
         name = sample_filenames[counter].split(os.sep)[-1].split('_')[0]
         plt.title(name, fontsize=10)
-        plt.imshow(tf.cast(image, tf.uint8))
+        plt.imshow(images[counter])
         plt.axis('off')
 
-        scores = model.predict(tf.expand_dims(im, 0) , batch_size=1)
-        n = np.argmax(scores[0])
+        n = np.argmax(scores[counter])
         est_name = CLASSES[n].decode()
         if name==est_name:
            plt.text(10,50,'prediction: %s' % est_name,
@@ -229,7 +296,23 @@ def compute_hist(images):
     """
     images = images/255.
     mean = np.mean(images, axis=0, dtype=np.float64)
+    return compute_mean_hist(mean)
 
+#-----------------------------------
+def compute_mean_hist(mean):
+    """
+    compute_mean_hist(mean)
+    Compute the per channel histogram of a mean image
+    (e.g. from compute_mean_image, or the "mean" of get_dataset_stats)
+    INPUTS:
+        * mean [ndarray]: mean image of shape (W x H x 3), in [0,1]
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * hist_r [dict]: histogram frequencies {'hist'} and bins {'bins'} for red channel
+        * hist_g [dict]: histogram frequencies {'hist'} and bins {'bins'} for green channel
+        * hist_b [dict]: histogram frequencies {'hist'} and bins {'bins'} for blue channel
+    """
     mean_r, mean_g, mean_b = mean[:,:,0], mean[:,:,1], mean[:,:,2]
     mean_r = np.reshape(mean_r, (-1, 1))
     mean_g = np.reshape(mean_g, (-1, 1))
@@ -246,25 +329,29 @@ def compute_hist(images):
     return hist_r, hist_g, hist_b
 
 #-----------------------------------
-def plot_distribution(images, labels, class_id, CLASSES):
+def plot_distribution(images, labels, class_id, CLASSES, stats=None):
     """
-    plot_distribution(images, labels, class_id, CLASSES)
+    plot_distribution(images, labels, class_id, CLASSES, stats=None)
     Compute the per channel histogram for a batch
     of images
     INPUTS:
         * images [ndarray]: batch of shape (N x W x H x 3)
         * labels [ndarray]: batch of shape (N x 1)
         * class_id [int]: class integer to plot
-    OPTIONAL INPUTS: None
+    OPTIONAL INPUTS:
+        * stats [dict]: from get_dataset_stats, used instead of images and labels (which can be None)
     GLOBAL INPUTS: None
     OUTPUTS: matplotlib figure
     """
     fig = plt.figure(figsize=(21,7))
     rows, cols = 1, 3
-    locs = np.where(labels == class_id)
-    samples = locs[:][0]
-    class_images = images[samples]
-    hist_r, hist_g, hist_b = compute_hist(class_images)
+    if stats is not None:
+        hist_r, hist_g, hist_b = compute_mean_hist(stats[class_id]["mean"])
+    else:
+        locs = np.where(labels == class_id)
+        samples = locs[:][0]
+        class_images = images[samples]
+        hist_r, hist_g, hist_b = compute_hist(class_images)
     plt.title("Histogram - Mean Pixel Value:  " + CLASSES[class_id])
     plt.axis('off')
 
@@ -338,14 +425,16 @@ def compute_mean_image(images, opt="mean"):
         return np.median(images, axis=0)
 
 #-----------------------------------
-def plot_mean_images(images, labels, CLASSES, rows=3, cols = 2):
+def plot_mean_images(images, labels, CLASSES, rows=3, cols = 2, stats=None):
     """
-    plot_mean_images(images, labels, CLASSES, rows=3, cols = 2)
+    plot_mean_images(images, labels, CLASSES, rows=3, cols = 2, stats=None)
     Plot the mean image of a set of images
     INPUTS:
         * images [ndarray]: batch of shape (N x W x H x 3)
         * labels [ndarray]: batch of shape (N x 1)
     OPTIONAL INPUTS:
+        * stats [dict]: from get_dataset_stats, used instead of images and labels (which can be None);
+          the median images are plotted if they were computed, otherwise the mean images
     GLOBAL INPUTS:
     OUTPUTS: matplotlib figure
     """
@@ -354,14 +443,41 @@ def plot_mean_images(images, labels, CLASSES, rows=3, cols = 2):
     example_images = []
     for n in np.arange(len(CLASSES)):
         fig.add_subplot(rows, cols, n + 1)
-        locs = np.where(labels == n)
-        samples = locs[:][0]
-        class_images = images[samples]
-        img = compute_mean_image(class_images, "median")
+        if stats is not None:
+            if n not in stats:
+                continue
+            img = stats[n]["median"] if stats[n]["median"] is not None else stats[n]["mean"]
+        else:
+            locs = np.where(labels == n)
+            samples = locs[:][0]
+            class_images = images[samples]
+            img = compute_mean_image(class_images, "median")
         plt.imshow(img)
         plt.title(CLASSES[n])
         plt.axis('off')
 
+#-----------------------------------
+def plot_channel_histograms(stats, class_id, CLASSES):
+    """
+    plot_channel_histograms(stats, class_id, CLASSES)
+    Plot the red, green and blue histograms of all pixels of one class
+    INPUTS:
+        * stats [dict]: from get_dataset_stats
+        * class_id [int]: class integer to plot
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: matplotlib figure
+    """
+    fig = plt.figure(figsize=(21,7))
+    plt.title("Histogram - Pixel Value:  " + CLASSES[class_id])
+    plt.axis('off')
+    hist = stats[class_id]["channel_hist"]
+    for c, color in enumerate(['r', 'g', 'b']):
+        fig.add_subplot(1, 3, c + 1)
+        plt.bar(np.arange(256)/255., hist[c]/np.sum(hist[c]), align='center', width=0.7/255., color=color)
+        plt.xlim((0,1))
+        plt.ylabel('Fraction of pixels')
+
 #-----------------------------------
 def plot_tsne(tsne_result, label_ids, CLASSES):
     """
@@ -426,3 +542,197 @@ def visualize_scatter_with_images(X_2d_data, labels, images, figsize=(15,15), im
     ax.set_xlim(xlim)
     ax.set_ylim(ylim)
     return fig
+
+###############################################################
+### EMBEDDING FUNCTIONS
+###############################################################
+
+#-----------------------------------
+def extract_features(filenames, feature_model, output_dir, thumb_size=32, model='mobilenet'):
+    """
+    extract_features(filenames, feature_model, output_dir, thumb_size=32, model='mobilenet')
+    Compute the feature vector of every image in a list of tfrecord files, in batches, and
+    append the features, labels and small thumbnails of the images to files in output_dir
+    (features.dat, float32; labels.npy; thumbnails.dat, uint8), so only one batch is in memory
+    INPUTS:
+        * filenames [list]: tfrecord files of ("image", "class") examples
+        * feature_model [keras model]: image to feature vector (see get_feature_model)
+        * output_dir [string]: directory for the output files
+    OPTIONAL INPUTS:
+        * thumb_size [int]: thumbnail height and width in pixels
+        * model = {'mobilenet' | 'vgg'}: standardization of the images for feature_model
+    GLOBAL INPUTS: BATCH_SIZE
+    OUTPUTS:
+        * features [ndarray]: memory-mapped, number of images x feature length
+        * labels [ndarray]: class of each image
+        * thumbnails [ndarray]: memory-mapped, number of images x thumb_size x thumb_size x 3
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    dataset = get_record_dataset(filenames, shuffle=False).map(read_tfrecord_uint8, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    dataset = dataset.batch(BATCH_SIZE).prefetch(tf.data.experimental.AUTOTUNE)
+
+    labels = []
+    num_features = None
+    with open(output_dir+os.sep+'features.dat', 'wb') as f_features, open(output_dir+os.sep+'thumbnails.dat', 'wb') as f_thumbs:
+        for images, lbls in dataset:
+            features = feature_model.predict_on_batch(standardize_image(images, lbls, model)[0])
+            features = np.reshape(features, (len(lbls), -1)).astype(np.float32)
+            num_features = features.shape[1]
+            f_features.write(features.tobytes())
+            f_thumbs.write(tf.cast(tf.image.resize(images, (thumb_size, thumb_size), antialias=True), tf.uint8).numpy().tobytes())
+            labels.append(lbls.numpy())
+    labels = np.hstack(labels) if len(labels)>0 else np.array([], dtype=np.int32)
+    np.save(output_dir+os.sep+'labels.npy', labels)
+    print("Extracted {} features from {} images".format(num_features, len(labels)))
+
+    features = np.memmap(output_dir+os.sep+'features.dat', dtype=np.float32, mode='r', shape=(len(labels), num_features or 0))
+    thumbnails = np.memmap(output_dir+os.sep+'thumbnails.dat', dtype=np.uint8, mode='r', shape=(len(labels), thumb_size, thumb_size, 3))
+    return features, labels, thumbnails
+
+#-----------------------------------
+def reduce_features(features, num_components=50, chunk_size=1024):
+    """
+    reduce_features(features, num_components=50, chunk_size=1024)
+    Reduce feature vectors with incremental PCA: the PCA is fitted one chunk of
+    rows at a time, then each chunk is projected, so features can be a memory-mapped array
+    larger than memory
+    INPUTS:
+        * features [ndarray]: number of images x feature length
+    OPTIONAL INPUTS:
+        * num_components [int]: number of principal components kept
+        * chunk_size [int]: rows per chunk (at least num_components)
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * reduced [ndarray]: number of images x num_components
+        * pca [sklearn IncrementalPCA]: fitted model
+    """
+    num_components = min(num_components, features.shape[0], features.shape[1])
+    chunk_size = max(chunk_size, num_components)
+    pca = IncrementalPCA(n_components=num_components)
+    # the last chunk is merged with the one before if it has fewer rows than components
+    starts = list(range(0, features.shape[0], chunk_size))
+    if len(starts)>1 and features.shape[0]-starts[-1] < num_components:
+        starts = starts[:-1]
+    ends = starts[1:] + [features.shape[0]]
+    for start, end in zip(starts, ends):
+        pca.partial_fit(np.asarray(features[start:end]))
+    reduced = np.vstack([pca.transform(np.asarray(features[start:end])) for start, end in zip(starts, ends)])
+    print('Cumulative variance explained by {} principal components: {}'.format(num_components, np.sum(pca.explained_variance_ratio_)))
+    return reduced.astype(np.float32), pca
+
+#-----------------------------------
+def embed_features(reduced, num_dims=3, perplexity=30):
+    """
+    embed_features(reduced, num_dims=3, perplexity=30)
+    Embed (PCA-reduced) feature vectors in 2 or 3 dimensions with Barnes-Hut t-SNE
+    (approximate, O(N log N) instead of the O(N^2) of exact t-SNE), scaled to zero mean and unit variance
+    INPUTS:
+        * reduced [ndarray]: number of images x number of components
+    OPTIONAL INPUTS:
+        * num_dims [int]: 2 or 3 (plot_tsne and visualize_scatter_with_images use 3)
+        * perplexity [float]: t-SNE perplexity (roughly, the number of neighbours each point keeps close)
+    GLOBAL INPUTS: SEED
+    OUTPUTS:
+        * embedding [ndarray]: number of images x num_dims
+    """
+    tsne = TSNE(n_components=num_dims, perplexity=perplexity, method='barnes_hut', init='pca', random_state=SEED, n_jobs=-1)
+    return StandardScaler().fit_transform(tsne.fit_transform(reduced))
+
+#-----------------------------------
+def write_sprite(thumbnails, sprite_file, max_size=8192):
+    """
+    write_sprite(thumbnails, sprite_file, max_size=8192)
+    Pack thumbnails into one square grid image (a sprite atlas, in the format of the
+    tensorboard embedding projector), row by row in image order. Thumbnails are shrunk
+    if the atlas would be larger than max_size pixels across
+    INPUTS:
+        * thumbnails [ndarray]: number of images x height x width x 3, uint8
+        * sprite_file [string]: png file to write
+    OPTIONAL INPUTS:
+        * max_size [int]: largest atlas height and width in pixels (8192 for tensorboard)
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * sprite [dict]: thumb_size, columns and num_images of the atlas (also written next to it, as json)
+    """
+    num_images = len(thumbnails)
+    columns = max(int(np.ceil(np.sqrt(num_images))), 1)
+    thumb_size = min(thumbnails.shape[1], max_size // columns)
+    if thumb_size < 1:
+        raise ValueError("{} thumbnails do not fit in a {} pixel sprite".format(num_images, max_size))
+    atlas = np.zeros((columns*thumb_size, columns*thumb_size, 3), dtype=np.uint8)
+    for start in range(0, num_images, 1024):
+        batch = np.asarray(thumbnails[start:start+1024])
+        if thumb_size != thumbnails.shape[1]:
+            batch = tf.cast(tf.image.resize(batch, (thumb_size, thumb_size), antialias=True), tf.uint8).numpy()
+        for k, thumb in enumerate(batch):
+            row, col = divmod(start+k, columns)
+            atlas[row*thumb_size:(row+1)*thumb_size, col*thumb_size:(col+1)*thumb_size] = thumb
+    plt.imsave(sprite_file, atlas)
+    sprite = {"thumb_size": int(thumb_size), "columns": columns, "num_images": num_images}
+    with open(os.path.splitext(sprite_file)[0]+'.json', 'w') as f:
+        json.dump(sprite, f)
+    return sprite
+
+#-----------------------------------
+def read_sprite_thumbnails(sprite_file, indices):
+    """
+    read_sprite_thumbnails(sprite_file, indices)
+    Read some thumbnails back from a sprite atlas written by write_sprite
+    (e.g. for visualize_scatter_with_images)
+    INPUTS:
+        * sprite_file [string]: png file
+        * indices [list]: image indices
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: list of thumbnails [ndarray]
+    """
+    with open(os.path.splitext(sprite_file)[0]+'.json') as f:
+        sprite = json.load(f)
+    atlas = plt.imread(sprite_file)
+    t = sprite["thumb_size"]
+    thumbs = []
+    for i in indices:
+        row, col = divmod(int(i), sprite["columns"])
+        thumbs.append(atlas[row*t:(row+1)*t, col*t:(col+1)*t, :3])
+    return thumbs
+
+#-----------------------------------
+def write_embedding(filenames, feature_model, output_dir, CLASSES, num_components=50, num_dims=3, perplexity=30, thumb_size=32, model='mobilenet'):
+    """
+    write_embedding(filenames, feature_model, output_dir, CLASSES, num_components=50, num_dims=3, perplexity=30, thumb_size=32, model='mobilenet')
+    Embedding visualization of a whole tfrecord dataset: backbone features extracted in
+    batches (extract_features), reduced with incremental PCA (reduce_features), and embedded
+    with Barnes-Hut t-SNE (embed_features). Writes to output_dir:
+    embedding.csv (index, class id, class name and coordinates of each image), sprite.png
+    (thumbnail atlas) and, for the tensorboard embedding projector, features.tsv (PCA features),
+    metadata.tsv and projector_config.pbtxt (tensorboard --logdir output_dir)
+    INPUTS:
+        * filenames [list]: tfrecord files of ("image", "class") examples
+        * feature_model [keras model]: image to feature vector (see get_feature_model)
+        * output_dir [string]: directory for the output files
+        * CLASSES [list]: class names
+    OPTIONAL INPUTS:
+        * num_components, num_dims, perplexity, thumb_size, model: see the functions above
+    GLOBAL INPUTS: BATCH_SIZE, SEED
+    OUTPUTS:
+        * embedding [ndarray]: number of images x num_dims
+        * labels [ndarray]: class of each image
+    """
+    features, labels, thumbnails = extract_features(filenames, feature_model, output_dir, thumb_size, model)
+    reduced, pca = reduce_features(features, num_components)
+    embedding = embed_features(reduced, num_dims, perplexity)
+    sprite = write_sprite(thumbnails, output_dir+os.sep+'sprite.png')
+
+    names = np.array([CLASSES[k] if 0 <= k < len(CLASSES) else str(k) for k in labels])
+    with open(output_dir+os.sep+'embedding.csv', 'w') as f:
+        f.write('index,class_id,class,'+','.join('x{}'.format(d) for d in range(num_dims))+'\n')
+        for i in range(len(labels)):
+            f.write('{},{},{},'.format(i, labels[i], names[i])+','.join('{:.5f}'.format(v) for v in embedding[i])+'\n')
+    np.savetxt(output_dir+os.sep+'features.tsv', reduced, delimiter='\t', fmt='%.5f')
+    with open(output_dir+os.sep+'metadata.tsv', 'w') as f:
+        f.write('\n'.join(names)+'\n')
+    with open(output_dir+os.sep+'projector_config.pbtxt', 'w') as f:
+        f.write('embeddings {{\n  tensor_path: "features.tsv"\n  metadata_path: "metadata.tsv"\n'
+                '  sprite {{\n    image_path: "sprite.png"\n    single_image_dim: {0}\n    single_image_dim: {0}\n  }}\n}}\n'.format(sprite["thumb_size"]))
+    print("Wrote the embedding of {} images to {}".format(len(labels), output_dir))
+    return embedding, labels
@@ -0,0 +1,73 @@
+# Written by Dr Daniel Buscombe, Marda Science LLC
+# for "ML Mondays", a course supported by the USGS Community for Data Integration
+# and the USGS Coastal Change Hazards Program
+#
+# MIT License
+#
+# Copyright (c) 2020, Marda Science LLC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Classifies every image in a directory (or matching a glob pattern) with a trained model, in batches,
+# and streams the top_k classes and probabilities of each image to a csv or parquet file,
+# with the throughput printed at the end. A figure of the first 24 images is optional
+
+###############################################################
+## IMPORTS
+###############################################################
+
+from imports import *
+
+# faster kernels and a private tf.data thread pool, outputs still in input order (see EXECUTION_PROFILES)
+set_execution_profile('inference')
+
+###############################################################
+## VARIABLES
+###############################################################
+
+weights_file = os.getcwd()+os.sep+'results/tamucc_subset_3class_mv2_best_weights_model2.h5'
+classes_file = os.getcwd()+os.sep+'data/tamucc/subset_3class/classes.json' # {"0": "marsh", "1": "dev", ...}
+
+image_path = os.getcwd()+os.sep+'data/tamucc/subset_3class/sample' # a directory, or a glob pattern such as 'data/frames/*/*.jpg'
+
+build_model = transfer_learning_mobilenet_model # the model function the weights were trained with
+standardize = 'mobilenet' # 'vgg' for transfer_learning_model_vgg
+
+output_file = os.getcwd()+os.sep+'results/tamucc_subset_3class_mv2_predictions.csv' # or .parquet
+top_k = 3 # classes written per image
+
+sample_plot_fig = None # e.g. os.getcwd()+os.sep+'results/tamucc_subset_3class_mv2_predictions.png' (first 24 images)
+
+###############################################################
+## EXECUTION
+###############################################################
+
+CLASSES = read_classes_from_json(classes_file)
+
+filenames = get_image_filenames(image_path)
+print('{} images to classify'.format(len(filenames)))
+
+model = build_model(len(CLASSES), (TARGET_SIZE, TARGET_SIZE, 3))
+model.load_weights(weights_file)
+
+stats = predict_files(model, filenames, CLASSES, output_file, top_k, standardize)
+
+if sample_plot_fig is not None:
+    make_sample_plot(model, filenames[:24], sample_plot_fig, CLASSES, standardize)
@@ -0,0 +1,194 @@
+# Written by Dr Daniel Buscombe, Marda Science LLC
+# for "ML Mondays", a course supported by the USGS Community for Data Integration
+# and the USGS Coastal Change Hazards Program
+#
+# MIT License
+#
+# Copyright (c) 2020, Marda Science LLC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Trains the 2-class (dev/undev), 3-class (marsh/dev/other) and 4-class TAMUCC models as one model:
+# a single mobilenet v2 extractor shared by three classification heads, trained from one stream of images
+# from the full-class tfrecords (the coarser labels are derived from the original class of each image),
+# so each image is decoded and passed through the extractor once for all three label sets
+
+###############################################################
+## IMPORTS
+###############################################################
+
+from imports import *
+
+#-----------------------------------
+def get_training_dataset():
+    """
+    get_training_dataset()
+    This function will return a batched dataset for multi-head model training
+    INPUTS: None
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: training_filenames, head_maps
+    OUTPUTS: batched data set object
+    """
+    return to_multihead(get_batched_dataset(training_filenames), head_maps)
+
+def get_validation_dataset():
+    """
+    get_validation_dataset()
+    This function will return a batched dataset for multi-head model validation
+    INPUTS: None
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: validation_filenames, head_maps
+    OUTPUTS: batched data set object
+    """
+    return to_multihead(get_batched_dataset(validation_filenames), head_maps)
+
+def get_validation_eval_dataset():
+    """
+    get_validation_eval_dataset()
+    This function will return a batched dataset for multi-head model evaluation (one pass, in order)
+    INPUTS: None
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: validation_filenames, head_maps
+    OUTPUTS: batched data set object
+    """
+    return to_multihead(get_eval_dataset(validation_filenames), head_maps)
+
+###############################################################
+## VARIABLES
+###############################################################
+
+data_path= os.getcwd()+os.sep+"data/tamucc/full/"+str(TARGET_SIZE)
+# the class list, for tfrecords written before the manifest (see tamucc_make_tfrecords.py)
+csvfile = '/media/marda/TWOTB/USGS/DATA/tamucc_coastal_imagery/tamucc_full.csv'
+
+patience = 10
+
+filepath = os.getcwd()+os.sep+'results/tamucc_full_multihead_mv2_best_weights.h5'
+
+train_hist_fig = os.getcwd()+os.sep+'results/tamucc_full_multihead_mv2_model.png'
+cm_prefix = os.getcwd()+os.sep+'results/tamucc_full_multihead_mv2_model_cm_val_'
+
+###############################################################
+## EXECUTION
+###############################################################
+
+#images already shuffled
+filenames = sorted(tf.io.gfile.glob(data_path+os.sep+'*.tfrec'))
+
+print('.....................................')
+print('Reading files and making datasets ...')
+
+manifest = read_manifest(data_path)
+if manifest is not None:
+    CLASSES = [c.encode() for c in manifest["classes"]]
+else:
+    # no manifest: the classes are read from the csv file, as in tamucc_make_tfrecords.py
+    CLASSES = [c.encode() for c in np.unique(pd.read_csv(csvfile)['class'].values)]
+
+## the label sets of tamucc_make_tfrecords_sample_2class, _3class and _4class, in terms of the original classes
+dev_classes = [c for c in CLASSES if b'structures' in c] + [c for c in CLASSES if b'manmade' in c]
+marsh_classes = [c for c in CLASSES if b'marsh' in c] + [c for c in CLASSES if b'swamp' in c] + [c for c in CLASSES if b'flat' in c]
+
+HEADS = {
+ 'class2': {b'dev': dev_classes,
+            b'undev': np.setdiff1d(CLASSES, dev_classes).tolist()},
+ 'class3': {b'marsh': marsh_classes,
+            b'dev': dev_classes,
+            b'other': np.setdiff1d(np.setdiff1d(CLASSES, dev_classes), marsh_classes).tolist()},
+ 'class4': {c:[c] for c in [b'finegrained_sand_beaches', b'gravel_shell_beaches',
+                            b'salt_brackish_water_marshes', b'sheltered_solid_manmade']}, # other classes are not used by this head
+}
+head_maps = get_head_maps(CLASSES, HEADS)
+
+nb_images = get_num_records(filenames, manifest)
+print(nb_images)
+
+split = int(len(filenames) * VALIDATION_SPLIT)
+
+training_filenames = filenames[split:]
+validation_filenames = filenames[:split]
+
+validation_steps = get_num_records(validation_filenames, manifest) // BATCH_SIZE
+steps_per_epoch = get_num_records(training_filenames, manifest) // BATCH_SIZE
+
+print(steps_per_epoch)
+print(validation_steps)
+
+print('.....................................')
+print('Creating and compiling model ...')
+
+lr_callback = tf.keras.callbacks.LearningRateScheduler(lambda epoch: lrfn(epoch), verbose=True)
+
+model = multihead_mobilenet_model({name:len(HEADS[name]) for name in HEADS}, (TARGET_SIZE, TARGET_SIZE, 3), dropout_rate=0.5)
+
+# images outside the classes of a head have zero weight for that head, so the accuracies are weighted too
+model.compile(optimizer=tf.keras.optimizers.Adam(),
+          loss={name:'sparse_categorical_crossentropy' for name in HEADS},
+          weighted_metrics=['accuracy'])
+
+earlystop = EarlyStopping(monitor="val_loss",
+                              mode="min", patience=patience)
+
+# set checkpoint file
+model_checkpoint = ModelCheckpoint(filepath, monitor='val_loss',
+                                verbose=0, save_best_only=True, mode='min',
+                                save_weights_only = True)
+
+callbacks = [model_checkpoint, earlystop, lr_callback]
+
+do_train = False #True
+
+if do_train:
+    print('.....................................')
+    print('Training model ...')
+
+    history = model.fit(get_training_dataset(), steps_per_epoch=steps_per_epoch, epochs=MAX_EPOCHS,
+                          validation_data=get_validation_dataset(), validation_steps=validation_steps,
+                          callbacks=callbacks)
+
+    # Plot training history
+    plot_multihead_history(history, list(HEADS.keys()), train_hist_fig)
+
+    plt.close('all')
+    K.clear_session()
+
+else:
+    model.load_weights(filepath)
+
+
+##########################################################
+### evaluate
+print('.....................................')
+print('Evaluating model ...')
+
+scores = model.evaluate(get_validation_eval_dataset(), return_dict=True)
+for name in HEADS:
+    print(name+' test mean accuracy: ', round((scores[name+'_accuracy'])*100, 2),' %')
+
+## confusion matrices
+print('.....................................')
+print('Computing confusion matrices and printing to '+cm_prefix+'*.png')
+
+# one pass of the extractor per image, for all heads
+label_pairs = get_multihead_label_pairs(get_validation_eval_dataset(), model)
+
+for name in HEADS:
+    labs, preds = label_pairs[name]
+    p_confmat(labs, preds, cm_prefix+name+'.png', list(HEADS[name].keys()))
@@ -122,7 +122,9 @@ filenames = sorted(tf.io.gfile.glob(data_path+os.sep+'*.tfrec'))
 print('.....................................')
 print('Reading files and making datasets ...')
 
-nb_images = ims_per_shard * len(filenames)
+manifest = read_manifest(data_path)
+
+nb_images = get_num_records(filenames, manifest)
 print(nb_images)
 
 split = int(len(filenames) * VALIDATION_SPLIT)
@@ -130,8 +132,8 @@ split = int(len(filenames) * VALIDATION_SPLIT)
 training_filenames = filenames[split:]
 validation_filenames = filenames[:split]
 
-validation_steps = int(nb_images // len(filenames) * len(validation_filenames)) // BATCH_SIZE
-steps_per_epoch = int(nb_images // len(filenames) * len(training_filenames)) // BATCH_SIZE
+validation_steps = get_num_records(validation_filenames, manifest) // BATCH_SIZE
+steps_per_epoch = get_num_records(training_filenames, manifest) // BATCH_SIZE
 
 print(steps_per_epoch)
 print(validation_steps)
@@ -36,9 +36,11 @@ def get_training_dataset():
     This function will return a batched dataset for model training
     INPUTS: None
     OPTIONAL INPUTS: None
-    GLOBAL INPUTS: training_filenames
+    GLOBAL INPUTS: training_filenames, balanced, manifest
     OUTPUTS: batched data set object
     """
+    if balanced:
+        return get_class_balanced_dataset(training_filenames, manifest)
     return get_batched_dataset(training_filenames)
 
 def get_validation_dataset():
@@ -103,12 +105,21 @@ patience = 10
 
 filepath = os.getcwd()+os.sep+'results/tamucc_subset_3class_mv2_best_weights_model2.h5'
 
+# True = train only the head, on features computed once by the frozen extractor and cached in bottleneck_dir
+# (much faster, but without data augmentation); the full model is then reassembled and saved to filepath
+bottleneck = False
+bottleneck_dir = filepath.replace('.h5', '_bottleneck')
+
 train_hist_fig = os.getcwd()+os.sep+'results/tamucc_sample_3class_mv2_model2.png'
 cm_filename = os.getcwd()+os.sep+'results/tamucc_sample_3class_mv2_model2_cm_val.png'
 sample_plot_name = os.getcwd()+os.sep+'results/tamucc_sample_3class_mv2_model2_est24samples.png'
 
 test_samples_fig = os.getcwd()+os.sep+'results/tamucc_full_sample_3class_mv2_model_est24samples.png'
 
+# True = class-balanced training batches, drawn from per-class shards
+# (made with write_records(..., by_class=True)), instead of class weights
+balanced = False
+
 ###############################################################
 ## EXECUTION
 ###############################################################
@@ -119,16 +130,22 @@ filenames = sorted(tf.io.gfile.glob(data_path+os.sep+'*.tfrec'))
 print('.....................................')
 print('Reading files and making datasets ...')
 
-nb_images = ims_per_shard * len(filenames)
+manifest = read_manifest(data_path)
+
+nb_images = get_num_records(filenames, manifest)
 print(nb_images)
 
-split = int(len(filenames) * VALIDATION_SPLIT)
+if balanced:
+    # the shards hold one class each, so each class is split separately
+    training_filenames, validation_filenames = split_filenames_by_class(filenames, manifest, VALIDATION_SPLIT)
+else:
+    split = int(len(filenames) * VALIDATION_SPLIT)
 
-training_filenames = filenames[split:]
-validation_filenames = filenames[:split]
+    training_filenames = filenames[split:]
+    validation_filenames = filenames[:split]
 
-validation_steps = int(nb_images // len(filenames) * len(validation_filenames)) // BATCH_SIZE
-steps_per_epoch = int(nb_images // len(filenames) * len(training_filenames)) // BATCH_SIZE
+validation_steps = get_num_records(validation_filenames, manifest) // BATCH_SIZE
+steps_per_epoch = get_num_records(training_filenames, manifest) // BATCH_SIZE
 
 print(steps_per_epoch)
 print(validation_steps)
@@ -147,24 +164,9 @@ print('Computing class weights ...')
 
 ## are train and validation sets approximately equal in terms of their class representation?
 
-num_batches = int(((1-VALIDATION_SPLIT) * nb_images) / BATCH_SIZE)
-print(num_batches)
-Ntrain = []
-train_ds = get_training_dataset()
-for _,lbls in train_ds.take(num_batches):
-  n = np.bincount(lbls, minlength=len(CLASSES))
-  Ntrain.append(n)
-
-num_batches = int((VALIDATION_SPLIT * nb_images) / BATCH_SIZE)
-print(num_batches)
-Nval = []
-val_ds = get_validation_dataset()
-for _,lbls in val_ds.take(num_batches):
-  n = np.bincount(lbls, minlength=len(CLASSES))
-  Nval.append(n)
-
-Ntrain = np.sum(Ntrain, axis=0)
-Nval = np.sum(Nval, axis=0)
+# only the class labels are read from the tfrecords (no images are decoded)
+Ntrain = np.bincount(get_labels(training_filenames), minlength=len(CLASSES))
+Nval = np.bincount(get_labels(validation_filenames), minlength=len(CLASSES))
 
 plt.figure(figsize=(10,10))
 plt.subplot(121)
@@ -236,9 +238,33 @@ if do_train:
     print('.....................................')
     print('Training model ...')
 
-    history = model2.fit(augmented_train_ds, steps_per_epoch=steps_per_epoch, epochs=MAX_EPOCHS,
-                          validation_data=augmented_val_ds, validation_steps=validation_steps,
-                          callbacks=callbacks)
+    if bottleneck:
+        # the frozen extractor runs once per image; only the head is trained, on the cached features
+        train_features, train_labels = cache_bottleneck_features(training_filenames, bottleneck_dir+os.sep+'train', 'mobilenet')
+        val_features, val_labels = cache_bottleneck_features(validation_filenames, bottleneck_dir+os.sep+'val', 'mobilenet')
+
+        head = transfer_learning_head(train_features.shape[1], len(CLASSES), dropout_rate=0.5)
+        head.compile(optimizer=tf.keras.optimizers.Adam(),
+                  loss='sparse_categorical_crossentropy',
+                  metrics=['accuracy'])
+        head_checkpoint = ModelCheckpoint(bottleneck_dir+os.sep+'head_weights.h5', monitor='val_loss',
+                                        verbose=0, save_best_only=True, mode='min',
+                                        save_weights_only = True)
+
+        history = head.fit(get_bottleneck_dataset(train_features, train_labels), steps_per_epoch=len(train_labels) // BATCH_SIZE,
+                              epochs=MAX_EPOCHS, validation_data=get_bottleneck_dataset(val_features, val_labels, shuffle=False),
+                              callbacks=[head_checkpoint, earlystop, lr_callback])
+
+        head.load_weights(bottleneck_dir+os.sep+'head_weights.h5')
+        model2 = assemble_transfer_model(head, 'mobilenet')
+        model2.compile(optimizer=tf.keras.optimizers.Adam(),
+                  loss='sparse_categorical_crossentropy',
+                  metrics=['accuracy'])
+        model2.save_weights(filepath)
+    else:
+        history = model2.fit(augmented_train_ds, steps_per_epoch=steps_per_epoch, epochs=MAX_EPOCHS,
+                              validation_data=augmented_val_ds, validation_steps=validation_steps,
+                              callbacks=callbacks)
 
     # Plot training history
     plot_history(history, train_hist_fig)
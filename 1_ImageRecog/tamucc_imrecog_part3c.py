@@ -35,9 +35,11 @@ def get_training_dataset():
     This function will return a batched dataset for model training
     INPUTS: None
     OPTIONAL INPUTS: None
-    GLOBAL INPUTS: training_filenames
+    GLOBAL INPUTS: training_filenames, balanced, manifest
     OUTPUTS: batched data set object
     """
+    if balanced:
+        return get_class_balanced_dataset(training_filenames, manifest)
     return get_batched_dataset(training_filenames)
 
 def get_validation_dataset():
@@ -89,30 +91,19 @@ def get_aug_datasets():
     return augmented_train_ds, augmented_val_ds
 
 #-----------------------------------
-def get_all_labels(nb_images, VALIDATION_SPLIT, BATCH_SIZE):
+def get_all_labels():
     """
-    get_all_labels(nb_images, VALIDATION_SPLIT, BATCH_SIZE)
+    get_all_labels()
     This function will obtain the classes of all samples in both train and
     validation sets. For computing class imbalance on the whole dataset
-    INPUTS:
-        * nb_images [int]: number of total images
+    Only the class feature of each record is parsed (see get_labels), so no image is decoded
+    INPUTS: None
     OPTIONAL INPUTS: None
-    GLOBAL INPUTS: VALIDATION_SPLIT, BATCH_SIZE
+    GLOBAL INPUTS: training_filenames, validation_filenames
     OUTPUTS:
-        * l [list]: list of integers representing labels of each image
+        * l [ndarray]: 1d vector of integers representing labels of each image
     """
-    l = []
-    num_batches = int(((1-VALIDATION_SPLIT) * nb_images) / BATCH_SIZE)
-    train_ds = get_training_dataset()
-    for _,lbls in train_ds.take(num_batches):
-        l.append(lbls.numpy())
-
-    val_ds = get_validation_dataset()
-    num_batches = int(((VALIDATION_SPLIT) * nb_images) / BATCH_SIZE)
-    for _,lbls in val_ds.take(num_batches):
-        l.append(lbls.numpy())
-
-    l = np.asarray(l).flatten()
+    l = np.hstack((get_labels(training_filenames), get_labels(validation_filenames)))
     return l
 
 ###############################################################
@@ -140,6 +131,10 @@ test_samples_fig = os.getcwd()+os.sep+'results/tamucc_full_sample_4class_mv2_mod
 
 patience = 30
 
+# True = class-balanced training batches, drawn from per-class shards
+# (made with write_records(..., by_class=True)), instead of class weights
+balanced = False
+
 ###############################################################
 ## EXECUTION
 ###############################################################
@@ -152,16 +147,22 @@ print('Reading files and making datasets ...')
 CLASSES = read_classes_from_json(json_file)
 print(CLASSES)
 
-nb_images = ims_per_shard * len(filenames)
+manifest = read_manifest(data_path)
+
+nb_images = get_num_records(filenames, manifest)
 print(nb_images)
 
-split = int(len(filenames) * VALIDATION_SPLIT)
+if balanced:
+    # the shards hold one class each, so each class is split separately
+    training_filenames, validation_filenames = split_filenames_by_class(filenames, manifest, VALIDATION_SPLIT)
+else:
+    split = int(len(filenames) * VALIDATION_SPLIT)
 
-training_filenames = filenames[split:]
-validation_filenames = filenames[:split]
+    training_filenames = filenames[split:]
+    validation_filenames = filenames[:split]
 
-validation_steps = int(nb_images // len(filenames) * len(validation_filenames)) // BATCH_SIZE
-steps_per_epoch = int(nb_images // len(filenames) * len(training_filenames)) // BATCH_SIZE
+validation_steps = get_num_records(validation_filenames, manifest) // BATCH_SIZE
+steps_per_epoch = get_num_records(training_filenames, manifest) // BATCH_SIZE
 
 print(steps_per_epoch)
 print(validation_steps)
@@ -205,15 +206,22 @@ plt.savefig(os.getcwd()+os.sep+'results/tamucc_full_4class_valsamples.png', dpi=
 print('.....................................')
 print('Computing class weights ...')
 
-l = get_all_labels(nb_images, VALIDATION_SPLIT, BATCH_SIZE)
-
 # class weights will be given by n_samples / (n_classes * np.bincount(y))
 
-class_weights = class_weight.compute_class_weight('balanced',
-                                                 np.unique(l),
-                                                 l)
+if balanced:
+    # the training batches are already balanced
+    class_weights = None
+elif manifest is not None:
+    # class counts are in the manifest, so there is no need to read the data
+    class_weights = get_class_weights(filenames, manifest)
+else:
+    l = get_all_labels()
+
+    class_weights = class_weight.compute_class_weight('balanced',
+                                                     np.unique(l),
+                                                     l)
 
-class_weights = dict(enumerate(class_weights))
+    class_weights = dict(enumerate(class_weights))
 print(class_weights)
 
 
@@ -30,79 +30,85 @@
 from imports import *
 
 
-#============================================
+# the worker processes are spawned and import this script again (see _spawn_pool in tfrecords_funcs.py),
+# so the work only runs in the main process
+if __name__ == '__main__':
+    #============================================
 
-imdir = '/media/marda/TWOTB/USGS/DATA/tamucc_coastal_imagery/subset'
-csvfile = '/media/marda/TWOTB/USGS/DATA/tamucc_coastal_imagery/tamucc_subset.csv'
-recoded_dir = '/media/marda/TWOTB/USGS/DATA/tamucc_coastal_imagery/subset_recoded_3class'
-# os.mkdir(recoded_dir)
-tfrecord_dir = '1_ImageRecog/data/tamucc/subset_3class/'+str(TARGET_SIZE)
-# os.mkdir(tfrecord_dir)
+    imdir = '/media/marda/TWOTB/USGS/DATA/tamucc_coastal_imagery/subset'
+    csvfile = '/media/marda/TWOTB/USGS/DATA/tamucc_coastal_imagery/tamucc_subset.csv'
+    recoded_dir = '/media/marda/TWOTB/USGS/DATA/tamucc_coastal_imagery/subset_recoded_3class'
+    # os.mkdir(recoded_dir)
+    tfrecord_dir = '1_ImageRecog/data/tamucc/subset_3class/'+str(TARGET_SIZE)
+    # os.mkdir(tfrecord_dir)
 
-dat = pd.read_csv(csvfile)
-CLASSES = np.unique(dat['class'].values)
-print(CLASSES)
+    dat = pd.read_csv(csvfile)
+    CLASSES = np.unique(dat['class'].values)
+    print(CLASSES)
 
-CLASSES = [c.encode() for c in CLASSES]
+    CLASSES = [c.encode() for c in CLASSES]
 
-#low energy
-marsh_classes = [c for c in CLASSES if b'marsh' in c] + [c for c in CLASSES if b'swamp' in c] + [c for c in CLASSES if b'flat' in c]
+    #low energy
+    marsh_classes = [c for c in CLASSES if b'marsh' in c] + [c for c in CLASSES if b'swamp' in c] + [c for c in CLASSES if b'flat' in c]
 
-#developed
-dev_classes = [c for c in CLASSES if b'structures' in c] + [c for c in CLASSES if b'manmade' in c]
+    #developed
+    dev_classes = [c for c in CLASSES if b'structures' in c] + [c for c in CLASSES if b'manmade' in c]
 
-#high energy
-other_classes = np.setdiff1d(np.setdiff1d(CLASSES, dev_classes), marsh_classes).tolist()
+    #high energy
+    other_classes = np.setdiff1d(np.setdiff1d(CLASSES, dev_classes), marsh_classes).tolist()
 
 
 
-# for f,c in zip(dat.file.values, dat['class'].values):
-#   if c.encode() in marsh_classes:
-#      shutil.copy(imdir+os.sep+f, recoded_dir+os.sep+'marsh'+'_'+f)
-#   elif c.encode() in dev_classes:
-#      shutil.copy(imdir+os.sep+f, recoded_dir+os.sep+'dev'+'_'+f)
-#   else:
-#      shutil.copy(imdir+os.sep+f, recoded_dir+os.sep+'other'+'_'+f)
+    # for f,c in zip(dat.file.values, dat['class'].values):
+    #   if c.encode() in marsh_classes:
+    #      shutil.copy(imdir+os.sep+f, recoded_dir+os.sep+'marsh'+'_'+f)
+    #   elif c.encode() in dev_classes:
+    #      shutil.copy(imdir+os.sep+f, recoded_dir+os.sep+'dev'+'_'+f)
+    #   else:
+    #      shutil.copy(imdir+os.sep+f, recoded_dir+os.sep+'other'+'_'+f)
 
 
-im, lab = read_image_and_label(recoded_dir+os.sep+'dev_IMG_0158_SecMO_Sum12_Pt3.jpg')
-print(lab)
+    im, lab = read_image_and_label(recoded_dir+os.sep+'dev_IMG_0158_SecMO_Sum12_Pt3.jpg')
+    print(lab)
 
-im, lab = read_image_and_label(recoded_dir+os.sep+'other_IMG_1576_SecBC_Spr12.jpg')
-print(lab)
+    im, lab = read_image_and_label(recoded_dir+os.sep+'other_IMG_1576_SecBC_Spr12.jpg')
+    print(lab)
 
-im, lab = read_image_and_label(recoded_dir+os.sep+'marsh_IMG_4882_SecJMO_Sum12_Pt3.jpg')
-print(lab)
+    im, lab = read_image_and_label(recoded_dir+os.sep+'marsh_IMG_4882_SecJMO_Sum12_Pt3.jpg')
+    print(lab)
 
 
-nb_images=len(tf.io.gfile.glob(recoded_dir+os.sep+'*.jpg'))
+    nb_images=len(tf.io.gfile.glob(recoded_dir+os.sep+'*.jpg'))
 
-SHARDS = int(nb_images / ims_per_shard) + (1 if nb_images % ims_per_shard != 0 else 0)
-print(SHARDS)
+    SHARDS = int(nb_images / ims_per_shard) + (1 if nb_images % ims_per_shard != 0 else 0)
+    print(SHARDS)
 
-shared_size = int(np.ceil(1.0 * nb_images / SHARDS))
-print(shared_size)
+    shared_size = int(np.ceil(1.0 * nb_images / SHARDS))
+    print(shared_size)
 
-tamucc_dataset = get_dataset_for_tfrecords(recoded_dir, shared_size)
+    tamucc_dataset = get_dataset_for_tfrecords(recoded_dir, shared_size, fast_decode=True)
 
-write_records(tamucc_dataset, tfrecord_dir)
+    CLASSES = [b'marsh', b'dev', b'other']
 
-#
-# tamucc_dataset = tf.data.Dataset.list_files(recoded_dir+os.sep+'*.jpg', seed=10000) # This also shuffles the images
-# tamucc_dataset = tamucc_dataset.map(read_image_and_label)
-# tamucc_dataset = tamucc_dataset.map(resize_and_crop_image, num_parallel_calls=AUTO)
-#
-# tamucc_dataset = tamucc_dataset.map(recompress_image, num_parallel_calls=AUTO)
-# tamucc_dataset = tamucc_dataset.batch(shared_size)
-#
-# CLASSES = [b'marsh', b'dev', b'other']
-#
-# for shard, (image, label) in enumerate(tamucc_dataset):
-#   shard_size = image.numpy().shape[0]
-#   filename = tfrecord_dir+os.sep+"tamucc" + "{:02d}-{}.tfrec".format(shard, shard_size)
-#
-#   with tf.io.TFRecordWriter(filename) as out_file:
-#     for i in range(shard_size):
-#       example = to_tfrecord(image.numpy()[i],label.numpy()[i], CLASSES)
-#       out_file.write(example.SerializeToString())
-#     print("Wrote file {} containing {} records".format(filename, shard_size))
+    by_class = False # True = separate shards for each class, for get_class_balanced_dataset
+    write_records(tamucc_dataset, tfrecord_dir, CLASSES, by_class=by_class)
+
+    #
+    # tamucc_dataset = tf.data.Dataset.list_files(recoded_dir+os.sep+'*.jpg', seed=10000) # This also shuffles the images
+    # tamucc_dataset = tamucc_dataset.map(read_image_and_label)
+    # tamucc_dataset = tamucc_dataset.map(resize_and_crop_image, num_parallel_calls=AUTO)
+    #
+    # tamucc_dataset = tamucc_dataset.map(recompress_image, num_parallel_calls=AUTO)
+    # tamucc_dataset = tamucc_dataset.batch(shared_size)
+    #
+    # CLASSES = [b'marsh', b'dev', b'other']
+    #
+    # for shard, (image, label) in enumerate(tamucc_dataset):
+    #   shard_size = image.numpy().shape[0]
+    #   filename = tfrecord_dir+os.sep+"tamucc" + "{:02d}-{}.tfrec".format(shard, shard_size)
+    #
+    #   with tf.io.TFRecordWriter(filename) as out_file:
+    #     for i in range(shard_size):
+    #       example = to_tfrecord(image.numpy()[i],label.numpy()[i], CLASSES)
+    #       out_file.write(example.SerializeToString())
+    #     print("Wrote file {} containing {} records".format(filename, shard_size))
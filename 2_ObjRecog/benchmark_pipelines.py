@@ -0,0 +1,79 @@
+# Written by Dr Daniel Buscombe, Marda Science LLC
+# for "ML Mondays", a course supported by the USGS Community for Data Integration
+# and the USGS Coastal Change Hazards Program
+#
+# MIT License
+#
+# Copyright (c) 2020, Marda Science LLC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Times the input pipelines with no model attached, over a sweep of pipeline settings,
+# and writes the results as json. If model.fit trains at about the images/sec of
+# the secoora training dataset here, training is input-bound
+# (LabelEncoderCoco.encode_batch is usually the most expensive stage)
+
+###############################################################
+## IMPORTS
+###############################################################
+from imports import *
+import time
+
+###############################################################
+## VARIABLES
+###############################################################
+
+data_path = os.getcwd()+os.sep+"data/synthetic" # (see synthetic_make_tfrecords.py) or e.g. "data/secoora"
+train_pattern = '*.tfrec' # e.g. '*train*.tfrecord'
+val_pattern = '*.tfrec' # e.g. '*val*.tfrecord'
+
+json_file = os.getcwd()+os.sep+'results/benchmark_pipelines_'+time.strftime("%Y%m%d-%H%M%S")+'.json'
+baseline_json = None # earlier results file, to report throughput regressions against
+
+num_elements = 50 # batches timed in each run
+
+# every combination of these settings is timed (see the top of tfrecords_funcs.py)
+grid = {"CYCLE_LENGTH": [None, 4],
+        "MAP_PARALLELISM": [AUTO, 4],
+        "BATCH_SIZE": [BATCH_SIZE, 4]}
+
+###############################################################
+## EXECUTION
+###############################################################
+
+train_filenames = sorted(tf.io.gfile.glob(data_path+os.sep+train_pattern))
+val_filenames = sorted(tf.io.gfile.glob(data_path+os.sep+val_pattern))
+print("{} training and {} validation tfrecord files".format(len(train_filenames), len(val_filenames)))
+
+pipelines = [
+    # the stages of the training dataset: reading the records, parsing them, decoding, resizing and
+    # padded-batching them, then encoding the boxes as anchor targets (LabelEncoderCoco.encode_batch)
+    ("read", lambda: get_secoora_stage_dataset(train_filenames, 'read'), True),
+    ("read+parse", lambda: get_secoora_stage_dataset(train_filenames, 'parse'), False),
+    ("read+parse+preprocess", lambda: get_secoora_stage_dataset(train_filenames, 'preprocess'), True),
+    ("read+parse+preprocess+encode_batch", lambda: get_secoora_stage_dataset(train_filenames, 'encode'), True),
+    ("prepare_secoora_datasets_for_training (train)", lambda: prepare_secoora_datasets_for_training(data_path, train_filenames, val_filenames)[0], True),
+    ("prepare_secoora_datasets_for_training (val)", lambda: prepare_secoora_datasets_for_training(data_path, train_filenames, val_filenames)[1], True),
+]
+
+results = benchmark_pipelines(pipelines, grid, json_file, num_elements)
+
+if baseline_json is not None:
+    compare_benchmarks(baseline_json, json_file)
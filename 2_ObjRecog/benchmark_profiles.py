@@ -0,0 +1,82 @@
+# Written by Dr Daniel Buscombe, Marda Science LLC
+# for "ML Mondays", a course supported by the USGS Community for Data Integration
+# and the USGS Coastal Change Hazards Program
+#
+# MIT License
+#
+# Copyright (c) 2020, Marda Science LLC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Times the input pipelines, and a model training and prediction step on their batches,
+# under each execution profile (see EXECUTION_PROFILES in tfrecords_funcs.py), and prints the
+# throughput gap between the profiles. Kernel determinism and the thread pools are fixed when
+# tensorflow starts, so this script runs itself once per profile, each in a fresh python process
+
+###############################################################
+## IMPORTS
+###############################################################
+from imports import *
+import time, subprocess, sys
+
+###############################################################
+## VARIABLES
+###############################################################
+
+data_path = os.getcwd()+os.sep+"data/synthetic" # (see synthetic_make_tfrecords.py) or e.g. "data/secoora"
+train_pattern = '*.tfrec' # e.g. '*train*.tfrecord'
+val_pattern = '*.tfrec' # e.g. '*val*.tfrecord'
+
+profiles = ['reproducible', 'fast', 'inference'] # the first one is the reference
+
+# one results file per profile, <json_stem>_<profile>.json
+json_stem = os.environ.get("BENCHMARK_JSON_STEM", os.getcwd()+os.sep+'results/benchmark_profiles_'+time.strftime("%Y%m%d-%H%M%S"))
+
+num_elements = 50 # batches timed in each run
+
+###############################################################
+## EXECUTION
+###############################################################
+
+if "EXECUTION_PROFILE" not in os.environ:
+    for profile in profiles:
+        print("Execution profile: {}".format(profile))
+        subprocess.run([sys.executable, os.path.abspath(__file__)], check=True,
+                       env=dict(os.environ, EXECUTION_PROFILE=profile, BENCHMARK_JSON_STEM=json_stem))
+    compare_profiles([json_stem+'_'+profile+'.json' for profile in profiles])
+
+else:
+    train_filenames = sorted(tf.io.gfile.glob(data_path+os.sep+train_pattern))
+    val_filenames = sorted(tf.io.gfile.glob(data_path+os.sep+val_pattern))
+
+    resnet50_backbone = get_backbone()
+    loss_fn = RetinaNetLoss(num_classes)
+    model = RetinaNet(num_classes, resnet50_backbone)
+    model.compile(loss=loss_fn, optimizer=tf.optimizers.SGD(momentum=0.9))
+
+    pipelines = [
+        ("prepare_secoora_datasets_for_training (train)", lambda: prepare_secoora_datasets_for_training(data_path, train_filenames, val_filenames)[0], True),
+        ("prepare_secoora_datasets_for_training (train) + train step", lambda: prepare_secoora_datasets_for_training(data_path, train_filenames, val_filenames)[0], True,
+         lambda batch: model.train_on_batch(*batch)),
+        ("prepare_secoora_datasets_for_training (val) + predict step", lambda: prepare_secoora_datasets_for_training(data_path, train_filenames, val_filenames)[1], True,
+         lambda batch: model.predict_on_batch(batch[0])),
+    ]
+
+    benchmark_pipelines(pipelines, None, json_stem+'_'+os.environ["EXECUTION_PROFILE"]+'.json', num_elements)
@@ -42,3 +42,7 @@ sustain_epochs = 0
 exp_decay = .8
 MAX_EPOCHS = 100
 patience = 20
+
+#execution profile (see EXECUTION_PROFILES in tfrecords_funcs.py): 'reproducible' (repeatable runs),
+#'strict' (repeatable op order too, slower), 'fast' (maximum training throughput) or 'inference' (maximum throughput, outputs in input order)
+EXECUTION_PROFILE = 'reproducible'
@@ -327,7 +327,8 @@ SCORES = np.hstack(SCORES)
 
 
 
-train_dataset, val_dataset = prepare_coco_datasets_for_training(train_dataset, val_dataset)
+# the tfds coco examples are not checked with validate_tfrecords.py, so examples that fail to encode are skipped
+train_dataset, val_dataset = prepare_coco_datasets_for_training(train_dataset, val_dataset, ignore_errors=True)
 
 
 do_train = True
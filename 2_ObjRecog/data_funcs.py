@@ -1,7 +1,7 @@
 
 #see mlmondays blog post:
 import os
-os.environ["TF_DETERMINISTIC_OPS"] = "1"
+# kernel determinism is set by the execution profile (see set_execution_profile in tfrecords_funcs.py)
 
 ##calcs
 import numpy as np
@@ -331,8 +331,8 @@ def preprocess_secoora_data(example):
     image = tf.cast(image, tf.float32)
     #image = tf.image.per_image_standardization(image)
 
-    bbox = tf.numpy_function(np.array,[[example["objects/xmin"], example["objects/ymin"], example["objects/xmax"], example["objects/ymax"]]], tf.float32)
-    bbox = tf.transpose(bbox)
+    # pure tensorflow ops (no tf.numpy_function), so the map can run on tf.data service workers
+    bbox = tf.stack([example["objects/xmin"], example["objects/ymin"], example["objects/xmax"], example["objects/ymax"]], axis=-1)
 
     class_id = tf.cast(example["objects/label"], dtype=tf.int32)
 
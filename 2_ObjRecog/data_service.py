@@ -0,0 +1,173 @@
+# Written by Dr Daniel Buscombe, Marda Science LLC
+# for "ML Mondays", a course supported by the USGS Community for Data Integration
+# and the USGS Coastal Change Hazards Program
+#
+# MIT License
+#
+# Copyright (c) 2020, Marda Science LLC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Starts a tf.data service on this machine with one command:
+#   python data_service.py
+# then pass service='localhost:5050' to get_batched_dataset (or get_batched_dataset_oysternet,
+# get_batched_dataset_obx, prepare_secoora_datasets_for_training) in the training script,
+# and the input pipeline runs in these worker processes instead of the training process.
+# To add cpu from another machine, copy this file there, set dispatcher_address to
+# '<dispatcher host>:5050' and run it: only workers are started, and they join the same service.
+
+###############################################################
+## IMPORTS
+###############################################################
+import os, socket, multiprocessing, tempfile, glob
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+import tensorflow as tf
+
+###############################################################
+## VARIABLES
+###############################################################
+
+port = 5050 # dispatcher port
+num_workers = 2 # worker processes started on this machine (each runs a full multithreaded pipeline)
+dispatcher_address = None # None = start a dispatcher here; '<host>:5050' = only start workers for that dispatcher
+work_dir = None # directory where the dispatcher journals its state, so it can be restarted (None = in memory)
+check = True # push a small dataset, then the secoora training pipeline on synthetic shards, through the service once it is up
+
+###############################################################
+## FUNCTIONS
+###############################################################
+
+#-----------------------------------
+def run_dispatcher(port, work_dir=None):
+    """
+    run_dispatcher(port, work_dir=None)
+    This function runs a tf.data service dispatcher until the process is killed
+    INPUTS:
+        * port [int]
+    OPTIONAL INPUTS:
+        * work_dir [string]: directory for the dispatcher journal (None = in memory)
+    GLOBAL INPUTS: None
+    OUTPUTS: None
+    """
+    config = tf.data.experimental.service.DispatcherConfig(port=port, work_dir=work_dir,
+                                                           fault_tolerant_mode=work_dir is not None)
+    tf.data.experimental.service.DispatchServer(config).join()
+
+#-----------------------------------
+def run_worker(dispatcher_address, worker_host='localhost'):
+    """
+    run_worker(dispatcher_address, worker_host='localhost')
+    This function runs a tf.data service worker, registered with the dispatcher,
+    until the process is killed. The worker picks a free port
+    INPUTS:
+        * dispatcher_address [string]: '<host>:<port>'
+    OPTIONAL INPUTS:
+        * worker_host [string]: name under which trainers reach this worker
+    GLOBAL INPUTS: None
+    OUTPUTS: None
+    """
+    config = tf.data.experimental.service.WorkerConfig(dispatcher_address=dispatcher_address,
+                                                       worker_address=worker_host+':%port%')
+    tf.data.experimental.service.WorkerServer(config).join()
+
+#-----------------------------------
+def check_service(dispatcher_address, num_elements=64):
+    """
+    check_service(dispatcher_address, num_elements=64)
+    This function runs a small dataset through the service and checks what comes back
+    (each worker produces its own copy of the data in 'parallel_epochs' mode)
+    INPUTS:
+        * dispatcher_address [string]: '<host>:<port>'
+    OPTIONAL INPUTS:
+        * num_elements [int]
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * ok [bool]
+    """
+    dataset = tf.data.Dataset.range(num_elements).map(lambda x: x*x)
+    dataset = dataset.apply(tf.data.experimental.service.distribute(processing_mode="parallel_epochs",
+                                                                    service='grpc://'+dispatcher_address))
+    values = [int(x) for x in dataset]
+    ok = len(values)>0 and set(values)==set(x*x for x in range(num_elements))
+    print("Service check {}: received {} elements".format("passed" if ok else "FAILED", len(values)))
+    return ok
+
+#-----------------------------------
+def check_secoora_pipeline(dispatcher_address, num_images=16, num_batches=2):
+    """
+    check_secoora_pipeline(dispatcher_address, num_images=16, num_batches=2)
+    This function writes a few synthetic object detection shards (same schema as the
+    secoora tfrecords) to a temporary directory, builds the training pipeline with
+    prepare_secoora_datasets_for_training(..., service=dispatcher_address) and checks
+    that the workers return label-encoded batches. The workers run on this machine, so
+    they can read the temporary files
+    INPUTS:
+        * dispatcher_address [string]: '<host>:<port>'
+    OPTIONAL INPUTS:
+        * num_images [int]: number of synthetic records
+        * num_batches [int]: number of batches to fetch
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * ok [bool]
+    """
+    # imported here, so that workers started on other machines only need tensorflow
+    from tfrecords_funcs import write_synthetic_detection_records, prepare_secoora_datasets_for_training, BATCH_SIZE
+
+    with tempfile.TemporaryDirectory() as tfrecord_dir:
+        write_synthetic_detection_records(tfrecord_dir, num_images, 2, height=240, width=320, num_workers=1)
+        filenames = sorted(glob.glob(tfrecord_dir+os.sep+'*.tfrec'))
+        train_dataset, _ = prepare_secoora_datasets_for_training(tfrecord_dir, filenames, filenames,
+                                                                 service=dispatcher_address, ignore_errors=False)
+        batches = [(images.shape, labels.shape) for images, labels in train_dataset.take(num_batches)]
+
+    ok = len(batches)==num_batches and all(i[0]==BATCH_SIZE and i[-1]==3 and l[0]==BATCH_SIZE and l[-1]==5
+                                           for i, l in batches)
+    print("Secoora pipeline check {}: received batches {}".format("passed" if ok else "FAILED", batches))
+    return ok
+
+###############################################################
+## EXECUTION
+###############################################################
+
+if __name__ == '__main__':
+    ctx = multiprocessing.get_context('spawn') # tensorflow must not be forked
+    processes = []
+    if dispatcher_address is None:
+        dispatcher_address = 'localhost:{}'.format(port)
+        worker_host = 'localhost'
+        processes.append(ctx.Process(target=run_dispatcher, args=(port, work_dir), daemon=True))
+    else:
+        worker_host = socket.gethostname()
+    for k in range(num_workers):
+        processes.append(ctx.Process(target=run_worker, args=(dispatcher_address, worker_host), daemon=True))
+
+    for p in processes:
+        p.start()
+    print("tf.data service at {} with {} local workers".format(dispatcher_address, num_workers))
+
+    if check:
+        check_service(dispatcher_address)
+        check_secoora_pipeline(dispatcher_address)
+
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        print("Stopping tf.data service")
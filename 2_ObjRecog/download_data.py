@@ -1,13 +1,18 @@
 
-import os, zipfile
-import tensorflow as tf
+import os
+from download_funcs import *
 
+# set extract = False to keep secoora.zip instead of extracting it; its tfrecords can then be read
+# in place with list_zip_members and the zip_path argument of the dataset functions (see tfrecords_funcs.py).
+# The coco data and model weights are always extracted
+extract = True
 
-try:
-    os.mkdir('data')
-except:
-    pass
 
+for folder in ['data', 'data/secoora', './retinanet', './retinanet/scratch', './retinanet/finetune']:
+    try:
+        os.mkdir(folder)
+    except:
+        pass
 
 
 # """
@@ -17,103 +22,24 @@ except:
 # training in this example.
 # """
 
-url = "https://ml-mondays-data.s3-us-west-2.amazonaws.com/mlmondays_data_imrecog/releases/download/0.1.0/data.zip"
-# url = "https://github.com/srihari-humbarwadi/datasets/releases/download/v0.1.0/data.zip"
-filename = os.path.join(os.getcwd(), "data.zip")
-tf.keras.utils.get_file(filename, url)
-
-
-with zipfile.ZipFile("data.zip", "r") as z_fp:
-    z_fp.extractall("./")
-
-    
-
-try:
-    os.mkdir('data/secoora')
-except:
-    pass
-
-folder = './data/secoora'
-
-file = 'secoora.zip'
-
-#url = "https://github.com/dbuscombe-usgs/mlmondays_data_objrecog/releases/download/0.1.0/"+file
-url = "https://ml-mondays-data.s3-us-west-2.amazonaws.com/mlmondays_data_imrecog/releases/download/0.1.0/"+file
-filename = os.path.join(os.getcwd(), file)
-print("Downloading %s ... " % (filename))
-tf.keras.utils.get_file(filename, url)
-print("Unzipping to %s ... " % (folder))
-with zipfile.ZipFile(file, "r") as z_fp:
-    z_fp.extractall("./"+folder)
-
-try:
-    os.remove(file)
-except:
-    pass
-
+url = "https://ml-mondays-data.s3-us-west-2.amazonaws.com/mlmondays_data_imrecog/releases/download/0.1.0/"
+# coco: url = "https://github.com/srihari-humbarwadi/datasets/releases/download/v0.1.0/data.zip"
+# secoora: url = "https://github.com/dbuscombe-usgs/mlmondays_data_objrecog/releases/download/0.1.0/"+file
+# weights: url = "https://github.com/dbuscombe-usgs/mlmondays_data_objrecog/releases/download/0.1.1/"+file
 
+downloads = [
+(url+'data.zip', os.path.join(os.getcwd(), 'data.zip'), './'),
+(url+'secoora.zip', os.path.join(os.getcwd(), 'secoora.zip'), './data/secoora' if extract else None),
 #========= weights
+(url+'secoora_retinanet_scratch_weights.zip', os.path.join(os.getcwd(), 'secoora_retinanet_scratch_weights.zip'), './retinanet/scratch'),
+(url+'secoora_retinanet_coco_finetune_weights.zip', os.path.join(os.getcwd(), 'secoora_retinanet_coco_finetune_weights.zip'), './retinanet/finetune'),
+]
 
+# sha256 of each release file, checked after download (recorded in checksums.json with
+# write_checksums(<release files>, 'checksums.json'); files with a null hash are not verified)
+checksums = read_checksums(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checksums.json'))
 
-### === scratch
-file = 'secoora_retinanet_scratch_weights.zip'
-
-folder = './retinanet'
-try:
-    os.mkdir(folder)
-except:
-    pass
-
-folder = './retinanet/scratch'
-try:
-    os.mkdir(folder)
-except:
-    pass
-
-url = "https://ml-mondays-data.s3-us-west-2.amazonaws.com/mlmondays_data_imrecog/releases/download/0.1.0/"+file
-#url = "https://github.com/dbuscombe-usgs/mlmondays_data_objrecog/releases/download/0.1.1/"+file
-filename = os.path.join(os.getcwd(), file)
-print("Downloading %s ... " % (filename))
-tf.keras.utils.get_file(filename, url)
-print("Unzipping to %s ... " % (folder))
-with zipfile.ZipFile(file, "r") as z_fp:
-    z_fp.extractall("./"+folder)
-
-try:
-    os.remove(file)
-except:
-    pass
-
-
-## fine-tuned
-file = 'secoora_retinanet_coco_finetune_weights.zip'
-
-folder = './retinanet'
-try:
-    os.mkdir(folder)
-except:
-    pass
-
-folder = './retinanet/finetune'
-try:
-    os.mkdir(folder)
-except:
-    pass
-
-url = "https://ml-mondays-data.s3-us-west-2.amazonaws.com/mlmondays_data_imrecog/releases/download/0.1.0/"+file
-# url = "https://ml-mondays-data.s3-us-west-2.amazonaws.com/mlmondays_data_objrecog/releases/download/0.1.1/"+file
-
-filename = os.path.join(os.getcwd(), file)
-print("Downloading %s ... " % (filename))
-tf.keras.utils.get_file(filename, url)
-print("Unzipping to %s ... " % (folder))
-with zipfile.ZipFile(file, "r") as z_fp:
-    z_fp.extractall("./"+folder)
-
-try:
-    os.remove(file)
-except:
-    pass
+download_files(downloads, checksums)
 
 os.system('mv data/*final* data/coco')
 os.system('mv data/check* data/coco')
@@ -181,6 +181,8 @@ callbacks = [model_checkpoint, earlystop, lr_callback]
 val_filenames = sorted(tf.io.gfile.glob(data_path+os.sep+'*val*.tfrecord'))
 train_filenames = sorted(tf.io.gfile.glob(data_path+os.sep+'*train*.tfrecord'))
 
+# bad records raise an error (check the tfrecords first with validate_tfrecords.py); to skip them instead:
+# train_dataset, val_dataset = prepare_secoora_datasets_for_training(data_path, train_filenames, val_filenames, ignore_errors=True)
 train_dataset, val_dataset = prepare_secoora_datasets_for_training(data_path, train_filenames, val_filenames)
 
 
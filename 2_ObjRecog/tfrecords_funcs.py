@@ -3,8 +3,8 @@ from coco_imports import *
 # from secoora_imports import *
 
 #see mlmondays blog post:
-import os
-os.environ["TF_DETERMINISTIC_OPS"] = "1"
+import os, json, time, hashlib, itertools, platform, multiprocessing, struct, zlib, zipfile, fnmatch, mmap, shutil
+import PIL.Image
 
 ##calcs
 import numpy as np
@@ -19,8 +19,84 @@ SEED=42
 np.random.seed(SEED)
 AUTO = tf.data.experimental.AUTOTUNE # used in tf.data.Dataset API
 
+#input pipeline settings read by the dataset builders (swept by benchmark_pipelines.py)
+CYCLE_LENGTH = None # number of tfrecord files read at once (None = one after another)
+MAP_PARALLELISM = AUTO # parallel calls of the decoding/preprocessing maps
+
 tf.random.set_seed(SEED)
 
+###############################################################
+### EXECUTION PROFILE FUNCTIONS
+###############################################################
+
+# named determinism and parallelism settings, chosen with EXECUTION_PROFILE
+EXECUTION_PROFILES = {
+    # repeatable runs, for comparing experiments: deterministic kernels, tf.data elements in a fixed
+    # order, the shared tf.data thread pool and no XLA (deterministic kernels give the same results
+    # whatever the thread pools, so these keep tensorflow's default sizes)
+    "reproducible": {"deterministic_ops": True, "ordered": True, "intra_op_threads": 0, "inter_op_threads": 0,
+                     "private_threadpool_size": 0, "xla": False},
+    # opt-in, for debugging run-to-run differences: as 'reproducible', but one op at a time on the
+    # inter-op pool, so ops also run in the same order (slower)
+    "strict": {"deterministic_ops": True, "ordered": True, "intra_op_threads": 0, "inter_op_threads": 1,
+               "private_threadpool_size": 0, "xla": False},
+    # maximum training throughput: the fastest kernels, tf.data elements in the order they are ready,
+    # a private tf.data thread pool (input work does not queue behind model ops) and XLA auto-clustering
+    "fast": {"deterministic_ops": False, "ordered": False, "intra_op_threads": 0, "inter_op_threads": 0,
+             "private_threadpool_size": os.cpu_count() or 0, "xla": True},
+    # maximum prediction throughput, with the outputs still in the order of the inputs
+    "inference": {"deterministic_ops": False, "ordered": True, "intra_op_threads": 0, "inter_op_threads": 0,
+                  "private_threadpool_size": os.cpu_count() or 0, "xla": True},
+}
+
+#-----------------------------------
+def set_execution_profile(profile):
+    """
+    set_execution_profile(profile)
+    This function applies a named execution profile (see EXECUTION_PROFILES): kernel determinism,
+    tf.data ordering, the intra-op and inter-op thread pools, the private tf.data thread pool and XLA
+    auto-clustering (0 threads = tensorflow's default). It is called on import with EXECUTION_PROFILE,
+    because kernel determinism and the thread pools are fixed once tensorflow has run its first op;
+    the other settings can be changed later by calling it again
+    INPUTS:
+        * profile [string]: key of EXECUTION_PROFILES
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: EXECUTION_PROFILES
+    OUTPUTS: None (sets the globals EXECUTION_PROFILE, DETERMINISTIC and PRIVATE_THREADPOOL_SIZE)
+    """
+    if profile not in EXECUTION_PROFILES:
+        raise ValueError("unknown execution profile {} (use one of {})".format(profile, sorted(EXECUTION_PROFILES.keys())))
+    settings = EXECUTION_PROFILES[profile]
+    os.environ["TF_DETERMINISTIC_OPS"] = "1" if settings["deterministic_ops"] else "0"
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(settings["intra_op_threads"])
+        tf.config.threading.set_inter_op_parallelism_threads(settings["inter_op_threads"])
+    except RuntimeError: # the tensorflow runtime has already started
+        print("Thread pools are already set up; restart python to change them")
+    tf.config.optimizer.set_jit(settings["xla"])
+    globals().update(EXECUTION_PROFILE=profile, DETERMINISTIC=settings["ordered"],
+                     PRIVATE_THREADPOOL_SIZE=settings["private_threadpool_size"])
+
+#-----------------------------------
+def get_dataset_options():
+    """
+    get_dataset_options()
+    This function returns the tf.data options of the execution profile: whether parallel
+    stages keep the order of their elements, and the size of the pipeline's private thread pool
+    INPUTS: None
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: DETERMINISTIC, PRIVATE_THREADPOOL_SIZE
+    OUTPUTS: tf.data.Options object
+    """
+    options = tf.data.Options()
+    options.experimental_deterministic = DETERMINISTIC
+    if PRIVATE_THREADPOOL_SIZE > 0:
+        options.experimental_threading.private_threadpool_size = PRIVATE_THREADPOOL_SIZE
+    return options
+
+# the EXECUTION_PROFILE environment variable overrides the setting (benchmark_profiles.py runs each profile this way)
+set_execution_profile(os.environ.get("EXECUTION_PROFILE", EXECUTION_PROFILE))
+
 
 ###===============================================================
 def compute_iou(boxes1, boxes2):
@@ -174,16 +250,17 @@ def prepare_image(image):
     return tf.expand_dims(image, axis=0), ratio
 
 #----------------------------------------------
-def get_test_secoora_dataset(val_filenames):
+def get_test_secoora_dataset(val_filenames, zip_path=None):
     """
-    prepare_secoora_datasets_for_training(data_path, val_filenames):
+    get_test_secoora_dataset(val_filenames, zip_path=None):
     This funcion prepares train and validation datasets  by extracting features (images, bounding boxes, and class labels)
     then map to preprocess_secoora_data, then apply prefetch, padded batch and label encoder
     INPUTS:
         * data_path [string]: path to the tfrecords
         * train_filenames [string]: tfrecord filenames for training
         * val_filenames [string]: tfrecord filenames for validation
-    OPTIONAL INPUTS: None
+    OPTIONAL INPUTS:
+        * zip_path [string]: zip archive containing the tfrecords (filenames are then member names)
     OUTPUTS:
         * val_dataset [tensorflow dataset]: validation dataset
         * train_dataset [tensorflow dataset]: training dataset
@@ -208,27 +285,39 @@ def get_test_secoora_dataset(val_filenames):
       # Parse the input `tf.train.Example` proto using the dictionary above.
       return tf.io.parse_single_example(example_proto, features)
 
-    dataset = tf.data.TFRecordDataset(val_filenames)
+    if zip_path is None:
+        dataset = tf.data.TFRecordDataset(val_filenames)
+    else:
+        dataset = get_zip_record_dataset(zip_path, val_filenames)
     dataset = dataset.map(_parse_function)
     return dataset
 
 #----------------------------------------------
-def prepare_secoora_datasets_for_training(data_path, train_filenames, val_filenames):
+def prepare_secoora_datasets_for_training(data_path, train_filenames, val_filenames, zip_path=None, service=None, ignore_errors=False):
     """
-    prepare_secoora_datasets_for_training(data_path, train_filenames, val_filenames):
+    prepare_secoora_datasets_for_training(data_path, train_filenames, val_filenames, zip_path=None, service=None, ignore_errors=False):
     This funcion prepares train and validation datasets  by extracting features (images, bounding boxes, and class labels)
     then map to preprocess_secoora_data, then apply prefetch, padded batch and label encoder
     INPUTS:
         * data_path [string]: path to the tfrecords
         * train_filenames [string]: tfrecord filenames for training
         * val_filenames [string]: tfrecord filenames for validation
-    OPTIONAL INPUTS: None
+    OPTIONAL INPUTS:
+        * zip_path [string]: zip archive containing the tfrecords (filenames are then member names)
+        * service [string]: tf.data service dispatcher address (see data_service.py); the training
+          preprocessing (including label encoding) then runs on its workers
+        * ignore_errors [bool]: silently drop examples that fail to decode or encode. Left False once
+          the tfrecords have been checked with validate_records (see validate_tfrecords.py), so that
+          a bad record raises an error instead of shrinking the dataset unnoticed
     OUTPUTS:
         * val_dataset [tensorflow dataset]: validation dataset
         * train_dataset [tensorflow dataset]: training dataset
-    GLOBAL INPUTS: None
+    GLOBAL INPUTS: BATCH_SIZE, CYCLE_LENGTH, MAP_PARALLELISM
     """
 
+    if service is not None and zip_path is not None:
+        raise ValueError("zip archives are read with python generators, which cannot run on a tf.data service")
+
     features = {
         'image': tf.io.FixedLenFeature([], tf.string, default_value=''),
         'objects/xmin': tf.io.FixedLenSequenceFeature([], tf.float32, allow_missing=True),
@@ -243,10 +332,14 @@ def prepare_secoora_datasets_for_training(data_path, train_filenames, val_filena
       # Parse the input `tf.train.Example` proto using the dictionary above.
       return tf.io.parse_single_example(example_proto, features)
 
-    train_dataset = tf.data.TFRecordDataset(train_filenames)
+    if zip_path is None:
+        train_dataset = tf.data.TFRecordDataset(train_filenames, num_parallel_reads=CYCLE_LENGTH)
+    else:
+        train_dataset = get_zip_record_dataset(zip_path, train_filenames)
+    train_dataset = train_dataset.with_options(get_dataset_options())
     train_dataset = train_dataset.map(_parse_function)
 
-    train_dataset = train_dataset.map(preprocess_secoora_data, num_parallel_calls=AUTO)
+    train_dataset = train_dataset.map(preprocess_secoora_data, num_parallel_calls=MAP_PARALLELISM)
 
     shapes = (tf.TensorShape([None,None,3]),tf.TensorShape([None,4]),tf.TensorShape([None,]))
 
@@ -259,38 +352,93 @@ def prepare_secoora_datasets_for_training(data_path, train_filenames, val_filena
 
     # train_dataset = train_dataset.shuffle(8 * BATCH_SIZE)
     train_dataset = train_dataset.map(
-        label_encoder.encode_batch, num_parallel_calls=AUTO
+        label_encoder.encode_batch, num_parallel_calls=MAP_PARALLELISM
     )
 
-    train_dataset = train_dataset.apply(tf.data.experimental.ignore_errors())
+    if ignore_errors:
+        train_dataset = train_dataset.apply(tf.data.experimental.ignore_errors())
     train_dataset = train_dataset.prefetch(AUTO)
+    if service is not None:
+        train_dataset = distribute_dataset(train_dataset, service)
 
-    val_dataset = tf.data.TFRecordDataset(val_filenames)
+    if zip_path is None:
+        val_dataset = tf.data.TFRecordDataset(val_filenames, num_parallel_reads=CYCLE_LENGTH)
+    else:
+        val_dataset = get_zip_record_dataset(zip_path, val_filenames)
+    val_dataset = val_dataset.with_options(get_dataset_options())
     val_dataset = val_dataset.map(_parse_function)
-    val_dataset = val_dataset.map(preprocess_secoora_data, num_parallel_calls=AUTO)
+    val_dataset = val_dataset.map(preprocess_secoora_data, num_parallel_calls=MAP_PARALLELISM)
 
     val_dataset = val_dataset.padded_batch(
         batch_size = BATCH_SIZE, padding_values=(0.0, 1e-8, -1), drop_remainder=True, padded_shapes=shapes,
     )
 
     val_dataset = val_dataset.map(
-        label_encoder.encode_batch, num_parallel_calls=AUTO
+        label_encoder.encode_batch, num_parallel_calls=MAP_PARALLELISM
     )
-    val_dataset = val_dataset.apply(tf.data.experimental.ignore_errors())
+    if ignore_errors:
+        val_dataset = val_dataset.apply(tf.data.experimental.ignore_errors())
     val_dataset = val_dataset.prefetch(AUTO)
 
     return train_dataset, val_dataset
 
+#-----------------------------------
+def get_secoora_stage_dataset(filenames, stage='encode'):
+    """
+    get_secoora_stage_dataset(filenames, stage='encode')
+    This function builds the training pipeline of prepare_secoora_datasets_for_training up to one
+    of its stages, so benchmark_pipelines can time each stage with the current settings:
+    'read' (serialized records, batched), 'parse' (records parsed into features, one element per record),
+    'preprocess' (images decoded, resized and padded-batched with their boxes) or 'encode'
+    (batches label-encoded for training)
+    INPUTS:
+        * filenames [list]: tfrecord files
+    OPTIONAL INPUTS:
+        * stage = {'read' | 'parse' | 'preprocess' | 'encode'}
+    GLOBAL INPUTS: BATCH_SIZE, CYCLE_LENGTH, MAP_PARALLELISM, AUTO
+    OUTPUTS: tf.data.Dataset object
+    """
+    if stage not in ('read', 'parse', 'preprocess', 'encode'):
+        raise ValueError("unknown stage {} (use 'read', 'parse', 'preprocess' or 'encode')".format(stage))
+
+    features = {
+        'image': tf.io.FixedLenFeature([], tf.string, default_value=''),
+        'objects/xmin': tf.io.FixedLenSequenceFeature([], tf.float32, allow_missing=True),
+        'objects/ymin': tf.io.FixedLenSequenceFeature([], tf.float32,allow_missing=True),
+        'objects/xmax': tf.io.FixedLenSequenceFeature([], tf.float32,allow_missing=True),
+        'objects/ymax': tf.io.FixedLenSequenceFeature([], tf.float32,allow_missing=True),
+        'objects/label': tf.io.FixedLenSequenceFeature([], tf.int64,allow_missing=True),
+    }
+
+    dataset = tf.data.TFRecordDataset(filenames, num_parallel_reads=CYCLE_LENGTH)
+    dataset = dataset.with_options(get_dataset_options())
+    if stage == 'read':
+        return dataset.batch(BATCH_SIZE).prefetch(AUTO)
+    dataset = dataset.map(lambda example: tf.io.parse_single_example(example, features), num_parallel_calls=MAP_PARALLELISM)
+    if stage == 'parse':
+        return dataset.prefetch(AUTO)
+
+    dataset = dataset.map(preprocess_secoora_data, num_parallel_calls=MAP_PARALLELISM)
+    shapes = (tf.TensorShape([None,None,3]),tf.TensorShape([None,4]),tf.TensorShape([None,]))
+    dataset = dataset.padded_batch(batch_size = BATCH_SIZE, drop_remainder=True, padding_values=(0.0, 1e-8, -1), padded_shapes=shapes)
+    if stage == 'preprocess':
+        return dataset.prefetch(AUTO)
+
+    dataset = dataset.map(LabelEncoderCoco().encode_batch, num_parallel_calls=MAP_PARALLELISM)
+    return dataset.prefetch(AUTO)
+
 
 #----------------------------------------------
-def prepare_coco_datasets_for_training(train_dataset, val_dataset):
+def prepare_coco_datasets_for_training(train_dataset, val_dataset, ignore_errors=False):
     """
-    prepare_coco_datasets_for_training(train_dataset, val_dataset)
+    prepare_coco_datasets_for_training(train_dataset, val_dataset, ignore_errors=False)
     This function prepares a coco dataset loaded from tfds into one trainable by the model
     INPUTS:
         * val_dataset [tensorflow dataset]: validation dataset
         * train_dataset [tensorflow dataset]: training dataset
-    OPTIONAL INPUTS: None
+    OPTIONAL INPUTS:
+        * ignore_errors [bool]: silently drop examples that fail to preprocess or encode
+          (see prepare_secoora_datasets_for_training)
     OUTPUTS:
         * val_dataset [tensorflow dataset]: validation dataset
         * train_dataset [tensorflow dataset]: training dataset
@@ -308,6 +456,7 @@ def prepare_coco_datasets_for_training(train_dataset, val_dataset):
 
     label_encoder = LabelEncoderCoco()
 
+    train_dataset = train_dataset.with_options(get_dataset_options())
     train_dataset = train_dataset.map(preprocess_coco_data, num_parallel_calls=AUTO)
 
     train_dataset = train_dataset.shuffle(8 * BATCH_SIZE)
@@ -318,16 +467,19 @@ def prepare_coco_datasets_for_training(train_dataset, val_dataset):
     train_dataset = train_dataset.map(
         label_encoder.encode_batch, num_parallel_calls=AUTO
     )
-    train_dataset = train_dataset.apply(tf.data.experimental.ignore_errors())
+    if ignore_errors:
+        train_dataset = train_dataset.apply(tf.data.experimental.ignore_errors())
     train_dataset = train_dataset.prefetch(AUTO)
 
 
+    val_dataset = val_dataset.with_options(get_dataset_options())
     val_dataset = val_dataset.map(preprocess_coco_data, num_parallel_calls=AUTO)
     val_dataset = val_dataset.padded_batch(
         batch_size = BATCH_SIZE, padding_values=(0.0, 1e-8, -1), drop_remainder=True
     )
     val_dataset = val_dataset.map(label_encoder.encode_batch, num_parallel_calls=AUTO)
-    val_dataset = val_dataset.apply(tf.data.experimental.ignore_errors())
+    if ignore_errors:
+        val_dataset = val_dataset.apply(tf.data.experimental.ignore_errors())
     val_dataset = val_dataset.prefetch(AUTO)
     return train_dataset, val_dataset
 
@@ -358,6 +510,8 @@ def write_tfrecords(output_path, image_dir, csv_input):
     write_tfrecords(output_path, image_dir, csv_input)
     ""
     This function writes tfrecords to fisk
+    and adds the file to the manifest.json in the same directory
+    (per-class counts are numbers of objects, not images)
     INPUTS:
         * image_dir [string]: place where jpeg images are
         * csv_input [string]: csv file that contains the labels
@@ -366,19 +520,23 @@ def write_tfrecords(output_path, image_dir, csv_input):
     OUTPUTS: None (tfrecord files written to disk)
     GLOBAL INPUTS: BATCH_SIZE
     """
-    writer = tf.io.TFRecordWriter(output_path)
-
     path = os.path.join(os.getcwd(),image_dir)
 
     examples = pd.read_csv(csv_input)
     print(len(examples))
     grouped = split(examples, 'filename')
 
-    for group in grouped:
-        tf_example = create_tf_example_coco(group, path)
-        writer.write(tf_example.SerializeToString())
+    class_counts = {}
+    def serialized_examples():
+        for group in grouped:
+            tf_example = create_tf_example_coco(group, path)
+            for label in tf_example.features.feature['objects/label'].int64_list.value:
+                class_counts[label] = class_counts.get(label, 0) + 1
+            yield tf_example.SerializeToString()
+
+    offsets = write_examples(output_path, serialized_examples())
+    write_manifest(os.path.dirname(output_path) or '.', [get_shard_info(output_path, offsets, class_counts)])
 
-    writer.close()
     output_path = os.path.join(os.getcwd(), output_path)
     print('Successfully created the TFRecords: {}'.format(output_path))
 
@@ -488,3 +646,1326 @@ def create_tf_example_coco(group, path):
     }))
 
     return tf_example
+
+###############################################################
+### MANIFEST FUNCTIONS
+###############################################################
+"""
+Each tfrecord directory gets a 'manifest.json' sidecar, written by the tfrecord writers, listing
+for every shard file: the number of records, the byte offset of each record in the file,
+the per-class record counts and the md5 hash of the file.
+Dataset sizes, step counts and class weights can then be read from the manifest
+instead of being inferred from file names or by reading all the data
+"""
+#-----------------------------------
+def _file_md5(filename):
+    """
+    "_file_md5(filename)"
+    compute the md5 hash of a file, reading it in chunks
+    INPUTS:
+        * filename [string]
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: hex digest [string]
+    """
+    md5 = hashlib.md5()
+    with tf.io.gfile.GFile(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1<<20), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+#-----------------------------------
+def _spawn_pool(num_workers):
+    """
+    "_spawn_pool(num_workers)"
+    start a pool of worker processes with the 'spawn' start method, for workers that run tensorflow
+    ops (tf.io.TFRecordWriter): tensorflow is not fork-safe. Spawned workers import the calling script
+    again, so scripts that start a pool keep their work under "if __name__ == '__main__':"
+    INPUTS:
+        * num_workers [int]
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: multiprocessing.Pool
+    """
+    return multiprocessing.get_context('spawn').Pool(num_workers)
+
+#-----------------------------------
+def write_examples(filename, examples):
+    """
+    write_examples(filename, examples)
+    This function writes serialized tfrecord examples to a tfrecord file
+    and keeps track of the byte offset where each record starts
+    (each record is stored as an 8-byte length, a 4-byte crc, the data and another 4-byte crc)
+    INPUTS:
+        * filename [string]: tfrecord file to write
+        * examples [iterable]: serialized tf.train.Example bytestrings
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * offsets [list]: byte offset of each record in the file
+    """
+    offsets = []
+    position = 0
+    with tf.io.TFRecordWriter(filename) as out_file:
+        for example in examples:
+            out_file.write(example)
+            offsets.append(position)
+            position += len(example) + 16
+    return offsets
+
+#-----------------------------------
+def get_shard_info(filename, offsets, class_counts=None):
+    """
+    get_shard_info(filename, offsets, class_counts=None)
+    This function collates the manifest entry for one tfrecord shard
+    INPUTS:
+        * filename [string]: tfrecord file (already written)
+        * offsets [list]: byte offset of each record (from write_examples)
+    OPTIONAL INPUTS:
+        * class_counts [dict]: number of records (or objects) per integer class id
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * shard [dict]
+    """
+    shard = {"file": filename.split(os.sep)[-1],
+             "num_records": len(offsets),
+             "offsets": offsets,
+             "md5": _file_md5(filename)}
+    if class_counts is not None:
+        shard["class_counts"] = {str(k):int(v) for k,v in class_counts.items()}
+    return shard
+
+#-----------------------------------
+def write_manifest(tfrecord_dir, shards, CLASSES=None):
+    """
+    write_manifest(tfrecord_dir, shards, CLASSES=None)
+    This function writes (or updates) the manifest.json file in tfrecord_dir
+    Entries for shards already in an existing manifest are replaced,
+    and the dataset totals are recomputed
+    INPUTS:
+        * tfrecord_dir [string]: directory containing the tfrecord shards
+        * shards [list]: of dicts from get_shard_info
+    OPTIONAL INPUTS:
+        * CLASSES [list]: class names, in class id order
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * manifest [dict] (also written to disk)
+    """
+    manifest = read_manifest(tfrecord_dir) or {}
+    all_shards = {s["file"]:s for s in manifest.get("shards", [])}
+    for s in shards:
+        all_shards[s["file"]] = s
+    all_shards = [all_shards[k] for k in sorted(all_shards.keys())]
+
+    if CLASSES is not None:
+        manifest["classes"] = [c.decode() if isinstance(c, bytes) else str(c) for c in CLASSES]
+    manifest["num_records"] = int(np.sum([s["num_records"] for s in all_shards]))
+    class_counts = {}
+    for s in all_shards:
+        for k,v in s.get("class_counts", {}).items():
+            class_counts[k] = class_counts.get(k, 0) + v
+    if len(class_counts)>0:
+        manifest["class_counts"] = class_counts
+    manifest["shards"] = all_shards
+
+    with open(tfrecord_dir+os.sep+'manifest.json', 'w') as f:
+        json.dump(manifest, f)
+    print("Wrote manifest for {} records in {} shards".format(manifest["num_records"], len(all_shards)))
+    return manifest
+
+#-----------------------------------
+def read_manifest(tfrecord_dir):
+    """
+    read_manifest(tfrecord_dir)
+    This function reads the manifest.json file in tfrecord_dir, if there is one
+    INPUTS:
+        * tfrecord_dir [string]: directory containing the tfrecord shards
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * manifest [dict], or None if there is no manifest
+    """
+    manifest_file = tfrecord_dir+os.sep+'manifest.json'
+    if not os.path.isfile(manifest_file):
+        return None
+    with open(manifest_file) as f:
+        return json.load(f)
+
+#-----------------------------------
+def get_manifest_shards(filenames, manifest):
+    """
+    get_manifest_shards(filenames, manifest)
+    This function looks up the manifest entries for a list of tfrecord files
+    INPUTS:
+        * filenames [list]: tfrecord files
+        * manifest [dict]: from read_manifest
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * shards [list]: manifest entry of each file (None for files not in the manifest)
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    if manifest is None:
+        return [None for f in filenames]
+    lookup = {s["file"]:s for s in manifest["shards"]}
+    return [lookup.get(f.split(os.sep)[-1]) for f in filenames]
+
+#-----------------------------------
+def get_num_records(filenames, manifest=None):
+    """
+    get_num_records(filenames, manifest=None)
+    This function returns the exact number of records in a list of tfrecord files,
+    from the manifest. For files not in the manifest, the count is parsed from
+    file names ending in '-{count}.tfrec' (as written by the writers here),
+    or else assumed to be ims_per_shard
+    INPUTS:
+        * filenames [list]: tfrecord files
+    OPTIONAL INPUTS:
+        * manifest [dict]: from read_manifest
+    GLOBAL INPUTS: ims_per_shard
+    OUTPUTS:
+        * nb_images [int]
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    nb_images = 0
+    for f, shard in zip(filenames, get_manifest_shards(filenames, manifest)):
+        if shard is not None:
+            nb_images += shard["num_records"]
+            continue
+        try:
+            nb_images += int(f.split('-')[-1].split('.tfrec')[0])
+        except ValueError:
+            nb_images += ims_per_shard
+    return nb_images
+
+#-----------------------------------
+def read_record_at(filename, offset):
+    """
+    read_record_at(filename, offset)
+    This function reads the single serialized record that starts at a byte offset
+    in a tfrecord file (offsets are listed in the manifest), without reading the rest of the file.
+    The result can be passed to the same parsing functions as a tf.data.TFRecordDataset element
+    INPUTS:
+        * filename [string]: tfrecord file
+        * offset [int]: byte offset of the record
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * example [bytes]: serialized tf.train.Example
+    """
+    with tf.io.gfile.GFile(filename, 'rb') as f:
+        f.seek(offset)
+        length = struct.unpack('<Q', f.read(8))[0]
+        f.read(4) # crc of the length
+        return f.read(length)
+
+#-----------------------------------
+def get_record(tfrecord_dir, index, manifest=None):
+    """
+    get_record(tfrecord_dir, index, manifest=None)
+    This function provides random access to the record with a given index
+    (counting through the shards in manifest order)
+    INPUTS:
+        * tfrecord_dir [string]: directory containing the tfrecord shards and manifest
+        * index [int]: record index in the whole dataset
+    OPTIONAL INPUTS:
+        * manifest [dict]: from read_manifest (read from tfrecord_dir if None)
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * example [bytes]: serialized tf.train.Example
+    """
+    if manifest is None:
+        manifest = read_manifest(tfrecord_dir)
+    for shard in manifest["shards"]:
+        if index < shard["num_records"]:
+            return read_record_at(tfrecord_dir+os.sep+shard["file"], shard["offsets"][index])
+        index -= shard["num_records"]
+    raise IndexError("record index out of range")
+
+#-----------------------------------
+def get_class_counts(filenames, manifest):
+    """
+    get_class_counts(filenames, manifest)
+    This function sums the per-class counts of a list of tfrecord files from the manifest
+    INPUTS:
+        * filenames [list]: tfrecord files
+        * manifest [dict]: from read_manifest
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * class_counts [dict]: count per integer class id
+    """
+    class_counts = {}
+    for shard in get_manifest_shards(filenames, manifest):
+        if shard is None:
+            continue
+        for k,v in shard.get("class_counts", {}).items():
+            class_counts[int(k)] = class_counts.get(int(k), 0) + v
+    return class_counts
+
+#-----------------------------------
+def get_class_weights(filenames, manifest):
+    """
+    get_class_weights(filenames, manifest)
+    This function computes 'balanced' class weights from the manifest class counts,
+    n_samples / (n_classes * count), i.e. the same as
+    sklearn.utils.class_weight.compute_class_weight('balanced', ...) but without reading any data
+    INPUTS:
+        * filenames [list]: tfrecord files
+        * manifest [dict]: from read_manifest
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * class_weights [dict]: weight per integer class id, for model.fit(class_weight=...)
+    """
+    class_counts = {k:v for k,v in get_class_counts(filenames, manifest).items() if v>0}
+    n_samples = np.sum(list(class_counts.values()))
+    return {k: float(n_samples / (len(class_counts) * class_counts[k])) for k in sorted(class_counts.keys())}
+
+###############################################################
+### ZIP ARCHIVE FUNCTIONS
+###############################################################
+"""
+Datasets can be read straight from the zip archives fetched by download_data.py, without extracting them.
+The zip central directory is indexed once per archive (get_zip_index); each member is then read
+directly at its data offset: stored (uncompressed) members are sliced from a memory map of the archive,
+deflated members are inflated in memory. Members are read in parallel by tf.data
+"""
+_ZIP_INDEX = {}
+_ZIP_MMAP = {}
+
+#-----------------------------------
+def get_zip_index(zip_path):
+    """
+    get_zip_index(zip_path)
+    This function indexes the members of a zip archive from its central directory,
+    recording where the data of each member starts (from its local file header).
+    The index is computed once per archive and then reused
+    INPUTS:
+        * zip_path [string]: zip archive
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * index [dict]: member name to dict of offset, size, compress_size, compress_type
+    """
+    if zip_path in _ZIP_INDEX:
+        return _ZIP_INDEX[zip_path]
+    index = {}
+    with open(zip_path, 'rb') as f, zipfile.ZipFile(f) as z:
+        for info in z.infolist():
+            if info.is_dir():
+                continue
+            f.seek(info.header_offset)
+            header = f.read(30) # fixed-size part of the local file header
+            name_len, extra_len = struct.unpack('<HH', header[26:30])
+            index[info.filename] = {"offset": info.header_offset + 30 + name_len + extra_len,
+                                    "size": info.file_size,
+                                    "compress_size": info.compress_size,
+                                    "compress_type": info.compress_type}
+    _ZIP_INDEX[zip_path] = index
+    return index
+
+#-----------------------------------
+def list_zip_members(zip_path, pattern='*'):
+    """
+    list_zip_members(zip_path, pattern='*')
+    This function lists the members of a zip archive whose names match a glob pattern,
+    e.g. '*400/*.tfrec' (the zip equivalent of tf.io.gfile.glob)
+    INPUTS:
+        * zip_path [string]: zip archive
+    OPTIONAL INPUTS:
+        * pattern [string]: glob pattern matched against member names
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * members [list]: sorted member names
+    """
+    return sorted([name for name in get_zip_index(zip_path) if fnmatch.fnmatch(name, pattern)])
+
+#-----------------------------------
+def read_zip_member(zip_path, name):
+    """
+    read_zip_member(zip_path, name)
+    This function returns the contents of one member of a zip archive.
+    Stored members are returned as a zero-copy memoryview of a memory map of the archive,
+    deflated members are inflated from the same memory map
+    INPUTS:
+        * zip_path [string]: zip archive
+        * name [string]: member name
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * data [memoryview or bytes]
+    """
+    member = get_zip_index(zip_path)[name]
+    if zip_path not in _ZIP_MMAP:
+        with open(zip_path, 'rb') as f:
+            _ZIP_MMAP[zip_path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    data = memoryview(_ZIP_MMAP[zip_path])[member["offset"]:member["offset"]+member["compress_size"]]
+    if member["compress_type"] == zipfile.ZIP_STORED:
+        return data
+    if member["compress_type"] == zipfile.ZIP_DEFLATED:
+        return zlib.decompress(data, -15) # raw deflate stream, no zlib header
+    with zipfile.ZipFile(zip_path) as z: # other compression methods (rarely used)
+        return z.read(name)
+
+#-----------------------------------
+def _iterate_tfrecords(data):
+    """
+    "_iterate_tfrecords(data)"
+    split the contents of an (uncompressed) tfrecord file into serialized records
+    (each record is stored as an 8-byte length, a 4-byte crc, the data and another 4-byte crc;
+    crcs are not checked here, see _read_verified_records)
+    INPUTS:
+        * data [bytes or memoryview]: tfrecord file contents
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: generator of serialized records [bytes]
+    """
+    position = 0
+    while position < len(data):
+        length = struct.unpack_from('<Q', data, position)[0]
+        yield bytes(data[position+12:position+12+length])
+        position += length + 16
+
+#-----------------------------------
+def get_zip_record_dataset(zip_path, members, cycle_length=16):
+    """
+    get_zip_record_dataset(zip_path, members, cycle_length=16)
+    This function returns the serialized records of tfrecord files stored in a zip archive,
+    reading cycle_length members in parallel. It is the zip equivalent of
+    interleaving tf.data.TFRecordDataset over a list of extracted files
+    INPUTS:
+        * zip_path [string]: zip archive
+        * members [list]: tfrecord member names (e.g. from list_zip_members)
+    OPTIONAL INPUTS:
+        * cycle_length [int]: number of members read at once
+    GLOBAL INPUTS: AUTO
+    OUTPUTS: tf.data.Dataset object (of serialized examples)
+    """
+    get_zip_index(zip_path)
+
+    def records(name):
+        yield from _iterate_tfrecords(read_zip_member(zip_path, name.decode()))
+
+    dataset = tf.data.Dataset.from_tensor_slices(members)
+    dataset = dataset.interleave(lambda name: tf.data.Dataset.from_generator(records, args=(name,),
+                                     output_signature=tf.TensorSpec([], tf.string)),
+                                 cycle_length=cycle_length, num_parallel_calls=AUTO)
+    return dataset
+
+#-----------------------------------
+def get_zip_file_dataset(zip_path, members):
+    """
+    get_zip_file_dataset(zip_path, members)
+    This function returns the name and contents of members of a zip archive (e.g. jpeg images),
+    read in parallel. It is the zip equivalent of mapping tf.io.read_file over a list of extracted files
+    INPUTS:
+        * zip_path [string]: zip archive
+        * members [list]: member names (e.g. from list_zip_members)
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: AUTO
+    OUTPUTS: tf.data.Dataset object (of (name, bytestring) pairs)
+    """
+    get_zip_index(zip_path)
+
+    def read_member(name):
+        return np.array(bytes(read_zip_member(zip_path, name.decode())), dtype=object)
+
+    dataset = tf.data.Dataset.from_tensor_slices(members)
+    dataset = dataset.map(lambda name: (name, tf.reshape(tf.numpy_function(read_member, [name], tf.string), [])),
+                          num_parallel_calls=AUTO)
+    return dataset
+
+###############################################################
+### DATA SERVICE FUNCTIONS
+###############################################################
+
+#-----------------------------------
+def distribute_dataset(dataset, service, job_name=None):
+    """
+    distribute_dataset(dataset, service, job_name=None)
+    This function hands a dataset to a tf.data service (started with data_service.py):
+    the dataset graph is sent to the dispatcher, every worker runs its own copy of the
+    pipeline (decoding, augmentation, label encoding, cache), and this process only
+    receives the finished batches. Files are read by the workers, so workers on other
+    machines need the tfrecords at the same paths
+    INPUTS:
+        * dataset [tf.data.Dataset]
+        * service [string]: dispatcher address, e.g. 'localhost:5050' or 'grpc://cpubox:5050'
+    OPTIONAL INPUTS:
+        * job_name [string]: trainers using the same job_name share (split) one stream of batches
+    GLOBAL INPUTS: AUTO
+    OUTPUTS: tf.data.Dataset object
+    """
+    if not service.startswith('grpc://'):
+        service = 'grpc://'+service
+    dataset = dataset.apply(tf.data.experimental.service.distribute(processing_mode="parallel_epochs",
+                                                                    service=service, job_name=job_name))
+    return dataset.prefetch(AUTO)
+
+###############################################################
+### SYNTHETIC DATA FUNCTIONS
+###############################################################
+
+#-----------------------------------
+def get_shard_sizes(num_images, num_shards):
+    """
+    get_shard_sizes(num_images, num_shards)
+    This function splits a number of images as evenly as possible into shards
+    INPUTS:
+        * num_images [int]
+        * num_shards [int]
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * sizes [list]: number of images in each shard
+    """
+    return [num_images//num_shards + (1 if k < num_images % num_shards else 0) for k in range(num_shards)]
+
+#-----------------------------------
+def _synthetic_field(rng, height, width, cells=8):
+    """
+    "_synthetic_field(rng, height, width, cells=8)"
+    make a smooth random field in [0,1] (a coarse random grid, upsampled), so that
+    synthetic imagery compresses roughly like real imagery rather than like noise
+    INPUTS:
+        * rng [np.random.Generator]
+        * height, width [int]
+    OPTIONAL INPUTS:
+        * cells [int]: grid cells along each side
+    GLOBAL INPUTS: None
+    OUTPUTS: field [ndarray, height x width]
+    """
+    field = np.kron(rng.random((cells, cells)), np.ones((-(-height//cells), -(-width//cells))))
+    return field[:height,:width]
+
+#-----------------------------------
+def _encode_synthetic(image, encoding='jpeg'):
+    """
+    "_encode_synthetic(image, encoding='jpeg')"
+    encode a uint8 image as a jpeg bytestring (with PIL, which is safe to use in
+    worker processes), or return it unchanged for raw uint8 records
+    INPUTS:
+        * image [ndarray]: uint8, height x width x channels
+    OPTIONAL INPUTS:
+        * encoding = {'jpeg' | 'raw'}
+    GLOBAL INPUTS: None
+    OUTPUTS: jpeg bytestring, or uint8 ndarray
+    """
+    if encoding == 'raw':
+        return image
+    buffer = io.BytesIO()
+    PIL.Image.fromarray(np.squeeze(image)).save(buffer, format='JPEG', quality=95, optimize=True, subsampling=0)
+    return buffer.getvalue()
+
+#-----------------------------------
+def _write_synthetic_shards(write_shard, tasks, tfrecord_dir, num_workers=None, CLASSES=None):
+    """
+    "_write_synthetic_shards(write_shard, tasks, tfrecord_dir, num_workers=None, CLASSES=None)"
+    run write_shard over a list of argument tuples with a pool of worker processes,
+    then write the manifest for all the shards. The workers are spawned (see _spawn_pool),
+    so write_shard can write with tf.io.TFRecordWriter (through write_examples)
+    INPUTS:
+        * write_shard [function]: returns a manifest entry (see get_shard_info)
+        * tasks [list]: argument tuples, one per shard
+        * tfrecord_dir [string]
+    OPTIONAL INPUTS:
+        * num_workers [int]: number of writer processes (None = number of cpus, 1 = no pool)
+        * CLASSES [list]: class names, for the manifest
+    GLOBAL INPUTS: None
+    OUTPUTS: None (files written to disk)
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    written = []
+    def report(shard):
+        written.append(shard)
+        print("Wrote file {} containing {} records".format(tfrecord_dir+os.sep+shard["file"], shard["num_records"]))
+
+    if num_workers == 1:
+        for task in tasks:
+            report(write_shard(*task))
+    else:
+        with _spawn_pool(num_workers) as pool:
+            for result in [pool.apply_async(write_shard, task) for task in tasks]:
+                report(result.get())
+
+    write_manifest(tfrecord_dir, written, CLASSES)
+
+#-----------------------------------
+def _write_synthetic_detection_shard(filename, num_records, height, width, max_boxes, num_classes, seed):
+    """
+    "_write_synthetic_detection_shard(filename, num_records, height, width, max_boxes, num_classes, seed)"
+    write one shard of synthetic object detection records (runs in a worker process),
+    with the features written by create_tf_example_coco. Each image has between 1 and
+    max_boxes filled boxes (in pixel coordinates), coloured by class
+    INPUTS:
+        * filename [string]: shard file to write
+        * num_records [int]
+        * height, width [int]: image size
+        * max_boxes [int]: maximum number of objects per image
+        * num_classes [int]
+        * seed [int]: random seed for this shard
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * shard [dict]: manifest entry for the shard (see get_shard_info)
+    """
+    rng = np.random.default_rng(seed)
+    colours = np.random.default_rng(num_classes).integers(32, 224, (num_classes, 3))
+    class_counts = {}
+
+    def examples():
+        for k in range(num_records):
+            image = 96 + 64*_synthetic_field(rng, height, width)[:,:,np.newaxis] + rng.normal(0, 8, (height, width, 3))
+            num_boxes = rng.integers(1, max_boxes+1)
+            labels = rng.integers(0, num_classes, num_boxes)
+            xmins = rng.uniform(0, 0.9*width, num_boxes); ymins = rng.uniform(0, 0.9*height, num_boxes)
+            xmaxs = np.minimum(xmins + rng.uniform(0.02, 0.3, num_boxes)*width, width-1)
+            ymaxs = np.minimum(ymins + rng.uniform(0.02, 0.3, num_boxes)*height, height-1)
+            for label, x0, y0, x1, y1 in zip(labels, xmins, ymins, xmaxs, ymaxs):
+                image[int(y0):int(y1), int(x0):int(x1)] = colours[label]
+                class_counts[int(label)] = class_counts.get(int(label), 0) + 1
+            image = np.clip(image, 0, 255).astype(np.uint8)
+
+            ids = list(range(num_boxes))
+            tf_example = tf.train.Example(features=tf.train.Features(feature={
+                'objects/is_crowd': int64_list_feature([False]*num_boxes),
+                'image/filename': bytes_feature("synthetic_{}.jpg".format(k).encode('utf8')),
+                'image/id': int64_list_feature(ids),
+                'image': bytes_feature(_encode_synthetic(image)),
+                'objects/xmin': float_list_feature(xmins),
+                'objects/xmax': float_list_feature(xmaxs),
+                'objects/ymin': float_list_feature(ymins),
+                'objects/ymax': float_list_feature(ymaxs),
+                'objects/area': float_list_feature((xmaxs-xmins)*(ymaxs-ymins)),
+                'objects/id': int64_list_feature(ids),
+                'objects/label': int64_list_feature(labels),
+            }))
+            yield tf_example.SerializeToString()
+
+    offsets = write_examples(filename, examples())
+    return get_shard_info(filename, offsets, class_counts)
+
+#-----------------------------------
+def write_synthetic_detection_records(tfrecord_dir, num_images, num_shards, height=480, width=640, max_boxes=10, num_classes=num_classes, num_workers=None, seed=SEED):
+    """
+    write_synthetic_detection_records(tfrecord_dir, num_images, num_shards, height=480, width=640, max_boxes=10, num_classes=num_classes, num_workers=None, seed=SEED)
+    This function writes synthetic TFRecord shards with the same schema as the real
+    object detection data ("image" jpeg bytestring, "objects/xmin" ... "objects/label"),
+    and a manifest.json, for load and scaling tests of the input pipelines and models.
+    Shards are generated in parallel by a pool of worker processes
+    INPUTS:
+        * tfrecord_dir [string]: path to directory where files will be written
+        * num_images [int]: total number of records
+        * num_shards [int]: number of shard files
+    OPTIONAL INPUTS:
+        * height, width [int]: image size
+        * max_boxes [int]: maximum number of objects per image
+        * num_classes [int]: number of object classes
+        * num_workers [int]: number of writer processes (None = number of cpus, 1 = no pool)
+        * seed [int]: random seed (shard k uses seed+k)
+    GLOBAL INPUTS: num_classes, SEED
+    OUTPUTS: None (files written to disk)
+    """
+    tasks = [(tfrecord_dir+os.sep+"synthetic" + "{:02d}-{}.tfrec".format(shard, shard_size),
+              shard_size, height, width, max_boxes, num_classes, seed+shard)
+             for shard, shard_size in enumerate(get_shard_sizes(num_images, num_shards))]
+    _write_synthetic_shards(_write_synthetic_detection_shard, tasks, tfrecord_dir, num_workers)
+
+###############################################################
+### BENCHMARK FUNCTIONS
+###############################################################
+
+#-----------------------------------
+def time_dataset(dataset, num_elements=100, warmup=5, batched=True, step=None):
+    """
+    time_dataset(dataset, num_elements=100, warmup=5, batched=True, step=None)
+    This function iterates over a dataset, with no model attached (unless step is given), and times it:
+    the latency to the first element (pipeline start-up and first file reads),
+    then the throughput and the latency of each element over num_elements elements
+    INPUTS:
+        * dataset [tf.data.Dataset]
+    OPTIONAL INPUTS:
+        * num_elements [int]: number of elements timed, after the warmup
+        * warmup [int]: number of elements read, and not timed, first
+        * batched [bool]: elements are batches (False = each element is one image or record)
+        * step [function]: called on each element and timed with it, e.g. lambda batch: model.train_on_batch(*batch)
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * timings [dict]: first_element_s, elements, images, seconds, images_per_sec,
+          element_ms_p50, element_ms_p95 (over fewer elements if the dataset ends first)
+    """
+    iterator = iter(dataset)
+    start = time.perf_counter()
+    first_element_s = None
+    latencies = []
+    images = 0
+    try:
+        for k in range(warmup+num_elements):
+            t = time.perf_counter()
+            element = next(iterator)
+            if step is not None:
+                step(element)
+            if first_element_s is None:
+                first_element_s = time.perf_counter()-start
+            if k >= warmup:
+                latencies.append(time.perf_counter()-t)
+                images += int(tf.nest.flatten(element)[0].shape[0]) if batched else 1
+    except StopIteration:
+        pass
+
+    seconds = float(np.sum(latencies))
+    return {"first_element_s": first_element_s,
+            "elements": len(latencies),
+            "images": images,
+            "seconds": seconds,
+            "images_per_sec": images/seconds if seconds>0 else None,
+            "element_ms_p50": float(np.percentile(latencies, 50)*1000) if len(latencies)>0 else None,
+            "element_ms_p95": float(np.percentile(latencies, 95)*1000) if len(latencies)>0 else None}
+
+#-----------------------------------
+def benchmark_pipelines(pipelines, grid=None, json_file=None, num_elements=100, warmup=5):
+    """
+    benchmark_pipelines(pipelines, grid=None, json_file=None, num_elements=100, warmup=5)
+    This function times each pipeline (with time_dataset) for every combination of the
+    input pipeline settings in grid. The settings are the module globals read by the
+    dataset builders (e.g. CYCLE_LENGTH, MAP_PARALLELISM, BATCH_SIZE); each combination is
+    set before the pipelines are built, and the original values are restored at the end.
+    A training run is input-bound if model.fit reaches about the images_per_sec of its pipeline
+    INPUTS:
+        * pipelines [list]: of (name, build, batched) or (name, build, batched, step) tuples;
+          build() returns a tf.data.Dataset (for step, see time_dataset)
+    OPTIONAL INPUTS:
+        * grid [dict]: global setting name to list of values (None = current settings only)
+        * json_file [string]: file to write the results to, as json
+        * num_elements, warmup: see time_dataset
+    GLOBAL INPUTS: the settings in grid, EXECUTION_PROFILE
+    OUTPUTS:
+        * results [dict]: machine, tensorflow version and execution profile, and one entry per (pipeline, settings) run
+    """
+    grid = grid or {}
+    names = sorted(grid.keys())
+    saved = {k:globals()[k] for k in names}
+    runs = []
+    try:
+        for values in itertools.product(*[grid[k] for k in names]):
+            settings = dict(zip(names, values))
+            globals().update(settings)
+            for name, build, batched, *step in pipelines:
+                run = dict(pipeline=name, settings=settings, **time_dataset(build(), num_elements, warmup, batched, *step))
+                runs.append(run)
+                print("{} {}: {} img/s, first element {} s, p50 {} ms, p95 {} ms".format(name, settings,
+                      *[None if run[k] is None else round(run[k], 2) for k in
+                        ["images_per_sec", "first_element_s", "element_ms_p50", "element_ms_p95"]]))
+    finally:
+        globals().update(saved)
+
+    results = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+               "host": platform.node(),
+               "cpus": os.cpu_count(),
+               "tensorflow": tf.__version__,
+               "profile": EXECUTION_PROFILE,
+               "runs": runs}
+    if json_file is not None:
+        with open(json_file, 'w') as f:
+            json.dump(results, f, indent=2)
+        print("Wrote {} benchmark runs to {}".format(len(runs), json_file))
+    return results
+
+#-----------------------------------
+def compare_benchmarks(old_json, new_json, tolerance=0.1):
+    """
+    compare_benchmarks(old_json, new_json, tolerance=0.1)
+    This function compares two benchmark_pipelines json files, matching runs by pipeline
+    name and settings, and reports the runs whose throughput dropped by more than tolerance
+    INPUTS:
+        * old_json [string]: baseline results file
+        * new_json [string]: new results file
+    OPTIONAL INPUTS:
+        * tolerance [float]: fractional drop in images_per_sec reported as a regression
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * regressions [list]: of (pipeline, settings, old images_per_sec, new images_per_sec)
+    """
+    def load(json_file):
+        with open(json_file) as f:
+            runs = json.load(f)["runs"]
+        return {(r["pipeline"], json.dumps(r["settings"], sort_keys=True)):r["images_per_sec"] for r in runs}
+
+    old, new = load(old_json), load(new_json)
+    regressions = []
+    for key in sorted(set(old) & set(new)):
+        if old[key] and new[key] is not None and new[key] < (1-tolerance)*old[key]:
+            regressions.append((key[0], json.loads(key[1]), old[key], new[key]))
+            print("REGRESSION {} {}: {:.1f} -> {:.1f} img/s".format(key[0], key[1], old[key], new[key]))
+    print("{} of {} matching runs regressed".format(len(regressions), len(set(old) & set(new))))
+    return regressions
+
+#-----------------------------------
+def compare_profiles(json_files):
+    """
+    compare_profiles(json_files)
+    This function compares benchmark_pipelines json files written under different execution
+    profiles (see benchmark_profiles.py), matching runs by pipeline name and settings, and
+    prints the throughput of each run under each profile, relative to the first file
+    INPUTS:
+        * json_files [list]: results files, the first one is the reference
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * table [dict]: (pipeline, settings) to list of images_per_sec, one per file
+    """
+    profiles, tables = [], []
+    for json_file in json_files:
+        with open(json_file) as f:
+            results = json.load(f)
+        profiles.append(results.get("profile"))
+        tables.append({(r["pipeline"], json.dumps(r["settings"], sort_keys=True)):r["images_per_sec"] for r in results["runs"]})
+
+    table = {}
+    for key in sorted(set.intersection(*[set(t) for t in tables])):
+        table[key] = [t[key] for t in tables]
+        print("{} {}: ".format(key[0], key[1]) + ", ".join(
+              "{} {:.1f} img/s ({:.2f}x)".format(profile, rate, rate/table[key][0]) if rate and table[key][0]
+              else "{} {}".format(profile, rate) for profile, rate in zip(profiles, table[key])))
+    return table
+
+###############################################################
+### RECORD VALIDATION FUNCTIONS
+###############################################################
+
+#-----------------------------------
+def _read_shard_records(filename):
+    """
+    "_read_shard_records(filename)"
+    read all the serialized records of a tfrecord file in python
+    (no tensorflow ops, so this is safe in worker processes)
+    INPUTS:
+        * filename [string]: tfrecord file
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: list of serialized records [bytes]
+    """
+    with open(filename, 'rb') as f:
+        return list(_iterate_tfrecords(f.read()))
+
+#-----------------------------------
+def _masked_crc32c(data):
+    """
+    "_masked_crc32c(data)"
+    the masked crc32c checksum that tfrecord files store for each record length and record
+    INPUTS:
+        * data [bytes]
+        OPTIONAL INPUTS: None
+IONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: checksum [int]
+    """
+    import google_crc32c # only needed to validate records (conda install google-crc32c, see mlmondays.yml)
+    crc = google_crc32c.value(data)
+    return (((crc >> 15) | (crc << 17)) + 0xA282EAD8) & 0xFFFFFFFF
+
+#-----------------------------------
+def _read_verified_records(filename):
+    """
+    "_read_verified_records(filename)"
+    read all the serialized records of a tfrecord file in python, checking the record bounds and both
+    checksums of every record. A record whose data checksum does not match is a bad record; a length
+    checksum that does not match, or a truncated record, leaves the rest of the file unreadable (a bad file)
+    INPUTS:
+        * filename [string]: tfrecord file
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * records [list]: serialized records [bytes] up to any file problem
+        * bad [list]: (index, problem) of the records with a bad data checksum
+        * file_problem [string]: why the file could not be read to the end (None if it was)
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    records, bad = [], []
+    position = 0
+    while position < len(data):
+        if position+12 > len(data):
+            return records, bad, "truncated record header at byte {}".format(position)
+        length = struct.unpack_from('<Q', data, position)[0]
+        if struct.unpack_from('<I', data, position+8)[0] != _masked_crc32c(data[position:position+8]):
+            return records, bad, "length checksum does not match at byte {}".format(position)
+        if position+16+length > len(data):
+            return records, bad, "truncated record at byte {}".format(position)
+        record = data[position+12:position+12+length]
+        if struct.unpack_from('<I', data, position+12+length)[0] != _masked_crc32c(record):
+            bad.append((len(records), "data checksum does not match"))
+        records.append(record)
+        position += length + 16
+    return records, bad, None
+
+#-----------------------------------
+def _open_image(bits):
+    """
+    "_open_image(bits)"
+    decode an image bytestring with PIL (raises an exception if it does not decode)
+    INPUTS:
+        * bits [bytes]: encoded image
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: PIL.Image
+    """
+    image = PIL.Image.open(io.BytesIO(bits))
+    image.load()
+    return image
+
+#-----------------------------------
+def _record_class_ids(record):
+    """
+    "_record_class_ids(record)"
+    get the integer class ids of a serialized example ("class", or "objects/label" for object detection)
+    INPUTS:
+        * record [bytes]: serialized tf.train.Example
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: list of class ids [int]
+    """
+    feature = tf.train.Example.FromString(record).features.feature
+    for key in ["class", "objects/label"]:
+        if key in feature:
+            return list(feature[key].int64_list.value)
+    return []
+
+#-----------------------------------
+def _validate_shard(filename, check, check_args=(), quarantine_dir='.', shard=None, rewrite=False):
+    """
+    "_validate_shard(filename, check, check_args=(), quarantine_dir='.', shard=None, rewrite=False)"
+    check every record of one tfrecord file (runs in a spawned worker process, see _spawn_pool).
+    The record framing (bounds and checksums, see _read_verified_records) is checked before check runs.
+    Bad records are written to a shard of the same name in quarantine_dir and, if rewrite, the file is
+    rewritten with only the good records (a bad file is also copied to quarantine_dir as <name>.damaged,
+    and keeps the good records read before the damage)
+    INPUTS:
+        * filename [string]: tfrecord file
+        * check [function]: check(record, *check_args) returns None, or a description of the problem
+    OPTIONAL INPUTS:
+        * check_args [tuple]: extra arguments for check
+        * quarantine_dir [string]: directory for the quarantine shards
+        * shard [dict]: manifest entry of the file (its sources and class counts are kept up to date)
+        * rewrite [bool]: remove the bad records from the file
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * result [dict]: file, num_records, bad (list of (index, problem)), file_problem (None, or why
+          the file could not be read to the end), shard (new manifest entry, if rewritten)
+    """
+    try:
+        records, bad, file_problem = _read_verified_records(filename)
+    except Exception as e:
+        return {"file": filename, "num_records": 0, "bad": [], "file_problem": "does not read: {}".format(e), "shard": None}
+
+    crc_ids = set(i for i, problem in bad)
+    for i, record in enumerate(records):
+        if i in crc_ids:
+            continue
+        problem = check(record, *check_args)
+        if problem is not None:
+            bad.append((i, problem))
+    bad.sort()
+    result = {"file": filename, "num_records": len(records), "bad": bad, "file_problem": file_problem, "shard": None}
+    if len(bad)==0 and file_problem is None:
+        return result
+
+    bad_ids = set(i for i, problem in bad)
+    if len(bad_ids)>0:
+        write_examples(quarantine_dir+os.sep+filename.split(os.sep)[-1], [records[i] for i in sorted(bad_ids)])
+    if file_problem is not None and rewrite:
+        # keep the damaged file, the records after the damage are lost from the rewritten file
+        shutil.copyfile(filename, quarantine_dir+os.sep+filename.split(os.sep)[-1]+'.damaged')
+    if rewrite:
+        good = [record for i, record in enumerate(records) if i not in bad_ids]
+        offsets = write_examples(filename+'.tmp', good)
+        os.replace(filename+'.tmp', filename)
+        class_counts = None
+        if shard is not None and "class_counts" in shard:
+            class_counts = {}
+            for record in good:
+                for k in _record_class_ids(record):
+                    class_counts[k] = class_counts.get(k, 0) + 1
+        result["shard"] = get_shard_info(filename, offsets, class_counts)
+    return result
+
+#-----------------------------------
+def validate_records(filenames, check, check_args=(), quarantine_dir=None, rewrite=False, num_workers=None):
+    """
+    validate_records(filenames, check, check_args=(), quarantine_dir=None, rewrite=False, num_workers=None)
+    This function checks every record of a list of tfrecord files, with a pool of worker processes
+    (one file per task). Bad records are copied to quarantine shards (same file names, in quarantine_dir)
+    and listed in quarantine_dir/report.json. With rewrite=True the bad records are also removed from
+    the original files and the manifest is updated, so training needs no error-catching wrapper
+    (file names are kept, so a record count in a file name is only a hint after a rewrite; the manifest is exact)
+    INPUTS:
+        * filenames [list]: tfrecord files (in the same directory)
+        * check [function]: check(record, *check_args) returns None, or a description of the problem
+    OPTIONAL INPUTS:
+        * check_args [tuple]: extra arguments for check
+        * quarantine_dir [string]: directory for quarantine shards and report (None = <tfrecord dir>/quarantine)
+        * rewrite [bool]: remove the bad records from the original files
+        * num_workers [int]: number of worker processes (None = number of cpus, 1 = no pool)
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * report [dict]: also written to quarantine_dir/report.json
+    """
+    tfrecord_dir = os.path.dirname(filenames[0]) or '.'
+    if quarantine_dir is None:
+        quarantine_dir = tfrecord_dir+os.sep+'quarantine'
+    os.makedirs(quarantine_dir, exist_ok=True)
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    manifest = read_manifest(tfrecord_dir)
+    tasks = [(f, check, check_args, quarantine_dir, shard, rewrite)
+             for f, shard in zip(filenames, get_manifest_shards(filenames, manifest))]
+
+    results = []
+    def report_shard(result):
+        results.append(result)
+        if len(result["bad"])>0:
+            print("{}: {} of {} records bad".format(result["file"], len(result["bad"]), result["num_records"]))
+        if result["file_problem"] is not None:
+            print("{}: bad file, {}".format(result["file"], result["file_problem"]))
+
+    if num_workers == 1:
+        for task in tasks:
+            report_shard(_validate_shard(*task))
+    else:
+        with _spawn_pool(num_workers) as pool:
+            for result in [pool.apply_async(_validate_shard, task) for task in tasks]:
+                report_shard(result.get())
+
+    report = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "num_files": len(results),
+              "num_records": int(np.sum([r["num_records"] for r in results])),
+              "num_bad": int(np.sum([len(r["bad"]) for r in results])),
+              "rewritten": rewrite,
+              "bad": {r["file"].split(os.sep)[-1]: [{"index": i, "problem": problem} for i, problem in r["bad"]]
+                      for r in results if len(r["bad"])>0},
+              "bad_files": {r["file"].split(os.sep)[-1]: r["file_problem"] for r in results if r["file_problem"] is not None}}
+    with open(quarantine_dir+os.sep+'report.json', 'w') as f:
+        json.dump(report, f, indent=2)
+    print("{} bad records out of {} in {} files, {} bad files (report in {})".format(report["num_bad"], report["num_records"],
+          report["num_files"], len(report["bad_files"]), quarantine_dir+os.sep+'report.json'))
+
+    if rewrite and manifest is not None:
+        write_manifest(tfrecord_dir, [r["shard"] for r in results if r["shard"] is not None])
+    return report
+
+#-----------------------------------
+def check_detection_record(record, num_classes=num_classes):
+    """
+    check_detection_record(record, num_classes=num_classes)
+    This function checks one serialized object detection example: it parses, the "image"
+    decodes, there are as many objects/xmin, ymin, xmax, ymax and label values, every box
+    lies within the image with xmin < xmax and ymin < ymax, and every label is in [0, num_classes)
+    INPUTS:
+        * record [bytes]: serialized tf.train.Example
+    OPTIONAL INPUTS:
+        * num_classes [int]
+    GLOBAL INPUTS: num_classes
+    OUTPUTS: None if the record is good, otherwise a description of the problem [string]
+    """
+    try:
+        feature = tf.train.Example.FromString(record).features.feature
+    except Exception as e:
+        return "does not parse: {}".format(e)
+    if "image" not in feature or len(feature["image"].bytes_list.value) != 1:
+        return "no image"
+    try:
+        width, height = _open_image(feature["image"].bytes_list.value[0]).size
+    except Exception as e:
+        return "image does not decode: {}".format(e)
+
+    boxes = [np.array(feature[k].float_list.value) if k in feature else np.zeros(0)
+             for k in ["objects/xmin", "objects/ymin", "objects/xmax", "objects/ymax"]]
+    labels = np.array(feature["objects/label"].int64_list.value) if "objects/label" in feature else np.zeros(0)
+    if len(set([len(b) for b in boxes] + [len(labels)])) != 1:
+        return "different numbers of box coordinates and labels"
+    xmin, ymin, xmax, ymax = boxes
+    if np.any(xmin < 0) or np.any(ymin < 0) or np.any(xmax > width) or np.any(ymax > height):
+        return "box outside the {}x{} image".format(width, height)
+    if np.any(xmin >= xmax) or np.any(ymin >= ymax):
+        return "empty or inverted box"
+    if np.any(labels < 0) or np.any(labels >= num_classes):
+        return "label out of range"
+    return None
+
+###############################################################
+### NEAR-DUPLICATE FUNCTIONS
+###############################################################
+
+#-----------------------------------
+def _image_hash(bits, hash_size=8):
+    """
+    "_image_hash(bits, hash_size=8)"
+    difference hash of an encoded image: the image is shrunk to hash_size+1 x hash_size grey
+    pixels, and each bit says whether a pixel is brighter than its left neighbour.
+    Near-duplicate images have hashes that differ in only a few bits
+    INPUTS:
+        * bits [bytes]: encoded image
+    OPTIONAL INPUTS:
+        * hash_size [int]: the hash has hash_size x hash_size bits (at most 8, for 64 bits)
+    GLOBAL INPUTS: None
+    OUTPUTS: hash [int]
+    """
+    image = _open_image(bits)
+    grey = np.asarray(image.convert('L').resize((hash_size+1, hash_size), PIL.Image.BILINEAR), dtype=np.int16)
+    hash = 0
+    for bit in (grey[:,1:] > grey[:,:-1]).ravel():
+        hash = (hash << 1) | int(bit)
+    return hash
+
+#-----------------------------------
+def _shard_hashes(task):
+    """
+    "_shard_hashes(task)"
+    hash the image of every record of one tfrecord file (runs in a worker process)
+    INPUTS:
+        * task [tuple]: (filename, hash_size)
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: list of hashes [int] (None for a record whose image does not decode)
+    """
+    filename, hash_size = task
+    hashes = []
+    for record in _read_shard_records(filename):
+        try:
+            feature = tf.train.Example.FromString(record).features.feature
+            hashes.append(_image_hash(feature["image"].bytes_list.value[0], hash_size))
+        except Exception:
+            hashes.append(None)
+    return hashes
+
+#-----------------------------------
+def hash_records(filenames, hash_size=8, num_workers=None):
+    """
+    hash_records(filenames, hash_size=8, num_workers=None)
+    This function computes a perceptual (difference) hash of the image of every record in
+    a list of tfrecord files, with a pool of worker processes (one file per task)
+    INPUTS:
+        * filenames [list]: tfrecord files
+    OPTIONAL INPUTS:
+        * hash_size [int]: the hashes have hash_size x hash_size bits (at most 8)
+        * num_workers [int]: number of worker processes (None = number of cpus, 1 = no pool)
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * hashes [ndarray]: uint64 hash of each record (records whose image does not decode are left out)
+        * file_ids [ndarray]: index in filenames of the file of each record
+        * record_ids [ndarray]: index of each record in its file
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    tasks = [(f, hash_size) for f in filenames]
+    if num_workers == 1:
+        results = [_shard_hashes(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(num_workers) as pool:
+            results = pool.map(_shard_hashes, tasks)
+
+    hashes, file_ids, record_ids = [], [], []
+    for k, file_hashes in enumerate(results):
+        for i, hash in enumerate(file_hashes):
+            if hash is not None:
+                hashes.append(hash); file_ids.append(k); record_ids.append(i)
+    return np.array(hashes, dtype=np.uint64), np.array(file_ids, dtype=np.int64), np.array(record_ids, dtype=np.int64)
+
+#-----------------------------------
+def _popcount(x):
+    """
+    "_popcount(x)"
+    number of set bits of each element of a uint64 array
+    INPUTS:
+        * x [ndarray]: uint64
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: bit counts [ndarray]
+    """
+    return np.unpackbits(np.ascontiguousarray(x, dtype=np.uint64).view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+#-----------------------------------
+def find_near_duplicates(hashes, max_distance=5, num_bits=64, max_pairs=2**20):
+    """
+    find_near_duplicates(hashes, max_distance=5, num_bits=64, max_pairs=2**20)
+    This function groups hashes that differ in at most max_distance bits into clusters (chains
+    of near-duplicates join one cluster), without comparing all pairs: the hashes are split into
+    max_distance+1 bands, and two hashes within max_distance bits must agree exactly on at least
+    one band, so only hashes that share a band value (a bucket of the index) are compared.
+    Large buckets are compared in blocks of rows, so memory stays bounded by max_pairs
+    INPUTS:
+        * hashes [ndarray]: uint64 hashes (from hash_records)
+    OPTIONAL INPUTS:
+        * max_distance [int]: largest number of differing bits for near-duplicates
+        * num_bits [int]: bits per hash (hash_size x hash_size)
+        * max_pairs [int]: largest number of hash pairs compared at once
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * clusters [ndarray]: cluster id of each hash (the index of its first member)
+    """
+    # identical hashes are merged first, so each bucket holds distinct hashes only
+    unique, inverse = np.unique(hashes, return_inverse=True)
+    parent = np.arange(len(unique))
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    bands = np.array_split(np.arange(num_bits), max_distance+1)
+    for band in bands:
+        shift, width = int(band[0]), len(band)
+        keys = (unique >> np.uint64(shift)) & np.uint64((1 << width)-1)
+        order = np.argsort(keys, kind='stable')
+        bounds = np.flatnonzero(np.diff(keys[order])) + 1
+        for bucket in np.split(order, bounds):
+            if len(bucket) < 2:
+                continue
+            values = unique[bucket]
+            step = max(1, max_pairs//len(bucket))
+            for start in range(0, len(bucket)-1, step):
+                # rows start..start+step against every later column of the bucket
+                rows = np.arange(start, min(start+step, len(bucket)-1))
+                cols = np.arange(start+1, len(bucket))
+                xor = values[rows][:,np.newaxis] ^ values[cols][np.newaxis,:]
+                close = (_popcount(xor.ravel()).reshape(xor.shape) <= max_distance) & (cols > rows[:,np.newaxis])
+                a, b = np.nonzero(close)
+                for i, j in zip(bucket[rows[a]], bucket[cols[b]]):
+                    ri, rj = root(i), root(j)
+                    if ri != rj:
+                        parent[max(ri, rj)] = min(ri, rj)
+
+    unique_roots = np.array([root(i) for i in range(len(unique))], dtype=np.int64)
+    # number the clusters by their first record
+    roots = unique_roots[inverse]
+    first = {}
+    clusters = np.empty(len(hashes), dtype=np.int64)
+    for k, r in enumerate(roots):
+        clusters[k] = first.setdefault(r, k)
+    return clusters
+
+#-----------------------------------
+def make_split_manifest(filenames, validation_split, split_file, hash_size=8, max_distance=5, deduplicate=True, num_workers=None, seed=SEED):
+    """
+    make_split_manifest(filenames, validation_split, split_file, hash_size=8, max_distance=5, deduplicate=True, num_workers=None, seed=SEED)
+    This function finds near-duplicate records in a list of tfrecord files (hash_records, then
+    find_near_duplicates) and writes a train/validation split as json in which every cluster of
+    near-duplicates is on one side only (no leakage between the splits). With deduplicate=True
+    only the first record of each cluster is kept. Records are listed by file name and index in the
+    file; write_split_records writes them to new train and validation shards
+    INPUTS:
+        * filenames [list]: tfrecord files (in the same directory)
+        * validation_split [float]: fraction of the (kept) records for validation
+        * split_file [string]: json file to write
+    OPTIONAL INPUTS:
+        * hash_size, max_distance: see hash_records and find_near_duplicates
+        * deduplicate [bool]: keep one record per cluster
+        * num_workers [int]: number of worker processes (None = number of cpus)
+        * seed [int]: random seed for the assignment of clusters to the splits
+    GLOBAL INPUTS: SEED
+    OUTPUTS:
+        * split [dict]: also written to split_file
+    """
+    hashes, file_ids, record_ids = hash_records(filenames, hash_size, num_workers)
+    clusters = find_near_duplicates(hashes, max_distance, hash_size*hash_size)
+    names = [f.split(os.sep)[-1] for f in filenames]
+
+    members = {}
+    for k, c in enumerate(clusters):
+        members.setdefault(c, []).append(k)
+    cluster_ids = sorted(members.keys())
+    duplicates = [[[names[file_ids[k]], int(record_ids[k])] for k in members[c]] for c in cluster_ids if len(members[c]) > 1]
+    if deduplicate:
+        members = {c:members[c][:1] for c in cluster_ids}
+    num_kept = sum(len(members[c]) for c in cluster_ids)
+
+    # whole clusters go to validation, in random order, until it holds validation_split of the records
+    validation = set()
+    num_validation = 0
+    for c in np.random.RandomState(seed).permutation(cluster_ids):
+        if num_validation >= validation_split*num_kept:
+            break
+        validation.add(c)
+        num_validation += len(members[c])
+
+    splits = {"train": {}, "val": {}}
+    for c in cluster_ids:
+        side = splits["val"] if c in validation else splits["train"]
+        for k in members[c]:
+            side.setdefault(names[file_ids[k]], []).append(int(record_ids[k]))
+    for side in splits.values():
+        for name in side:
+            side[name] = sorted(side[name])
+
+    split = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+             "tfrecord_dir": os.path.dirname(filenames[0]) or '.',
+             "hash_size": hash_size,
+             "max_distance": max_distance,
+             "deduplicate": deduplicate,
+             "validation_split": validation_split,
+             "num_records": len(hashes),
+             "num_clusters": len(cluster_ids),
+             "num_train": num_kept-num_validation,
+             "num_val": num_validation,
+             "splits": splits,
+             "duplicates": duplicates}
+    with open(split_file, 'w') as f:
+        json.dump(split, f)
+    print("{} records in {} clusters of near-duplicates: {} for training, {} for validation".format(
+          len(hashes), len(cluster_ids), split["num_train"], split["num_val"]))
+    return split
+
+#-----------------------------------
+def write_split_records(split_file, output_dir, records_per_shard=ims_per_shard):
+    """
+    write_split_records(split_file, output_dir, records_per_shard=ims_per_shard)
+    This function copies the records listed in a split file (from make_split_manifest) to new
+    tfrecord shards, "train-{shard}-{count}.tfrecord" and "val-{shard}-{count}.tfrecord", with a manifest
+    INPUTS:
+        * split_file [string]: json file from make_split_manifest
+        * output_dir [string]: directory for the new shards (not the one the records are read from)
+    OPTIONAL INPUTS:
+        * records_per_shard [int]: number of records per new shard
+    GLOBAL INPUTS: ims_per_shard
+    OUTPUTS: list of new tfrecord files
+    """
+    with open(split_file) as f:
+        split = json.load(f)
+    tfrecord_dir = split["tfrecord_dir"]
+    if os.path.abspath(output_dir) == os.path.abspath(tfrecord_dir):
+        raise ValueError("write the split shards to a different directory than the source tfrecords")
+    os.makedirs(output_dir, exist_ok=True)
+
+    shards, written = [], []
+    def flush(name, records, counter):
+        filename = output_dir+os.sep+"{}-{:02d}-{}.tfrecord".format(name, counter, len(records))
+        class_counts = {}
+        for record in records:
+            for k in _record_class_ids(record):
+                class_counts[k] = class_counts.get(k, 0) + 1
+        offsets = write_examples(filename, records)
+        shards.append(get_shard_info(filename, offsets, class_counts))
+        written.append(filename)
+        print("Wrote file {} containing {} records".format(filename, len(records)))
+
+    for name in ["train", "val"]:
+        buffer, counter = [], 0
+        for source in sorted(split["splits"][name].keys()):
+            keep = set(split["splits"][name][source])
+            records = _read_shard_records(tfrecord_dir+os.sep+source)
+            buffer += [record for i, record in enumerate(records) if i in keep]
+            while len(buffer) >= records_per_shard:
+                flush(name, buffer[:records_per_shard], counter)
+                buffer, counter = buffer[records_per_shard:], counter+1
+        if len(buffer) > 0:
+            flush(name, buffer, counter)
+
+    manifest = read_manifest(tfrecord_dir)
+    write_manifest(output_dir, shards, manifest.get("classes") if manifest is not None else None)
+    return written
@@ -1,6 +1,9 @@
+import os
+from download_funcs import *
 
-import os, zipfile
-import tensorflow as tf
+# set extract = False to keep the zip files instead of extracting them; the tfrecords can then be read
+# in place with list_zip_members and the zip_path argument of the dataset functions (see tfrecords_funcs.py)
+extract = True
 
 
 try:
@@ -9,35 +12,19 @@ except:
     pass
 
 folder = './data'
-file = 'oysternet.zip'
 
-url = "https://ml-mondays-data.s3-us-west-2.amazonaws.com/mlmondays_data_imrecog/releases/download/0.1.0/"+file
-# url = "https://github.com/dbuscombe-usgs/mlmondays_data_imseg/releases/download/0.1.0/"+file
-filename = os.path.join(os.getcwd(), file)
-print("Downloading %s ... " % (filename))
-tf.keras.utils.get_file(filename, url)
-print("Unzipping to %s ... " % (folder))
-with zipfile.ZipFile(file, "r") as z_fp:
-    z_fp.extractall("./"+folder)
-
-try:
-    os.remove(file)
-except:
-    pass
+files_to_download = [
+'oysternet.zip',
+'obx.zip',
+]
 
+url = "https://ml-mondays-data.s3-us-west-2.amazonaws.com/mlmondays_data_imrecog/releases/download/0.1.0/"
+# url = "https://github.com/dbuscombe-usgs/mlmondays_data_imseg/releases/download/0.1.0/" (oysternet: 0.1.0, obx: 0.1.1)
 
-file = 'obx.zip'
+# sha256 of each release file, checked after download (recorded in checksums.json with
+# write_checksums(<release files>, 'checksums.json'); files with a null hash are not verified)
+checksums = read_checksums(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checksums.json'))
 
-url = "https://ml-mondays-data.s3-us-west-2.amazonaws.com/mlmondays_data_imrecog/releases/download/0.1.0/"+file
-# url = "https://github.com/dbuscombe-usgs/mlmondays_data_imseg/releases/download/0.1.1/"+file
-filename = os.path.join(os.getcwd(), file)
-print("Downloading %s ... " % (filename))
-tf.keras.utils.get_file(filename, url)
-print("Unzipping to %s ... " % (folder))
-with zipfile.ZipFile(file, "r") as z_fp:
-    z_fp.extractall("./"+folder)
+downloads = [(url+file, os.path.join(os.getcwd(), file), folder if extract else None) for file in files_to_download]
 
-try:
-    os.remove(file)
-except:
-    pass
+download_files(downloads, checksums)
@@ -0,0 +1,244 @@
+# Written by Dr Daniel Buscombe, Marda Science LLC
+# for "ML Mondays", a course supported by the USGS Community for Data Integration
+# and the USGS Coastal Change Hazards Program
+#
+# MIT License
+#
+# Copyright (c) 2020, Marda Science LLC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os, json, hashlib, zipfile, time
+import urllib.request, urllib.error, http.client
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+###############################################################
+### DOWNLOAD FUNCTIONS
+###############################################################
+"""
+These functions download the course data files in parallel. Each file is written to '{filename}.part'
+and resumed with an HTTP range request if the connection drops, then checked against a checksum
+manifest (checksums.json: file name to sha256) before being renamed into place.
+Zip files are extracted in a background thread as soon as they are verified,
+while the remaining downloads continue, and are not downloaded again once extracted
+"""
+#-----------------------------------
+def file_sha256(filename):
+    """
+    file_sha256(filename)
+    This function computes the sha256 hash of a file, reading it in chunks
+    INPUTS:
+        * filename [string]
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * hex digest [string]
+    """
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1<<20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+#-----------------------------------
+def read_checksums(json_file):
+    """
+    read_checksums(json_file)
+    This function reads a checksum manifest (a json file mapping file name to sha256 hash;
+    a null hash is a release file whose hash has not been recorded with write_checksums yet)
+    INPUTS:
+        * json_file [string]
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * checksums [dict] (empty if the file does not exist)
+    """
+    if not os.path.isfile(json_file):
+        return {}
+    with open(json_file) as f:
+        return json.load(f)
+
+#-----------------------------------
+def write_checksums(filenames, json_file):
+    """
+    write_checksums(filenames, json_file)
+    This function writes (or updates) a checksum manifest from files known to be good,
+    for example the release files before they are uploaded
+    INPUTS:
+        * filenames [list]: files to hash
+        * json_file [string]: checksum manifest to write
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * checksums [dict]
+    """
+    checksums = read_checksums(json_file)
+    for f in filenames:
+        checksums[os.path.basename(f)] = file_sha256(f)
+    with open(json_file, 'w') as fp:
+        json.dump(checksums, fp, indent=2, sort_keys=True)
+    return checksums
+
+#-----------------------------------
+def fetch_file(url, filename, sha256=None, retries=5, chunk_size=1<<20, timeout=60):
+    """
+    fetch_file(url, filename, sha256=None, retries=5, chunk_size=1<<20, timeout=60)
+    This function downloads a url to a file. Data is written to '{filename}.part', so an interrupted
+    download (in this or a previous run) is resumed from where it stopped with an HTTP range request
+    (servers that ignore the range are re-downloaded from the start).
+    If sha256 is given the finished file is verified, and a corrupt download is discarded and retried.
+    A file that already exists (and matches sha256, if given) is not downloaded again
+    INPUTS:
+        * url [string]
+        * filename [string]: destination file
+    OPTIONAL INPUTS:
+        * sha256 [string]: expected sha256 hash of the file
+        * retries [int]: number of attempts
+        * chunk_size [int]: bytes read from the connection at a time
+        * timeout [float]: connection timeout in seconds
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * filename [string]
+    """
+    if os.path.isfile(filename) and (sha256 is None or file_sha256(filename) == sha256):
+        return filename
+
+    part = filename+'.part'
+    for attempt in range(retries):
+        start = os.path.getsize(part) if os.path.isfile(part) else 0
+        request = urllib.request.Request(url)
+        if start > 0:
+            request.add_header('Range', 'bytes={}-'.format(start))
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                if start > 0 and response.status != 206: # range ignored, the whole file is being sent
+                    start = 0
+                length = response.headers.get('Content-Length')
+                expected = start + int(length) if length is not None else None
+                with open(part, 'ab' if start > 0 else 'wb') as f:
+                    for chunk in iter(lambda: response.read(chunk_size), b''):
+                        f.write(chunk)
+        except urllib.error.HTTPError as e:
+            if e.code != 416: # 416 = range not satisfiable, i.e. the .part file is already complete
+                if attempt == retries-1:
+                    raise
+                time.sleep(2**attempt)
+                continue
+            expected = None
+        except (urllib.error.URLError, http.client.HTTPException, OSError): # e.g. dropped connection, resumed on the next attempt
+            if attempt == retries-1:
+                raise
+            time.sleep(2**attempt)
+            continue
+
+        if expected is not None and os.path.getsize(part) < expected: # connection dropped, resume
+            continue
+        if sha256 is not None and file_sha256(part) != sha256:
+            print("Checksum mismatch for {}, downloading again".format(filename))
+            os.remove(part)
+            continue
+        os.replace(part, filename)
+        return filename
+
+    raise IOError("Could not download {} from {}".format(filename, url))
+
+#-----------------------------------
+def extracted_marker(filename, folder):
+    """
+    extracted_marker(filename, folder)
+    This function returns the marker file that extract_zip writes in folder once a zip file
+    has been extracted completely (download_files skips zip files whose marker exists)
+    INPUTS:
+        * filename [string]: zip file
+        * folder [string]: folder it is extracted to
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * marker [string]: file name
+    """
+    return os.path.join(folder, '.'+os.path.basename(filename)+'.extracted')
+
+#-----------------------------------
+def extract_zip(filename, folder, remove=True):
+    """
+    extract_zip(filename, folder, remove=True)
+    This function extracts a zip file to a folder, writes its marker (see extracted_marker),
+    then (optionally) deletes the zip file
+    INPUTS:
+        * filename [string]: zip file
+        * folder [string]: folder to extract to
+    OPTIONAL INPUTS:
+        * remove [bool]: delete the zip file after extraction
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * folder [string]
+    """
+    print("Unzipping {} to {} ... ".format(filename, folder))
+    with zipfile.ZipFile(filename, "r") as z_fp:
+        z_fp.extractall(folder)
+    with open(extracted_marker(filename, folder), 'w') as f:
+        f.write(time.strftime("%Y-%m-%d %H:%M:%S"))
+    if remove:
+        os.remove(filename)
+    return folder
+
+#-----------------------------------
+def download_files(downloads, checksums=None, num_workers=4, remove=True):
+    """
+    download_files(downloads, checksums=None, num_workers=4, remove=True)
+    This function downloads a list of files in parallel (see fetch_file), and extracts each zip file
+    in a background thread as soon as it has been downloaded and verified, while other downloads continue.
+    Zip files already extracted to their folder (see extracted_marker) are skipped; delete the marker to fetch one again
+    INPUTS:
+        * downloads [list]: of (url, filename, folder) tuples; files with folder=None are downloaded but not extracted
+    OPTIONAL INPUTS:
+        * checksums [dict]: file name to sha256 hash (files not listed, or with a None hash, are not verified)
+        * num_workers [int]: number of simultaneous downloads
+        * remove [bool]: delete zip files after extraction
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * filenames [list]: downloaded files
+    """
+    if checksums is None:
+        checksums = {}
+    skipped = [d for d in downloads if d[2] is not None and os.path.isfile(extracted_marker(d[1], d[2]))]
+    for url, filename, folder in skipped:
+        print("{} is already extracted to {}, skipping".format(os.path.basename(filename), folder))
+    downloads = [d for d in downloads if d not in skipped]
+    for url, filename, folder in downloads:
+        if checksums.get(os.path.basename(filename)) is None:
+            print("No checksum for {}: it will not be verified".format(os.path.basename(filename)))
+
+    filenames = []
+    with ThreadPoolExecutor(num_workers) as downloader, ThreadPoolExecutor(1) as extractor:
+        jobs = {}
+        for url, filename, folder in downloads:
+            print("Downloading {} ... ".format(filename))
+            jobs[downloader.submit(fetch_file, url, filename, checksums.get(os.path.basename(filename)))] = folder
+
+        extractions = []
+        for job in as_completed(jobs):
+            filename = job.result()
+            filenames.append(filename)
+            print("Downloaded {}".format(filename))
+            if jobs[job] is not None:
+                extractions.append(extractor.submit(extract_zip, filename, jobs[job], remove))
+        for extraction in extractions:
+            extraction.result()
+    return filenames
@@ -27,7 +27,7 @@
 from oyster_imports import *
 
 import os
-os.environ["TF_DETERMINISTIC_OPS"] = "1"
+# kernel determinism is set by the execution profile (see set_execution_profile in tfrecords_funcs.py)
 
 ##calcs
 import tensorflow as tf #numerical operations on gpu
@@ -43,3 +43,7 @@ max_lr = 1e-3
 rampup_epochs = 5
 sustain_epochs = 0
 exp_decay = .9
+
+#execution profile (see EXECUTION_PROFILES in tfrecords_funcs.py): 'reproducible' (repeatable runs),
+#'strict' (repeatable op order too, slower), 'fast' (maximum training throughput) or 'inference' (maximum throughput, outputs in input order)
+EXECUTION_PROFILE = 'reproducible'
@@ -84,13 +84,13 @@ validation_filenames = sorted(tf.io.gfile.glob(data_path+os.sep+'*val*.tfrec'))
 print('.....................................')
 print('Reading files and making datasets ...')
 
-num_files =  (len(training_filenames)+len(validation_filenames))
+manifest = read_manifest(data_path)
 
-nb_images = ims_per_shard * num_files
+nb_images = get_num_records(training_filenames+validation_filenames, manifest)
 print(nb_images)
 
-validation_steps = int(nb_images // num_files * len(validation_filenames)) // BATCH_SIZE
-steps_per_epoch = int(nb_images // num_files * len(training_filenames)) // BATCH_SIZE
+validation_steps = get_num_records(validation_filenames, manifest) // BATCH_SIZE
+steps_per_epoch = get_num_records(training_filenames, manifest) // BATCH_SIZE
 
 print(steps_per_epoch)
 print(validation_steps)
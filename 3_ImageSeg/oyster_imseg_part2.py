@@ -64,12 +64,12 @@ def get_batched_eval_dataset_oysternet(filenames):
     GLOBAL INPUTS: BATCH_SIZE, AUTO
     OUTPUTS: tf.data.Dataset object
     """
-    option_no_order = tf.data.Options()
-    option_no_order.experimental_deterministic = True
+    option_no_order = get_dataset_options()
 
     dataset = tf.data.Dataset.list_files(filenames)
     dataset = dataset.with_options(option_no_order)
-    dataset = dataset.interleave(tf.data.TFRecordDataset, cycle_length=16, num_parallel_calls=AUTO)
+    compression_type = get_compression_type(filenames)
+    dataset = dataset.interleave(lambda f: tf.data.TFRecordDataset(f, compression_type=compression_type), cycle_length=16, num_parallel_calls=AUTO)
     dataset = dataset.map(read_seg_tfrecord_oysternet, num_parallel_calls=AUTO)
     dataset = dataset.cache() # This dataset fits in RAM
     #dataset = dataset.repeat()
@@ -118,7 +118,9 @@ filenames = sorted(tf.io.gfile.glob(data_path+os.sep+'*.tfrec'))
 print('.....................................')
 print('Reading files and making datasets ...')
 
-nb_images = ims_per_shard * len(filenames)
+manifest = read_manifest(data_path)
+
+nb_images = get_num_records(filenames, manifest)
 print(nb_images)
 
 split = int(len(filenames) * VALIDATION_SPLIT)
@@ -126,8 +128,8 @@ split = int(len(filenames) * VALIDATION_SPLIT)
 training_filenames = filenames[split:]
 validation_filenames = filenames[:split]
 
-validation_steps = int(nb_images // len(filenames) * len(validation_filenames)) // BATCH_SIZE
-steps_per_epoch = int(nb_images // len(filenames) * len(training_filenames)) // BATCH_SIZE
+validation_steps = get_num_records(validation_filenames, manifest) // BATCH_SIZE
+steps_per_epoch = get_num_records(training_filenames, manifest) // BATCH_SIZE
 
 print(steps_per_epoch)
 print(validation_steps)
@@ -65,6 +65,8 @@ dataset = get_seg_dataset_for_tfrecords_oysternet(imdir, lab_path, shared_size)
 
 filestr = "oysternet-train"
 write_seg_records_oysternet(dataset, tfrecord_dir, filestr)
+# # on later runs, encode only the new and changed images (and rewrite shards holding deleted ones)
+# update_seg_records_oysternet(imdir, lab_path, tfrecord_dir, filestr, shared_size)
 
 #
 
@@ -107,6 +109,8 @@ plt.show()
 
 filestr = "oysternet-test"
 write_seg_records_oysternet(dataset, tfrecord_dir, filestr)
+# # on later runs, encode only the new and changed images (and rewrite shards holding deleted ones)
+# update_seg_records_oysternet(imdir, lab_path, tfrecord_dir, filestr, shared_size)
 
 #
 
@@ -149,5 +153,7 @@ plt.show()
 
 filestr = "oysternet-val"
 write_seg_records_oysternet(dataset, tfrecord_dir, filestr)
+# # on later runs, encode only the new and changed images (and rewrite shards holding deleted ones)
+# update_seg_records_oysternet(imdir, lab_path, tfrecord_dir, filestr, shared_size)
 
 #
@@ -32,7 +32,7 @@ import tensorflow as tf #numerical operations on gpu
 
 #see mlmondays blog post:
 import os
-os.environ["TF_DETERMINISTIC_OPS"] = "1"
+# kernel determinism is set by the execution profile (see set_execution_profile in tfrecords_funcs.py)
 
 ##calcs
 import numpy as np
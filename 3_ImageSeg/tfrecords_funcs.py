@@ -27,8 +27,8 @@
 
 from oyster_imports import *
 
-import os
-os.environ["TF_DETERMINISTIC_OPS"] = "1"
+import os, io, json, time, gzip, hashlib, itertools, platform, multiprocessing, multiprocessing.pool, struct, zlib, zipfile, fnmatch, mmap, shutil
+import PIL.Image
 
 ##calcs
 import tensorflow as tf #numerical operations on gpu
@@ -39,8 +39,86 @@ SEED=42
 np.random.seed(SEED)
 AUTO = tf.data.experimental.AUTOTUNE # used in tf.data.Dataset API
 
+#input pipeline settings read by the dataset builders (swept by benchmark_pipelines.py)
+CYCLE_LENGTH = 16 # number of tfrecord files read at once
+MAP_PARALLELISM = AUTO # parallel calls of the decoding/preprocessing maps
+SHUFFLE_BUFFER = 2048 # number of examples in the shuffle buffer
+CACHE = True # cache the decoded examples after the first pass
+
 tf.random.set_seed(SEED)
 
+###############################################################
+### EXECUTION PROFILE FUNCTIONS
+###############################################################
+
+# named determinism and parallelism settings, chosen with EXECUTION_PROFILE
+EXECUTION_PROFILES = {
+    # repeatable runs, for comparing experiments: deterministic kernels, tf.data elements in a fixed
+    # order, the shared tf.data thread pool and no XLA (deterministic kernels give the same results
+    # whatever the thread pools, so these keep tensorflow's default sizes)
+    "reproducible": {"deterministic_ops": True, "ordered": True, "intra_op_threads": 0, "inter_op_threads": 0,
+                     "private_threadpool_size": 0, "xla": False},
+    # opt-in, for debugging run-to-run differences: as 'reproducible', but one op at a time on the
+    # inter-op pool, so ops also run in the same order (slower)
+    "strict": {"deterministic_ops": True, "ordered": True, "intra_op_threads": 0, "inter_op_threads": 1,
+               "private_threadpool_size": 0, "xla": False},
+    # maximum training throughput: the fastest kernels, tf.data elements in the order they are ready,
+    # a private tf.data thread pool (input work does not queue behind model ops) and XLA auto-clustering
+    "fast": {"deterministic_ops": False, "ordered": False, "intra_op_threads": 0, "inter_op_threads": 0,
+             "private_threadpool_size": os.cpu_count() or 0, "xla": True},
+    # maximum prediction throughput, with the outputs still in the order of the inputs
+    "inference": {"deterministic_ops": False, "ordered": True, "intra_op_threads": 0, "inter_op_threads": 0,
+                  "private_threadpool_size": os.cpu_count() or 0, "xla": True},
+}
+
+#-----------------------------------
+def set_execution_profile(profile):
+    """
+    set_execution_profile(profile)
+    This function applies a named execution profile (see EXECUTION_PROFILES): kernel determinism,
+    tf.data ordering, the intra-op and inter-op thread pools, the private tf.data thread pool and XLA
+    auto-clustering (0 threads = tensorflow's default). It is called on import with EXECUTION_PROFILE,
+    because kernel determinism and the thread pools are fixed once tensorflow has run its first op;
+    the other settings can be changed later by calling it again
+    INPUTS:
+        * profile [string]: key of EXECUTION_PROFILES
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: EXECUTION_PROFILES
+    OUTPUTS: None (sets the globals EXECUTION_PROFILE, DETERMINISTIC and PRIVATE_THREADPOOL_SIZE)
+    """
+    if profile not in EXECUTION_PROFILES:
+        raise ValueError("unknown execution profile {} (use one of {})".format(profile, sorted(EXECUTION_PROFILES.keys())))
+    settings = EXECUTION_PROFILES[profile]
+    os.environ["TF_DETERMINISTIC_OPS"] = "1" if settings["deterministic_ops"] else "0"
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(settings["intra_op_threads"])
+        tf.config.threading.set_inter_op_parallelism_threads(settings["inter_op_threads"])
+    except RuntimeError: # the tensorflow runtime has already started
+        print("Thread pools are already set up; restart python to change them")
+    tf.config.optimizer.set_jit(settings["xla"])
+    globals().update(EXECUTION_PROFILE=profile, DETERMINISTIC=settings["ordered"],
+                     PRIVATE_THREADPOOL_SIZE=settings["private_threadpool_size"])
+
+#-----------------------------------
+def get_dataset_options():
+    """
+    get_dataset_options()
+    This function returns the tf.data options of the execution profile: whether parallel
+    stages keep the order of their elements, and the size of the pipeline's private thread pool
+    INPUTS: None
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: DETERMINISTIC, PRIVATE_THREADPOOL_SIZE
+    OUTPUTS: tf.data.Options object
+    """
+    options = tf.data.Options()
+    options.experimental_deterministic = DETERMINISTIC
+    if PRIVATE_THREADPOOL_SIZE > 0:
+        options.experimental_threading.private_threadpool_size = PRIVATE_THREADPOOL_SIZE
+    return options
+
+# the EXECUTION_PROFILE environment variable overrides the setting (benchmark_profiles.py runs each profile this way)
+set_execution_profile(os.environ.get("EXECUTION_PROFILE", EXECUTION_PROFILE))
+
 ###############################################################
 ### TFRECORD FUNCTIONS
 ###############################################################
@@ -71,13 +149,13 @@ def read_seg_tfrecord_obx_binary(example):
     # decode the TFRecord
     example = tf.io.parse_single_example(example, features)
 
-    image = tf.image.decode_jpeg(example['image'], channels=3)
+    image = decode_seg_bytes(example['image'], 3)
     image = tf.cast(image, tf.float32)/ 255.0
     image = tf.reshape(image, [TARGET_SIZE,TARGET_SIZE, 3])
     ##uncomment for greyscale imagery
     #image = tf.reshape(tf.image.rgb_to_grayscale(image), [TARGET_SIZE,TARGET_SIZE, 1])
 
-    label = tf.image.decode_jpeg(example['label'], channels=1)
+    label = decode_seg_bytes(example['label'], 1)
     label = tf.cast(label, tf.uint8)#/ 255.0
     label = tf.reshape(label, [TARGET_SIZE,TARGET_SIZE, 1])
 
@@ -135,12 +213,12 @@ def read_seg_tfrecord_obx_multiclass(example):
     # decode the TFRecord
     example = tf.io.parse_single_example(example, features)
 
-    image = tf.image.decode_jpeg(example['image'], channels=3)
+    image = decode_seg_bytes(example['image'], 3)
     image = tf.cast(image, tf.float32)/ 255.0
     image = tf.reshape(image, [TARGET_SIZE,TARGET_SIZE, 3])
     #image = tf.reshape(tf.image.rgb_to_grayscale(image), [TARGET_SIZE,TARGET_SIZE, 1])
 
-    label = tf.image.decode_jpeg(example['label'], channels=1)
+    label = decode_seg_bytes(example['label'], 1)
     label = tf.cast(label, tf.uint8)#/ 255.0
     label = tf.reshape(label, [TARGET_SIZE,TARGET_SIZE, 1])
 
@@ -171,38 +249,67 @@ def read_seg_tfrecord_obx_multiclass(example):
 
 
 #-----------------------------------
-def get_batched_dataset_oysternet(filenames):
+def get_batched_dataset_oysternet(filenames, zip_path=None, service=None):
     """
-    "get_batched_dataset_oysternet(filenames)"
+    "get_batched_dataset_oysternet(filenames, zip_path=None, service=None)"
     This function defines a workflow for the model to read data from
     tfrecord files by defining the degree of parallelism, batch size, pre-fetching, etc
     and also formats the imagery properly for model training
     (assumes oysternet by using read_seg_tfrecord_oysternet)
     INPUTS:
         * filenames [list]
-    OPTIONAL INPUTS: None
-    GLOBAL INPUTS: BATCH_SIZE, AUTO
+    OPTIONAL INPUTS:
+        * zip_path [string]: zip archive containing the tfrecords (filenames are then member names)
+        * service [string]: tf.data service dispatcher address (see data_service.py); preprocessing then runs on its workers
+    GLOBAL INPUTS: BATCH_SIZE, AUTO, CYCLE_LENGTH, MAP_PARALLELISM, SHUFFLE_BUFFER, CACHE
     OUTPUTS: tf.data.Dataset object
     """
-    option_no_order = tf.data.Options()
-    option_no_order.experimental_deterministic = True
+    if service is not None and zip_path is not None:
+        raise ValueError("zip archives are read with python generators, which cannot run on a tf.data service")
+    option_no_order = get_dataset_options()
 
-    dataset = tf.data.Dataset.list_files(filenames)
+    dataset = get_record_dataset(filenames, zip_path)
     dataset = dataset.with_options(option_no_order)
-    dataset = dataset.interleave(tf.data.TFRecordDataset, cycle_length=16, num_parallel_calls=AUTO)
-    dataset = dataset.map(read_seg_tfrecord_oysternet, num_parallel_calls=AUTO)
-    dataset = dataset.cache() # This dataset fits in RAM
+    dataset = dataset.map(read_seg_tfrecord_oysternet, num_parallel_calls=MAP_PARALLELISM)
+    if CACHE:
+        dataset = dataset.cache() # This dataset fits in RAM
     dataset = dataset.repeat()
-    dataset = dataset.shuffle(2048)
+    dataset = dataset.shuffle(SHUFFLE_BUFFER)
     dataset = dataset.batch(BATCH_SIZE, drop_remainder=True) # drop_remainder will be needed on TPU
     dataset = dataset.prefetch(AUTO) #
+    if service is not None:
+        dataset = distribute_dataset(dataset, service)
 
     return dataset
 
 #-----------------------------------
-def get_batched_dataset_obx(filenames, flag):
+def get_stage_dataset_oysternet(filenames, stage='parse'):
+    """
+    "get_stage_dataset_oysternet(filenames, stage='parse')"
+    This function builds the pipeline of get_batched_dataset_oysternet up to one of its stages, batched,
+    so benchmark_pipelines can time each stage with the current settings: 'read' (serialized records)
+    or 'parse' (records decoded with read_seg_tfrecord_oysternet)
+    INPUTS:
+        * filenames [list]
+    OPTIONAL INPUTS:
+        * stage = {'read' | 'parse'}
+    GLOBAL INPUTS: BATCH_SIZE, AUTO, CYCLE_LENGTH, MAP_PARALLELISM
+    OUTPUTS: tf.data.Dataset object
+    """
+    if stage not in ('read', 'parse'):
+        raise ValueError("unknown stage {} (use 'read' or 'parse')".format(stage))
+
+    dataset = get_record_dataset(filenames)
+    dataset = dataset.with_options(get_dataset_options())
+    if stage == 'parse':
+        dataset = dataset.map(read_seg_tfrecord_oysternet, num_parallel_calls=MAP_PARALLELISM)
+    dataset = dataset.batch(BATCH_SIZE)
+    return dataset.prefetch(AUTO)
+
+#-----------------------------------
+def get_batched_dataset_obx(filenames, flag, zip_path=None, service=None):
     """
-    "get_batched_dataset_obx(filenames, flag)"
+    "get_batched_dataset_obx(filenames, flag, zip_path=None, service=None)"
     This function defines a workflow for the model to read data from
     tfrecord files by defining the degree of parallelism, batch size, pre-fetching, etc
     and also formats the imagery properly for model training
@@ -212,33 +319,38 @@ def get_batched_dataset_obx(filenames, flag):
     tfrecords into 4 classes,. recoded 0 through 3
     INPUTS:
         * filenames [list]
-    OPTIONAL INPUTS: None
-    GLOBAL INPUTS: BATCH_SIZE, AUTO
+    OPTIONAL INPUTS:
+        * zip_path [string]: zip archive containing the tfrecords (filenames are then member names)
+        * service [string]: tf.data service dispatcher address (see data_service.py); preprocessing then runs on its workers
+    GLOBAL INPUTS: BATCH_SIZE, AUTO, CYCLE_LENGTH, MAP_PARALLELISM, SHUFFLE_BUFFER, CACHE
     OUTPUTS: tf.data.Dataset object
     """
-    option_no_order = tf.data.Options()
-    option_no_order.experimental_deterministic = True
+    if service is not None and zip_path is not None:
+        raise ValueError("zip archives are read with python generators, which cannot run on a tf.data service")
+    option_no_order = get_dataset_options()
 
-    dataset = tf.data.Dataset.list_files(filenames)
+    dataset = get_record_dataset(filenames, zip_path)
     dataset = dataset.with_options(option_no_order)
-    dataset = dataset.interleave(tf.data.TFRecordDataset, cycle_length=16, num_parallel_calls=AUTO)
     if flag is 'binary':
-        dataset = dataset.map(read_seg_tfrecord_obx_binary, num_parallel_calls=AUTO)
+        dataset = dataset.map(read_seg_tfrecord_obx_binary, num_parallel_calls=MAP_PARALLELISM)
     else:
-        dataset = dataset.map(read_seg_tfrecord_obx_multiclass, num_parallel_calls=AUTO)
+        dataset = dataset.map(read_seg_tfrecord_obx_multiclass, num_parallel_calls=MAP_PARALLELISM)
 
-    dataset = dataset.cache() # This dataset fits in RAM
+    if CACHE:
+        dataset = dataset.cache() # This dataset fits in RAM
     dataset = dataset.repeat()
-    dataset = dataset.shuffle(2048)
+    dataset = dataset.shuffle(SHUFFLE_BUFFER)
     dataset = dataset.batch(BATCH_SIZE, drop_remainder=True) # drop_remainder will be needed on TPU
     dataset = dataset.prefetch(AUTO) #
+    if service is not None:
+        dataset = distribute_dataset(dataset, service)
 
     return dataset
 
 #-----------------------------------
-def get_seg_dataset_for_tfrecords_oysternet(imdir, lab_path, shared_size):
+def get_seg_dataset_for_tfrecords_oysternet(imdir, lab_path, shared_size, encoding='jpeg', filenames=None):
     """
-    "get_seg_dataset_for_tfrecords_oysternet(imdir, lab_path, shared_size)"
+    "get_seg_dataset_for_tfrecords_oysternet(imdir, lab_path, shared_size, encoding='jpeg', filenames=None)"
     This function reads an image and label and decodes both jpegs
     into bytestring arrays.
     This works because the images and labels have the same name
@@ -246,24 +358,32 @@ def get_seg_dataset_for_tfrecords_oysternet(imdir, lab_path, shared_size):
     INPUTS:
         * image [tensor array]
         * label [tensor array]
-    OPTIONAL INPUTS: None
+    OPTIONAL INPUTS:
+        * encoding = {'jpeg' | 'raw'}: recompress image and label as jpeg, or keep raw uint8 pixels
+        * filenames [list]: images to use, in this order (default: all jpegs in imdir, shuffled)
     GLOBAL INPUTS: TARGET_SIZE
     OUTPUTS:
         * image [tensor array]
         * label [tensor array]
     """
-    dataset = tf.data.Dataset.list_files(imdir+os.sep+'*.jpg', seed=10000) # This also shuffles the images
+    if filenames is None:
+        dataset = tf.data.Dataset.list_files(imdir+os.sep+'*.jpg', seed=10000) # This also shuffles the images
+    else:
+        dataset = tf.data.Dataset.from_tensor_slices(filenames)
     dataset = dataset.map(read_seg_image_and_label)
     dataset = dataset.map(resize_and_crop_seg_image, num_parallel_calls=AUTO)
-    dataset = dataset.map(recompress_seg_image, num_parallel_calls=AUTO)
+    if encoding == 'raw':
+        dataset = dataset.map(recode_seg_image_raw, num_parallel_calls=AUTO)
+    else:
+        dataset = dataset.map(recompress_seg_image, num_parallel_calls=AUTO)
     dataset = dataset.batch(shared_size)
     return dataset
 
 
 #-----------------------------------
-def get_seg_dataset_for_tfrecords_obx(imdir, lab_path, shared_size):
+def get_seg_dataset_for_tfrecords_obx(imdir, lab_path, shared_size, encoding='jpeg'):
     """
-    "get_seg_dataset_for_tfrecords_obx"
+    "get_seg_dataset_for_tfrecords_obx(imdir, lab_path, shared_size, encoding='jpeg')"
     This function reads an image and label and decodes both jpegs
     into bytestring arrays.
     This is the version for OBX data, which differs in use of both
@@ -272,7 +392,8 @@ def get_seg_dataset_for_tfrecords_obx(imdir, lab_path, shared_size):
     INPUTS:
         * image [tensor array]
         * label [tensor array]
-    OPTIONAL INPUTS: None
+    OPTIONAL INPUTS:
+        * encoding = {'jpeg' | 'raw'}: recompress image and label as jpeg, or keep raw uint8 pixels
     GLOBAL INPUTS: TARGET_SIZE
     OUTPUTS:
         * image [tensor array]
@@ -281,7 +402,10 @@ def get_seg_dataset_for_tfrecords_obx(imdir, lab_path, shared_size):
     dataset = tf.data.Dataset.list_files(imdir+os.sep+'*.jpg', seed=10000) # This also shuffles the images
     dataset = dataset.map(read_seg_image_and_label_obx)
     dataset = dataset.map(resize_and_crop_seg_image_obx, num_parallel_calls=AUTO)
-    dataset = dataset.map(recompress_seg_image, num_parallel_calls=AUTO)
+    if encoding == 'raw':
+        dataset = dataset.map(recode_seg_image_raw, num_parallel_calls=AUTO)
+    else:
+        dataset = dataset.map(recompress_seg_image, num_parallel_calls=AUTO)
     dataset = dataset.batch(shared_size)
     return dataset
 
@@ -444,50 +568,193 @@ def recompress_seg_image(image, label):
     return image, label
 
 #-----------------------------------
-def write_seg_records_obx(dataset, tfrecord_dir):
+def recode_seg_image_raw(image, label):
+    """
+    "recode_seg_image_raw"
+    This function casts an image and label to 8-bit, to be stored as raw pixel bytes
+    (no jpeg encoding, so no decoding cost at training time and no compression artifacts in the labels)
+    INPUTS:
+        * image [tensor array]
+        * label [tensor array]
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * image [tensor array]
+        * label [tensor array]
+    """
+    image = tf.cast(image, tf.uint8)
+    label = tf.cast(label, tf.uint8)
+    return image, label
+
+#-----------------------------------
+def decode_seg_bytes(bits, channels):
+    """
+    "decode_seg_bytes(bits, channels)"
+    This function decodes an image or label bytestring from a tfrecord example,
+    which is either a jpeg or raw TARGET_SIZE x TARGET_SIZE x channels uint8 pixels
+    (raw data is detected from the length of the bytestring)
+    INPUTS:
+        * bits [tensor]: image bytestring
+        * channels [int]: 3 for images, 1 for labels
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: TARGET_SIZE
+    OUTPUTS: image [tensor] (uint8)
+    """
+    return tf.cond(tf.strings.length(bits) == TARGET_SIZE*TARGET_SIZE*channels,
+                   lambda: tf.reshape(tf.io.decode_raw(bits, tf.uint8), [TARGET_SIZE, TARGET_SIZE, channels]),
+                   lambda: tf.image.decode_jpeg(bits, channels=channels))
+
+#-----------------------------------
+def write_seg_records_obx(dataset, tfrecord_dir, compression_type=''):
     """
-    "write_seg_records_obx(dataset, tfrecord_dir)"
+    "write_seg_records_obx(dataset, tfrecord_dir, compression_type='')"
     This function writes a tf.data.Dataset object to TFRecord shards
     The version for OBX data preprends "obx" to the filenames, but otherwise is identical
     to write_seg_records
     INPUTS:
         * dataset [tf.data.Dataset]
         * tfrecord_dir [string] : path to directory where files will be written
-    OPTIONAL INPUTS: None
+    OPTIONAL INPUTS:
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}: record compression (worth using with raw images)
     GLOBAL INPUTS: None
-    OUTPUTS: None (files written to disk)
+    OUTPUTS: None (files written to disk, with a manifest.json)
     """
+    shards = []
     for shard, (image, label) in enumerate(dataset):
       shard_size = image.numpy().shape[0]
       filename = tfrecord_dir+os.sep+"obx" + "{:02d}-{}.tfrec".format(shard, shard_size)
 
-      with tf.io.TFRecordWriter(filename) as out_file:
-        for i in range(shard_size):
-          example = to_seg_tfrecord(image.numpy()[i],label.numpy()[i])
-          out_file.write(example.SerializeToString())
-        print("Wrote file {} containing {} records".format(filename, shard_size))
+      images = image.numpy()
+      labels = label.numpy()
+      offsets = write_examples(filename, (to_seg_tfrecord(images[i],labels[i]).SerializeToString() for i in range(shard_size)), compression_type)
+      shards.append(get_shard_info(filename, offsets, compression_type=compression_type))
+      print("Wrote file {} containing {} records".format(filename, shard_size))
+
+    write_manifest(tfrecord_dir, shards)
 
 #-----------------------------------
-def write_seg_records_oysternet(dataset, tfrecord_dir, filestr):
+def write_seg_records_oysternet(dataset, tfrecord_dir, filestr, compression_type='', sources=None, first_shard=0):
     """
-    "write_seg_records_oysternet(dataset, tfrecord_dir, filestr)"
+    "write_seg_records_oysternet(dataset, tfrecord_dir, filestr, compression_type='', sources=None, first_shard=0)"
     This function writes a tf.data.Dataset object to TFRecord shards
     INPUTS:
         * dataset [tf.data.Dataset]
         * tfrecord_dir [string] : path to directory where files will be written
-    OPTIONAL INPUTS: None
+    OPTIONAL INPUTS:
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}: record compression (worth using with raw images)
+        * sources [list]: (source file name, content hash) of each image in dataset order,
+          recorded in the manifest for update_seg_records_oysternet
+        * first_shard [int]: index of the first shard file name
     GLOBAL INPUTS: None
-    OUTPUTS: None (files written to disk)
+    OUTPUTS: None (files written to disk, with a manifest.json)
     """
-    for shard, (image, label) in enumerate(dataset):
+    shards = []
+    position = 0
+    for shard, (image, label) in enumerate(dataset, first_shard):
       shard_size = image.numpy().shape[0]
       filename = tfrecord_dir+os.sep+filestr + "{:02d}-{}.tfrec".format(shard, shard_size)
 
-      with tf.io.TFRecordWriter(filename) as out_file:
-        for i in range(shard_size):
-          example = to_seg_tfrecord(image.numpy()[i],label.numpy()[i])
-          out_file.write(example.SerializeToString())
-        print("Wrote file {} containing {} records".format(filename, shard_size))
+      images = image.numpy()
+      labels = label.numpy()
+      offsets = write_examples(filename, (to_seg_tfrecord(images[i],labels[i]).SerializeToString() for i in range(shard_size)), compression_type)
+      shard_sources = None if sources is None else sources[position:position+shard_size]
+      position += shard_size
+      shards.append(get_shard_info(filename, offsets, compression_type=compression_type, sources=shard_sources))
+      print("Wrote file {} containing {} records".format(filename, shard_size))
+
+    write_manifest(tfrecord_dir, shards)
+
+#-----------------------------------
+def hash_seg_sources(filenames, num_workers=None):
+    """
+    "hash_seg_sources(filenames, num_workers=None)"
+    This function computes a content hash for each image and its label
+    (same name, in the labels folder), in parallel
+    INPUTS:
+        * filenames [list]: image files
+    OPTIONAL INPUTS:
+        * num_workers [int]: number of threads (None = number of cpus)
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * hashes [list]: hex digests, in the same order as filenames
+    """
+    def hash_pair(f):
+        return _file_md5(f)+_file_md5(f.replace("images", "labels"))
+    with multiprocessing.pool.ThreadPool(num_workers or os.cpu_count() or 1) as pool:
+        return pool.map(hash_pair, filenames)
+
+#-----------------------------------
+def plan_update(manifest, sources, prefix):
+    """
+    "plan_update(manifest, sources, prefix)"
+    This function compares the current source files with the sources recorded in the manifest
+    for the shards whose names start with prefix. Shards with a deleted or changed source
+    (or no recorded sources) are dropped; sources not in a kept shard need to be encoded
+    INPUTS:
+        * manifest [dict]: from read_manifest (or None)
+        * sources [dict]: source file name to content hash
+        * prefix [string]: shard file name prefix
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * dropped [list]: file names of shards to delete
+        * new_sources [list]: source file names to encode
+        * next_shard [int]: index for the next shard file name
+    """
+    shards = [s for s in (manifest or {}).get("shards", []) if s["file"].startswith(prefix)]
+    dropped, encoded = [], set()
+    for shard in shards:
+        shard_sources = shard.get("sources")
+        if shard_sources is not None and all(sources.get(name) == h for name, h in shard_sources):
+            encoded.update(name for name, h in shard_sources)
+        else:
+            dropped.append(shard["file"])
+    new_sources = sorted(name for name in sources if name not in encoded)
+
+    indices = [int(s["file"][len(prefix):].split('-')[0]) for s in shards if s["file"][len(prefix):].split('-')[0].isdigit()]
+    next_shard = max(indices)+1 if len(indices)>0 else 0
+    return dropped, new_sources, next_shard
+
+#-----------------------------------
+def update_seg_records_oysternet(imdir, lab_path, tfrecord_dir, filestr, shared_size, encoding='jpeg', compression_type=''):
+    """
+    "update_seg_records_oysternet(imdir, lab_path, tfrecord_dir, filestr, shared_size, encoding='jpeg', compression_type='')"
+    This function incrementally updates the filestr TFRecord shards in tfrecord_dir.
+    Every image/label pair is hashed and compared with the sources recorded in the manifest:
+    only new or changed pairs are encoded, into new shards, and shards containing a deleted or
+    changed pair are deleted (their unchanged pairs are encoded again).
+    The first update of shards written without sources rewrites them all
+    INPUTS:
+        * imdir [string]: directory of images (labels have the same name, in the labels folder)
+        * lab_path [string]: directory of labels
+        * tfrecord_dir [string]: path to directory where files will be written
+        * filestr [string]: shard file name prefix
+        * shared_size [int]: number of images per new shard
+    OPTIONAL INPUTS:
+        * encoding, compression_type: see get_seg_dataset_for_tfrecords_oysternet and write_seg_records_oysternet
+    GLOBAL INPUTS: SEED
+    OUTPUTS: None (files written to disk)
+    """
+    filenames = sorted(tf.io.gfile.glob(imdir+os.sep+'*.jpg'))
+    names = [f.split(os.sep)[-1] for f in filenames]
+    sources = dict(zip(names, hash_seg_sources(filenames)))
+
+    dropped, new_sources, next_shard = plan_update(read_manifest(tfrecord_dir), sources, filestr)
+    print("{} sources: {} to encode, {} shards to drop".format(len(sources), len(new_sources), len(dropped)))
+
+    if len(dropped)>0:
+        for f in dropped:
+            if os.path.isfile(tfrecord_dir+os.sep+f):
+                os.remove(tfrecord_dir+os.sep+f)
+        write_manifest(tfrecord_dir, [], remove=dropped)
+    if len(new_sources)==0:
+        return
+
+    np.random.RandomState(SEED).shuffle(new_sources)
+    dataset = get_seg_dataset_for_tfrecords_oysternet(imdir, lab_path, shared_size, encoding,
+                                                      filenames=[imdir+os.sep+name for name in new_sources])
+    write_seg_records_oysternet(dataset, tfrecord_dir, filestr, compression_type,
+                                sources=[(name, sources[name]) for name in new_sources], first_shard=next_shard)
 
 #-----------------------------------
 def _bytestring_feature(list_of_bytestrings):
@@ -508,12 +775,16 @@ def to_seg_tfrecord(img_bytes, label_bytes):
     "to_seg_tfrecord"
     This function creates a TFRecord example from an image byte string and a label feature
     INPUTS:
-        * img_bytes
-        * label_bytes
+        * img_bytes (jpeg bytestring, or uint8 image array stored as raw bytes)
+        * label_bytes (jpeg bytestring, or uint8 label array stored as raw bytes)
     OPTIONAL INPUTS: None
     GLOBAL INPUTS: None
     OUTPUTS: tf.train.Feature example
     """
+    if isinstance(img_bytes, np.ndarray):
+        img_bytes = img_bytes.tobytes()
+    if isinstance(label_bytes, np.ndarray):
+        label_bytes = label_bytes.tobytes()
     feature = {
       "image": _bytestring_feature([img_bytes]), # one image in the list
       "label": _bytestring_feature([label_bytes]), # one label image in the list
@@ -540,14 +811,14 @@ def read_seg_tfrecord_oysternet(example):
     # decode the TFRecord
     example = tf.io.parse_single_example(example, features)
 
-    image = tf.image.decode_jpeg(example['image'], channels=3)
+    image = decode_seg_bytes(example['image'], 3)
     image = tf.cast(image, tf.float32)/ 255.0
     image = tf.reshape(image, [TARGET_SIZE,TARGET_SIZE, 3])
 
     image = tf.image.adjust_contrast(image, 2)
     # image = tf.image.per_image_standardization(image)
 
-    label = tf.image.decode_jpeg(example['label'], channels=1)
+    label = decode_seg_bytes(example['label'], 1)
     label = tf.reshape(label, [TARGET_SIZE,TARGET_SIZE, 1])
     label = tf.cast(label, tf.float32)/ 255.0
     # label = tf.cast(label, tf.int32)
@@ -587,3 +858,1527 @@ def seg_file2tensor(f):
     # image = tf.cast(image, tf.uint8) #/ 255.0
 
     return image
+
+###############################################################
+### MANIFEST FUNCTIONS
+###############################################################
+"""
+Each tfrecord directory gets a 'manifest.json' sidecar, written by the tfrecord writers, listing
+for every shard file: the number of records, the byte offset of each record in the file,
+the per-class record counts (classification only) and the md5 hash of the file.
+Dataset sizes and step counts can then be read from the manifest
+instead of being inferred from file names or by reading all the data
+"""
+#-----------------------------------
+def _file_md5(filename):
+    """
+    "_file_md5(filename)"
+    compute the md5 hash of a file, reading it in chunks
+    INPUTS:
+        * filename [string]
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: hex digest [string]
+    """
+    md5 = hashlib.md5()
+    with tf.io.gfile.GFile(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1<<20), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+#-----------------------------------
+def _spawn_pool(num_workers):
+    """
+    "_spawn_pool(num_workers)"
+    start a pool of worker processes with the 'spawn' start method, for workers that run tensorflow
+    ops (tf.io.TFRecordWriter): tensorflow is not fork-safe. Spawned workers import the calling script
+    again, so scripts that start a pool keep their work under "if __name__ == '__main__':"
+    INPUTS:
+        * num_workers [int]
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: multiprocessing.Pool
+    """
+    return multiprocessing.get_context('spawn').Pool(num_workers)
+
+#-----------------------------------
+def write_examples(filename, examples, compression_type=''):
+    """
+    write_examples(filename, examples, compression_type='')
+    This function writes serialized tfrecord examples to a tfrecord file
+    and keeps track of the byte offset where each record starts
+    (each record is stored as an 8-byte length, a 4-byte crc, the data and another 4-byte crc)
+    INPUTS:
+        * filename [string]: tfrecord file to write
+        * examples [iterable]: serialized tf.train.Example bytestrings
+    OPTIONAL INPUTS:
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * offsets [list]: byte offset of each record in the file
+          (in the uncompressed record stream, if compression_type is set)
+    """
+    offsets = []
+    position = 0
+    with tf.io.TFRecordWriter(filename, options=compression_type or None) as out_file:
+        for example in examples:
+            out_file.write(example)
+            offsets.append(position)
+            position += len(example) + 16
+    return offsets
+
+#-----------------------------------
+def get_shard_info(filename, offsets, class_counts=None, compression_type='', sources=None):
+    """
+    get_shard_info(filename, offsets, class_counts=None, compression_type='', sources=None)
+    This function collates the manifest entry for one tfrecord shard
+    INPUTS:
+        * filename [string]: tfrecord file (already written)
+        * offsets [list]: byte offset of each record (from write_examples)
+    OPTIONAL INPUTS:
+        * class_counts [dict]: number of records (or objects) per integer class id
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}: byte offsets are not stored
+          for compressed files, because records cannot be seeked to
+        * sources [list]: (source file name, content hash) of each record, for incremental updates
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * shard [dict]
+    """
+    shard = {"file": filename.split(os.sep)[-1],
+             "num_records": len(offsets),
+             "offsets": None if compression_type else offsets,
+             "compression": compression_type,
+             "md5": _file_md5(filename)}
+    if class_counts is not None:
+        shard["class_counts"] = {str(k):int(v) for k,v in class_counts.items()}
+    if sources is not None:
+        shard["sources"] = [list(source) for source in sources]
+    return shard
+
+#-----------------------------------
+def write_manifest(tfrecord_dir, shards, CLASSES=None, remove=None):
+    """
+    write_manifest(tfrecord_dir, shards, CLASSES=None, remove=None)
+    This function writes (or updates) the manifest.json file in tfrecord_dir
+    Entries for shards already in an existing manifest are replaced (or removed),
+    and the dataset totals are recomputed
+    INPUTS:
+        * tfrecord_dir [string]: directory containing the tfrecord shards
+        * shards [list]: of dicts from get_shard_info
+    OPTIONAL INPUTS:
+        * CLASSES [list]: class names, in class id order
+        * remove [list]: file names of shards to remove from the manifest
+    GLOBAL INPUTS: TARGET_SIZE
+    OUTPUTS:
+        * manifest [dict] (also written to disk)
+    """
+    manifest = read_manifest(tfrecord_dir) or {}
+    all_shards = {s["file"]:s for s in manifest.get("shards", [])}
+    for s in shards:
+        all_shards[s["file"]] = s
+    for f in (remove or []):
+        all_shards.pop(f, None)
+    all_shards = [all_shards[k] for k in sorted(all_shards.keys())]
+
+    manifest["target_size"] = TARGET_SIZE
+    if CLASSES is not None:
+        manifest["classes"] = [c.decode() if isinstance(c, bytes) else str(c) for c in CLASSES]
+    manifest["num_records"] = int(np.sum([s["num_records"] for s in all_shards]))
+    class_counts = {}
+    for s in all_shards:
+        for k,v in s.get("class_counts", {}).items():
+            class_counts[k] = class_counts.get(k, 0) + v
+    if len(class_counts)>0:
+        manifest["class_counts"] = class_counts
+    manifest["shards"] = all_shards
+
+    with open(tfrecord_dir+os.sep+'manifest.json', 'w') as f:
+        json.dump(manifest, f)
+    print("Wrote manifest for {} records in {} shards".format(manifest["num_records"], len(all_shards)))
+    return manifest
+
+#-----------------------------------
+def read_manifest(tfrecord_dir):
+    """
+    read_manifest(tfrecord_dir)
+    This function reads the manifest.json file in tfrecord_dir, if there is one
+    INPUTS:
+        * tfrecord_dir [string]: directory containing the tfrecord shards
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * manifest [dict], or None if there is no manifest
+    """
+    manifest_file = tfrecord_dir+os.sep+'manifest.json'
+    if not os.path.isfile(manifest_file):
+        return None
+    with open(manifest_file) as f:
+        return json.load(f)
+
+#-----------------------------------
+def get_manifest_shards(filenames, manifest):
+    """
+    get_manifest_shards(filenames, manifest)
+    This function looks up the manifest entries for a list of tfrecord files
+    INPUTS:
+        * filenames [list]: tfrecord files
+        * manifest [dict]: from read_manifest
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * shards [list]: manifest entry of each file (None for files not in the manifest)
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    if manifest is None:
+        return [None for f in filenames]
+    lookup = {s["file"]:s for s in manifest["shards"]}
+    return [lookup.get(f.split(os.sep)[-1]) for f in filenames]
+
+#-----------------------------------
+def get_num_records(filenames, manifest=None):
+    """
+    get_num_records(filenames, manifest=None)
+    This function returns the exact number of records in a list of tfrecord files,
+    from the manifest. For files not in the manifest, the count is parsed from
+    file names ending in '-{count}.tfrec' (as written by the writers here),
+    or else assumed to be ims_per_shard
+    INPUTS:
+        * filenames [list]: tfrecord files
+    OPTIONAL INPUTS:
+        * manifest [dict]: from read_manifest
+    GLOBAL INPUTS: ims_per_shard
+    OUTPUTS:
+        * nb_images [int]
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    nb_images = 0
+    for f, shard in zip(filenames, get_manifest_shards(filenames, manifest)):
+        if shard is not None:
+            nb_images += shard["num_records"]
+            continue
+        try:
+            nb_images += int(f.split('-')[-1].split('.tfrec')[0])
+        except ValueError:
+            nb_images += ims_per_shard
+    return nb_images
+
+#-----------------------------------
+def read_record_at(filename, offset):
+    """
+    read_record_at(filename, offset)
+    This function reads the single serialized record that starts at a byte offset
+    in a tfrecord file (offsets are listed in the manifest), without reading the rest of the file.
+    The result can be passed to the same parsing functions as a tf.data.TFRecordDataset element
+    INPUTS:
+        * filename [string]: tfrecord file
+        * offset [int]: byte offset of the record
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * example [bytes]: serialized tf.train.Example
+    """
+    with tf.io.gfile.GFile(filename, 'rb') as f:
+        f.seek(offset)
+        length = struct.unpack('<Q', f.read(8))[0]
+        f.read(4) # crc of the length
+        return f.read(length)
+
+#-----------------------------------
+def get_record(tfrecord_dir, index, manifest=None):
+    """
+    get_record(tfrecord_dir, index, manifest=None)
+    This function provides random access to the record with a given index
+    (counting through the shards in manifest order).
+    Compressed shards have no byte offsets, so they are read sequentially up to the record
+    INPUTS:
+        * tfrecord_dir [string]: directory containing the tfrecord shards and manifest
+        * index [int]: record index in the whole dataset
+    OPTIONAL INPUTS:
+        * manifest [dict]: from read_manifest (read from tfrecord_dir if None)
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * example [bytes]: serialized tf.train.Example
+    """
+    if manifest is None:
+        manifest = read_manifest(tfrecord_dir)
+    for shard in manifest["shards"]:
+        if index < shard["num_records"]:
+            if shard.get("offsets") is None:
+                # compressed shard: no byte offsets, so read through the file up to the record
+                dataset = tf.data.TFRecordDataset(tfrecord_dir+os.sep+shard["file"], compression_type=shard.get("compression", ""))
+                return next(iter(dataset.skip(index).take(1))).numpy()
+            return read_record_at(tfrecord_dir+os.sep+shard["file"], shard["offsets"][index])
+        index -= shard["num_records"]
+    raise IndexError("record index out of range")
+
+#-----------------------------------
+def _sniff_compression(filename):
+    """
+    "_sniff_compression(filename)"
+    guess the compression of a tfrecord file from its first bytes
+    (gzip magic number, or a zlib header followed by a valid deflate stream)
+    INPUTS:
+        * filename [string]: tfrecord file
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: compression_type [string]: '', 'ZLIB' or 'GZIP'
+    """
+    with tf.io.gfile.GFile(filename, 'rb') as f:
+        head = f.read(1024)
+    if head[:2] == b'\x1f\x8b':
+        return 'GZIP'
+    if len(head) > 2 and head[0] == 0x78 and (head[0]*256 + head[1]) % 31 == 0:
+        try:
+            zlib.decompressobj().decompress(head)
+            return 'ZLIB'
+        except zlib.error:
+            pass
+    return ''
+
+#-----------------------------------
+def get_compression_type(filenames, manifest=None):
+    """
+    get_compression_type(filenames, manifest=None)
+    This function returns the record compression of a list of tfrecord files
+    (all files in a list are assumed to be written the same way), for tf.data.TFRecordDataset.
+    It is read from the manifest if the first file is listed in it, otherwise guessed from the file contents
+    INPUTS:
+        * filenames [list]: tfrecord files (or a glob pattern)
+    OPTIONAL INPUTS:
+        * manifest [dict]: from read_manifest (read from the directory of the first file if None)
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * compression_type [string]: '', 'ZLIB' or 'GZIP'
+    """
+    if isinstance(filenames, str):
+        filenames = tf.io.gfile.glob(filenames)
+    if len(filenames)==0:
+        return ''
+    if manifest is None:
+        manifest = read_manifest(os.path.dirname(filenames[0]) or '.')
+    shard = get_manifest_shards(filenames[:1], manifest)[0]
+    if shard is not None:
+        return shard.get("compression", "")
+    return _sniff_compression(filenames[0])
+
+###############################################################
+### NUMPY MEMMAP FUNCTIONS
+###############################################################
+"""
+The tfrecord shards of a dataset can be exported once to a pair of .npy files,
+{npy_prefix}_images.npy (N x TARGET_SIZE x TARGET_SIZE x 3, uint8) and
+{npy_prefix}_labels.npy (N x TARGET_SIZE x TARGET_SIZE x 1, uint8).
+Both arrays are opened memory-mapped, so batches are sliced straight out of the page cache,
+with random access, no decoding at start-up, and one copy in memory shared by all
+training processes on a machine
+"""
+#-----------------------------------
+def read_seg_tfrecord_uint8(examples):
+    """
+    "read_seg_tfrecord_uint8(examples)"
+    This function reads a batch of examples from a TFrecord file into 8-bit images and labels,
+    exactly as stored (no rescaling or class recoding)
+    INPUTS:
+        * 1d vector of TFRecord example objects
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: TARGET_SIZE
+    OUTPUTS:
+        * images [tensor array] (uint8)
+        * labels [tensor array] (uint8)
+    """
+    features = {
+        "image": tf.io.FixedLenFeature([], tf.string),  # tf.string = bytestring (not text string)
+        "label": tf.io.FixedLenFeature([], tf.string),   # shape [] means scalar
+    }
+    examples = tf.io.parse_example(examples, features)
+
+    images = tf.map_fn(lambda b: decode_seg_bytes(b, 3), examples['image'], fn_output_signature=tf.uint8)
+    labels = tf.map_fn(lambda b: decode_seg_bytes(b, 1), examples['label'], fn_output_signature=tf.uint8)
+    images = tf.reshape(images, [-1, TARGET_SIZE, TARGET_SIZE, 3])
+    labels = tf.reshape(labels, [-1, TARGET_SIZE, TARGET_SIZE, 1])
+    return images, labels
+
+#-----------------------------------
+def export_seg_npy(filenames, npy_prefix, batch_size=64):
+    """
+    "export_seg_npy(filenames, npy_prefix, batch_size=64)"
+    This function decodes every record in a list of tfrecord files, in order,
+    into memory-mapped uint8 image and label arrays saved as .npy files
+    INPUTS:
+        * filenames [list]: tfrecord files
+        * npy_prefix [string]: output path prefix ('_images.npy' and '_labels.npy' are appended)
+    OPTIONAL INPUTS:
+        * batch_size [int]: number of records decoded at once
+    GLOBAL INPUTS: TARGET_SIZE, AUTO
+    OUTPUTS:
+        * nb_images [int] (files written to disk)
+    """
+    compression_type = get_compression_type(filenames)
+    nb_images = 0
+    for _ in tf.data.TFRecordDataset(filenames, compression_type=compression_type): # count records, without decoding
+        nb_images += 1
+
+    images = np.lib.format.open_memmap(npy_prefix+'_images.npy', mode='w+', dtype=np.uint8,
+                                       shape=(nb_images, TARGET_SIZE, TARGET_SIZE, 3))
+    labels = np.lib.format.open_memmap(npy_prefix+'_labels.npy', mode='w+', dtype=np.uint8,
+                                       shape=(nb_images, TARGET_SIZE, TARGET_SIZE, 1))
+
+    dataset = tf.data.TFRecordDataset(filenames, compression_type=compression_type)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(read_seg_tfrecord_uint8, num_parallel_calls=AUTO)
+    dataset = dataset.prefetch(AUTO)
+
+    n = 0
+    for imgs, lbls in dataset:
+        images[n:n+len(imgs)] = imgs.numpy()
+        labels[n:n+len(lbls)] = lbls.numpy()
+        n += len(imgs)
+    images.flush()
+    labels.flush()
+    del images, labels
+    print("Wrote {} images and labels to {}".format(n, npy_prefix+'_*.npy'))
+    return n
+
+#-----------------------------------
+def standardize_seg_oysternet(image, label):
+    """
+    "standardize_seg_oysternet(image, label)"
+    This function applies the oysternet pre-processing of read_seg_tfrecord_oysternet
+    to an 8-bit image and label (or batch of images and labels)
+    INPUTS:
+        * image [tensor array] (uint8)
+        * label [tensor array] (uint8)
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * image [tensor array]
+        * label [tensor array]
+    """
+    image = tf.cast(image, tf.float32)/ 255.0
+    image = tf.image.adjust_contrast(image, 2)
+    label = tf.cast(label, tf.float32)/ 255.0
+    return image, label
+
+#-----------------------------------
+def get_seg_npy_dataset_oysternet(npy_prefix, shuffle=True, repeat=True):
+    """
+    "get_seg_npy_dataset_oysternet(npy_prefix, shuffle=True, repeat=True)"
+    This function defines a workflow for the model to read batches of images and labels
+    from .npy files written by export_seg_npy (an alternative to get_batched_dataset_oysternet).
+    Only record indices are shuffled and batched; each batch is then sliced from the memory-mapped arrays
+    INPUTS:
+        * npy_prefix [string]: path prefix used with export_seg_npy
+    OPTIONAL INPUTS:
+        * shuffle [bool]: shuffle the records every epoch
+        * repeat [bool]: repeat indefinitely (for model.fit with steps_per_epoch)
+    GLOBAL INPUTS: BATCH_SIZE, TARGET_SIZE, AUTO
+    OUTPUTS: tf.data.Dataset object
+    """
+    images = np.load(npy_prefix+'_images.npy', mmap_mode='r')
+    labels = np.load(npy_prefix+'_labels.npy', mmap_mode='r')
+
+    def get_batch(idx):
+        idx = np.sort(idx) # read the memmaps in file order
+        return images[idx], labels[idx]
+
+    def read_batch(idx):
+        imgs, lbls = tf.numpy_function(get_batch, [idx], [tf.uint8, tf.uint8])
+        imgs = tf.reshape(imgs, [-1, TARGET_SIZE, TARGET_SIZE, 3])
+        lbls = tf.reshape(lbls, [-1, TARGET_SIZE, TARGET_SIZE, 1])
+        return standardize_seg_oysternet(imgs, lbls)
+
+    dataset = tf.data.Dataset.range(len(images))
+    if shuffle:
+        dataset = dataset.shuffle(len(images), reshuffle_each_iteration=True)
+    if repeat:
+        dataset = dataset.repeat()
+    dataset = dataset.batch(BATCH_SIZE, drop_remainder=True)
+    dataset = dataset.map(read_batch, num_parallel_calls=AUTO)
+    dataset = dataset.prefetch(AUTO)
+    return dataset
+
+###############################################################
+### ZIP ARCHIVE FUNCTIONS
+###############################################################
+"""
+Datasets can be read straight from the zip archives fetched by download_data.py, without extracting them.
+The zip central directory is indexed once per archive (get_zip_index); each member is then read
+directly at its data offset: stored (uncompressed) members are sliced from a memory map of the archive,
+deflated members are inflated in memory. Members are read in parallel by tf.data
+"""
+_ZIP_INDEX = {}
+_ZIP_MMAP = {}
+
+#-----------------------------------
+def get_record_dataset(filenames, zip_path=None, cycle_length=None, shuffle=True):
+    """
+    get_record_dataset(filenames, zip_path=None, cycle_length=None, shuffle=True)
+    This function reads the serialized examples of a list of tfrecord files, cycle_length files at a time
+    (compressed files are detected with get_compression_type).
+    If zip_path is given, filenames are tfrecord members of that zip archive, which are read
+    without extracting it (see get_zip_record_dataset)
+    INPUTS:
+        * filenames [list]: tfrecord files, or zip member names
+    OPTIONAL INPUTS:
+        * zip_path [string]: zip archive containing the tfrecords
+        * cycle_length [int]: number of files read at once (None = CYCLE_LENGTH)
+        * shuffle [bool]: shuffle the file order (as tf.data.Dataset.list_files does)
+    GLOBAL INPUTS: AUTO, CYCLE_LENGTH
+    OUTPUTS: tf.data.Dataset object (of serialized examples)
+    """
+    if cycle_length is None:
+        cycle_length = CYCLE_LENGTH
+    if zip_path is not None:
+        return get_zip_record_dataset(zip_path, filenames, cycle_length, shuffle)
+    compression_type = get_compression_type(filenames)
+    if shuffle:
+        dataset = tf.data.Dataset.list_files(filenames)
+    else:
+        dataset = tf.data.Dataset.from_tensor_slices(filenames)
+    dataset = dataset.interleave(lambda f: tf.data.TFRecordDataset(f, compression_type=compression_type),
+                                 cycle_length=cycle_length, num_parallel_calls=AUTO)
+    return dataset
+
+#-----------------------------------
+def get_zip_index(zip_path):
+    """
+    get_zip_index(zip_path)
+    This function indexes the members of a zip archive from its central directory,
+    recording where the data of each member starts (from its local file header).
+    The index is computed once per archive and then reused
+    INPUTS:
+        * zip_path [string]: zip archive
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * index [dict]: member name to dict of offset, size, compress_size, compress_type
+    """
+    if zip_path in _ZIP_INDEX:
+        return _ZIP_INDEX[zip_path]
+    index = {}
+    with open(zip_path, 'rb') as f, zipfile.ZipFile(f) as z:
+        for info in z.infolist():
+            if info.is_dir():
+                continue
+            f.seek(info.header_offset)
+            header = f.read(30) # fixed-size part of the local file header
+            name_len, extra_len = struct.unpack('<HH', header[26:30])
+            index[info.filename] = {"offset": info.header_offset + 30 + name_len + extra_len,
+                                    "size": info.file_size,
+                                    "compress_size": info.compress_size,
+                                    "compress_type": info.compress_type}
+    _ZIP_INDEX[zip_path] = index
+    return index
+
+#-----------------------------------
+def list_zip_members(zip_path, pattern='*'):
+    """
+    list_zip_members(zip_path, pattern='*')
+    This function lists the members of a zip archive whose names match a glob pattern,
+    e.g. '*400/*.tfrec' (the zip equivalent of tf.io.gfile.glob)
+    INPUTS:
+        * zip_path [string]: zip archive
+    OPTIONAL INPUTS:
+        * pattern [string]: glob pattern matched against member names
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * members [list]: sorted member names
+    """
+    return sorted([name for name in get_zip_index(zip_path) if fnmatch.fnmatch(name, pattern)])
+
+#-----------------------------------
+def read_zip_member(zip_path, name):
+    """
+    read_zip_member(zip_path, name)
+    This function returns the contents of one member of a zip archive.
+    Stored members are returned as a zero-copy memoryview of a memory map of the archive,
+    deflated members are inflated from the same memory map
+    INPUTS:
+        * zip_path [string]: zip archive
+        * name [string]: member name
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * data [memoryview or bytes]
+    """
+    member = get_zip_index(zip_path)[name]
+    if zip_path not in _ZIP_MMAP:
+        with open(zip_path, 'rb') as f:
+            _ZIP_MMAP[zip_path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    data = memoryview(_ZIP_MMAP[zip_path])[member["offset"]:member["offset"]+member["compress_size"]]
+    if member["compress_type"] == zipfile.ZIP_STORED:
+        return data
+    if member["compress_type"] == zipfile.ZIP_DEFLATED:
+        return zlib.decompress(data, -15) # raw deflate stream, no zlib header
+    with zipfile.ZipFile(zip_path) as z: # other compression methods (rarely used)
+        return z.read(name)
+
+#-----------------------------------
+def _iterate_tfrecords(data):
+    """
+    "_iterate_tfrecords(data)"
+    split the contents of an (uncompressed) tfrecord file into serialized records
+    (each record is stored as an 8-byte length, a 4-byte crc, the data and another 4-byte crc;
+    crcs are not checked here, see _read_verified_records)
+    INPUTS:
+        * data [bytes or memoryview]: tfrecord file contents
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: generator of serialized records [bytes]
+    """
+    position = 0
+    while position < len(data):
+        length = struct.unpack_from('<Q', data, position)[0]
+        yield bytes(data[position+12:position+12+length])
+        position += length + 16
+
+#-----------------------------------
+def get_zip_record_dataset(zip_path, members, cycle_length=16, shuffle=False):
+    """
+    get_zip_record_dataset(zip_path, members, cycle_length=16, shuffle=False)
+    This function returns the serialized records of tfrecord files stored in a zip archive,
+    reading cycle_length members in parallel. It is the zip equivalent of
+    interleaving tf.data.TFRecordDataset over a list of extracted files
+    INPUTS:
+        * zip_path [string]: zip archive
+        * members [list]: tfrecord member names (e.g. from list_zip_members)
+    OPTIONAL INPUTS:
+        * cycle_length [int]: number of members read at once
+        * shuffle [bool]: shuffle the member order
+    GLOBAL INPUTS: AUTO
+    OUTPUTS: tf.data.Dataset object (of serialized examples)
+    """
+    get_zip_index(zip_path)
+
+    def records(name):
+        yield from _iterate_tfrecords(read_zip_member(zip_path, name.decode()))
+
+    dataset = tf.data.Dataset.from_tensor_slices(members)
+    if shuffle:
+        dataset = dataset.shuffle(len(members))
+    dataset = dataset.interleave(lambda name: tf.data.Dataset.from_generator(records, args=(name,),
+                                     output_signature=tf.TensorSpec([], tf.string)),
+                                 cycle_length=cycle_length, num_parallel_calls=AUTO)
+    return dataset
+
+#-----------------------------------
+def get_zip_file_dataset(zip_path, members):
+    """
+    get_zip_file_dataset(zip_path, members)
+    This function returns the name and contents of members of a zip archive (e.g. jpeg images),
+    read in parallel. It is the zip equivalent of mapping tf.io.read_file over a list of extracted files
+    INPUTS:
+        * zip_path [string]: zip archive
+        * members [list]: member names (e.g. from list_zip_members)
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: AUTO
+    OUTPUTS: tf.data.Dataset object (of (name, bytestring) pairs)
+    """
+    get_zip_index(zip_path)
+
+    def read_member(name):
+        return np.array(bytes(read_zip_member(zip_path, name.decode())), dtype=object)
+
+    dataset = tf.data.Dataset.from_tensor_slices(members)
+    dataset = dataset.map(lambda name: (name, tf.reshape(tf.numpy_function(read_member, [name], tf.string), [])),
+                          num_parallel_calls=AUTO)
+    return dataset
+
+###############################################################
+### DATA SERVICE FUNCTIONS
+###############################################################
+
+#-----------------------------------
+def distribute_dataset(dataset, service, job_name=None):
+    """
+    distribute_dataset(dataset, service, job_name=None)
+    This function hands a dataset to a tf.data service (started with data_service.py):
+    the dataset graph is sent to the dispatcher, every worker runs its own copy of the
+    pipeline (decoding, augmentation, label encoding, cache), and this process only
+    receives the finished batches. Files are read by the workers, so workers on other
+    machines need the tfrecords at the same paths
+    INPUTS:
+        * dataset [tf.data.Dataset]
+        * service [string]: dispatcher address, e.g. 'localhost:5050' or 'grpc://cpubox:5050'
+    OPTIONAL INPUTS:
+        * job_name [string]: trainers using the same job_name share (split) one stream of batches
+    GLOBAL INPUTS: AUTO
+    OUTPUTS: tf.data.Dataset object
+    """
+    if not service.startswith('grpc://'):
+        service = 'grpc://'+service
+    dataset = dataset.apply(tf.data.experimental.service.distribute(processing_mode="parallel_epochs",
+                                                                    service=service, job_name=job_name))
+    return dataset.prefetch(AUTO)
+
+###############################################################
+### SYNTHETIC DATA FUNCTIONS
+###############################################################
+
+#-----------------------------------
+def get_shard_sizes(num_images, num_shards):
+    """
+    get_shard_sizes(num_images, num_shards)
+    This function splits a number of images as evenly as possible into shards
+    INPUTS:
+        * num_images [int]
+        * num_shards [int]
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * sizes [list]: number of images in each shard
+    """
+    return [num_images//num_shards + (1 if k < num_images % num_shards else 0) for k in range(num_shards)]
+
+#-----------------------------------
+def _synthetic_field(rng, height, width, cells=8):
+    """
+    "_synthetic_field(rng, height, width, cells=8)"
+    make a smooth random field in [0,1] (a coarse random grid, upsampled), so that
+    synthetic imagery compresses roughly like real imagery rather than like noise
+    INPUTS:
+        * rng [np.random.Generator]
+        * height, width [int]
+    OPTIONAL INPUTS:
+        * cells [int]: grid cells along each side
+    GLOBAL INPUTS: None
+    OUTPUTS: field [ndarray, height x width]
+    """
+    field = np.kron(rng.random((cells, cells)), np.ones((-(-height//cells), -(-width//cells))))
+    return field[:height,:width]
+
+#-----------------------------------
+def _encode_synthetic(image, encoding='jpeg'):
+    """
+    "_encode_synthetic(image, encoding='jpeg')"
+    encode a uint8 image as a jpeg bytestring (with PIL, which is safe to use in
+    worker processes), or return it unchanged for raw uint8 records
+    INPUTS:
+        * image [ndarray]: uint8, height x width x channels
+    OPTIONAL INPUTS:
+        * encoding = {'jpeg' | 'raw'}
+    GLOBAL INPUTS: None
+    OUTPUTS: jpeg bytestring, or uint8 ndarray
+    """
+    if encoding == 'raw':
+        return image
+    buffer = io.BytesIO()
+    PIL.Image.fromarray(np.squeeze(image)).save(buffer, format='JPEG', quality=95, optimize=True, subsampling=0)
+    return buffer.getvalue()
+
+#-----------------------------------
+def _write_synthetic_shards(write_shard, tasks, tfrecord_dir, num_workers=None, CLASSES=None):
+    """
+    "_write_synthetic_shards(write_shard, tasks, tfrecord_dir, num_workers=None, CLASSES=None)"
+    run write_shard over a list of argument tuples with a pool of worker processes,
+    then write the manifest for all the shards. The workers are spawned (see _spawn_pool),
+    so write_shard can write with tf.io.TFRecordWriter (through write_examples)
+    INPUTS:
+        * write_shard [function]: returns a manifest entry (see get_shard_info)
+        * tasks [list]: argument tuples, one per shard
+        * tfrecord_dir [string]
+    OPTIONAL INPUTS:
+        * num_workers [int]: number of writer processes (None = number of cpus, 1 = no pool)
+        * CLASSES [list]: class names, for the manifest
+    GLOBAL INPUTS: None
+    OUTPUTS: None (files written to disk)
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    written = []
+    def report(shard):
+        written.append(shard)
+        print("Wrote file {} containing {} records".format(tfrecord_dir+os.sep+shard["file"], shard["num_records"]))
+
+    if num_workers == 1:
+        for task in tasks:
+            report(write_shard(*task))
+    else:
+        with _spawn_pool(num_workers) as pool:
+            for result in [pool.apply_async(write_shard, task) for task in tasks]:
+                report(result.get())
+
+    write_manifest(tfrecord_dir, written, CLASSES)
+
+#-----------------------------------
+def _write_synthetic_segmentation_shard(filename, num_records, size, label_values, seed, encoding='jpeg', compression_type=''):
+    """
+    "_write_synthetic_segmentation_shard(filename, num_records, size, label_values, seed, encoding='jpeg', compression_type='')"
+    write one shard of synthetic (image, label) records (runs in a worker process)
+    Label regions come from a smooth random field, and each label value gets its own
+    image colour, so a model can learn the segmentation
+    INPUTS:
+        * filename [string]: shard file to write
+        * num_records [int]
+        * size [int]: image height and width
+        * label_values [list]: greyscale values used in the label images
+        * seed [int]: random seed for this shard
+    OPTIONAL INPUTS:
+        * encoding = {'jpeg' | 'raw'}
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * shard [dict]: manifest entry for the shard (see get_shard_info)
+    """
+    rng = np.random.default_rng(seed)
+    label_values = np.array(label_values, dtype=np.uint8)
+    colours = np.random.default_rng(len(label_values)).integers(32, 224, (len(label_values), 3))
+
+    def examples():
+        for k in range(num_records):
+            classes = np.minimum((_synthetic_field(rng, size, size)*len(label_values)).astype(int), len(label_values)-1)
+            image = colours[classes] + rng.normal(0, 8, (size, size, 3))
+            image = np.clip(image, 0, 255).astype(np.uint8)
+            label = label_values[classes][:,:,np.newaxis]
+            yield to_seg_tfrecord(_encode_synthetic(image, encoding), _encode_synthetic(label, encoding)).SerializeToString()
+
+    offsets = write_examples(filename, examples(), compression_type)
+    return get_shard_info(filename, offsets, compression_type=compression_type)
+
+#-----------------------------------
+def write_synthetic_segmentation_records(tfrecord_dir, num_images, num_shards, size=TARGET_SIZE, label_values=(0,255), encoding='jpeg', num_workers=None, compression_type='', seed=SEED):
+    """
+    write_synthetic_segmentation_records(tfrecord_dir, num_images, num_shards, size=TARGET_SIZE, label_values=(0,255), encoding='jpeg', num_workers=None, compression_type='', seed=SEED)
+    This function writes synthetic TFRecord shards with the same schema as the real
+    segmentation data ("image" and "label" bytestrings), and a manifest.json,
+    for load and scaling tests of the input pipelines and models.
+    Shards are generated in parallel by a pool of worker processes
+    INPUTS:
+        * tfrecord_dir [string]: path to directory where files will be written
+        * num_images [int]: total number of records
+        * num_shards [int]: number of shard files
+    OPTIONAL INPUTS:
+        * size [int]: image height and width (must be TARGET_SIZE for the readers to decode raw records)
+        * label_values [list]: greyscale label values, e.g. (0,255) for oysternet or (63,128,191,255) for obx
+        * encoding = {'jpeg' | 'raw'}
+        * num_workers [int]: number of writer processes (None = number of cpus, 1 = no pool)
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}
+        * seed [int]: random seed (shard k uses seed+k)
+    GLOBAL INPUTS: TARGET_SIZE, SEED
+    OUTPUTS: None (files written to disk)
+    """
+    tasks = [(tfrecord_dir+os.sep+"synthetic" + "{:02d}-{}.tfrec".format(shard, shard_size),
+              shard_size, size, label_values, seed+shard, encoding, compression_type)
+             for shard, shard_size in enumerate(get_shard_sizes(num_images, num_shards))]
+    _write_synthetic_shards(_write_synthetic_segmentation_shard, tasks, tfrecord_dir, num_workers)
+
+###############################################################
+### BENCHMARK FUNCTIONS
+###############################################################
+
+#-----------------------------------
+def time_dataset(dataset, num_elements=100, warmup=5, batched=True, step=None):
+    """
+    time_dataset(dataset, num_elements=100, warmup=5, batched=True, step=None)
+    This function iterates over a dataset, with no model attached (unless step is given), and times it:
+    the latency to the first element (pipeline start-up and first file reads),
+    then the throughput and the latency of each element over num_elements elements
+    INPUTS:
+        * dataset [tf.data.Dataset]
+    OPTIONAL INPUTS:
+        * num_elements [int]: number of elements timed, after the warmup
+        * warmup [int]: number of elements read, and not timed, first
+        * batched [bool]: elements are batches (False = each element is one image or record)
+        * step [function]: called on each element and timed with it, e.g. lambda batch: model.train_on_batch(*batch)
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * timings [dict]: first_element_s, elements, images, seconds, images_per_sec,
+          element_ms_p50, element_ms_p95 (over fewer elements if the dataset ends first)
+    """
+    iterator = iter(dataset)
+    start = time.perf_counter()
+    first_element_s = None
+    latencies = []
+    images = 0
+    try:
+        for k in range(warmup+num_elements):
+            t = time.perf_counter()
+            element = next(iterator)
+            if step is not None:
+                step(element)
+            if first_element_s is None:
+                first_element_s = time.perf_counter()-start
+            if k >= warmup:
+                latencies.append(time.perf_counter()-t)
+                images += int(tf.nest.flatten(element)[0].shape[0]) if batched else 1
+    except StopIteration:
+        pass
+
+    seconds = float(np.sum(latencies))
+    return {"first_element_s": first_element_s,
+            "elements": len(latencies),
+            "images": images,
+            "seconds": seconds,
+            "images_per_sec": images/seconds if seconds>0 else None,
+            "element_ms_p50": float(np.percentile(latencies, 50)*1000) if len(latencies)>0 else None,
+            "element_ms_p95": float(np.percentile(latencies, 95)*1000) if len(latencies)>0 else None}
+
+#-----------------------------------
+def benchmark_pipelines(pipelines, grid=None, json_file=None, num_elements=100, warmup=5):
+    """
+    benchmark_pipelines(pipelines, grid=None, json_file=None, num_elements=100, warmup=5)
+    This function times each pipeline (with time_dataset) for every combination of the
+    input pipeline settings in grid. The settings are the module globals read by the
+    dataset builders (e.g. CYCLE_LENGTH, MAP_PARALLELISM, BATCH_SIZE); each combination is
+    set before the pipelines are built, and the original values are restored at the end.
+    A training run is input-bound if model.fit reaches about the images_per_sec of its pipeline
+    INPUTS:
+        * pipelines [list]: of (name, build, batched) or (name, build, batched, step) tuples;
+          build() returns a tf.data.Dataset (for step, see time_dataset)
+    OPTIONAL INPUTS:
+        * grid [dict]: global setting name to list of values (None = current settings only)
+        * json_file [string]: file to write the results to, as json
+        * num_elements, warmup: see time_dataset
+    GLOBAL INPUTS: the settings in grid, EXECUTION_PROFILE
+    OUTPUTS:
+        * results [dict]: machine, tensorflow version and execution profile, and one entry per (pipeline, settings) run
+    """
+    grid = grid or {}
+    names = sorted(grid.keys())
+    saved = {k:globals()[k] for k in names}
+    runs = []
+    try:
+        for values in itertools.product(*[grid[k] for k in names]):
+            settings = dict(zip(names, values))
+            globals().update(settings)
+            for name, build, batched, *step in pipelines:
+                run = dict(pipeline=name, settings=settings, **time_dataset(build(), num_elements, warmup, batched, *step))
+                runs.append(run)
+                print("{} {}: {} img/s, first element {} s, p50 {} ms, p95 {} ms".format(name, settings,
+                      *[None if run[k] is None else round(run[k], 2) for k in
+                        ["images_per_sec", "first_element_s", "element_ms_p50", "element_ms_p95"]]))
+    finally:
+        globals().update(saved)
+
+    results = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+               "host": platform.node(),
+               "cpus": os.cpu_count(),
+               "tensorflow": tf.__version__,
+               "profile": EXECUTION_PROFILE,
+               "runs": runs}
+    if json_file is not None:
+        with open(json_file, 'w') as f:
+            json.dump(results, f, indent=2)
+        print("Wrote {} benchmark runs to {}".format(len(runs), json_file))
+    return results
+
+#-----------------------------------
+def compare_benchmarks(old_json, new_json, tolerance=0.1):
+    """
+    compare_benchmarks(old_json, new_json, tolerance=0.1)
+    This function compares two benchmark_pipelines json files, matching runs by pipeline
+    name and settings, and reports the runs whose throughput dropped by more than tolerance
+    INPUTS:
+        * old_json [string]: baseline results file
+        * new_json [string]: new results file
+    OPTIONAL INPUTS:
+        * tolerance [float]: fractional drop in images_per_sec reported as a regression
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * regressions [list]: of (pipeline, settings, old images_per_sec, new images_per_sec)
+    """
+    def load(json_file):
+        with open(json_file) as f:
+            runs = json.load(f)["runs"]
+        return {(r["pipeline"], json.dumps(r["settings"], sort_keys=True)):r["images_per_sec"] for r in runs}
+
+    old, new = load(old_json), load(new_json)
+    regressions = []
+    for key in sorted(set(old) & set(new)):
+        if old[key] and new[key] is not None and new[key] < (1-tolerance)*old[key]:
+            regressions.append((key[0], json.loads(key[1]), old[key], new[key]))
+            print("REGRESSION {} {}: {:.1f} -> {:.1f} img/s".format(key[0], key[1], old[key], new[key]))
+    print("{} of {} matching runs regressed".format(len(regressions), len(set(old) & set(new))))
+    return regressions
+
+#-----------------------------------
+def compare_profiles(json_files):
+    """
+    compare_profiles(json_files)
+    This function compares benchmark_pipelines json files written under different execution
+    profiles (see benchmark_profiles.py), matching runs by pipeline name and settings, and
+    prints the throughput of each run under each profile, relative to the first file
+    INPUTS:
+        * json_files [list]: results files, the first one is the reference
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * table [dict]: (pipeline, settings) to list of images_per_sec, one per file
+    """
+    profiles, tables = [], []
+    for json_file in json_files:
+        with open(json_file) as f:
+            results = json.load(f)
+        profiles.append(results.get("profile"))
+        tables.append({(r["pipeline"], json.dumps(r["settings"], sort_keys=True)):r["images_per_sec"] for r in results["runs"]})
+
+    table = {}
+    for key in sorted(set.intersection(*[set(t) for t in tables])):
+        table[key] = [t[key] for t in tables]
+        print("{} {}: ".format(key[0], key[1]) + ", ".join(
+              "{} {:.1f} img/s ({:.2f}x)".format(profile, rate, rate/table[key][0]) if rate and table[key][0]
+              else "{} {}".format(profile, rate) for profile, rate in zip(profiles, table[key])))
+    return table
+
+###############################################################
+### RECORD VALIDATION FUNCTIONS
+###############################################################
+
+#-----------------------------------
+def _read_shard_records(filename, compression_type=''):
+    """
+    "_read_shard_records(filename, compression_type='')"
+    read all the serialized records of a tfrecord file in python (no tensorflow ops,
+    so this is safe in worker processes), decompressing the file first if needed
+    INPUTS:
+        * filename [string]: tfrecord file
+    OPTIONAL INPUTS:
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}
+    GLOBAL INPUTS: None
+    OUTPUTS: list of serialized records [bytes]
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if compression_type == 'GZIP':
+        data = gzip.decompress(data)
+    elif compression_type == 'ZLIB':
+        data = zlib.decompress(data)
+    return list(_iterate_tfrecords(data))
+
+#-----------------------------------
+def _masked_crc32c(data):
+    """
+    "_masked_crc32c(data)"
+    the masked crc32c checksum that tfrecord files store for each record length and record
+    INPUTS:
+        * data [bytes]
+        OPTIONAL INPUTS:
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}
+IONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: checksum [int]
+    """
+    import google_crc32c # only needed to validate records (conda install google-crc32c, see mlmondays.yml)
+    crc = google_crc32c.value(data)
+    return (((crc >> 15) | (crc << 17)) + 0xA282EAD8) & 0xFFFFFFFF
+
+#-----------------------------------
+def _read_verified_records(filename, compression_type=''):
+    """
+    "_read_verified_records(filename, compression_type='')"
+    read all the serialized records of a tfrecord file in python, checking the record bounds and both
+    checksums of every record. A record whose data checksum does not match is a bad record; a length
+    checksum that does not match, or a truncated record, leaves the rest of the file unreadable (a bad file)
+    INPUTS:
+        * filename [string]: tfrecord file
+    OPTIONAL INPUTS:
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * records [list]: serialized records [bytes] up to any file problem
+        * bad [list]: (index, problem) of the records with a bad data checksum
+        * file_problem [string]: why the file could not be read to the end (None if it was)
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if compression_type == 'GZIP':
+        data = gzip.decompress(data)
+    elif compression_type == 'ZLIB':
+        data = zlib.decompress(data)
+    records, bad = [], []
+    position = 0
+    while position < len(data):
+        if position+12 > len(data):
+            return records, bad, "truncated record header at byte {}".format(position)
+        length = struct.unpack_from('<Q', data, position)[0]
+        if struct.unpack_from('<I', data, position+8)[0] != _masked_crc32c(data[position:position+8]):
+            return records, bad, "length checksum does not match at byte {}".format(position)
+        if position+16+length > len(data):
+            return records, bad, "truncated record at byte {}".format(position)
+        record = data[position+12:position+12+length]
+        if struct.unpack_from('<I', data, position+12+length)[0] != _masked_crc32c(record):
+            bad.append((len(records), "data checksum does not match"))
+        records.append(record)
+        position += length + 16
+    return records, bad, None
+
+#-----------------------------------
+def _open_image(bits):
+    """
+    "_open_image(bits)"
+    decode an image bytestring with PIL (raises an exception if it does not decode)
+    INPUTS:
+        * bits [bytes]: encoded image
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: PIL.Image
+    """
+    image = PIL.Image.open(io.BytesIO(bits))
+    image.load()
+    return image
+
+#-----------------------------------
+def _record_class_ids(record):
+    """
+    "_record_class_ids(record)"
+    get the integer class ids of a serialized example ("class", or "objects/label" for object detection)
+    INPUTS:
+        * record [bytes]: serialized tf.train.Example
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: list of class ids [int]
+    """
+    feature = tf.train.Example.FromString(record).features.feature
+    for key in ["class", "objects/label"]:
+        if key in feature:
+            return list(feature[key].int64_list.value)
+    return []
+
+#-----------------------------------
+def _validate_shard(filename, check, check_args=(), quarantine_dir='.', compression_type='', shard=None, rewrite=False):
+    """
+    "_validate_shard(filename, check, check_args=(), quarantine_dir='.', compression_type='', shard=None, rewrite=False)"
+    check every record of one tfrecord file (runs in a spawned worker process, see _spawn_pool).
+    The record framing (bounds and checksums, see _read_verified_records) is checked before check runs.
+    Bad records are written to a shard of the same name in quarantine_dir and, if rewrite, the file is
+    rewritten with only the good records (a bad file is also copied to quarantine_dir as <name>.damaged,
+    and keeps the good records read before the damage)
+    INPUTS:
+        * filename [string]: tfrecord file
+        * check [function]: check(record, *check_args) returns None, or a description of the problem
+    OPTIONAL INPUTS:
+        * check_args [tuple]: extra arguments for check
+        * quarantine_dir [string]: directory for the quarantine shards
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}
+        * shard [dict]: manifest entry of the file (its sources and class counts are kept up to date)
+        * rewrite [bool]: remove the bad records from the file
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * result [dict]: file, num_records, bad (list of (index, problem)), file_problem (None, or why
+          the file could not be read to the end), shard (new manifest entry, if rewritten)
+    """
+    try:
+        records, bad, file_problem = _read_verified_records(filename, compression_type)
+    except Exception as e:
+        return {"file": filename, "num_records": 0, "bad": [], "file_problem": "does not read: {}".format(e), "shard": None}
+
+    crc_ids = set(i for i, problem in bad)
+    for i, record in enumerate(records):
+        if i in crc_ids:
+            continue
+        problem = check(record, *check_args)
+        if problem is not None:
+            bad.append((i, problem))
+    bad.sort()
+    result = {"file": filename, "num_records": len(records), "bad": bad, "file_problem": file_problem, "shard": None}
+    if len(bad)==0 and file_problem is None:
+        return result
+
+    bad_ids = set(i for i, problem in bad)
+    if len(bad_ids)>0:
+        write_examples(quarantine_dir+os.sep+filename.split(os.sep)[-1], [records[i] for i in sorted(bad_ids)])
+    if file_problem is not None and rewrite:
+        # keep the damaged file, the records after the damage are lost from the rewritten file
+        shutil.copyfile(filename, quarantine_dir+os.sep+filename.split(os.sep)[-1]+'.damaged')
+    if rewrite:
+        good = [record for i, record in enumerate(records) if i not in bad_ids]
+        offsets = write_examples(filename+'.tmp', good, compression_type)
+        os.replace(filename+'.tmp', filename)
+        class_counts, sources = None, None
+        if shard is not None and "class_counts" in shard:
+            class_counts = {}
+            for record in good:
+                for k in _record_class_ids(record):
+                    class_counts[k] = class_counts.get(k, 0) + 1
+        if shard is not None and "sources" in shard:
+            sources = [source for i, source in enumerate(shard["sources"][:len(records)]) if i not in bad_ids]
+        result["shard"] = get_shard_info(filename, offsets, class_counts, compression_type, sources)
+    return result
+
+#-----------------------------------
+def validate_records(filenames, check, check_args=(), quarantine_dir=None, rewrite=False, num_workers=None):
+    """
+    validate_records(filenames, check, check_args=(), quarantine_dir=None, rewrite=False, num_workers=None)
+    This function checks every record of a list of tfrecord files, with a pool of worker processes
+    (one file per task). Bad records are copied to quarantine shards (same file names, in quarantine_dir)
+    and listed in quarantine_dir/report.json. With rewrite=True the bad records are also removed from
+    the original files and the manifest is updated, so training needs no error-catching wrapper
+    (file names are kept, so a record count in a file name is only a hint after a rewrite; the manifest is exact)
+    INPUTS:
+        * filenames [list]: tfrecord files (in the same directory)
+        * check [function]: check(record, *check_args) returns None, or a description of the problem
+    OPTIONAL INPUTS:
+        * check_args [tuple]: extra arguments for check
+        * quarantine_dir [string]: directory for quarantine shards and report (None = <tfrecord dir>/quarantine)
+        * rewrite [bool]: remove the bad records from the original files
+        * num_workers [int]: number of worker processes (None = number of cpus, 1 = no pool)
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * report [dict]: also written to quarantine_dir/report.json
+    """
+    tfrecord_dir = os.path.dirname(filenames[0]) or '.'
+    if quarantine_dir is None:
+        quarantine_dir = tfrecord_dir+os.sep+'quarantine'
+    os.makedirs(quarantine_dir, exist_ok=True)
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    manifest = read_manifest(tfrecord_dir)
+    compression_type = get_compression_type(filenames, manifest)
+    tasks = [(f, check, check_args, quarantine_dir, compression_type, shard, rewrite)
+             for f, shard in zip(filenames, get_manifest_shards(filenames, manifest))]
+
+    results = []
+    def report_shard(result):
+        results.append(result)
+        if len(result["bad"])>0:
+            print("{}: {} of {} records bad".format(result["file"], len(result["bad"]), result["num_records"]))
+        if result["file_problem"] is not None:
+            print("{}: bad file, {}".format(result["file"], result["file_problem"]))
+
+    if num_workers == 1:
+        for task in tasks:
+            report_shard(_validate_shard(*task))
+    else:
+        with _spawn_pool(num_workers) as pool:
+            for result in [pool.apply_async(_validate_shard, task) for task in tasks]:
+                report_shard(result.get())
+
+    report = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "num_files": len(results),
+              "num_records": int(np.sum([r["num_records"] for r in results])),
+              "num_bad": int(np.sum([len(r["bad"]) for r in results])),
+              "rewritten": rewrite,
+              "bad": {r["file"].split(os.sep)[-1]: [{"index": i, "problem": problem} for i, problem in r["bad"]]
+                      for r in results if len(r["bad"])>0},
+              "bad_files": {r["file"].split(os.sep)[-1]: r["file_problem"] for r in results if r["file_problem"] is not None}}
+    with open(quarantine_dir+os.sep+'report.json', 'w') as f:
+        json.dump(report, f, indent=2)
+    print("{} bad records out of {} in {} files, {} bad files (report in {})".format(report["num_bad"], report["num_records"],
+          report["num_files"], len(report["bad_files"]), quarantine_dir+os.sep+'report.json'))
+
+    if rewrite and manifest is not None:
+        write_manifest(tfrecord_dir, [r["shard"] for r in results if r["shard"] is not None])
+    return report
+
+#-----------------------------------
+def check_segmentation_record(record, label_values=None, tolerance=10):
+    """
+    check_segmentation_record(record, label_values=None, tolerance=10)
+    This function checks one serialized segmentation example: it parses, the "image" and
+    "label" decode (jpeg, or raw uint8 pixels) to TARGET_SIZE x TARGET_SIZE, and every label
+    pixel is within tolerance (for jpeg artifacts) of one of the valid label values
+    INPUTS:
+        * record [bytes]: serialized tf.train.Example
+    OPTIONAL INPUTS:
+        * label_values [list]: valid greyscale label values, e.g. (0,255) or (63,128,191,255) (None = not checked)
+        * tolerance [int]: largest allowed difference to the nearest valid value
+    GLOBAL INPUTS: TARGET_SIZE
+    OUTPUTS: None if the record is good, otherwise a description of the problem [string]
+    """
+    try:
+        feature = tf.train.Example.FromString(record).features.feature
+    except Exception as e:
+        return "does not parse: {}".format(e)
+
+    for key, channels in [("image", 3), ("label", 1)]:
+        if key not in feature or len(feature[key].bytes_list.value) != 1:
+            return "no {}".format(key)
+        bits = feature[key].bytes_list.value[0]
+        if len(bits) == TARGET_SIZE*TARGET_SIZE*channels: # raw uint8 pixels
+            pixels = np.frombuffer(bits, dtype=np.uint8)
+        else:
+            try:
+                image = _open_image(bits)
+            except Exception as e:
+                return "{} does not decode: {}".format(key, e)
+            if image.size != (TARGET_SIZE, TARGET_SIZE):
+                return "{} is {}x{}, not {}x{}".format(key, image.size[0], image.size[1], TARGET_SIZE, TARGET_SIZE)
+            pixels = np.array(image.convert('L')) if channels == 1 else None
+
+    if label_values is not None:
+        distance = np.min(np.abs(pixels.astype(int)[...,np.newaxis] - np.array(label_values)), axis=-1)
+        if np.max(distance) > tolerance:
+            return "label holds invalid values, e.g. {}".format(np.unique(pixels[distance > tolerance])[:5].tolist())
+    return None
+
+###############################################################
+### NEAR-DUPLICATE FUNCTIONS
+###############################################################
+
+#-----------------------------------
+def _image_hash(bits, hash_size=8):
+    """
+    "_image_hash(bits, hash_size=8)"
+    difference hash of an encoded image: the image is shrunk to hash_size+1 x hash_size grey
+    pixels, and each bit says whether a pixel is brighter than its left neighbour.
+    Near-duplicate images have hashes that differ in only a few bits
+    INPUTS:
+        * bits [bytes]: encoded image (jpeg, png, or raw uint8 pixels)
+    OPTIONAL INPUTS:
+        * hash_size [int]: the hash has hash_size x hash_size bits (at most 8, for 64 bits)
+    GLOBAL INPUTS: TARGET_SIZE
+    OUTPUTS: hash [int]
+    """
+    if len(bits) == TARGET_SIZE*TARGET_SIZE*3: # raw uint8 pixels
+        image = PIL.Image.fromarray(np.frombuffer(bits, dtype=np.uint8).reshape((TARGET_SIZE, TARGET_SIZE, 3)))
+    else:
+        image = _open_image(bits)
+    grey = np.asarray(image.convert('L').resize((hash_size+1, hash_size), PIL.Image.BILINEAR), dtype=np.int16)
+    hash = 0
+    for bit in (grey[:,1:] > grey[:,:-1]).ravel():
+        hash = (hash << 1) | int(bit)
+    return hash
+
+#-----------------------------------
+def _shard_hashes(task):
+    """
+    "_shard_hashes(task)"
+    hash the image of every record of one tfrecord file (runs in a worker process)
+    INPUTS:
+        * task [tuple]: (filename, compression_type, hash_size)
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: list of hashes [int] (None for a record whose image does not decode)
+    """
+    filename, compression_type, hash_size = task
+    hashes = []
+    for record in _read_shard_records(filename, compression_type):
+        try:
+            feature = tf.train.Example.FromString(record).features.feature
+            hashes.append(_image_hash(feature["image"].bytes_list.value[0], hash_size))
+        except Exception:
+            hashes.append(None)
+    return hashes
+
+#-----------------------------------
+def hash_records(filenames, hash_size=8, num_workers=None):
+    """
+    hash_records(filenames, hash_size=8, num_workers=None)
+    This function computes a perceptual (difference) hash of the image of every record in
+    a list of tfrecord files, with a pool of worker processes (one file per task)
+    INPUTS:
+        * filenames [list]: tfrecord files
+    OPTIONAL INPUTS:
+        * hash_size [int]: the hashes have hash_size x hash_size bits (at most 8)
+        * num_workers [int]: number of worker processes (None = number of cpus, 1 = no pool)
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * hashes [ndarray]: uint64 hash of each record (records whose image does not decode are left out)
+        * file_ids [ndarray]: index in filenames of the file of each record
+        * record_ids [ndarray]: index of each record in its file
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    compression_type = get_compression_type(filenames)
+    tasks = [(f, compression_type, hash_size) for f in filenames]
+    if num_workers == 1:
+        results = [_shard_hashes(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(num_workers) as pool:
+            results = pool.map(_shard_hashes, tasks)
+
+    hashes, file_ids, record_ids = [], [], []
+    for k, file_hashes in enumerate(results):
+        for i, hash in enumerate(file_hashes):
+            if hash is not None:
+                hashes.append(hash); file_ids.append(k); record_ids.append(i)
+    return np.array(hashes, dtype=np.uint64), np.array(file_ids, dtype=np.int64), np.array(record_ids, dtype=np.int64)
+
+#-----------------------------------
+def _popcount(x):
+    """
+    "_popcount(x)"
+    number of set bits of each element of a uint64 array
+    INPUTS:
+        * x [ndarray]: uint64
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: bit counts [ndarray]
+    """
+    return np.unpackbits(np.ascontiguousarray(x, dtype=np.uint64).view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+#-----------------------------------
+def find_near_duplicates(hashes, max_distance=5, num_bits=64, max_pairs=2**20):
+    """
+    find_near_duplicates(hashes, max_distance=5, num_bits=64, max_pairs=2**20)
+    This function groups hashes that differ in at most max_distance bits into clusters (chains
+    of near-duplicates join one cluster), without comparing all pairs: the hashes are split into
+    max_distance+1 bands, and two hashes within max_distance bits must agree exactly on at least
+    one band, so only hashes that share a band value (a bucket of the index) are compared.
+    Large buckets are compared in blocks of rows, so memory stays bounded by max_pairs
+    INPUTS:
+        * hashes [ndarray]: uint64 hashes (from hash_records)
+    OPTIONAL INPUTS:
+        * max_distance [int]: largest number of differing bits for near-duplicates
+        * num_bits [int]: bits per hash (hash_size x hash_size)
+        * max_pairs [int]: largest number of hash pairs compared at once
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * clusters [ndarray]: cluster id of each hash (the index of its first member)
+    """
+    # identical hashes are merged first, so each bucket holds distinct hashes only
+    unique, inverse = np.unique(hashes, return_inverse=True)
+    parent = np.arange(len(unique))
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    bands = np.array_split(np.arange(num_bits), max_distance+1)
+    for band in bands:
+        shift, width = int(band[0]), len(band)
+        keys = (unique >> np.uint64(shift)) & np.uint64((1 << width)-1)
+        order = np.argsort(keys, kind='stable')
+        bounds = np.flatnonzero(np.diff(keys[order])) + 1
+        for bucket in np.split(order, bounds):
+            if len(bucket) < 2:
+                continue
+            values = unique[bucket]
+            step = max(1, max_pairs//len(bucket))
+            for start in range(0, len(bucket)-1, step):
+                # rows start..start+step against every later column of the bucket
+                rows = np.arange(start, min(start+step, len(bucket)-1))
+                cols = np.arange(start+1, len(bucket))
+                xor = values[rows][:,np.newaxis] ^ values[cols][np.newaxis,:]
+                close = (_popcount(xor.ravel()).reshape(xor.shape) <= max_distance) & (cols > rows[:,np.newaxis])
+                a, b = np.nonzero(close)
+                for i, j in zip(bucket[rows[a]], bucket[cols[b]]):
+                    ri, rj = root(i), root(j)
+                    if ri != rj:
+                        parent[max(ri, rj)] = min(ri, rj)
+
+    unique_roots = np.array([root(i) for i in range(len(unique))], dtype=np.int64)
+    # number the clusters by their first record
+    roots = unique_roots[inverse]
+    first = {}
+    clusters = np.empty(len(hashes), dtype=np.int64)
+    for k, r in enumerate(roots):
+        clusters[k] = first.setdefault(r, k)
+    return clusters
+
+#-----------------------------------
+def make_split_manifest(filenames, validation_split, split_file, hash_size=8, max_distance=5, deduplicate=True, num_workers=None, seed=SEED):
+    """
+    make_split_manifest(filenames, validation_split, split_file, hash_size=8, max_distance=5, deduplicate=True, num_workers=None, seed=SEED)
+    This function finds near-duplicate records in a list of tfrecord files (hash_records, then
+    find_near_duplicates) and writes a train/validation split as json in which every cluster of
+    near-duplicates is on one side only (no leakage between the splits). With deduplicate=True
+    only the first record of each cluster is kept. Records are listed by file name and index in the
+    file; write_split_records writes them to new train and validation shards
+    INPUTS:
+        * filenames [list]: tfrecord files (in the same directory)
+        * validation_split [float]: fraction of the (kept) records for validation
+        * split_file [string]: json file to write
+    OPTIONAL INPUTS:
+        * hash_size, max_distance: see hash_records and find_near_duplicates
+        * deduplicate [bool]: keep one record per cluster
+        * num_workers [int]: number of worker processes (None = number of cpus)
+        * seed [int]: random seed for the assignment of clusters to the splits
+    GLOBAL INPUTS: SEED
+    OUTPUTS:
+        * split [dict]: also written to split_file
+    """
+    hashes, file_ids, record_ids = hash_records(filenames, hash_size, num_workers)
+    clusters = find_near_duplicates(hashes, max_distance, hash_size*hash_size)
+    names = [f.split(os.sep)[-1] for f in filenames]
+
+    members = {}
+    for k, c in enumerate(clusters):
+        members.setdefault(c, []).append(k)
+    cluster_ids = sorted(members.keys())
+    duplicates = [[[names[file_ids[k]], int(record_ids[k])] for k in members[c]] for c in cluster_ids if len(members[c]) > 1]
+    if deduplicate:
+        members = {c:members[c][:1] for c in cluster_ids}
+    num_kept = sum(len(members[c]) for c in cluster_ids)
+
+    # whole clusters go to validation, in random order, until it holds validation_split of the records
+    validation = set()
+    num_validation = 0
+    for c in np.random.RandomState(seed).permutation(cluster_ids):
+        if num_validation >= validation_split*num_kept:
+            break
+        validation.add(c)
+        num_validation += len(members[c])
+
+    splits = {"train": {}, "val": {}}
+    for c in cluster_ids:
+        side = splits["val"] if c in validation else splits["train"]
+        for k in members[c]:
+            side.setdefault(names[file_ids[k]], []).append(int(record_ids[k]))
+    for side in splits.values():
+        for name in side:
+            side[name] = sorted(side[name])
+
+    split = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+             "tfrecord_dir": os.path.dirname(filenames[0]) or '.',
+             "hash_size": hash_size,
+             "max_distance": max_distance,
+             "deduplicate": deduplicate,
+             "validation_split": validation_split,
+             "num_records": len(hashes),
+             "num_clusters": len(cluster_ids),
+             "num_train": num_kept-num_validation,
+             "num_val": num_validation,
+             "splits": splits,
+             "duplicates": duplicates}
+    with open(split_file, 'w') as f:
+        json.dump(split, f)
+    print("{} records in {} clusters of near-duplicates: {} for training, {} for validation".format(
+          len(hashes), len(cluster_ids), split["num_train"], split["num_val"]))
+    return split
+
+#-----------------------------------
+def write_split_records(split_file, output_dir, records_per_shard=ims_per_shard):
+    """
+    write_split_records(split_file, output_dir, records_per_shard=ims_per_shard)
+    This function copies the records listed in a split file (from make_split_manifest) to new
+    tfrecord shards, "train-{shard}-{count}.tfrec" and "val-{shard}-{count}.tfrec", with a manifest
+    INPUTS:
+        * split_file [string]: json file from make_split_manifest
+        * output_dir [string]: directory for the new shards (not the one the records are read from)
+    OPTIONAL INPUTS:
+        * records_per_shard [int]: number of records per new shard
+    GLOBAL INPUTS: ims_per_shard
+    OUTPUTS: list of new tfrecord files
+    """
+    with open(split_file) as f:
+        split = json.load(f)
+    tfrecord_dir = split["tfrecord_dir"]
+    if os.path.abspath(output_dir) == os.path.abspath(tfrecord_dir):
+        raise ValueError("write the split shards to a different directory than the source tfrecords")
+    os.makedirs(output_dir, exist_ok=True)
+    compression_type = get_compression_type([tfrecord_dir+os.sep+f for f in sorted(split["splits"]["train"].keys())] or
+                                            [tfrecord_dir+os.sep+f for f in sorted(split["splits"]["val"].keys())])
+
+    shards, written = [], []
+    def flush(name, records, counter):
+        filename = output_dir+os.sep+"{}-{:02d}-{}.tfrec".format(name, counter, len(records))
+        class_counts = {}
+        for record in records:
+            for k in _record_class_ids(record):
+                class_counts[k] = class_counts.get(k, 0) + 1
+        offsets = write_examples(filename, records, compression_type)
+        shards.append(get_shard_info(filename, offsets, class_counts, compression_type))
+        written.append(filename)
+        print("Wrote file {} containing {} records".format(filename, len(records)))
+
+    for name in ["train", "val"]:
+        buffer, counter = [], 0
+        for source in sorted(split["splits"][name].keys()):
+            keep = set(split["splits"][name][source])
+            records = _read_shard_records(tfrecord_dir+os.sep+source, compression_type)
+            buffer += [record for i, record in enumerate(records) if i in keep]
+            while len(buffer) >= records_per_shard:
+                flush(name, buffer[:records_per_shard], counter)
+                buffer, counter = buffer[records_per_shard:], counter+1
+        if len(buffer) > 0:
+            flush(name, buffer, counter)
+
+    manifest = read_manifest(tfrecord_dir)
+    write_manifest(output_dir, shards, manifest.get("classes") if manifest is not None else None)
+    return written
@@ -0,0 +1,63 @@
+# Written by Dr Daniel Buscombe, Marda Science LLC
+# for "ML Mondays", a course supported by the USGS Community for Data Integration
+# and the USGS Coastal Change Hazards Program
+#
+# MIT License
+#
+# Copyright (c) 2020, Marda Science LLC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Finds near-duplicate records in a folder of tfrecords (perceptual hashes computed in parallel, clustered through
+# a hash index rather than all-pairs comparison) and writes a train/validation split in which near-duplicates
+# never straddle the two splits (keeping only one record per cluster if deduplicate = True).
+# If output_dir is set, the records are also copied to new train-*/val-* shards with a manifest
+
+###############################################################
+## IMPORTS
+###############################################################
+from imports import *
+
+###############################################################
+## VARIABLES
+###############################################################
+
+data_path = os.getcwd()+os.sep+"data/tamucc/subset_12class/"+str(TARGET_SIZE)
+hash_size = 8 # hashes of hash_size x hash_size bits
+max_distance = 5 # records whose hashes differ in at most this many bits are near-duplicates
+validation_split = VALIDATION_SPLIT # fraction of records for validation
+deduplicate = True # keep one record per cluster of near-duplicates
+num_workers = None # hashing processes (None = number of cpus)
+
+split_file = data_path+os.sep+'split.json'
+output_dir = None # e.g. data_path+os.sep+'dedup' to write the split to new shards (None = split file only)
+
+###############################################################
+## EXECUTION
+###############################################################
+
+filenames = sorted(tf.io.gfile.glob(data_path+os.sep+'*.tfrec'))
+
+start = time.time()
+split = make_split_manifest(filenames, validation_split, split_file, hash_size, max_distance, deduplicate, num_workers)
+print("Hashed and clustered {} records in {:.1f} s".format(split["num_records"], time.time()-start))
+
+if output_dir is not None:
+    write_split_records(split_file, output_dir)
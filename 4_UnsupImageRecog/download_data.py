@@ -1,6 +1,9 @@
+import os
+from download_funcs import *
 
-import os, zipfile
-import tensorflow as tf
+# set extract = False to keep the zip files instead of extracting them; the tfrecords can then be read
+# in place with list_zip_members and the zip_path argument of the dataset functions (see tfrecords_funcs.py)
+extract = True
 
 try:
     os.mkdir('data')
@@ -17,14 +20,9 @@ file = 'tamucc_subset_12class.zip'
 
 url = "https://ml-mondays-data.s3-us-west-2.amazonaws.com/mlmondays_data_imrecog/releases/download/0.1.0/"+file
 # url = "https://github.com/dbuscombe-usgs/mlmondays_data_ssimrecog/releases/download/0.1.0/"+file
-filename = os.path.join(os.getcwd(), file)
-print("Downloading %s ... " % (filename))
-tf.keras.utils.get_file(filename, url)
-print("Unzipping to %s ... " % (folder))
-with zipfile.ZipFile(file, "r") as z_fp:
-    z_fp.extractall("./"+folder)
 
-try:
-    os.remove(file)
-except:
-    pass
+# sha256 of each release file, checked after download (recorded in checksums.json with
+# write_checksums(<release files>, 'checksums.json'); files with a null hash are not verified)
+checksums = read_checksums(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checksums.json'))
+
+download_files([(url, os.path.join(os.getcwd(), file), folder if extract else None)], checksums)
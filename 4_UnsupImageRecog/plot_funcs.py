@@ -32,7 +32,7 @@ from tamucc_imports import *
 
 #see mlmondays blog post:
 import os
-os.environ["TF_DETERMINISTIC_OPS"] = "1"
+# kernel determinism is set by the execution profile (see set_execution_profile in tfrecords_funcs.py)
 
 ##calcs
 import tensorflow as tf #numerical operations on gpu
@@ -54,7 +54,7 @@ tf.random.set_seed(SEED)
 
 import tensorflow.keras.backend as K
 
-from tfrecords_funcs import file2tensor
+from tfrecords_funcs import get_file_dataset
 import tensorflow as tf #numerical operations on gpu
 
 
@@ -87,19 +87,19 @@ def conf_mat_filesamples(model, knn, sample_filenames, num_classes, num_dim_use,
 
     y_obs = []
     y_est = []
-    for f in sample_filenames:
-        # read image and convert to 32-bit tensor
-        image = tf.cast(file2tensor(f), np.float32)
-        # get the embeddings from the neural network model
-        embeddings_sample = model.predict(tf.expand_dims(image, 0))
-        # get class numeric code prediction from the k-nearest neighbours model
-        est_class_idx = knn.predict(embeddings_sample[:,:num_dim_use])[0]
-        y_est.append(est_class_idx)
-        obs_class = f.split('/')[-1].split('_IMG')[0] #could this be a lambda function passed to the function as an argument?
-        # get numeric code from class name
-        class_idx = [i for i,c in enumerate(CLASSES) if c.decode()==obs_class][0]
-        y_obs.append(class_idx)
-        cm[class_idx, est_class_idx] += 1
+    # images are decoded once each, and the embeddings computed a batch at a time
+    for images, filenames in get_file_dataset(sample_filenames):
+        # convert to 32-bit tensor and get the embeddings from the neural network model
+        embeddings_sample = model.predict_on_batch(tf.cast(images, np.float32))
+        # get class numeric code predictions from the k-nearest neighbours model
+        est_class_idxs = knn.predict(embeddings_sample[:,:num_dim_use])
+        for f, est_class_idx in zip(filenames.numpy(), est_class_idxs):
+            y_est.append(est_class_idx)
+            obs_class = f.decode().split('/')[-1].split('_IMG')[0] #could this be a lambda function passed to the function as an argument?
+            # get numeric code from class name
+            class_idx = [i for i,c in enumerate(CLASSES) if c.decode()==obs_class][0]
+            y_obs.append(class_idx)
+            cm[class_idx, est_class_idx] += 1
 
     cm = cm.astype('float') / cm.sum(axis=1)[:, np.newaxis]
     return cm
@@ -0,0 +1,66 @@
+# Written by Dr Daniel Buscombe, Marda Science LLC
+# for "ML Mondays", a course supported by the USGS Community for Data Integration
+# and the USGS Coastal Change Hazards Program
+#
+# MIT License
+#
+# Copyright (c) 2020, Marda Science LLC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Writes synthetic tfrecords with the same schema as the real data in this module,
+# at any size, for load and scaling tests of the input pipelines and models
+
+###############################################################
+## IMPORTS
+###############################################################
+from imports import *
+
+###############################################################
+## VARIABLES
+###############################################################
+
+num_images = 10000 # total number of records
+num_shards = 100 # number of tfrecord files
+num_classes = 12 # number of classes
+size = TARGET_SIZE # image height and width
+encoding = 'jpeg' # 'jpeg' or 'raw' (raw needs size = TARGET_SIZE)
+compression_type = '' # '', 'ZLIB' or 'GZIP'
+num_workers = None # writer processes (None = number of cpus)
+
+tfrecord_dir = os.getcwd()+os.sep+'data/synthetic/'+str(size)
+
+###############################################################
+## EXECUTION
+###############################################################
+
+# the worker processes are spawned and import this script again (see _spawn_pool in tfrecords_funcs.py),
+# so the work only runs in the main process
+if __name__ == '__main__':
+    os.makedirs(tfrecord_dir, exist_ok=True)
+
+    start = time.time()
+    CLASSES = [("class"+str(k)).encode() for k in range(num_classes)]
+    write_synthetic_classification_records(tfrecord_dir, num_images, num_shards, CLASSES, size,
+                                           encoding, num_workers, compression_type)
+    elapsed = time.time()-start
+
+    nbytes = sum(os.path.getsize(f) for f in tf.io.gfile.glob(tfrecord_dir+os.sep+'synthetic*.tfrec'))
+    print("Wrote {} records ({:.2f} GB) in {:.1f} s ({:.1f} MB/s)".format(num_images, nbytes/1e9, elapsed, nbytes/1e6/elapsed))
@@ -47,3 +47,7 @@ patience = 10
 num_embed_dim = 8
 max_epochs = 100
 lr = 1e-4
+
+#execution profile (see EXECUTION_PROFILES in tfrecords_funcs.py): 'reproducible' (repeatable runs),
+#'strict' (repeatable op order too, slower), 'fast' (maximum training throughput) or 'inference' (maximum throughput, outputs in input order)
+EXECUTION_PROFILE = 'reproducible'
@@ -128,7 +128,9 @@ print(CLASSES)
 print('.....................................')
 print('Reading files and making datasets ...')
 
-nb_images = ims_per_shard * len(filenames)
+manifest = read_manifest(data_path)
+
+nb_images = get_num_records(filenames, manifest)
 print(nb_images)
 
 split = int(len(filenames) * VALIDATION_SPLIT)
@@ -136,8 +138,8 @@ split = int(len(filenames) * VALIDATION_SPLIT)
 training_filenames = filenames[split:]
 validation_filenames = filenames[:split]
 
-validation_steps = int(nb_images // len(filenames) * len(validation_filenames)) // BATCH_SIZE
-steps_per_epoch = int(nb_images // len(filenames) * len(training_filenames)) // BATCH_SIZE
+validation_steps = get_num_records(validation_filenames, manifest) // BATCH_SIZE
+steps_per_epoch = get_num_records(training_filenames, manifest) // BATCH_SIZE
 
 print(steps_per_epoch)
 print(validation_steps)
@@ -147,7 +149,7 @@ train_ds = get_training_dataset()
 val_ds = get_validation_dataset()
 
 training_filenames = sorted(tf.io.gfile.glob(data_path+os.sep+'*.tfrec'))
-nb_images = ims_per_shard * len(training_filenames)
+nb_images = get_num_records(training_filenames, manifest)
 print(nb_images)
 
 num_batches = int(((1-VALIDATION_SPLIT) * nb_images) / BATCH_SIZE)
@@ -250,14 +252,13 @@ p_confmat(ytest[:touse], y_pred, cm_filename, CLASSES, thres = 0.1)
 
 sample_filenames = sorted(tf.io.gfile.glob(sample_data_path+os.sep+'*.jpg'))
 
-for f in sample_filenames[:10]:
-    image = file2tensor(f)
-    image = tf.cast(image, np.float32)
-
-    embeddings_sample = model1.predict(tf.expand_dims(image, 0))
+for images, filenames in get_file_dataset(sample_filenames[:10]):
+    embeddings_sample = model1.predict_on_batch(tf.cast(images, np.float32))
 
-    #knn.predict_proba(embeddings_sample[:,:2])
-    obs_class = f.split('/')[-1].split('_IMG')[0]
-    est_class = CLASSES[knn1.predict(embeddings_sample[:,:num_dim_use])[0]].decode()
+        #knn.predict_proba(embeddings_sample[:,:2])
+    est_classes = knn1.predict(embeddings_sample[:,:num_dim_use])
+    for f, est_class_idx in zip(filenames.numpy(), est_classes):
+        obs_class = f.decode().split('/')[-1].split('_IMG')[0]
+        est_class = CLASSES[est_class_idx].decode()
 
-    print('pred:%s, est:%s' % (obs_class, est_class ) )
+        print('pred:%s, est:%s' % (obs_class, est_class ) )
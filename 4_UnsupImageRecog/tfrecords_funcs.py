@@ -31,8 +31,8 @@ from tamucc_imports import *
 # from nwpu_imports import *
 
 #see mlmondays blog post:
-import os, json
-os.environ["TF_DETERMINISTIC_OPS"] = "1"
+import os, io, json, time, gzip, hashlib, multiprocessing, multiprocessing.pool, struct, zlib, zipfile, fnmatch, mmap, shutil
+import PIL.Image
 
 ##calcs
 import tensorflow as tf #numerical operations on gpu
@@ -42,46 +42,256 @@ import numpy as np #numerical operations on cpu
 SEED=42
 np.random.seed(SEED)
 AUTO = tf.data.experimental.AUTOTUNE # used in tf.data.Dataset API
+DECODE_PARALLELISM = os.cpu_count() or 1 # images of a batch decoded at once (parallel_iterations of tf.map_fn)
 
 tf.random.set_seed(SEED)
 
 import tensorflow.keras.backend as K
 from collections import defaultdict
 
+###############################################################
+### EXECUTION PROFILE FUNCTIONS
+###############################################################
+
+# named determinism and parallelism settings, chosen with EXECUTION_PROFILE
+EXECUTION_PROFILES = {
+    # repeatable runs, for comparing experiments: deterministic kernels, tf.data elements in a fixed
+    # order, the shared tf.data thread pool and no XLA (deterministic kernels give the same results
+    # whatever the thread pools, so these keep tensorflow's default sizes)
+    "reproducible": {"deterministic_ops": True, "ordered": True, "intra_op_threads": 0, "inter_op_threads": 0,
+                     "private_threadpool_size": 0, "xla": False},
+    # opt-in, for debugging run-to-run differences: as 'reproducible', but one op at a time on the
+    # inter-op pool, so ops also run in the same order (slower)
+    "strict": {"deterministic_ops": True, "ordered": True, "intra_op_threads": 0, "inter_op_threads": 1,
+               "private_threadpool_size": 0, "xla": False},
+    # maximum training throughput: the fastest kernels, tf.data elements in the order they are ready,
+    # a private tf.data thread pool (input work does not queue behind model ops) and XLA auto-clustering
+    "fast": {"deterministic_ops": False, "ordered": False, "intra_op_threads": 0, "inter_op_threads": 0,
+             "private_threadpool_size": os.cpu_count() or 0, "xla": True},
+    # maximum prediction throughput, with the outputs still in the order of the inputs
+    "inference": {"deterministic_ops": False, "ordered": True, "intra_op_threads": 0, "inter_op_threads": 0,
+                  "private_threadpool_size": os.cpu_count() or 0, "xla": True},
+}
+
+#-----------------------------------
+def set_execution_profile(profile):
+    """
+    set_execution_profile(profile)
+    This function applies a named execution profile (see EXECUTION_PROFILES): kernel determinism,
+    tf.data ordering, the intra-op and inter-op thread pools, the private tf.data thread pool and XLA
+    auto-clustering (0 threads = tensorflow's default). It is called on import with EXECUTION_PROFILE,
+    because kernel determinism and the thread pools are fixed once tensorflow has run its first op;
+    the other settings can be changed later by calling it again
+    INPUTS:
+        * profile [string]: key of EXECUTION_PROFILES
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: EXECUTION_PROFILES
+    OUTPUTS: None (sets the globals EXECUTION_PROFILE, DETERMINISTIC and PRIVATE_THREADPOOL_SIZE)
+    """
+    if profile not in EXECUTION_PROFILES:
+        raise ValueError("unknown execution profile {} (use one of {})".format(profile, sorted(EXECUTION_PROFILES.keys())))
+    settings = EXECUTION_PROFILES[profile]
+    os.environ["TF_DETERMINISTIC_OPS"] = "1" if settings["deterministic_ops"] else "0"
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(settings["intra_op_threads"])
+        tf.config.threading.set_inter_op_parallelism_threads(settings["inter_op_threads"])
+    except RuntimeError: # the tensorflow runtime has already started
+        print("Thread pools are already set up; restart python to change them")
+    tf.config.optimizer.set_jit(settings["xla"])
+    globals().update(EXECUTION_PROFILE=profile, DETERMINISTIC=settings["ordered"],
+                     PRIVATE_THREADPOOL_SIZE=settings["private_threadpool_size"])
+
+#-----------------------------------
+def get_dataset_options():
+    """
+    get_dataset_options()
+    This function returns the tf.data options of the execution profile: whether parallel
+    stages keep the order of their elements, and the size of the pipeline's private thread pool
+    INPUTS: None
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: DETERMINISTIC, PRIVATE_THREADPOOL_SIZE
+    OUTPUTS: tf.data.Options object
+    """
+    options = tf.data.Options()
+    options.experimental_deterministic = DETERMINISTIC
+    if PRIVATE_THREADPOOL_SIZE > 0:
+        options.experimental_threading.private_threadpool_size = PRIVATE_THREADPOOL_SIZE
+    return options
+
+# the EXECUTION_PROFILE environment variable overrides the setting (benchmark_profiles.py runs each profile this way)
+set_execution_profile(os.environ.get("EXECUTION_PROFILE", EXECUTION_PROFILE))
+
 
 ###############################################################
 ### DATA FUNCTIONS
 ###############################################################
 #-----------------------------------
-def get_batched_dataset(filenames):
+def get_batched_dataset(filenames, parse_mode='record', cache_mode='float', cache_dir=None, zip_path=None, service=None):
     """
-    get_batched_dataset(filenames)
+    get_batched_dataset(filenames, parse_mode='record', cache_mode='float', cache_dir=None, zip_path=None, service=None)
     This function defines a workflow for the model to read data from
     tfrecord files by defining the degree of parallelism, batch size, pre-fetching, etc
     and also formats the imagery properly for model training
     (assumes mobilenet by using read_tfrecord_mv2)
+
+    With parse_mode='batch', raw serialized records are batched first and each batch
+    is parsed with a single tf.io.parse_example call (read_tfrecord_batch),
+    which cuts per-element op overhead on cpu-bound input pipelines
+
+    With cache_mode='uint8', the cache holds decoded 8-bit pixels (4x smaller than float32)
+    and the rescaling to [0,1] is applied to each batch after the cache
+    (in RAM, or on disk under cache_dir)
     INPUTS:
         * filenames [list]
-    OPTIONAL INPUTS: None
+    OPTIONAL INPUTS:
+        * parse_mode = {'record' | 'batch'}
+        * cache_mode = {'float' | 'uint8'}
+        * cache_dir [string]: directory for a file-backed cache (None = cache in RAM)
+        * zip_path [string]: zip archive containing the tfrecords (filenames are then member names)
+        * service [string]: tf.data service dispatcher address (see data_service.py); preprocessing then runs on its workers
     GLOBAL INPUTS: BATCH_SIZE, AUTO
     OUTPUTS: tf.data.Dataset object
     """
-    option_no_order = tf.data.Options()
-    option_no_order.experimental_deterministic = True
+    if service is not None and zip_path is not None:
+        raise ValueError("zip archives are read with python generators, which cannot run on a tf.data service")
+    option_no_order = get_dataset_options()
 
-    dataset = tf.data.Dataset.list_files(filenames)
+    dataset = get_record_dataset(filenames, zip_path, cycle_length=16)
     dataset = dataset.with_options(option_no_order)
-    dataset = dataset.interleave(tf.data.TFRecordDataset, cycle_length=16, num_parallel_calls=AUTO)
-    dataset = dataset.map(read_tfrecord, num_parallel_calls=AUTO)
+    if cache_mode == 'uint8':
+        dataset = parse_dataset(dataset, read_tfrecord_uint8, read_tfrecord_batch_uint8, parse_mode)
+    else:
+        dataset = parse_dataset(dataset, read_tfrecord, read_tfrecord_batch, parse_mode)
 
-    dataset = dataset.cache() # This dataset fits in RAM
+    dataset = dataset.cache(get_cache_filename(filenames, cache_dir, cache_mode)) # This dataset fits in RAM
     #dataset = dataset.repeat()
     dataset = dataset.shuffle(2048)
     dataset = dataset.batch(BATCH_SIZE, drop_remainder=True) # drop_remainder will be needed on TPU
+    if cache_mode == 'uint8':
+        dataset = dataset.map(standardize_image, num_parallel_calls=AUTO)
     dataset = dataset.prefetch(AUTO) #
+    if service is not None:
+        dataset = distribute_dataset(dataset, service)
+
+    return dataset
+
+#-----------------------------------
+def get_cache_filename(filenames, cache_dir=None, cache_mode='float'):
+    """
+    get_cache_filename(filenames, cache_dir=None, cache_mode='float')
+    This function returns the filename to pass to dataset.cache():
+    an empty string (cache in RAM) if cache_dir is None, otherwise a file in cache_dir
+    named from a hash of the tfrecord filenames, so train and validation sets get separate caches
+    INPUTS:
+        * filenames [list]
+    OPTIONAL INPUTS:
+        * cache_dir [string]
+        * cache_mode = {'float' | 'uint8'}
+    GLOBAL INPUTS: TARGET_SIZE
+    OUTPUTS:
+        * cache_file [string]
+    """
+    if cache_dir is None:
+        return ''
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    key = hashlib.md5('\n'.join(sorted(filenames)).encode()).hexdigest()[:16]
+    return cache_dir+os.sep+"cache_{}_{}_{}".format(TARGET_SIZE, cache_mode, key)
+
+#-----------------------------------
+def standardize_image(image, label):
+    """
+    standardize_image(image, label)
+    This function casts an 8-bit image (or batch of images) to float
+    and rescales it to [0,1], as read_tfrecord does
+    The label passes through unmodified
+    INPUTS:
+        * image [tensor array]: uint8
+        * label [int]
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * image [tensor array]: float32, rescaled
+        * label [int]
+    """
+    image = tf.cast(image, tf.float32) / 255.0
+    return image, label
 
+#-----------------------------------
+def parse_dataset(dataset, record_reader, batch_reader, parse_mode='record'):
+    """
+    parse_dataset(dataset, record_reader, batch_reader, parse_mode='record')
+    This function maps a dataset of serialized tfrecord examples to (image, label) pairs,
+    either one record at a time (parse_mode='record', using record_reader)
+    or one batch of BATCH_SIZE records at a time (parse_mode='batch', using batch_reader).
+    In batch mode the parsed batches are unbatched again, so the output is the same
+    stream of (image, label) elements in both modes and can be cached, shuffled and rebatched as usual
+    INPUTS:
+        * dataset [tf.data.Dataset]: serialized tfrecord examples
+        * record_reader [function]: per-record parser, e.g. read_tfrecord
+        * batch_reader [function]: per-batch parser, e.g. read_tfrecord_batch
+    OPTIONAL INPUTS:
+        * parse_mode = {'record' | 'batch'}
+    GLOBAL INPUTS: BATCH_SIZE, AUTO
+    OUTPUTS: tf.data.Dataset object
+    """
+    if parse_mode == 'batch':
+        dataset = dataset.batch(BATCH_SIZE)
+        dataset = dataset.map(batch_reader, num_parallel_calls=AUTO)
+        dataset = dataset.unbatch()
+    else:
+        dataset = dataset.map(record_reader, num_parallel_calls=AUTO)
     return dataset
 
+#-----------------------------------
+def measure_throughput(dataset, num_batches=100):
+    """
+    measure_throughput(dataset, num_batches=100)
+    This function iterates over a batched dataset with no model attached
+    and reports how many images per second the input pipeline delivers.
+    The first batch is excluded from the timing, because it includes pipeline start-up
+    INPUTS:
+        * dataset [tf.data.Dataset]: batched dataset of (image, label) pairs
+    OPTIONAL INPUTS:
+        * num_batches [int]: number of batches to time
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * images_per_sec [float]
+    """
+    iterator = iter(dataset)
+    next(iterator)
+    nb_images = 0
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        try:
+            imgs, lbls = next(iterator)
+        except StopIteration:
+            break
+        nb_images += int(tf.shape(imgs)[0])
+    elapsed = time.perf_counter() - start
+    return nb_images / max(elapsed, 1e-9)
+
+#-----------------------------------
+def compare_parse_modes(filenames, num_batches=100):
+    """
+    compare_parse_modes(filenames, num_batches=100)
+    This function measures the images/sec delivered by get_batched_dataset
+    using per-record and per-batch tfrecord parsing, and prints the comparison
+    INPUTS:
+        * filenames [list]: tfrecord files
+    OPTIONAL INPUTS:
+        * num_batches [int]: number of batches to time per mode
+    GLOBAL INPUTS: BATCH_SIZE
+    OUTPUTS:
+        * rates [dict]: images/sec keyed by parse mode
+    """
+    rates = {}
+    for parse_mode in ['record', 'batch']:
+        rates[parse_mode] = measure_throughput(get_batched_dataset(filenames, parse_mode), num_batches)
+        print("parse_mode={}: {:.1f} images/sec".format(parse_mode, rates[parse_mode]))
+    print("batch/record speed-up: {:.2f}x".format(rates['batch'] / max(rates['record'], 1e-9)))
+    return rates
+
 def get_data_stuff(ds, num_batches):
     """
     get_data_stuff(ds, num_batches)
@@ -145,37 +355,63 @@ def read_classes_from_json(json_file):
 def file2tensor(f):
     """
     file2tensor(f)
-    This function reads a jpeg image from file into a cropped and resized tensor,
-    for use in prediction with a trained mobilenet or vgg model
-    (the imagery is standardized depedning on target model framework)
+    This function reads an image from file into a cropped and resized tensor,
+    for use in prediction with a trained model. The file is decoded once, with
+    decode_file_image; to read many files use get_file_dataset
     INPUTS:
         * f [string] file name of jpeg
     OPTIONAL INPUTS: None
     OUTPUTS:
-        * image [tensor array]: unstandardized image
-        * im [tensor array]: standardized image
+        * image [tensor array]: uint8 image
     GLOBAL INPUTS: TARGET_SIZE
     """
-    bits = tf.io.read_file(f)
-    image = tf.image.decode_jpeg(bits)
-
-    w = tf.shape(image)[0]
-    h = tf.shape(image)[1]
-    tw = TARGET_SIZE
-    th = TARGET_SIZE
-    resize_crit = (w * th) / (h * tw)
-    image = tf.cond(resize_crit < 1,
-                  lambda: tf.image.resize(image, [w*tw/w, h*tw/w]), # if true
-                  lambda: tf.image.resize(image, [w*th/h, h*th/h])  # if false
-                 )
-
-    nw = tf.shape(image)[0]
-    nh = tf.shape(image)[1]
-    image = tf.image.crop_to_bounding_box(image, (nw - tw) // 2, (nh - th) // 2, tw, th)
+    image = decode_file_image(tf.io.read_file(f))
     image = tf.cast(image, tf.uint8) #/ 255.0
 
     return image
 
+#-----------------------------------
+def decode_file_image(bits):
+    """
+    decode_file_image(bits)
+    This function decodes an image file once into a TARGET_SIZE x TARGET_SIZE square, cropped
+    at the centre as resize_and_crop_image does. Jpegs are decoded at reduced scale, and only
+    inside the crop (decode_resize_crop_jpeg); other formats are decoded in full, then cropped and resized
+    INPUTS:
+        * bits [tensor]: contents of the image file
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: TARGET_SIZE
+    OUTPUTS:
+        * image [tensor array] (float32, TARGET_SIZE x TARGET_SIZE x 3, unstandardized)
+    """
+    image = tf.cond(tf.io.is_jpeg(bits),
+                    lambda: decode_resize_crop_jpeg(bits),
+                    lambda: resize_and_crop_image(tf.cast(tf.io.decode_image(bits, channels=3, expand_animations=False), tf.float32), None)[0])
+    return tf.reshape(image, [TARGET_SIZE, TARGET_SIZE, 3])
+
+#-----------------------------------
+def get_file_dataset(filenames, batch_size=None):
+    """
+    get_file_dataset(filenames, batch_size=None)
+    This function defines a workflow for prediction on a list of image files: each file is decoded once
+    (decode_file_image) in parallel, and batches of images are prefetched while the model runs on the previous one
+    INPUTS:
+        * filenames [list]: image files (jpeg, png, ...)
+    OPTIONAL INPUTS:
+        * batch_size [int]: images per batch (None = BATCH_SIZE)
+    GLOBAL INPUTS: BATCH_SIZE, AUTO, TARGET_SIZE
+    OUTPUTS: tf.data.Dataset object of (image, filename) batches, in the order of filenames
+        * image [tensor array]: uint8 images, as from file2tensor
+        * filename [tensor]: file name of each image
+    """
+    if batch_size is None:
+        batch_size = BATCH_SIZE
+    dataset = tf.data.Dataset.from_tensor_slices(list(filenames))
+    dataset = dataset.map(lambda f: (tf.cast(decode_file_image(tf.io.read_file(f)), tf.uint8), f), num_parallel_calls=AUTO)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.prefetch(AUTO)
+    return dataset
+
 ###############################################################
 ### TFRECORD FUNCTIONS
 ###############################################################
@@ -229,6 +465,25 @@ def recompress_image(image, label):
     image = tf.image.encode_jpeg(image, optimize_size=True, chroma_downsampling=False)
     return image, label
 
+#-----------------------------------
+def recode_image_raw(image, label):
+    """
+    recode_image_raw(image, label)
+    This function casts an image to 8-bit, to be stored as raw pixel bytes (no jpeg encoding)
+    Decoding raw pixels costs almost nothing at training time, at the expense of larger tfrecords
+    (see decode_image_bytes). Label passes through unmodified
+    INPUTS:
+        * image [tensor array]
+        * label [int]
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * image [tensor array] (uint8)
+        * label [int]
+    """
+    image = tf.cast(image, tf.uint8)
+    return image, label
+
 #-----------------------------------
 """
 These functions cast inputs into tf dataset 'feature' classes
@@ -276,14 +531,19 @@ def to_tfrecord(img_bytes, label, CLASSES):
     to_tfrecord(img_bytes, label, CLASSES)
     This function creates a TFRecord example from an image byte string and a label feature
     INPUTS:
-        * img_bytes
+        * img_bytes (jpeg bytestring, or uint8 image array stored as raw bytes)
         * label
-        * CLASSES
+        * CLASSES (list of classes, or dict mapping class to integer id)
     OPTIONAL INPUTS: None
     GLOBAL INPUTS: None
     OUTPUTS: tf.train.Feature example
     """
-    class_num = np.argmax(np.array(CLASSES)==label)
+    if isinstance(img_bytes, np.ndarray):
+        img_bytes = img_bytes.tobytes()
+    if isinstance(CLASSES, dict):
+        class_num = CLASSES[label]
+    else:
+        class_num = np.argmax(np.array(CLASSES)==label)
     feature = {
       "image": _bytestring_feature([img_bytes]), # one image in the list
       "class": _int_feature([class_num]),        # one class in the list
@@ -310,7 +570,7 @@ def read_tfrecord(example):
     # decode the TFRecord
     example = tf.io.parse_single_example(example, features)
 
-    image = tf.image.decode_jpeg(example['image'], channels=3)
+    image = decode_image_bytes(example['image'])
     image = tf.cast(image, tf.float32)/ 255.0
     image = tf.reshape(image, [TARGET_SIZE,TARGET_SIZE, 3])
 
@@ -318,6 +578,184 @@ def read_tfrecord(example):
 
     return image, class_label
 
+#-----------------------------------
+def decode_image_bytes(bits):
+    """
+    decode_image_bytes(bits)
+    This function decodes the image bytestring of a tfrecord example,
+    which is either a jpeg (encoding='jpeg') or raw TARGET_SIZE x TARGET_SIZE x 3 uint8 pixels (encoding='raw').
+    Raw images are detected from the length of the bytestring, so both kinds of tfrecords can be read
+    INPUTS:
+        * bits [tensor]: image bytestring
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: TARGET_SIZE
+    OUTPUTS: image [tensor] (uint8)
+    """
+    return tf.cond(tf.strings.length(bits) == TARGET_SIZE*TARGET_SIZE*3,
+                   lambda: tf.reshape(tf.io.decode_raw(bits, tf.uint8), [TARGET_SIZE, TARGET_SIZE, 3]),
+                   lambda: tf.image.decode_jpeg(bits, channels=3))
+
+#-----------------------------------
+def _decode_image_batch(image_bytes):
+    """
+    "_decode_image_batch(image_bytes)"
+    decode a vector of jpeg or raw image bytestrings into a uint8 image batch of size TARGET_SIZE
+    (a batch of raw images is decoded with a single decode_raw call). Jpeg images are decoded by
+    tf.map_fn, DECODE_PARALLELISM at a time: this speeds up large batches, but the threads are shared
+    with the parallel calls of the dataset map, so set it to 1 when MAP_PARALLELISM already fills the cpus
+    INPUTS:
+        * image_bytes [tensor]: 1d vector of image bytestrings
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: TARGET_SIZE, DECODE_PARALLELISM
+    OUTPUTS: image batch [tensor] (N x TARGET_SIZE x TARGET_SIZE x 3)
+    """
+    images = tf.cond(tf.reduce_all(tf.strings.length(image_bytes) == TARGET_SIZE*TARGET_SIZE*3),
+                     lambda: tf.io.decode_raw(image_bytes, tf.uint8),
+                     lambda: tf.map_fn(decode_image_bytes, image_bytes, fn_output_signature=tf.uint8,
+                                       parallel_iterations=DECODE_PARALLELISM))
+    return tf.reshape(images, [-1, TARGET_SIZE, TARGET_SIZE, 3])
+
+#-----------------------------------
+def read_tfrecord_batch(examples):
+    """
+    read_tfrecord_batch(examples)
+    This function reads a batch of examples from a TFrecord file with a single
+    tf.io.parse_example call into images and labels (batch version of read_tfrecord)
+    INPUTS:
+        * 1d vector of TFRecord example objects
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: TARGET_SIZE
+    OUTPUTS:
+        * images [tensor array]
+        * class_labels [tensor int]
+    """
+    features = {
+        "image": tf.io.FixedLenFeature([], tf.string),  # tf.string = bytestring (not text string)
+        "class": tf.io.FixedLenFeature([], tf.int64),   # shape [] means scalar
+    }
+    # decode the whole batch of TFRecords at once
+    examples = tf.io.parse_example(examples, features)
+
+    images = tf.cast(_decode_image_batch(examples['image']), tf.float32) / 255.0
+
+    class_labels = tf.cast(examples['class'], tf.int32)
+
+    return images, class_labels
+
+#-----------------------------------
+def read_tfrecord_uint8(example):
+    """
+    read_tfrecord_uint8(example)
+    This function reads an example from a TFrecord file into a single 8-bit image and label,
+    with no rescaling (for caching; see standardize_image)
+    INPUTS:
+        * TFRecord example object
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: TARGET_SIZE
+    OUTPUTS:
+        * image [tensor array]: uint8
+        * class_label [tensor int]
+    """
+    features = {
+        "image": tf.io.FixedLenFeature([], tf.string),  # tf.string = bytestring (not text string)
+        "class": tf.io.FixedLenFeature([], tf.int64),   # shape [] means scalar
+    }
+    # decode the TFRecord
+    example = tf.io.parse_single_example(example, features)
+
+    image = decode_image_bytes(example['image'])
+    image = tf.reshape(image, [TARGET_SIZE,TARGET_SIZE, 3])
+
+    class_label = tf.cast(example['class'], tf.int32)
+
+    return image, class_label
+
+#-----------------------------------
+def read_tfrecord_batch_uint8(examples):
+    """
+    read_tfrecord_batch_uint8(examples)
+    This function reads a batch of examples from a TFrecord file with a single
+    tf.io.parse_example call into 8-bit images and labels (batch version of read_tfrecord_uint8)
+    INPUTS:
+        * 1d vector of TFRecord example objects
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: TARGET_SIZE
+    OUTPUTS:
+        * images [tensor array]: uint8
+        * class_labels [tensor int]
+    """
+    features = {
+        "image": tf.io.FixedLenFeature([], tf.string),  # tf.string = bytestring (not text string)
+        "class": tf.io.FixedLenFeature([], tf.int64),   # shape [] means scalar
+    }
+    # decode the whole batch of TFRecords at once
+    examples = tf.io.parse_example(examples, features)
+
+    images = _decode_image_batch(examples['image'])
+
+    class_labels = tf.cast(examples['class'], tf.int32)
+
+    return images, class_labels
+
+#-----------------------------------
+def read_tfrecord_labels(examples):
+    """
+    read_tfrecord_labels(examples)
+    This function parses only the 'class' feature from a batch of tfrecord examples,
+    skipping the image entirely (no jpeg decoding)
+    INPUTS:
+        * examples: a 1d vector of tfrecord 'example' objects
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * class_labels [tensor] 32-bit integers
+    """
+    features = {
+        "class": tf.io.FixedLenFeature([], tf.int64),   # shape [] means scalar
+    }
+    examples = tf.io.parse_example(examples, features)
+    return tf.cast(examples['class'], tf.int32)
+
+#-----------------------------------
+def get_label_dataset(filenames, batch_size=1024, zip_path=None):
+    """
+    get_label_dataset(filenames, batch_size=1024, zip_path=None)
+    This function defines a workflow that reads only the class labels from tfrecord files,
+    reading shards in parallel and parsing large batches of records at a time.
+    It is much faster than iterating over get_batched_dataset, because no image is decoded
+    INPUTS:
+        * filenames [list]
+    OPTIONAL INPUTS:
+        * batch_size [int]: number of records parsed at once
+        * zip_path [string]: zip archive containing the tfrecords (filenames are then member names)
+    GLOBAL INPUTS: AUTO
+    OUTPUTS: tf.data.Dataset object (of label batches)
+    """
+    dataset = get_record_dataset(filenames, zip_path, cycle_length=16, shuffle=False)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(read_tfrecord_labels, num_parallel_calls=AUTO)
+    dataset = dataset.prefetch(AUTO)
+    return dataset
+
+#-----------------------------------
+def get_labels(filenames, zip_path=None):
+    """
+    get_labels(filenames, zip_path=None)
+    This function returns the class labels of every record in a list of tfrecord files
+    (using get_label_dataset, so images are not decoded)
+    INPUTS:
+        * filenames [list]
+    OPTIONAL INPUTS:
+        * zip_path [string]: zip archive containing the tfrecords (filenames are then member names)
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * labels [ndarray]: 1d vector of integer labels
+    """
+    labels = [lbls.numpy() for lbls in get_label_dataset(filenames, zip_path=zip_path)]
+    if len(labels)==0:
+        return np.array([], dtype=np.int32)
+    return np.hstack(labels)
+
 #-----------------------------------
 def read_image_and_label(img_path):
     """
@@ -342,9 +780,77 @@ def read_image_and_label(img_path):
     return image,label[0]
 
 #-----------------------------------
-def get_dataset_for_tfrecords(recoded_dir, shared_size):
+def _decode_and_crop_center_jpeg(bits, ratio):
+    """
+    "_decode_and_crop_center_jpeg(bits, ratio)"
+    decode only the centre square of a jpeg, downscaled by ratio in the DCT domain
+    (the crop window is in downscaled pixel coordinates, which libjpeg rounds up)
+    INPUTS:
+        * bits [tensor]: jpeg bytestring
+        * ratio [int]: jpeg scale denominator, one of 1, 2, 4, 8
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: image [tensor array] (uint8, square)
+    """
+    shape = tf.image.extract_jpeg_shape(bits)
+    h = (shape[0] + ratio - 1) // ratio
+    w = (shape[1] + ratio - 1) // ratio
+    s = tf.minimum(shape[0], shape[1]) // ratio
+    crop_window = tf.stack([(h - s) // 2, (w - s) // 2, s, s])
+    return tf.image.decode_and_crop_jpeg(bits, crop_window, channels=3, ratio=ratio)
+
+#-----------------------------------
+def decode_resize_crop_jpeg(bits):
+    """
+    decode_resize_crop_jpeg(bits)
+    This function is a fast equivalent of decoding a jpeg then calling resize_and_crop_image:
+    it picks the largest jpeg scale factor (8, 4, 2 or 1) that keeps the short side
+    at least TARGET_SIZE, decodes only the centre square at that scale, then resizes it to TARGET_SIZE.
+    Pixels outside the crop are never materialized, which greatly reduces time and memory
+    for large source images
+    INPUTS:
+        * bits [tensor]: jpeg bytestring
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: TARGET_SIZE
+    OUTPUTS:
+        * image [tensor array] (float32, TARGET_SIZE x TARGET_SIZE x 3)
+    """
+    shape = tf.image.extract_jpeg_shape(bits)
+    short_side = tf.minimum(shape[0], shape[1])
+    image = tf.case([(short_side >= 8*TARGET_SIZE, lambda: _decode_and_crop_center_jpeg(bits, 8)),
+                     (short_side >= 4*TARGET_SIZE, lambda: _decode_and_crop_center_jpeg(bits, 4)),
+                     (short_side >= 2*TARGET_SIZE, lambda: _decode_and_crop_center_jpeg(bits, 2))],
+                    default=lambda: _decode_and_crop_center_jpeg(bits, 1))
+    image = tf.image.resize(image, [TARGET_SIZE, TARGET_SIZE])
+    return image
+
+#-----------------------------------
+def read_image_and_label_fast(img_path):
+    """
+    read_image_and_label_fast(img_path)
+    This function reads a jpeg image from a provided filepath, already center-cropped and
+    resized to TARGET_SIZE using decode_resize_crop_jpeg,
+    and extracts the label from the filename (assuming the class name is
+    before "_IMG" in the filename)
+    INPUTS:
+        * img_path [string]: filepath to a jpeg image
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: TARGET_SIZE
+    OUTPUTS:
+        * image [tensor array]
+        * class_label [tensor int]
+    """
+    image = decode_resize_crop_jpeg(tf.io.read_file(img_path))
+
+    label = tf.strings.split(img_path, sep='/')
+    label = tf.strings.split(label[-1], sep='_IMG')
+
+    return image,label[0]
+
+#-----------------------------------
+def get_dataset_for_tfrecords(recoded_dir, shared_size, fast_decode=False, encoding='jpeg', filenames=None):
     """
-    get_dataset_for_tfrecords(recoded_dir, shared_size)
+    get_dataset_for_tfrecords(recoded_dir, shared_size, fast_decode=False, encoding='jpeg', filenames=None)
     This function reads a list of TFREcord shard files,
     decode the images and label
     resize and crop the image to TARGET_SIZE
@@ -352,38 +858,1463 @@ def get_dataset_for_tfrecords(recoded_dir, shared_size):
     INPUTS:
         * recoded_dir
         * shared_size
-    OPTIONAL INPUTS: None
+    OPTIONAL INPUTS:
+        * fast_decode [bool]: if True, use read_image_and_label_fast (reduced-resolution,
+          crop-window jpeg decoding) instead of read_image_and_label and resize_and_crop_image
+        * encoding = {'jpeg' | 'raw'}: recompress the images as jpeg, or keep raw uint8 pixels
+        * filenames [list]: jpegs to use, in this order (default: all jpegs in recoded_dir, shuffled)
     GLOBAL INPUTS: TARGET_SIZE
     OUTPUTS:
         * tf.data.Dataset object
     """
-    tamucc_dataset = tf.data.Dataset.list_files(recoded_dir+os.sep+'*.jpg', seed=10000) # This also shuffles the images
-    tamucc_dataset = tamucc_dataset.map(read_image_and_label)
-    tamucc_dataset = tamucc_dataset.map(resize_and_crop_image, num_parallel_calls=AUTO)
+    if filenames is None:
+        tamucc_dataset = tf.data.Dataset.list_files(recoded_dir+os.sep+'*.jpg', seed=10000) # This also shuffles the images
+    else:
+        tamucc_dataset = tf.data.Dataset.from_tensor_slices(filenames)
+    if fast_decode:
+        tamucc_dataset = tamucc_dataset.map(read_image_and_label_fast, num_parallel_calls=AUTO)
+    else:
+        tamucc_dataset = tamucc_dataset.map(read_image_and_label)
+        tamucc_dataset = tamucc_dataset.map(resize_and_crop_image, num_parallel_calls=AUTO)
 
-    tamucc_dataset = tamucc_dataset.map(recompress_image, num_parallel_calls=AUTO)
+    if encoding == 'raw':
+        tamucc_dataset = tamucc_dataset.map(recode_image_raw, num_parallel_calls=AUTO)
+    else:
+        tamucc_dataset = tamucc_dataset.map(recompress_image, num_parallel_calls=AUTO)
     tamucc_dataset = tamucc_dataset.batch(shared_size)
     return tamucc_dataset
 
 #-----------------------------------
-def write_records(tamucc_dataset, tfrecord_dir, CLASSES):
+def _write_shard(filename, images, labels, class_ids, compression_type='', sources=None):
+    """
+    "_write_shard(filename, images, labels, class_ids, compression_type='', sources=None)"
+    encode and write one TFRecord shard (runs in a worker process)
+    INPUTS:
+        * filename [string]: shard file to write
+        * images [ndarray]: jpeg bytestrings, or uint8 images
+        * labels [ndarray]: label bytestrings
+        * class_ids [dict]: class bytestring to integer id
+    OPTIONAL INPUTS:
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}
+        * sources [list]: (source file name, content hash) of each image
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * shard [dict]: manifest entry for the shard (see get_shard_info)
+    """
+    examples = (to_tfrecord(img_bytes, label, class_ids).SerializeToString() for img_bytes, label in zip(images, labels))
+    offsets = write_examples(filename, examples, compression_type)
+
+    class_counts = {}
+    for label in labels:
+        class_counts[class_ids[label]] = class_counts.get(class_ids[label], 0) + 1
+    return get_shard_info(filename, offsets, class_counts, compression_type, sources)
+
+#-----------------------------------
+def write_records(tamucc_dataset, tfrecord_dir, CLASSES, num_workers=None, compression_type='', sources=None, first_shard=0):
     """
-    write_records(tamucc_dataset, tfrecord_dir, CLASSES)
+    write_records(tamucc_dataset, tfrecord_dir, CLASSES, num_workers=None, compression_type='', sources=None, first_shard=0)
     This function writes a tf.data.Dataset object to TFRecord shards
+    Each shard is converted to numpy once, then encoded and written by a pool
+    of worker processes while the dataset pipeline prepares the next shards.
+    A manifest.json (record counts, offsets, class counts, hashes) is written alongside
     INPUTS:
         * tamucc_dataset [tf.data.Dataset]
         * tfrecord_dir [string] : path to directory where files will be written
         * CLASSES [list] of class string names
-    OPTIONAL INPUTS: None
+    OPTIONAL INPUTS:
+        * num_workers [int]: number of writer processes (None = number of cpus, 1 = no pool)
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}: record compression, worth using with raw
+          (encoding='raw' in get_dataset_for_tfrecords) images, which compress well
+        * sources [list]: (source file name, content hash) of each image in dataset order,
+          recorded in the manifest for update_records
+        * first_shard [int]: index of the first shard file name
     GLOBAL INPUTS: None
     OUTPUTS: None (files written to disk)
     """
-    for shard, (image, label) in enumerate(tamucc_dataset):
-      shard_size = image.numpy().shape[0]
-      filename = tfrecord_dir+os.sep+"tamucc" + "{:02d}-{}.tfrec".format(shard, shard_size)
+    class_ids = {c:i for i,c in enumerate(CLASSES)}
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    def shards():
+        position = 0
+        for shard, (image, label) in enumerate(tamucc_dataset, first_shard):
+            images = image.numpy()
+            labels = label.numpy()
+            filename = tfrecord_dir+os.sep+"tamucc" + "{:02d}-{}.tfrec".format(shard, len(images))
+            shard_sources = None if sources is None else sources[position:position+len(images)]
+            position += len(images)
+            yield filename, images, labels, shard_sources
+
+    written = []
+    def report(shard):
+        written.append(shard)
+        print("Wrote file {} containing {} records".format(tfrecord_dir+os.sep+shard["file"], shard["num_records"]))
+
+    if num_workers == 1:
+        for filename, images, labels, shard_sources in shards():
+            report(_write_shard(filename, images, labels, class_ids, compression_type, shard_sources))
+    else:
+        with _spawn_pool(num_workers) as pool:
+            pending = []
+            for filename, images, labels, shard_sources in shards():
+                pending.append(pool.apply_async(_write_shard, (filename, images, labels, class_ids, compression_type, shard_sources)))
+                # bound the number of decoded shards held in memory at once
+                while len(pending) >= 2*num_workers:
+                    report(pending.pop(0).get())
+            for result in pending:
+                report(result.get())
+
+    write_manifest(tfrecord_dir, written, CLASSES)
+
+#-----------------------------------
+def hash_sources(filenames, num_workers=None):
+    """
+    hash_sources(filenames, num_workers=None)
+    This function computes the md5 hash of the contents of a list of source files, in parallel
+    INPUTS:
+        * filenames [list]: source files
+    OPTIONAL INPUTS:
+        * num_workers [int]: number of threads (None = number of cpus)
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * hashes [list]: hex digests, in the same order as filenames
+    """
+    with multiprocessing.pool.ThreadPool(num_workers or os.cpu_count() or 1) as pool:
+        return pool.map(_file_md5, filenames)
+
+#-----------------------------------
+def plan_update(manifest, sources, prefix):
+    """
+    plan_update(manifest, sources, prefix)
+    This function compares the current source files with the sources recorded in the manifest
+    for the shards whose names start with prefix. Shards with a deleted or changed source
+    (or no recorded sources) are dropped; sources not in a kept shard need to be encoded
+    INPUTS:
+        * manifest [dict]: from read_manifest (or None)
+        * sources [dict]: source file name to content hash
+        * prefix [string]: shard file name prefix
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * dropped [list]: file names of shards to delete
+        * new_sources [list]: source file names to encode
+        * next_shard [int]: index for the next shard file name
+    """
+    shards = [s for s in (manifest or {}).get("shards", []) if s["file"].startswith(prefix)]
+    dropped, encoded = [], set()
+    for shard in shards:
+        shard_sources = shard.get("sources")
+        if shard_sources is not None and all(sources.get(name) == h for name, h in shard_sources):
+            encoded.update(name for name, h in shard_sources)
+        else:
+            dropped.append(shard["file"])
+    new_sources = sorted(name for name in sources if name not in encoded)
+
+    indices = [int(s["file"][len(prefix):].split('-')[0]) for s in shards if s["file"][len(prefix):].split('-')[0].isdigit()]
+    next_shard = max(indices)+1 if len(indices)>0 else 0
+    return dropped, new_sources, next_shard
+
+#-----------------------------------
+def update_records(recoded_dir, tfrecord_dir, CLASSES, shared_size, fast_decode=True, encoding='jpeg', num_workers=None, compression_type=''):
+    """
+    update_records(recoded_dir, tfrecord_dir, CLASSES, shared_size, fast_decode=True, encoding='jpeg', num_workers=None, compression_type='')
+    This function incrementally updates the TFRecord shards in tfrecord_dir from the jpegs in recoded_dir.
+    Every source image is hashed and compared with the sources recorded in the manifest:
+    only new or changed images are encoded, into new shards, and shards containing a deleted or
+    changed image are deleted (their unchanged images are encoded again).
+    The first update of shards written by write_records (which records no sources) rewrites them all
+    INPUTS:
+        * recoded_dir [string]: directory of jpegs (labels are parsed from the file names)
+        * tfrecord_dir [string]: path to directory where files will be written
+        * CLASSES [list] of class string names
+        * shared_size [int]: number of images per new shard
+    OPTIONAL INPUTS:
+        * fast_decode, encoding: see get_dataset_for_tfrecords
+        * num_workers, compression_type: see write_records
+    GLOBAL INPUTS: SEED
+    OUTPUTS: None (files written to disk)
+    """
+    filenames = sorted(tf.io.gfile.glob(recoded_dir+os.sep+'*.jpg'))
+    names = [f.split(os.sep)[-1] for f in filenames]
+    sources = dict(zip(names, hash_sources(filenames, num_workers)))
+
+    dropped, new_sources, next_shard = plan_update(read_manifest(tfrecord_dir), sources, "tamucc")
+    print("{} sources: {} to encode, {} shards to drop".format(len(sources), len(new_sources), len(dropped)))
+
+    if len(dropped)>0:
+        for f in dropped:
+            if os.path.isfile(tfrecord_dir+os.sep+f):
+                os.remove(tfrecord_dir+os.sep+f)
+        write_manifest(tfrecord_dir, [], CLASSES, remove=dropped)
+    if len(new_sources)==0:
+        return
+
+    np.random.RandomState(SEED).shuffle(new_sources) # mix classes within shards, as list_files does for a full build
+    dataset = get_dataset_for_tfrecords(recoded_dir, shared_size, fast_decode, encoding,
+                                        filenames=[recoded_dir+os.sep+name for name in new_sources])
+    write_records(dataset, tfrecord_dir, CLASSES, num_workers, compression_type,
+                  sources=[(name, sources[name]) for name in new_sources], first_shard=next_shard)
+
+###############################################################
+### MANIFEST FUNCTIONS
+###############################################################
+"""
+Each tfrecord directory gets a 'manifest.json' sidecar, written by the tfrecord writers, listing
+for every shard file: the number of records, the byte offset of each record in the file,
+the per-class record counts and the md5 hash of the file.
+Dataset sizes, step counts and class weights can then be read from the manifest
+instead of being inferred from file names or by reading all the data
+"""
+#-----------------------------------
+def _file_md5(filename):
+    """
+    "_file_md5(filename)"
+    compute the md5 hash of a file, reading it in chunks
+    INPUTS:
+        * filename [string]
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: hex digest [string]
+    """
+    md5 = hashlib.md5()
+    with tf.io.gfile.GFile(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1<<20), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+#-----------------------------------
+def _spawn_pool(num_workers):
+    """
+    "_spawn_pool(num_workers)"
+    start a pool of worker processes with the 'spawn' start method, for workers that run tensorflow
+    ops (tf.io.TFRecordWriter): tensorflow is not fork-safe. Spawned workers import the calling script
+    again, so scripts that start a pool keep their work under "if __name__ == '__main__':"
+    INPUTS:
+        * num_workers [int]
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: multiprocessing.Pool
+    """
+    return multiprocessing.get_context('spawn').Pool(num_workers)
+
+#-----------------------------------
+def write_examples(filename, examples, compression_type=''):
+    """
+    write_examples(filename, examples, compression_type='')
+    This function writes serialized tfrecord examples to a tfrecord file
+    and keeps track of the byte offset where each record starts
+    (each record is stored as an 8-byte length, a 4-byte crc, the data and another 4-byte crc)
+    INPUTS:
+        * filename [string]: tfrecord file to write
+        * examples [iterable]: serialized tf.train.Example bytestrings
+    OPTIONAL INPUTS:
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * offsets [list]: byte offset of each record in the file
+          (in the uncompressed record stream, if compression_type is set)
+    """
+    offsets = []
+    position = 0
+    with tf.io.TFRecordWriter(filename, options=compression_type or None) as out_file:
+        for example in examples:
+            out_file.write(example)
+            offsets.append(position)
+            position += len(example) + 16
+    return offsets
+
+#-----------------------------------
+def get_shard_info(filename, offsets, class_counts=None, compression_type='', sources=None):
+    """
+    get_shard_info(filename, offsets, class_counts=None, compression_type='', sources=None)
+    This function collates the manifest entry for one tfrecord shard
+    INPUTS:
+        * filename [string]: tfrecord file (already written)
+        * offsets [list]: byte offset of each record (from write_examples)
+    OPTIONAL INPUTS:
+        * class_counts [dict]: number of records (or objects) per integer class id
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}: byte offsets are not stored
+          for compressed files, because records cannot be seeked to
+        * sources [list]: (source file name, content hash) of each record, for incremental updates
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * shard [dict]
+    """
+    shard = {"file": filename.split(os.sep)[-1],
+             "num_records": len(offsets),
+             "offsets": None if compression_type else offsets,
+             "compression": compression_type,
+             "md5": _file_md5(filename)}
+    if class_counts is not None:
+        shard["class_counts"] = {str(k):int(v) for k,v in class_counts.items()}
+    if sources is not None:
+        shard["sources"] = [list(source) for source in sources]
+    return shard
+
+#-----------------------------------
+def write_manifest(tfrecord_dir, shards, CLASSES=None, remove=None):
+    """
+    write_manifest(tfrecord_dir, shards, CLASSES=None, remove=None)
+    This function writes (or updates) the manifest.json file in tfrecord_dir
+    Entries for shards already in an existing manifest are replaced (or removed),
+    and the dataset totals are recomputed
+    INPUTS:
+        * tfrecord_dir [string]: directory containing the tfrecord shards
+        * shards [list]: of dicts from get_shard_info
+    OPTIONAL INPUTS:
+        * CLASSES [list]: class names, in class id order
+        * remove [list]: file names of shards to remove from the manifest
+    GLOBAL INPUTS: TARGET_SIZE
+    OUTPUTS:
+        * manifest [dict] (also written to disk)
+    """
+    manifest = read_manifest(tfrecord_dir) or {}
+    all_shards = {s["file"]:s for s in manifest.get("shards", [])}
+    for s in shards:
+        all_shards[s["file"]] = s
+    for f in (remove or []):
+        all_shards.pop(f, None)
+    all_shards = [all_shards[k] for k in sorted(all_shards.keys())]
+
+    manifest["target_size"] = TARGET_SIZE
+    if CLASSES is not None:
+        manifest["classes"] = [c.decode() if isinstance(c, bytes) else str(c) for c in CLASSES]
+    manifest["num_records"] = int(np.sum([s["num_records"] for s in all_shards]))
+    class_counts = {}
+    for s in all_shards:
+        for k,v in s.get("class_counts", {}).items():
+            class_counts[k] = class_counts.get(k, 0) + v
+    if len(class_counts)>0:
+        manifest["class_counts"] = class_counts
+    manifest["shards"] = all_shards
+
+    with open(tfrecord_dir+os.sep+'manifest.json', 'w') as f:
+        json.dump(manifest, f)
+    print("Wrote manifest for {} records in {} shards".format(manifest["num_records"], len(all_shards)))
+    return manifest
+
+#-----------------------------------
+def read_manifest(tfrecord_dir):
+    """
+    read_manifest(tfrecord_dir)
+    This function reads the manifest.json file in tfrecord_dir, if there is one
+    INPUTS:
+        * tfrecord_dir [string]: directory containing the tfrecord shards
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * manifest [dict], or None if there is no manifest
+    """
+    manifest_file = tfrecord_dir+os.sep+'manifest.json'
+    if not os.path.isfile(manifest_file):
+        return None
+    with open(manifest_file) as f:
+        return json.load(f)
+
+#-----------------------------------
+def get_manifest_shards(filenames, manifest):
+    """
+    get_manifest_shards(filenames, manifest)
+    This function looks up the manifest entries for a list of tfrecord files
+    INPUTS:
+        * filenames [list]: tfrecord files
+        * manifest [dict]: from read_manifest
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * shards [list]: manifest entry of each file (None for files not in the manifest)
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    if manifest is None:
+        return [None for f in filenames]
+    lookup = {s["file"]:s for s in manifest["shards"]}
+    return [lookup.get(f.split(os.sep)[-1]) for f in filenames]
+
+#-----------------------------------
+def get_num_records(filenames, manifest=None):
+    """
+    get_num_records(filenames, manifest=None)
+    This function returns the exact number of records in a list of tfrecord files,
+    from the manifest. For files not in the manifest, the count is parsed from
+    file names ending in '-{count}.tfrec' (as written by the writers here),
+    or else assumed to be ims_per_shard
+    INPUTS:
+        * filenames [list]: tfrecord files
+    OPTIONAL INPUTS:
+        * manifest [dict]: from read_manifest
+    GLOBAL INPUTS: ims_per_shard
+    OUTPUTS:
+        * nb_images [int]
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    nb_images = 0
+    for f, shard in zip(filenames, get_manifest_shards(filenames, manifest)):
+        if shard is not None:
+            nb_images += shard["num_records"]
+            continue
+        try:
+            nb_images += int(f.split('-')[-1].split('.tfrec')[0])
+        except ValueError:
+            nb_images += ims_per_shard
+    return nb_images
+
+#-----------------------------------
+def read_record_at(filename, offset):
+    """
+    read_record_at(filename, offset)
+    This function reads the single serialized record that starts at a byte offset
+    in a tfrecord file (offsets are listed in the manifest), without reading the rest of the file.
+    The result can be passed to the same parsing functions as a tf.data.TFRecordDataset element
+    INPUTS:
+        * filename [string]: tfrecord file
+        * offset [int]: byte offset of the record
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * example [bytes]: serialized tf.train.Example
+    """
+    with tf.io.gfile.GFile(filename, 'rb') as f:
+        f.seek(offset)
+        length = struct.unpack('<Q', f.read(8))[0]
+        f.read(4) # crc of the length
+        return f.read(length)
+
+#-----------------------------------
+def get_record(tfrecord_dir, index, manifest=None):
+    """
+    get_record(tfrecord_dir, index, manifest=None)
+    This function provides random access to the record with a given index
+    (counting through the shards in manifest order).
+    Compressed shards have no byte offsets, so they are read sequentially up to the record
+    INPUTS:
+        * tfrecord_dir [string]: directory containing the tfrecord shards and manifest
+        * index [int]: record index in the whole dataset
+    OPTIONAL INPUTS:
+        * manifest [dict]: from read_manifest (read from tfrecord_dir if None)
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * example [bytes]: serialized tf.train.Example
+    """
+    if manifest is None:
+        manifest = read_manifest(tfrecord_dir)
+    for shard in manifest["shards"]:
+        if index < shard["num_records"]:
+            if shard.get("offsets") is None:
+                # compressed shard: no byte offsets, so read through the file up to the record
+                dataset = tf.data.TFRecordDataset(tfrecord_dir+os.sep+shard["file"], compression_type=shard.get("compression", ""))
+                return next(iter(dataset.skip(index).take(1))).numpy()
+            return read_record_at(tfrecord_dir+os.sep+shard["file"], shard["offsets"][index])
+        index -= shard["num_records"]
+    raise IndexError("record index out of range")
+
+#-----------------------------------
+def _sniff_compression(filename):
+    """
+    "_sniff_compression(filename)"
+    guess the compression of a tfrecord file from its first bytes
+    (gzip magic number, or a zlib header followed by a valid deflate stream)
+    INPUTS:
+        * filename [string]: tfrecord file
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: compression_type [string]: '', 'ZLIB' or 'GZIP'
+    """
+    with tf.io.gfile.GFile(filename, 'rb') as f:
+        head = f.read(1024)
+    if head[:2] == b'\x1f\x8b':
+        return 'GZIP'
+    if len(head) > 2 and head[0] == 0x78 and (head[0]*256 + head[1]) % 31 == 0:
+        try:
+            zlib.decompressobj().decompress(head)
+            return 'ZLIB'
+        except zlib.error:
+            pass
+    return ''
+
+#-----------------------------------
+def get_compression_type(filenames, manifest=None):
+    """
+    get_compression_type(filenames, manifest=None)
+    This function returns the record compression of a list of tfrecord files
+    (all files in a list are assumed to be written the same way), for tf.data.TFRecordDataset.
+    It is read from the manifest if the first file is listed in it, otherwise guessed from the file contents
+    INPUTS:
+        * filenames [list]: tfrecord files (or a glob pattern)
+    OPTIONAL INPUTS:
+        * manifest [dict]: from read_manifest (read from the directory of the first file if None)
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * compression_type [string]: '', 'ZLIB' or 'GZIP'
+    """
+    if isinstance(filenames, str):
+        filenames = tf.io.gfile.glob(filenames)
+    if len(filenames)==0:
+        return ''
+    if manifest is None:
+        manifest = read_manifest(os.path.dirname(filenames[0]) or '.')
+    shard = get_manifest_shards(filenames[:1], manifest)[0]
+    if shard is not None:
+        return shard.get("compression", "")
+    return _sniff_compression(filenames[0])
+
+#-----------------------------------
+def get_class_counts(filenames, manifest):
+    """
+    get_class_counts(filenames, manifest)
+    This function sums the per-class counts of a list of tfrecord files from the manifest
+    INPUTS:
+        * filenames [list]: tfrecord files
+        * manifest [dict]: from read_manifest
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * class_counts [dict]: count per integer class id
+    """
+    class_counts = {}
+    for shard in get_manifest_shards(filenames, manifest):
+        if shard is None:
+            continue
+        for k,v in shard.get("class_counts", {}).items():
+            class_counts[int(k)] = class_counts.get(int(k), 0) + v
+    return class_counts
+
+#-----------------------------------
+def get_class_weights(filenames, manifest):
+    """
+    get_class_weights(filenames, manifest)
+    This function computes 'balanced' class weights from the manifest class counts,
+    n_samples / (n_classes * count), i.e. the same as
+    sklearn.utils.class_weight.compute_class_weight('balanced', ...) but without reading any data
+    INPUTS:
+        * filenames [list]: tfrecord files
+        * manifest [dict]: from read_manifest
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * class_weights [dict]: weight per integer class id, for model.fit(class_weight=...)
+    """
+    class_counts = {k:v for k,v in get_class_counts(filenames, manifest).items() if v>0}
+    n_samples = np.sum(list(class_counts.values()))
+    return {k: float(n_samples / (len(class_counts) * class_counts[k])) for k in sorted(class_counts.keys())}
+
+###############################################################
+### ZIP ARCHIVE FUNCTIONS
+###############################################################
+"""
+Datasets can be read straight from the zip archives fetched by download_data.py, without extracting them.
+The zip central directory is indexed once per archive (get_zip_index); each member is then read
+directly at its data offset: stored (uncompressed) members are sliced from a memory map of the archive,
+deflated members are inflated in memory. Members are read in parallel by tf.data
+"""
+_ZIP_INDEX = {}
+_ZIP_MMAP = {}
+
+#-----------------------------------
+def get_record_dataset(filenames, zip_path=None, cycle_length=16, shuffle=True):
+    """
+    get_record_dataset(filenames, zip_path=None, cycle_length=16, shuffle=True)
+    This function reads the serialized examples of a list of tfrecord files, cycle_length files at a time
+    (compressed files are detected with get_compression_type).
+    If zip_path is given, filenames are tfrecord members of that zip archive, which are read
+    without extracting it (see get_zip_record_dataset)
+    INPUTS:
+        * filenames [list]: tfrecord files, or zip member names
+    OPTIONAL INPUTS:
+        * zip_path [string]: zip archive containing the tfrecords
+        * cycle_length [int]: number of files read at once
+        * shuffle [bool]: shuffle the file order (as tf.data.Dataset.list_files does)
+    GLOBAL INPUTS: AUTO
+    OUTPUTS: tf.data.Dataset object (of serialized examples)
+    """
+    if zip_path is not None:
+        return get_zip_record_dataset(zip_path, filenames, cycle_length, shuffle)
+    compression_type = get_compression_type(filenames)
+    if shuffle:
+        dataset = tf.data.Dataset.list_files(filenames)
+    else:
+        dataset = tf.data.Dataset.from_tensor_slices(filenames)
+    dataset = dataset.interleave(lambda f: tf.data.TFRecordDataset(f, compression_type=compression_type),
+                                 cycle_length=cycle_length, num_parallel_calls=AUTO)
+    return dataset
+
+#-----------------------------------
+def get_zip_index(zip_path):
+    """
+    get_zip_index(zip_path)
+    This function indexes the members of a zip archive from its central directory,
+    recording where the data of each member starts (from its local file header).
+    The index is computed once per archive and then reused
+    INPUTS:
+        * zip_path [string]: zip archive
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * index [dict]: member name to dict of offset, size, compress_size, compress_type
+    """
+    if zip_path in _ZIP_INDEX:
+        return _ZIP_INDEX[zip_path]
+    index = {}
+    with open(zip_path, 'rb') as f, zipfile.ZipFile(f) as z:
+        for info in z.infolist():
+            if info.is_dir():
+                continue
+            f.seek(info.header_offset)
+            header = f.read(30) # fixed-size part of the local file header
+            name_len, extra_len = struct.unpack('<HH', header[26:30])
+            index[info.filename] = {"offset": info.header_offset + 30 + name_len + extra_len,
+                                    "size": info.file_size,
+                                    "compress_size": info.compress_size,
+                                    "compress_type": info.compress_type}
+    _ZIP_INDEX[zip_path] = index
+    return index
+
+#-----------------------------------
+def list_zip_members(zip_path, pattern='*'):
+    """
+    list_zip_members(zip_path, pattern='*')
+    This function lists the members of a zip archive whose names match a glob pattern,
+    e.g. '*400/*.tfrec' (the zip equivalent of tf.io.gfile.glob)
+    INPUTS:
+        * zip_path [string]: zip archive
+    OPTIONAL INPUTS:
+        * pattern [string]: glob pattern matched against member names
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * members [list]: sorted member names
+    """
+    return sorted([name for name in get_zip_index(zip_path) if fnmatch.fnmatch(name, pattern)])
+
+#-----------------------------------
+def read_zip_member(zip_path, name):
+    """
+    read_zip_member(zip_path, name)
+    This function returns the contents of one member of a zip archive.
+    Stored members are returned as a zero-copy memoryview of a memory map of the archive,
+    deflated members are inflated from the same memory map
+    INPUTS:
+        * zip_path [string]: zip archive
+        * name [string]: member name
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * data [memoryview or bytes]
+    """
+    member = get_zip_index(zip_path)[name]
+    if zip_path not in _ZIP_MMAP:
+        with open(zip_path, 'rb') as f:
+            _ZIP_MMAP[zip_path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    data = memoryview(_ZIP_MMAP[zip_path])[member["offset"]:member["offset"]+member["compress_size"]]
+    if member["compress_type"] == zipfile.ZIP_STORED:
+        return data
+    if member["compress_type"] == zipfile.ZIP_DEFLATED:
+        return zlib.decompress(data, -15) # raw deflate stream, no zlib header
+    with zipfile.ZipFile(zip_path) as z: # other compression methods (rarely used)
+        return z.read(name)
+
+#-----------------------------------
+def _iterate_tfrecords(data):
+    """
+    "_iterate_tfrecords(data)"
+    split the contents of an (uncompressed) tfrecord file into serialized records
+    (each record is stored as an 8-byte length, a 4-byte crc, the data and another 4-byte crc;
+    crcs are not checked here, see _read_verified_records)
+    INPUTS:
+        * data [bytes or memoryview]: tfrecord file contents
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: generator of serialized records [bytes]
+    """
+    position = 0
+    while position < len(data):
+        length = struct.unpack_from('<Q', data, position)[0]
+        yield bytes(data[position+12:position+12+length])
+        position += length + 16
+
+#-----------------------------------
+def get_zip_record_dataset(zip_path, members, cycle_length=16, shuffle=False):
+    """
+    get_zip_record_dataset(zip_path, members, cycle_length=16, shuffle=False)
+    This function returns the serialized records of tfrecord files stored in a zip archive,
+    reading cycle_length members in parallel. It is the zip equivalent of
+    interleaving tf.data.TFRecordDataset over a list of extracted files
+    INPUTS:
+        * zip_path [string]: zip archive
+        * members [list]: tfrecord member names (e.g. from list_zip_members)
+    OPTIONAL INPUTS:
+        * cycle_length [int]: number of members read at once
+        * shuffle [bool]: shuffle the member order
+    GLOBAL INPUTS: AUTO
+    OUTPUTS: tf.data.Dataset object (of serialized examples)
+    """
+    get_zip_index(zip_path)
+
+    def records(name):
+        yield from _iterate_tfrecords(read_zip_member(zip_path, name.decode()))
+
+    dataset = tf.data.Dataset.from_tensor_slices(members)
+    if shuffle:
+        dataset = dataset.shuffle(len(members))
+    dataset = dataset.interleave(lambda name: tf.data.Dataset.from_generator(records, args=(name,),
+                                     output_signature=tf.TensorSpec([], tf.string)),
+                                 cycle_length=cycle_length, num_parallel_calls=AUTO)
+    return dataset
+
+#-----------------------------------
+def get_zip_file_dataset(zip_path, members):
+    """
+    get_zip_file_dataset(zip_path, members)
+    This function returns the name and contents of members of a zip archive (e.g. jpeg images),
+    read in parallel. It is the zip equivalent of mapping tf.io.read_file over a list of extracted files
+    INPUTS:
+        * zip_path [string]: zip archive
+        * members [list]: member names (e.g. from list_zip_members)
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: AUTO
+    OUTPUTS: tf.data.Dataset object (of (name, bytestring) pairs)
+    """
+    get_zip_index(zip_path)
+
+    def read_member(name):
+        return np.array(bytes(read_zip_member(zip_path, name.decode())), dtype=object)
+
+    dataset = tf.data.Dataset.from_tensor_slices(members)
+    dataset = dataset.map(lambda name: (name, tf.reshape(tf.numpy_function(read_member, [name], tf.string), [])),
+                          num_parallel_calls=AUTO)
+    return dataset
+
+###############################################################
+### DATA SERVICE FUNCTIONS
+###############################################################
+
+#-----------------------------------
+def distribute_dataset(dataset, service, job_name=None):
+    """
+    distribute_dataset(dataset, service, job_name=None)
+    This function hands a dataset to a tf.data service (started with data_service.py):
+    the dataset graph is sent to the dispatcher, every worker runs its own copy of the
+    pipeline (decoding, augmentation, label encoding, cache), and this process only
+    receives the finished batches. Files are read by the workers, so workers on other
+    machines need the tfrecords at the same paths
+    INPUTS:
+        * dataset [tf.data.Dataset]
+        * service [string]: dispatcher address, e.g. 'localhost:5050' or 'grpc://cpubox:5050'
+    OPTIONAL INPUTS:
+        * job_name [string]: trainers using the same job_name share (split) one stream of batches
+    GLOBAL INPUTS: AUTO
+    OUTPUTS: tf.data.Dataset object
+    """
+    if not service.startswith('grpc://'):
+        service = 'grpc://'+service
+    dataset = dataset.apply(tf.data.experimental.service.distribute(processing_mode="parallel_epochs",
+                                                                    service=service, job_name=job_name))
+    return dataset.prefetch(AUTO)
+
+###############################################################
+### SYNTHETIC DATA FUNCTIONS
+###############################################################
+
+#-----------------------------------
+def get_shard_sizes(num_images, num_shards):
+    """
+    get_shard_sizes(num_images, num_shards)
+    This function splits a number of images as evenly as possible into shards
+    INPUTS:
+        * num_images [int]
+        * num_shards [int]
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * sizes [list]: number of images in each shard
+    """
+    return [num_images//num_shards + (1 if k < num_images % num_shards else 0) for k in range(num_shards)]
+
+#-----------------------------------
+def _synthetic_field(rng, height, width, cells=8):
+    """
+    "_synthetic_field(rng, height, width, cells=8)"
+    make a smooth random field in [0,1] (a coarse random grid, upsampled), so that
+    synthetic imagery compresses roughly like real imagery rather than like noise
+    INPUTS:
+        * rng [np.random.Generator]
+        * height, width [int]
+    OPTIONAL INPUTS:
+        * cells [int]: grid cells along each side
+    GLOBAL INPUTS: None
+    OUTPUTS: field [ndarray, height x width]
+    """
+    field = np.kron(rng.random((cells, cells)), np.ones((-(-height//cells), -(-width//cells))))
+    return field[:height,:width]
+
+#-----------------------------------
+def _encode_synthetic(image, encoding='jpeg'):
+    """
+    "_encode_synthetic(image, encoding='jpeg')"
+    encode a uint8 image as a jpeg bytestring (with PIL, which is safe to use in
+    worker processes), or return it unchanged for raw uint8 records
+    INPUTS:
+        * image [ndarray]: uint8, height x width x channels
+    OPTIONAL INPUTS:
+        * encoding = {'jpeg' | 'raw'}
+    GLOBAL INPUTS: None
+    OUTPUTS: jpeg bytestring, or uint8 ndarray
+    """
+    if encoding == 'raw':
+        return image
+    buffer = io.BytesIO()
+    PIL.Image.fromarray(np.squeeze(image)).save(buffer, format='JPEG', quality=95, optimize=True, subsampling=0)
+    return buffer.getvalue()
+
+#-----------------------------------
+def _write_synthetic_shards(write_shard, tasks, tfrecord_dir, num_workers=None, CLASSES=None):
+    """
+    "_write_synthetic_shards(write_shard, tasks, tfrecord_dir, num_workers=None, CLASSES=None)"
+    run write_shard over a list of argument tuples with a pool of worker processes,
+    then write the manifest for all the shards. The workers are spawned (see _spawn_pool),
+    so write_shard can write with tf.io.TFRecordWriter (through write_examples)
+    INPUTS:
+        * write_shard [function]: returns a manifest entry (see get_shard_info)
+        * tasks [list]: argument tuples, one per shard
+        * tfrecord_dir [string]
+    OPTIONAL INPUTS:
+        * num_workers [int]: number of writer processes (None = number of cpus, 1 = no pool)
+        * CLASSES [list]: class names, for the manifest
+    GLOBAL INPUTS: None
+    OUTPUTS: None (files written to disk)
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    written = []
+    def report(shard):
+        written.append(shard)
+        print("Wrote file {} containing {} records".format(tfrecord_dir+os.sep+shard["file"], shard["num_records"]))
+
+    if num_workers == 1:
+        for task in tasks:
+            report(write_shard(*task))
+    else:
+        with _spawn_pool(num_workers) as pool:
+            for result in [pool.apply_async(write_shard, task) for task in tasks]:
+                report(result.get())
+
+    write_manifest(tfrecord_dir, written, CLASSES)
+
+#-----------------------------------
+def _write_synthetic_classification_shard(filename, num_records, size, CLASSES, seed, encoding='jpeg', compression_type=''):
+    """
+    "_write_synthetic_classification_shard(filename, num_records, size, CLASSES, seed, encoding='jpeg', compression_type='')"
+    write one shard of synthetic (image, class) records (runs in a worker process)
+    Each class gets its own base colour, so a model can learn the classes
+    INPUTS:
+        * filename [string]: shard file to write
+        * num_records [int]
+        * size [int]: image height and width
+        * CLASSES [list] of class bytestrings
+        * seed [int]: random seed for this shard
+    OPTIONAL INPUTS:
+        * encoding = {'jpeg' | 'raw'}
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * shard [dict]: manifest entry for the shard (see get_shard_info)
+    """
+    rng = np.random.default_rng(seed)
+    class_ids = {c:i for i,c in enumerate(CLASSES)}
+    colours = np.random.default_rng(len(CLASSES)).integers(32, 224, (len(CLASSES), 3))
+    labels = rng.integers(0, len(CLASSES), num_records)
+
+    def examples():
+        for class_id in labels:
+            field = _synthetic_field(rng, size, size)[:,:,np.newaxis]
+            image = colours[class_id] + 64*(field-0.5) + rng.normal(0, 8, (size, size, 3))
+            image = np.clip(image, 0, 255).astype(np.uint8)
+            yield to_tfrecord(_encode_synthetic(image, encoding), CLASSES[class_id], class_ids).SerializeToString()
+
+    offsets = write_examples(filename, examples(), compression_type)
+    class_counts = {int(k):int(v) for k,v in zip(*np.unique(labels, return_counts=True))}
+    return get_shard_info(filename, offsets, class_counts, compression_type)
+
+#-----------------------------------
+def write_synthetic_classification_records(tfrecord_dir, num_images, num_shards, CLASSES, size=TARGET_SIZE, encoding='jpeg', num_workers=None, compression_type='', seed=SEED):
+    """
+    write_synthetic_classification_records(tfrecord_dir, num_images, num_shards, CLASSES, size=TARGET_SIZE, encoding='jpeg', num_workers=None, compression_type='', seed=SEED)
+    This function writes synthetic TFRecord shards with the same schema as the real
+    classification data ("image" bytestring, "class" integer), and a manifest.json,
+    for load and scaling tests of the input pipelines and models.
+    Shards are generated in parallel by a pool of worker processes
+    INPUTS:
+        * tfrecord_dir [string]: path to directory where files will be written
+        * num_images [int]: total number of records
+        * num_shards [int]: number of shard files
+        * CLASSES [list] of class bytestrings
+    OPTIONAL INPUTS:
+        * size [int]: image height and width (must be TARGET_SIZE for the readers to decode raw records)
+        * encoding = {'jpeg' | 'raw'}
+        * num_workers [int]: number of writer processes (None = number of cpus, 1 = no pool)
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}
+        * seed [int]: random seed (shard k uses seed+k)
+    GLOBAL INPUTS: TARGET_SIZE, SEED
+    OUTPUTS: None (files written to disk)
+    """
+    tasks = [(tfrecord_dir+os.sep+"synthetic" + "{:02d}-{}.tfrec".format(shard, shard_size),
+              shard_size, size, CLASSES, seed+shard, encoding, compression_type)
+             for shard, shard_size in enumerate(get_shard_sizes(num_images, num_shards))]
+    _write_synthetic_shards(_write_synthetic_classification_shard, tasks, tfrecord_dir, num_workers, CLASSES)
+
+###############################################################
+### RECORD VALIDATION FUNCTIONS
+###############################################################
+
+#-----------------------------------
+def _read_shard_records(filename, compression_type=''):
+    """
+    "_read_shard_records(filename, compression_type='')"
+    read all the serialized records of a tfrecord file in python (no tensorflow ops,
+    so this is safe in worker processes), decompressing the file first if needed
+    INPUTS:
+        * filename [string]: tfrecord file
+    OPTIONAL INPUTS:
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}
+    GLOBAL INPUTS: None
+    OUTPUTS: list of serialized records [bytes]
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if compression_type == 'GZIP':
+        data = gzip.decompress(data)
+    elif compression_type == 'ZLIB':
+        data = zlib.decompress(data)
+    return list(_iterate_tfrecords(data))
+
+#-----------------------------------
+def _masked_crc32c(data):
+    """
+    "_masked_crc32c(data)"
+    the masked crc32c checksum that tfrecord files store for each record length and record
+    INPUTS:
+        * data [bytes]
+        OPTIONAL INPUTS:
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}
+IONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: checksum [int]
+    """
+    import google_crc32c # only needed to validate records (conda install google-crc32c, see mlmondays.yml)
+    crc = google_crc32c.value(data)
+    return (((crc >> 15) | (crc << 17)) + 0xA282EAD8) & 0xFFFFFFFF
+
+#-----------------------------------
+def _read_verified_records(filename, compression_type=''):
+    """
+    "_read_verified_records(filename, compression_type='')"
+    read all the serialized records of a tfrecord file in python, checking the record bounds and both
+    checksums of every record. A record whose data checksum does not match is a bad record; a length
+    checksum that does not match, or a truncated record, leaves the rest of the file unreadable (a bad file)
+    INPUTS:
+        * filename [string]: tfrecord file
+    OPTIONAL INPUTS:
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * records [list]: serialized records [bytes] up to any file problem
+        * bad [list]: (index, problem) of the records with a bad data checksum
+        * file_problem [string]: why the file could not be read to the end (None if it was)
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if compression_type == 'GZIP':
+        data = gzip.decompress(data)
+    elif compression_type == 'ZLIB':
+        data = zlib.decompress(data)
+    records, bad = [], []
+    position = 0
+    while position < len(data):
+        if position+12 > len(data):
+            return records, bad, "truncated record header at byte {}".format(position)
+        length = struct.unpack_from('<Q', data, position)[0]
+        if struct.unpack_from('<I', data, position+8)[0] != _masked_crc32c(data[position:position+8]):
+            return records, bad, "length checksum does not match at byte {}".format(position)
+        if position+16+length > len(data):
+            return records, bad, "truncated record at byte {}".format(position)
+        record = data[position+12:position+12+length]
+        if struct.unpack_from('<I', data, position+12+length)[0] != _masked_crc32c(record):
+            bad.append((len(records), "data checksum does not match"))
+        records.append(record)
+        position += length + 16
+    return records, bad, None
+
+#-----------------------------------
+def _open_image(bits):
+    """
+    "_open_image(bits)"
+    decode an image bytestring with PIL (raises an exception if it does not decode)
+    INPUTS:
+        * bits [bytes]: encoded image
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: PIL.Image
+    """
+    image = PIL.Image.open(io.BytesIO(bits))
+    image.load()
+    return image
+
+#-----------------------------------
+def _record_class_ids(record):
+    """
+    "_record_class_ids(record)"
+    get the integer class ids of a serialized example ("class", or "objects/label" for object detection)
+    INPUTS:
+        * record [bytes]: serialized tf.train.Example
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: list of class ids [int]
+    """
+    feature = tf.train.Example.FromString(record).features.feature
+    for key in ["class", "objects/label"]:
+        if key in feature:
+            return list(feature[key].int64_list.value)
+    return []
+
+#-----------------------------------
+def _validate_shard(filename, check, check_args=(), quarantine_dir='.', compression_type='', shard=None, rewrite=False):
+    """
+    "_validate_shard(filename, check, check_args=(), quarantine_dir='.', compression_type='', shard=None, rewrite=False)"
+    check every record of one tfrecord file (runs in a spawned worker process, see _spawn_pool).
+    The record framing (bounds and checksums, see _read_verified_records) is checked before check runs.
+    Bad records are written to a shard of the same name in quarantine_dir and, if rewrite, the file is
+    rewritten with only the good records (a bad file is also copied to quarantine_dir as <name>.damaged,
+    and keeps the good records read before the damage)
+    INPUTS:
+        * filename [string]: tfrecord file
+        * check [function]: check(record, *check_args) returns None, or a description of the problem
+    OPTIONAL INPUTS:
+        * check_args [tuple]: extra arguments for check
+        * quarantine_dir [string]: directory for the quarantine shards
+        * compression_type = {'' | 'ZLIB' | 'GZIP'}
+        * shard [dict]: manifest entry of the file (its sources and class counts are kept up to date)
+        * rewrite [bool]: remove the bad records from the file
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * result [dict]: file, num_records, bad (list of (index, problem)), file_problem (None, or why
+          the file could not be read to the end), shard (new manifest entry, if rewritten)
+    """
+    try:
+        records, bad, file_problem = _read_verified_records(filename, compression_type)
+    except Exception as e:
+        return {"file": filename, "num_records": 0, "bad": [], "file_problem": "does not read: {}".format(e), "shard": None}
+
+    crc_ids = set(i for i, problem in bad)
+    for i, record in enumerate(records):
+        if i in crc_ids:
+            continue
+        problem = check(record, *check_args)
+        if problem is not None:
+            bad.append((i, problem))
+    bad.sort()
+    result = {"file": filename, "num_records": len(records), "bad": bad, "file_problem": file_problem, "shard": None}
+    if len(bad)==0 and file_problem is None:
+        return result
+
+    bad_ids = set(i for i, problem in bad)
+    if len(bad_ids)>0:
+        write_examples(quarantine_dir+os.sep+filename.split(os.sep)[-1], [records[i] for i in sorted(bad_ids)])
+    if file_problem is not None and rewrite:
+        # keep the damaged file, the records after the damage are lost from the rewritten file
+        shutil.copyfile(filename, quarantine_dir+os.sep+filename.split(os.sep)[-1]+'.damaged')
+    if rewrite:
+        good = [record for i, record in enumerate(records) if i not in bad_ids]
+        offsets = write_examples(filename+'.tmp', good, compression_type)
+        os.replace(filename+'.tmp', filename)
+        class_counts, sources = None, None
+        if shard is not None and "class_counts" in shard:
+            class_counts = {}
+            for record in good:
+                for k in _record_class_ids(record):
+                    class_counts[k] = class_counts.get(k, 0) + 1
+        if shard is not None and "sources" in shard:
+            sources = [source for i, source in enumerate(shard["sources"][:len(records)]) if i not in bad_ids]
+        result["shard"] = get_shard_info(filename, offsets, class_counts, compression_type, sources)
+    return result
+
+#-----------------------------------
+def validate_records(filenames, check, check_args=(), quarantine_dir=None, rewrite=False, num_workers=None):
+    """
+    validate_records(filenames, check, check_args=(), quarantine_dir=None, rewrite=False, num_workers=None)
+    This function checks every record of a list of tfrecord files, with a pool of worker processes
+    (one file per task). Bad records are copied to quarantine shards (same file names, in quarantine_dir)
+    and listed in quarantine_dir/report.json. With rewrite=True the bad records are also removed from
+    the original files and the manifest is updated, so training needs no error-catching wrapper
+    (file names are kept, so a record count in a file name is only a hint after a rewrite; the manifest is exact)
+    INPUTS:
+        * filenames [list]: tfrecord files (in the same directory)
+        * check [function]: check(record, *check_args) returns None, or a description of the problem
+    OPTIONAL INPUTS:
+        * check_args [tuple]: extra arguments for check
+        * quarantine_dir [string]: directory for quarantine shards and report (None = <tfrecord dir>/quarantine)
+        * rewrite [bool]: remove the bad records from the original files
+        * num_workers [int]: number of worker processes (None = number of cpus, 1 = no pool)
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * report [dict]: also written to quarantine_dir/report.json
+    """
+    tfrecord_dir = os.path.dirname(filenames[0]) or '.'
+    if quarantine_dir is None:
+        quarantine_dir = tfrecord_dir+os.sep+'quarantine'
+    os.makedirs(quarantine_dir, exist_ok=True)
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    manifest = read_manifest(tfrecord_dir)
+    compression_type = get_compression_type(filenames, manifest)
+    tasks = [(f, check, check_args, quarantine_dir, compression_type, shard, rewrite)
+             for f, shard in zip(filenames, get_manifest_shards(filenames, manifest))]
+
+    results = []
+    def report_shard(result):
+        results.append(result)
+        if len(result["bad"])>0:
+            print("{}: {} of {} records bad".format(result["file"], len(result["bad"]), result["num_records"]))
+        if result["file_problem"] is not None:
+            print("{}: bad file, {}".format(result["file"], result["file_problem"]))
+
+    if num_workers == 1:
+        for task in tasks:
+            report_shard(_validate_shard(*task))
+    else:
+        with _spawn_pool(num_workers) as pool:
+            for result in [pool.apply_async(_validate_shard, task) for task in tasks]:
+                report_shard(result.get())
+
+    report = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "num_files": len(results),
+              "num_records": int(np.sum([r["num_records"] for r in results])),
+              "num_bad": int(np.sum([len(r["bad"]) for r in results])),
+              "rewritten": rewrite,
+              "bad": {r["file"].split(os.sep)[-1]: [{"index": i, "problem": problem} for i, problem in r["bad"]]
+                      for r in results if len(r["bad"])>0},
+              "bad_files": {r["file"].split(os.sep)[-1]: r["file_problem"] for r in results if r["file_problem"] is not None}}
+    with open(quarantine_dir+os.sep+'report.json', 'w') as f:
+        json.dump(report, f, indent=2)
+    print("{} bad records out of {} in {} files, {} bad files (report in {})".format(report["num_bad"], report["num_records"],
+          report["num_files"], len(report["bad_files"]), quarantine_dir+os.sep+'report.json'))
+
+    if rewrite and manifest is not None:
+        write_manifest(tfrecord_dir, [r["shard"] for r in results if r["shard"] is not None])
+    return report
+
+#-----------------------------------
+def check_classification_record(record, num_classes):
+    """
+    check_classification_record(record, num_classes)
+    This function checks one serialized classification example: it parses, has one
+    "image" and one "class" in [0, num_classes), and the image decodes
+    (jpeg, or raw uint8 pixels) to TARGET_SIZE x TARGET_SIZE
+    INPUTS:
+        * record [bytes]: serialized tf.train.Example
+        * num_classes [int]
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: TARGET_SIZE
+    OUTPUTS: None if the record is good, otherwise a description of the problem [string]
+    """
+    try:
+        feature = tf.train.Example.FromString(record).features.feature
+    except Exception as e:
+        return "does not parse: {}".format(e)
+    if "image" not in feature or len(feature["image"].bytes_list.value) != 1:
+        return "no image"
+    if "class" not in feature or len(feature["class"].int64_list.value) != 1:
+        return "no class"
+    class_id = feature["class"].int64_list.value[0]
+    if not 0 <= class_id < num_classes:
+        return "class {} out of range".format(class_id)
+
+    bits = feature["image"].bytes_list.value[0]
+    if len(bits) == TARGET_SIZE*TARGET_SIZE*3: # raw uint8 pixels
+        return None
+    try:
+        image = _open_image(bits)
+    except Exception as e:
+        return "image does not decode: {}".format(e)
+    if image.size != (TARGET_SIZE, TARGET_SIZE):
+        return "image is {}x{}, not {}x{}".format(image.size[0], image.size[1], TARGET_SIZE, TARGET_SIZE)
+    return None
+
+###############################################################
+### NEAR-DUPLICATE FUNCTIONS
+###############################################################
+
+#-----------------------------------
+def _image_hash(bits, hash_size=8):
+    """
+    "_image_hash(bits, hash_size=8)"
+    difference hash of an encoded image: the image is shrunk to hash_size+1 x hash_size grey
+    pixels, and each bit says whether a pixel is brighter than its left neighbour.
+    Near-duplicate images have hashes that differ in only a few bits
+    INPUTS:
+        * bits [bytes]: encoded image (jpeg, png, or raw uint8 pixels)
+    OPTIONAL INPUTS:
+        * hash_size [int]: the hash has hash_size x hash_size bits (at most 8, for 64 bits)
+    GLOBAL INPUTS: TARGET_SIZE
+    OUTPUTS: hash [int]
+    """
+    if len(bits) == TARGET_SIZE*TARGET_SIZE*3: # raw uint8 pixels
+        image = PIL.Image.fromarray(np.frombuffer(bits, dtype=np.uint8).reshape((TARGET_SIZE, TARGET_SIZE, 3)))
+    else:
+        image = _open_image(bits)
+    grey = np.asarray(image.convert('L').resize((hash_size+1, hash_size), PIL.Image.BILINEAR), dtype=np.int16)
+    hash = 0
+    for bit in (grey[:,1:] > grey[:,:-1]).ravel():
+        hash = (hash << 1) | int(bit)
+    return hash
+
+#-----------------------------------
+def _shard_hashes(task):
+    """
+    "_shard_hashes(task)"
+    hash the image of every record of one tfrecord file (runs in a worker process)
+    INPUTS:
+        * task [tuple]: (filename, compression_type, hash_size)
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: list of hashes [int] (None for a record whose image does not decode)
+    """
+    filename, compression_type, hash_size = task
+    hashes = []
+    for record in _read_shard_records(filename, compression_type):
+        try:
+            feature = tf.train.Example.FromString(record).features.feature
+            hashes.append(_image_hash(feature["image"].bytes_list.value[0], hash_size))
+        except Exception:
+            hashes.append(None)
+    return hashes
+
+#-----------------------------------
+def hash_records(filenames, hash_size=8, num_workers=None):
+    """
+    hash_records(filenames, hash_size=8, num_workers=None)
+    This function computes a perceptual (difference) hash of the image of every record in
+    a list of tfrecord files, with a pool of worker processes (one file per task)
+    INPUTS:
+        * filenames [list]: tfrecord files
+    OPTIONAL INPUTS:
+        * hash_size [int]: the hashes have hash_size x hash_size bits (at most 8)
+        * num_workers [int]: number of worker processes (None = number of cpus, 1 = no pool)
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * hashes [ndarray]: uint64 hash of each record (records whose image does not decode are left out)
+        * file_ids [ndarray]: index in filenames of the file of each record
+        * record_ids [ndarray]: index of each record in its file
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    compression_type = get_compression_type(filenames)
+    tasks = [(f, compression_type, hash_size) for f in filenames]
+    if num_workers == 1:
+        results = [_shard_hashes(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(num_workers) as pool:
+            results = pool.map(_shard_hashes, tasks)
+
+    hashes, file_ids, record_ids = [], [], []
+    for k, file_hashes in enumerate(results):
+        for i, hash in enumerate(file_hashes):
+            if hash is not None:
+                hashes.append(hash); file_ids.append(k); record_ids.append(i)
+    return np.array(hashes, dtype=np.uint64), np.array(file_ids, dtype=np.int64), np.array(record_ids, dtype=np.int64)
+
+#-----------------------------------
+def _popcount(x):
+    """
+    "_popcount(x)"
+    number of set bits of each element of a uint64 array
+    INPUTS:
+        * x [ndarray]: uint64
+    OPTIONAL INPUTS: None
+    GLOBAL INPUTS: None
+    OUTPUTS: bit counts [ndarray]
+    """
+    return np.unpackbits(np.ascontiguousarray(x, dtype=np.uint64).view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+#-----------------------------------
+def find_near_duplicates(hashes, max_distance=5, num_bits=64, max_pairs=2**20):
+    """
+    find_near_duplicates(hashes, max_distance=5, num_bits=64, max_pairs=2**20)
+    This function groups hashes that differ in at most max_distance bits into clusters (chains
+    of near-duplicates join one cluster), without comparing all pairs: the hashes are split into
+    max_distance+1 bands, and two hashes within max_distance bits must agree exactly on at least
+    one band, so only hashes that share a band value (a bucket of the index) are compared.
+    Large buckets are compared in blocks of rows, so memory stays bounded by max_pairs
+    INPUTS:
+        * hashes [ndarray]: uint64 hashes (from hash_records)
+    OPTIONAL INPUTS:
+        * max_distance [int]: largest number of differing bits for near-duplicates
+        * num_bits [int]: bits per hash (hash_size x hash_size)
+        * max_pairs [int]: largest number of hash pairs compared at once
+    GLOBAL INPUTS: None
+    OUTPUTS:
+        * clusters [ndarray]: cluster id of each hash (the index of its first member)
+    """
+    # identical hashes are merged first, so each bucket holds distinct hashes only
+    unique, inverse = np.unique(hashes, return_inverse=True)
+    parent = np.arange(len(unique))
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    bands = np.array_split(np.arange(num_bits), max_distance+1)
+    for band in bands:
+        shift, width = int(band[0]), len(band)
+        keys = (unique >> np.uint64(shift)) & np.uint64((1 << width)-1)
+        order = np.argsort(keys, kind='stable')
+        bounds = np.flatnonzero(np.diff(keys[order])) + 1
+        for bucket in np.split(order, bounds):
+            if len(bucket) < 2:
+                continue
+            values = unique[bucket]
+            step = max(1, max_pairs//len(bucket))
+            for start in range(0, len(bucket)-1, step):
+                # rows start..start+step against every later column of the bucket
+                rows = np.arange(start, min(start+step, len(bucket)-1))
+                cols = np.arange(start+1, len(bucket))
+                xor = values[rows][:,np.newaxis] ^ values[cols][np.newaxis,:]
+                close = (_popcount(xor.ravel()).reshape(xor.shape) <= max_distance) & (cols > rows[:,np.newaxis])
+                a, b = np.nonzero(close)
+                for i, j in zip(bucket[rows[a]], bucket[cols[b]]):
+                    ri, rj = root(i), root(j)
+                    if ri != rj:
+                        parent[max(ri, rj)] = min(ri, rj)
+
+    unique_roots = np.array([root(i) for i in range(len(unique))], dtype=np.int64)
+    # number the clusters by their first record
+    roots = unique_roots[inverse]
+    first = {}
+    clusters = np.empty(len(hashes), dtype=np.int64)
+    for k, r in enumerate(roots):
+        clusters[k] = first.setdefault(r, k)
+    return clusters
+
+#-----------------------------------
+def make_split_manifest(filenames, validation_split, split_file, hash_size=8, max_distance=5, deduplicate=True, num_workers=None, seed=SEED):
+    """
+    make_split_manifest(filenames, validation_split, split_file, hash_size=8, max_distance=5, deduplicate=True, num_workers=None, seed=SEED)
+    This function finds near-duplicate records in a list of tfrecord files (hash_records, then
+    find_near_duplicates) and writes a train/validation split as json in which every cluster of
+    near-duplicates is on one side only (no leakage between the splits). With deduplicate=True
+    only the first record of each cluster is kept. Records are listed by file name and index in the
+    file; write_split_records writes them to new train and validation shards
+    INPUTS:
+        * filenames [list]: tfrecord files (in the same directory)
+        * validation_split [float]: fraction of the (kept) records for validation
+        * split_file [string]: json file to write
+    OPTIONAL INPUTS:
+        * hash_size, max_distance: see hash_records and find_near_duplicates
+        * deduplicate [bool]: keep one record per cluster
+        * num_workers [int]: number of worker processes (None = number of cpus)
+        * seed [int]: random seed for the assignment of clusters to the splits
+    GLOBAL INPUTS: SEED
+    OUTPUTS:
+        * split [dict]: also written to split_file
+    """
+    hashes, file_ids, record_ids = hash_records(filenames, hash_size, num_workers)
+    clusters = find_near_duplicates(hashes, max_distance, hash_size*hash_size)
+    names = [f.split(os.sep)[-1] for f in filenames]
+
+    members = {}
+    for k, c in enumerate(clusters):
+        members.setdefault(c, []).append(k)
+    cluster_ids = sorted(members.keys())
+    duplicates = [[[names[file_ids[k]], int(record_ids[k])] for k in members[c]] for c in cluster_ids if len(members[c]) > 1]
+    if deduplicate:
+        members = {c:members[c][:1] for c in cluster_ids}
+    num_kept = sum(len(members[c]) for c in cluster_ids)
+
+    # whole clusters go to validation, in random order, until it holds validation_split of the records
+    validation = set()
+    num_validation = 0
+    for c in np.random.RandomState(seed).permutation(cluster_ids):
+        if num_validation >= validation_split*num_kept:
+            break
+        validation.add(c)
+        num_validation += len(members[c])
+
+    splits = {"train": {}, "val": {}}
+    for c in cluster_ids:
+        side = splits["val"] if c in validation else splits["train"]
+        for k in members[c]:
+            side.setdefault(names[file_ids[k]], []).append(int(record_ids[k]))
+    for side in splits.values():
+        for name in side:
+            side[name] = sorted(side[name])
+
+    split = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+             "tfrecord_dir": os.path.dirname(filenames[0]) or '.',
+             "hash_size": hash_size,
+             "max_distance": max_distance,
+             "deduplicate": deduplicate,
+             "validation_split": validation_split,
+             "num_records": len(hashes),
+             "num_clusters": len(cluster_ids),
+             "num_train": num_kept-num_validation,
+             "num_val": num_validation,
+             "splits": splits,
+             "duplicates": duplicates}
+    with open(split_file, 'w') as f:
+        json.dump(split, f)
+    print("{} records in {} clusters of near-duplicates: {} for training, {} for validation".format(
+          len(hashes), len(cluster_ids), split["num_train"], split["num_val"]))
+    return split
+
+#-----------------------------------
+def write_split_records(split_file, output_dir, records_per_shard=ims_per_shard):
+    """
+    write_split_records(split_file, output_dir, records_per_shard=ims_per_shard)
+    This function copies the records listed in a split file (from make_split_manifest) to new
+    tfrecord shards, "train-{shard}-{count}.tfrec" and "val-{shard}-{count}.tfrec", with a manifest
+    INPUTS:
+        * split_file [string]: json file from make_split_manifest
+        * output_dir [string]: directory for the new shards (not the one the records are read from)
+    OPTIONAL INPUTS:
+        * records_per_shard [int]: number of records per new shard
+    GLOBAL INPUTS: ims_per_shard
+    OUTPUTS: list of new tfrecord files
+    """
+    with open(split_file) as f:
+        split = json.load(f)
+    tfrecord_dir = split["tfrecord_dir"]
+    if os.path.abspath(output_dir) == os.path.abspath(tfrecord_dir):
+        raise ValueError("write the split shards to a different directory than the source tfrecords")
+    os.makedirs(output_dir, exist_ok=True)
+    compression_type = get_compression_type([tfrecord_dir+os.sep+f for f in sorted(split["splits"]["train"].keys())] or
+                                            [tfrecord_dir+os.sep+f for f in sorted(split["splits"]["val"].keys())])
+
+    shards, written = [], []
+    def flush(name, records, counter):
+        filename = output_dir+os.sep+"{}-{:02d}-{}.tfrec".format(name, counter, len(records))
+        class_counts = {}
+        for record in records:
+            for k in _record_class_ids(record):
+                class_counts[k] = class_counts.get(k, 0) + 1
+        offsets = write_examples(filename, records, compression_type)
+        shards.append(get_shard_info(filename, offsets, class_counts, compression_type))
+        written.append(filename)
+        print("Wrote file {} containing {} records".format(filename, len(records)))
+
+    for name in ["train", "val"]:
+        buffer, counter = [], 0
+        for source in sorted(split["splits"][name].keys()):
+            keep = set(split["splits"][name][source])
+            records = _read_shard_records(tfrecord_dir+os.sep+source, compression_type)
+            buffer += [record for i, record in enumerate(records) if i in keep]
+            while len(buffer) >= records_per_shard:
+                flush(name, buffer[:records_per_shard], counter)
+                buffer, counter = buffer[records_per_shard:], counter+1
+        if len(buffer) > 0:
+            flush(name, buffer, counter)
 
-      with tf.io.TFRecordWriter(filename) as out_file:
-        for i in range(shard_size):
-          example = to_tfrecord(image.numpy()[i],label.numpy()[i], CLASSES)
-          out_file.write(example.SerializeToString())
-        print("Wrote file {} containing {} records".format(filename, shard_size))
+    manifest = read_manifest(tfrecord_dir)
+    write_manifest(output_dir, shards, manifest.get("classes") if manifest is not None else None)
+    return written
@@ -0,0 +1,60 @@
+# Written by Dr Daniel Buscombe, Marda Science LLC
+# for "ML Mondays", a course supported by the USGS Community for Data Integration
+# and the USGS Coastal Change Hazards Program
+#
+# MIT License
+#
+# Copyright (c) 2020, Marda Science LLC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Checks every record of a folder of tfrecords in parallel (parses, decodes, size is TARGET_SIZE, class is in range)
+# and copies the bad ones to quarantine shards (removing them from the tfrecords if rewrite = True),
+# with a report.json listing what was wrong
+
+###############################################################
+## IMPORTS
+###############################################################
+from imports import *
+
+###############################################################
+## VARIABLES
+###############################################################
+
+data_path = os.getcwd()+os.sep+"data/tamucc/subset_12class/"+str(TARGET_SIZE)
+num_classes = 12 # number of classes
+check_args = (num_classes,)
+rewrite = False # also remove the bad records from the original tfrecords (and update the manifest)
+num_workers = None # checker processes (None = number of cpus)
+
+quarantine_dir = data_path+os.sep+'quarantine'
+
+###############################################################
+## EXECUTION
+###############################################################
+
+# the worker processes are spawned and import this script again (see _spawn_pool in tfrecords_funcs.py),
+# so the work only runs in the main process
+if __name__ == '__main__':
+    filenames = sorted(tf.io.gfile.glob(data_path+os.sep+'*.tfrec'))
+
+    start = time.time()
+    report = validate_records(filenames, check_classification_record, check_args, quarantine_dir, rewrite, num_workers)
+    print("Checked {} records in {:.1f} s".format(report["num_records"], time.time()-start))